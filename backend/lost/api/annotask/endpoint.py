@@ -18,7 +18,7 @@ class Available(Resource):
     #@api.marshal_with(anno_task_list)
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -38,7 +38,7 @@ class Available(Resource):
     @jwt_required 
     def post(self):
         args = annotask_parser.parse_args(request)
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -54,7 +54,7 @@ class Working(Resource):
     #@api.marshal_with(anno_task)
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -75,7 +75,7 @@ class Working(Resource):
 class Statistic(Resource):
     @jwt_required 
     def get(self, annotask_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -90,7 +90,7 @@ class Statistic(Resource):
 class ReportService(Resource):
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -108,7 +108,7 @@ class ReportService(Resource):
 class ForceRelease(Resource):
     @jwt_required 
     def get(self, annotask_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -125,7 +125,7 @@ class ForceRelease(Resource):
 class ChangeUser(Resource):
     @jwt_required 
     def get(self, annotask_id, group_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -10,7 +10,7 @@ from lost.api.config.api_definition import config
 
 namespace = api.namespace('config', description='Config Interface')
 
-dbm = access.DBMan(LOST_CONFIG)
+dbm = access.DBMan(LOST_CONFIG, scoped=True)
 project_config = ProjectConfigMan(dbm)
 configs = project_config.get_all()
 db_key_list = [el['key'] for el in configs]
@@ -68,7 +68,7 @@ class ConfigList(Resource):
     @api.marshal_with(config)
     @jwt_required
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ADMINISTRATOR):
@@ -80,7 +80,7 @@ class ConfigList(Resource):
 
     @jwt_required
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ADMINISTRATOR):
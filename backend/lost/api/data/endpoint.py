@@ -2,7 +2,7 @@ from typing import BinaryIO
 from sqlalchemy import engine
 from sqlalchemy.sql.schema import DEFAULT_NAMING_CONVENTION
 from flask_restx import Resource
-from flask import request, send_from_directory, make_response
+from flask import request, send_from_directory, make_response, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from lost.api.api import api
 from lost.settings import LOST_CONFIG, FLASK_DEBUG
@@ -10,10 +10,10 @@ from lost.db import access, roles
 from lost.api.annotask.parsers import annotask_parser
 from lost.logic import anno_task as annotask_service
 from lost.logic.file_man import FileMan
+from lost.logic import log_stream
 import json
 import os
-from lost.pyapi import pe_base
-from io import BytesIO
+from lost.pyapi import anno_export
 namespace = api.namespace('data', description='Data API.')
 
 @namespace.route('/<string:path>')
@@ -21,7 +21,7 @@ class Data(Resource):
     @jwt_required 
     def get(self, path):
         print(path)
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -58,20 +58,27 @@ class Data(Resource):
 class Logs(Resource):
     @jwt_required 
     def get(self, path):
-        print(path)
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
             dbm.close_session()
             return "You are not authorized.", 401
         else:
-            # raise Exception('data/logs/ -> Not Implemented!')
+            dbm.close_session()
+            args = dict()
+            for key in ['offset', 'tail_bytes', 'tail_lines']:
+                if key in request.args:
+                    try:
+                        args[key] = int(request.args[key])
+                    except ValueError:
+                        return "{} needs to be an integer.".format(key), 400
+                    if args[key] < 0:
+                        return "{} needs to be positive.".format(key), 400
             fm = FileMan(LOST_CONFIG)
-            with fm.fs.open(fm.get_abs_path(path), 'rb') as f:
-                resp = make_response(f.read())
-                resp.headers["Content-Disposition"] = "attachment; filename=log.csv"
-                resp.headers["Content-Type"] = "text/csv"
+            resp = log_stream.send_log(fm, path, mimetype='text/csv', **args)
+            resp.headers["Content-Disposition"] = "attachment; filename=log.csv"
+            resp.headers["Access-Control-Expose-Headers"] = "ETag, X-Log-Offset, X-Log-Size"
             return resp
 
 @namespace.route('/dataexport/<deid>')
@@ -79,7 +86,7 @@ class Logs(Resource):
 class DataExport(Resource):
     @jwt_required 
     def get(self, deid):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -96,27 +103,47 @@ class DataExport(Resource):
                 resp.headers["Content-Type"] = "blob"
             return resp
 
+ANNOEXPORT_FORMATS = {
+    'parquet': ('annos.parquet', 'blob'),
+    'csv': ('annos.csv', 'text/csv'),
+    'jsonl': ('annos.jsonl', 'application/x-ndjson')
+}
+
 @namespace.route('/annoexport/<peid>')
 class AnnoExport(Resource):
     @jwt_required 
     def get(self, peid):
-         dbm = access.DBMan(LOST_CONFIG)
+         dbm = access.DBMan(LOST_CONFIG, scoped=True)
          identity = get_jwt_identity()
          user = dbm.get_user_by_id(identity)
          if not user.has_role(roles.DESIGNER):
              dbm.close_session()
              return "You are not authorized.", 401
          else:
+             export_format = request.args.get('format', 'parquet')
+             if export_format not in ANNOEXPORT_FORMATS:
+                 dbm.close_session()
+                 return "Unknown export format: {}".format(export_format), 400
              pe_db = dbm.get_pipe_element(pipe_e_id=peid)
-             pe = pe_base.Element(pe_db, dbm)
-             df = pe.inp.to_df()
-             # raise Exception('GO ON HERE !!!')
-             f = BytesIO()
-             df.to_parquet(f)
-             f.seek(0)
-             resp = make_response(f.read())
-             resp.headers["Content-Disposition"] = "attachment; filename=annos.parquet"
-             resp.headers["Content-Type"] = "blob"
+             result_ids = [result.idx for result in pe_db.result_in]
+             if export_format == 'parquet':
+                 parts = anno_export.iter_parquet(dbm, result_ids,
+                     row_group_size=LOST_CONFIG.annoexport_row_group_size,
+                     compression=LOST_CONFIG.annoexport_compression)
+             elif export_format == 'csv':
+                 parts = anno_export.iter_csv(dbm, result_ids)
+             else:
+                 parts = anno_export.iter_jsonl(dbm, result_ids)
+             def generate():
+                 try:
+                     for part in parts:
+                         yield part
+                 finally:
+                     dbm.close_session()
+             file_name, content_type = ANNOEXPORT_FORMATS[export_format]
+             resp = Response(stream_with_context(generate()),
+                 content_type=content_type)
+             resp.headers["Content-Disposition"] = "attachment; filename={}".format(file_name)
              return resp
 
 
@@ -125,7 +152,7 @@ class Logs(Resource):
     @jwt_required 
     def get(self, path):
         print(path)
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
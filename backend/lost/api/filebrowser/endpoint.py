@@ -7,18 +7,32 @@ from lost.settings import LOST_CONFIG, DATA_URL
 from lost.db.vis_level import VisLevel
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from lost.db import model, roles, access
-from lost.logic.file_man import FileMan, chonkyfy, DummyFileMan
+from lost.logic.file_man import FileMan, DummyFileMan
+from lost.logic import fs_listing
 from lost.logic.crypt import encrypt_fs_connection, decrypt_fs_connection
 from fsspec.registry import known_implementations
 import os
 
 namespace = api.namespace('fb', description='Lost Filebrowser API')
 
+def ls_page(fm, fs_key, path, data):
+    '''List a directory as requested by the file browser.
+
+    Optional request fields are *cursor* and *limit* for paging and
+    *probeChildren* to count the children of all listed directories.
+    '''
+    limit = data.get('limit')
+    if limit is not None:
+        limit = int(limit)
+    lister = fs_listing.Lister(fm, fs_key, fs_listing.get_cache(LOST_CONFIG))
+    return lister.ls_page(path, cursor=data.get('cursor'), limit=limit,
+        probe_children=bool(data.get('probeChildren', False)))
+
 @namespace.route('/ls')
 class LS(Resource):
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -33,16 +47,15 @@ class LS(Resource):
                 path = fs_db.root_path
             else:
                 path = data['path']
-            res = fm.ls(path, detail=True)
-            # raise Exception(res)
+            fs_id = fs_db.idx
             dbm.close_session()
-            return chonkyfy(res, path, fm)
+            return ls_page(fm, fs_id, path, data)
 
 @namespace.route('/lsTest')
 class LS(Resource):
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -69,16 +82,15 @@ class LS(Resource):
             # else:
             #     path = data['path']
             path = data['path']
-            res = fm.ls(path, detail=True)
-            # raise Exception(res)
             dbm.close_session()
-            return chonkyfy(res, path, fm)
+            # Connections under test are not cached
+            return ls_page(fm, None, path, data)
 
 @namespace.route('/delete')
 class Delete(Resource):
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -92,7 +104,7 @@ class Delete(Resource):
                 dbm.commit()
             except:
                 dbm.close_session()
-                dbm = access.DBMan(LOST_CONFIG)
+                dbm = access.DBMan(LOST_CONFIG, scoped=True)
                 fs_db = dbm.get_fs(fs_id=data['fs']['id'])
                 fs_db.deleted = True
                 dbm.add(fs_db)
@@ -105,7 +117,7 @@ class Delete(Resource):
 class FsList(Resource):
     @jwt_required 
     def get(self, visibility):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -149,7 +161,7 @@ class FsTypes(Resource):
 class SaveFs(Resource):
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -195,7 +207,7 @@ class SaveFs(Resource):
 class FullFs(Resource):
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
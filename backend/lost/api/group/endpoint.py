@@ -14,7 +14,7 @@ class GroupList(Resource):
     @api.marshal_with(group_list)
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -29,7 +29,7 @@ class GroupList(Resource):
     @jwt_required 
     def post(self):
         args = group_parser.parse_args(request)
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         group_name = args.get('group_name')
         if not group_name:
@@ -48,7 +48,7 @@ class Group(Resource):
     @api.marshal_with(group)
     @jwt_required 
     def get(self, id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         group = dbm.get_group_by_id(id)
         dbm.close_session()
@@ -59,7 +59,7 @@ class Group(Resource):
 
     @jwt_required 
     def delete(self, id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -7,7 +7,7 @@ from lost.api.label.parsers import update_label_parser, create_label_parser
 from lost.db import model, roles, access
 from lost.db.vis_level import VisLevel
 from lost.settings import LOST_CONFIG
-from lost.logic.label import LabelTree
+from lost.logic.label import LabelTree, get_hierarchical_dicts
 from io import BytesIO
 import flask 
 
@@ -18,7 +18,7 @@ class LabelTrees(Resource):
     #@api.marshal_with()
     @jwt_required 
     def get(self, visibility):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         default_group = dbm.get_group_by_name(user.user_name)
@@ -28,9 +28,7 @@ class LabelTrees(Resource):
                 return "You are not authorized.", 401
             else:
                 root_leaves = dbm.get_all_label_trees(group_id=default_group.idx)
-                trees = list()
-                for root_leaf in root_leaves:
-                    trees.append(LabelTree(dbm, root_leaf.idx).to_hierarchical_dict())
+                trees = get_hierarchical_dicts(dbm, root_leaves)
                 dbm.close_session()
                 return trees
         if visibility == VisLevel().GLOBAL:
@@ -39,9 +37,7 @@ class LabelTrees(Resource):
                 return "You are not authorized.", 401
             else:
                 root_leaves = dbm.get_all_label_trees(global_only=True)
-                trees = list()
-                for root_leaf in root_leaves:
-                    trees.append(LabelTree(dbm, root_leaf.idx).to_hierarchical_dict())
+                trees = get_hierarchical_dicts(dbm, root_leaves)
                 dbm.close_session()
                 return trees
         if visibility == VisLevel().ALL:
@@ -50,9 +46,7 @@ class LabelTrees(Resource):
                 return "You are not authorized.", 401
             else:
                 root_leaves = dbm.get_all_label_trees(group_id=default_group.idx, add_global=True)
-                trees = list()
-                for root_leaf in root_leaves:
-                    trees.append(LabelTree(dbm, root_leaf.idx).to_hierarchical_dict())
+                trees = get_hierarchical_dicts(dbm, root_leaves)
                 dbm.close_session()
                 return trees
         dbm.close_session()
@@ -65,7 +59,7 @@ class LabelEditNew(Resource):
     @jwt_required 
     def patch(self, visibility):
         args = update_label_parser.parse_args()
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -86,7 +80,7 @@ class LabelEditNew(Resource):
     @jwt_required 
     def post(self, visibility):
         args = create_label_parser.parse_args()
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         default_group = dbm.get_group_by_name(user.user_name)
@@ -127,7 +121,7 @@ class Label(Resource):
     @api.marshal_with(label_leaf)
     @jwt_required 
     def get(self,label_leaf_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -140,7 +134,7 @@ class Label(Resource):
 
     @jwt_required 
     def delete(self,label_leaf_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -157,7 +151,7 @@ class Label(Resource):
 class ExportLabelTree(Resource):
     @jwt_required 
     def get(self,label_leaf_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
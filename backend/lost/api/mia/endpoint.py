@@ -15,6 +15,8 @@ from lost.logic.file_man import FileMan
 from lost.pyapi.utils import anno_helper
 from lost.logic import mia
 from lost.logic import dask_session
+from lost.logic import image_stream
+from lost.logic import derivative_cache
 
 namespace = api.namespace('mia', description='MIA Annotation API.')
 
@@ -23,7 +25,7 @@ class Next(Resource):
     #@api.marshal_with(mia_anno)
     @jwt_required 
     def get(self, max_amount):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)     
         if not user.has_role(roles.ANNOTATOR):
@@ -39,7 +41,7 @@ class Label(Resource):
     #@api.marshal_with(label_trees)
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -54,7 +56,7 @@ class Label(Resource):
 class Update(Resource):
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -71,7 +73,7 @@ class Update(Resource):
 class Finish(Resource):
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -88,7 +90,7 @@ class Finish(Resource):
 class Special(Resource):
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)     
         if not user.has_role(roles.ANNOTATOR):
@@ -106,12 +108,120 @@ def load_img(db_img, fm, user):
     else:
         img = dask_session.ds_man.read_fs_img(user, db_img.fs, db_img.img_path)
     return img
+
+
+def get_crop_config(dbm, user):
+    config = mia.get_config(dbm, user.idx)
+    draw_anno = False
+    context = None
+    try:
+        draw_anno = config['drawAnno']
+    except:
+        pass
+    try:
+        context = float(config['addContext'])
+    except:
+        pass
+    return draw_anno, context
+
+def load_crop(db_img, db_anno, fm, user, draw_anno, context):
+    '''Get the crop of an annotation as encoded JPEG.
+
+    Crops are read through the derivative cache if the image file is
+    accessible from this process.
+    '''
+    def create():
+        image = load_img(db_img, fm, user)
+        crops, _ = anno_helper.crop_boxes(
+            [db_anno.to_vec('anno.data')],
+            [db_anno.to_vec('anno.dtype')], 
+            image, context=context, 
+            draw_annotations=draw_anno
+        )
+        return image_stream.encode_img(crops[0])
+    if LOST_CONFIG.worker_management == 'dynamic':
+        return create()
+    params = {
+        'data': db_anno.data,
+        'dtype': db_anno.dtype,
+        'context': context,
+        'draw_anno': draw_anno
+    }
+    return derivative_cache.load_derivative(fm, db_img.img_path, 'mia_crop',
+        params, create, lostconfig=LOST_CONFIG)
+
+@namespace.route('/image/<int:img_id>')
+@namespace.param('img_id', 'The id of the image annotation.')
+class Image(Resource):
+    @jwt_required 
+    def get(self, img_id):
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
+        identity = get_jwt_identity()
+        user = dbm.get_user_by_id(identity)
+        if not user.has_role(roles.ANNOTATOR):
+            dbm.close_session()
+            return "You need to be {} in order to perform this request.".format(roles.ANNOTATOR), 401
+
+        db_img = dbm.get_image_anno(img_id)
+        if db_img is None:
+            dbm.close_session()
+            return "Image annotation not found.", 404
+        if not image_stream.is_permitted(dbm, user, db_img.anno_task_id):
+            dbm.close_session()
+            return "You are not permitted to load this image.", 403
+        try:
+            if LOST_CONFIG.worker_management != 'dynamic':
+                fm = FileMan(fs_db=db_img.fs)
+                return image_stream.send_img_file(fm, db_img.img_path)
+            else:
+                img = load_img(db_img, None, user)
+                return image_stream.send_img_bytes(image_stream.encode_img(img))
+        finally:
+            dbm.close_session()
+
+@namespace.route('/annoimage/<int:anno_id>')
+@namespace.param('anno_id', 'The id of the two_d annotation that should be cropped.')
+class AnnoImage(Resource):
+    @jwt_required 
+    def get(self, anno_id):
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
+        identity = get_jwt_identity()
+        user = dbm.get_user_by_id(identity)
+        if not user.has_role(roles.ANNOTATOR):
+            dbm.close_session()
+            return "You need to be {} in order to perform this request.".format(roles.ANNOTATOR), 401
+
+        db_anno = dbm.get_two_d_anno(two_d_anno_id=anno_id)
+        if db_anno is None:
+            dbm.close_session()
+            return "Annotation not found.", 404
+        if not image_stream.is_permitted(dbm, user, db_anno.anno_task_id):
+            dbm.close_session()
+            return "You are not permitted to load this image.", 403
+        try:
+            db_img = dbm.get_image_anno(db_anno.img_anno_id)
+            draw_anno, context = get_crop_config(dbm, user)
+            fm = FileMan(fs_db=db_img.fs)
+            etag = None
+            mtime = None
+            if LOST_CONFIG.worker_management != 'dynamic':
+                abs_path = fm.get_abs_path(db_img.img_path)
+                size, mtime = image_stream.get_file_stat(fm, abs_path)
+                etag = image_stream.make_etag(db_img.fs.idx, abs_path, size,
+                    mtime, 'crop', db_anno.data, draw_anno, context)
+                if etag in flask.request.if_none_match:
+                    return image_stream.send_img_bytes(b'', etag, last_modified=mtime)
+            data = load_crop(db_img, db_anno, fm, user, draw_anno, context)
+            return image_stream.send_img_bytes(data, etag, last_modified=mtime)
+        finally:
+            dbm.close_session()
+
 @namespace.route('/getimage')
 class GetImage(Resource):
 
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -126,35 +236,17 @@ class GetImage(Resource):
                 db_img = dbm.get_image_anno(data['id'])
                 fm = FileMan(fs_db=db_img.fs)
                 img = load_img(db_img, fm, user)
+                _, data = cv2.imencode('.jpg', img)
+                data = data.tobytes()
             elif data['type'] == 'annoBased':
                 db_anno = dbm.get_two_d_anno(two_d_anno_id=data['id'])
                 db_img = dbm.get_image_anno(db_anno.img_anno_id)
                 fm = FileMan(fs_db=db_img.fs)
-                # image = fm.load_img(db_img.img_path)
-                image = load_img(db_img, fm, user)
-                
                 # get annotation_task config
-                config = mia.get_config(dbm, user.idx)
-                draw_anno = False
-                context = None
-                try:
-                    draw_anno = config['drawAnno']
-                except:
-                    pass
-                try:
-                    context = float(config['addContext'])
-                except:
-                    pass
-                crops, _ = anno_helper.crop_boxes(
-                    [db_anno.to_vec('anno.data')],
-                    [db_anno.to_vec('anno.dtype')], 
-                    image, context=context, 
-                    draw_annotations=draw_anno
-                )
-                img = crops[0]
+                draw_anno, context = get_crop_config(dbm, user)
+                data = load_crop(db_img, db_anno, fm, user, draw_anno, context)
             else:
                 raise Exception('Unknown mia image type')
-            _, data = cv2.imencode('.jpg', img)
-            data64 = base64.b64encode(data.tobytes())
+            data64 = base64.b64encode(data)
             dbm.close_session()
             return u'data:img/jpg;base64,'+data64.decode('utf-8')
\ No newline at end of file
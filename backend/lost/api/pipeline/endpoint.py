@@ -1,9 +1,9 @@
+import json
 from flask import request
-from flask_restx import Resource, Mask
+from flask_restx import Resource, Mask, marshal
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from lost.api.api import api
 from lost.api.pipeline.api_definition import templates, template, pipelines, pipeline
-from lost.api.pipeline import tasks
 from lost.api.label.api_definition import label_trees
 from lost.db import roles, access
 from lost.settings import LOST_CONFIG, DATA_URL
@@ -19,7 +19,7 @@ class TemplateList(Resource):
     @api.marshal_with(templates)
     @jwt_required
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -37,7 +37,7 @@ class Template(Resource):
     @api.marshal_with(template, skip_none=True)
     @jwt_required
     def get(self, template_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -56,7 +56,7 @@ class PipelineList(Resource):
     # @api.marshal_with(pipelines) 
     @jwt_required
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -80,7 +80,7 @@ class Pipeline(Resource):
     # @api.marshal_with(pipeline)
     @jwt_required
     def get(self, pipeline_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -92,14 +92,15 @@ class Pipeline(Resource):
             return re
     @jwt_required
     def delete(self, pipeline_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
             dbm.close_session()
             return "You need to be {} in order to perform this request.".format(roles.DESIGNER), 401
         else:
-            tasks.delete_pipe.delay(pipeline_id)
+            # Rows and files are removed in background by the cron jobs
+            pipeline_service.mark_deleted(dbm, pipeline_id)
             dbm.close_session()
             return 'success'
 
@@ -110,7 +111,7 @@ class PipelineStart(Resource):
     # @api.marshal_with(pipeline_start)
     @jwt_required
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -118,8 +119,6 @@ class PipelineStart(Resource):
             return "You need to be {} in order to perform this request.".format(roles.DESIGNER), 401
         else:
             data = request.data
-            # quick and dirty here, data was binary but should be dictonary without using json.loads locally.
-            import json
             data = json.loads(data)
             group_id = None
             for user_group in dbm.get_user_groups_by_user_id(identity):
@@ -133,12 +132,79 @@ class PipelineStart(Resource):
                 dbm.close_session()
                 return "default group for user {} not found.".format(identity), 400
 
+def _get_start_list(data, max_count):
+    '''Get start definitions of */startMany* from request data.
+
+    Args:
+        data (bytes): Json list of start definitions or a single definition
+            with an optional *count*.
+        max_count (int): Max number of pipes that may be started at once.
+
+    Returns:
+        list of dict: One start definition per pipe.
+
+    Raises:
+        ValueError: If data is no valid request.
+    '''
+    try:
+        data = json.loads(data)
+    except ValueError:
+        raise ValueError('Request is no valid json.')
+    if isinstance(data, dict):
+        count = data.pop('count', 1)
+        if not isinstance(count, int) or isinstance(count, bool) or count < 1:
+            raise ValueError('count needs to be a positive integer.')
+        data = [data] * count
+    if not isinstance(data, list) or len(data) == 0:
+        raise ValueError('Expected a start definition or a non empty list of them.')
+    if len(data) > max_count:
+        raise ValueError('At most {} pipes can be started at once.'.format(max_count))
+    for entry in data:
+        if not isinstance(entry, dict) or 'templateId' not in entry:
+            raise ValueError('Each start definition needs a templateId.')
+    return data
+
+@namespace.route('/startMany')
+class PipelineStartMany(Resource):
+    @api.response(200, 'success', pipelines)
+    @jwt_required
+    def post(self):
+        '''Start multiple pipes in one transaction.
+
+        Expects a list of start definitions like */start*, or a single
+        definition with a *count* to start this pipe count times.
+        '''
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
+        identity = get_jwt_identity()
+        user = dbm.get_user_by_id(identity)
+        if not user.has_role(roles.DESIGNER):
+            dbm.close_session()
+            return "You need to be {} in order to perform this request.".format(roles.DESIGNER), 401
+        try:
+            data = _get_start_list(request.data, LOST_CONFIG.pipe_start_max_count)
+        except ValueError as e:
+            dbm.close_session()
+            return str(e), 400
+        group_id = None
+        for user_group in dbm.get_user_groups_by_user_id(identity):
+            if user_group.group.is_user_default:
+                group_id = user_group.group.idx
+        if not group_id:
+            dbm.close_session()
+            return "default group for user {} not found.".format(identity), 400
+        try:
+            pipe_ids = pipeline_service.start_many(dbm, data, identity, group_id)
+        finally:
+            dbm.close_session()
+        return marshal({'pipelines': [{'id': pipe_id} for pipe_id in pipe_ids]},
+            pipelines)
+
 
 @namespace.route('/updateArguments')
 class PipelineUpdateArguments(Resource):
     @jwt_required
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -154,7 +220,7 @@ class PipelineUpdateArguments(Resource):
 class PipelinePause(Resource):
     @jwt_required
     def post(self, pipeline_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -170,7 +236,7 @@ class PipelinePause(Resource):
 class PipelinePlay(Resource):
     @jwt_required
     def post(self, pipeline_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
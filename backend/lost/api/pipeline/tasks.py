@@ -7,7 +7,6 @@ def delete_pipe(pipe_id):
     # logger = get_task_logger(__name__)
     # logger.info("DELETED BY CELERY {}".format(pipe_id))
     lostconfig = LOSTConfig()
-    dbm = DBMan(lostconfig)
-    pipeline.delete(dbm, pipe_id)
-    dbm.close_session()
+    with DBMan(lostconfig) as dbm:
+        pipeline.delete(dbm, pipe_id)
 
@@ -17,6 +17,8 @@ from io import BytesIO
 from lost.logic.file_man import FileMan
 # from lost.lost_session import lost_session
 from lost.logic import dask_session
+from lost.logic import image_stream
+from lost.logic import derivative_cache
 
 namespace = api.namespace('sia', description='SIA Annotation API.')
 
@@ -25,7 +27,7 @@ class First(Resource):
     @api.marshal_with(sia_anno)
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -42,7 +44,7 @@ class Next(Resource):
     @api.marshal_with(sia_anno)
     @jwt_required 
     def get(self, last_img_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -61,7 +63,7 @@ class Prev(Resource):
     @api.marshal_with(sia_anno)
     @jwt_required 
     def get(self,last_img_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -78,7 +80,7 @@ class Last(Resource):
     @api.marshal_with(sia_anno)
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -99,7 +101,7 @@ class GetImage(Resource):
     # @api.expect(sia_update)
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         # raise Exception('lostsession: {}'.format(dask_session.ds_man.session))
@@ -114,28 +116,78 @@ class GetImage(Resource):
             flask.current_app.logger.info('sia -> getimage. Received data: {}'.format(data))
             db_img = dbm.get_image_anno(data['imgId'])
             if LOST_CONFIG.worker_management != 'dynamic':
-                fm = FileMan(fs_db=db_img.fs)
                 flask.current_app.logger.info('sia -> getimage. fs.name: {} fs.root_path: {}'.format(db_img.fs.name, db_img.fs.root_path))
-                img = fm.load_img(db_img.img_path)
+                data = sia.load_jpeg(db_img, LOST_CONFIG)
             else:
                 img = dask_session.ds_man.read_fs_img(user, db_img.fs, db_img.img_path)
                 flask.current_app.logger.info('dask_session read_fs_img type: {}'.format(type(img)))
                 flask.current_app.logger.info('dask_session read_fs_img shape: {}'.format(img.shape))
+                _, data = cv2.imencode('.jpg', img)
+                data = data.tobytes()
 
             # img_path = fm.get_abs_path(db_img.img_path)
             # #raise Exception('sia -> getimage: {}'.format(img_path))
             # img = cv2.imread(img_path)
-            _, data = cv2.imencode('.jpg', img)
-            data64 = base64.b64encode(data.tobytes())
+            data64 = base64.b64encode(data)
             dbm.close_session()
             return u'data:img/jpg;base64,'+data64.decode('utf-8')
 
+@namespace.route('/image/<int:img_id>')
+@namespace.param('img_id', 'The id of the image annotation.')
+class Image(Resource):
+    @jwt_required 
+    def get(self, img_id):
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
+        identity = get_jwt_identity()
+        user = dbm.get_user_by_id(identity)
+        if not user.has_role(roles.ANNOTATOR):
+            dbm.close_session()
+            return "You need to be {} in order to perform this request.".format(roles.ANNOTATOR), 401
+
+        db_img = dbm.get_image_anno(img_id)
+        if db_img is None:
+            dbm.close_session()
+            return "Image annotation not found.", 404
+        if not image_stream.is_permitted(dbm, user, db_img.anno_task_id):
+            dbm.close_session()
+            return "You are not permitted to load this image.", 403
+        transcode = request.args.get('transcode', 'false') == 'true'
+        try:
+            if LOST_CONFIG.worker_management != 'dynamic':
+                fm = FileMan(fs_db=db_img.fs)
+                return image_stream.send_img_file(fm, db_img.img_path,
+                    transcode=transcode)
+            else:
+                img = dask_session.ds_man.read_fs_img(user, db_img.fs, db_img.img_path)
+                return image_stream.send_img_bytes(image_stream.encode_img(img))
+        finally:
+            dbm.close_session()
+
+def apply_filter(fs, img_path, params):
+    '''Load an image, apply SIA filters and encode it as JPEG.'''
+    if params['clahe']['active'] :
+        img = fs.load_img(img_path, color_type='gray')
+    else:
+        img = fs.load_img(img_path, color_type='color')
+    if params['rotate']['active']:
+        if params['rotate']['angle'] == 90:
+            img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
+        elif params['rotate']['angle'] == -90:
+            img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
+        elif params['rotate']['angle'] == 180:
+            img = cv2.rotate(img, cv2.ROTATE_180)
+    if params['clahe']['active']:
+        clahe = cv2.createCLAHE(params['clahe']['clipLimit'])
+        img = clahe.apply(img)
+    _, data = cv2.imencode('.jpg', img)
+    return data.tobytes()
+
 @namespace.route('/filter')
 class Filter(Resource):
     # @api.expect(sia_update)
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -147,39 +199,16 @@ class Filter(Resource):
             img = dbm.get_image_anno(data['imageId'])
             flask.current_app.logger.info('img.img_path: {}'.format(img.img_path))
             flask.current_app.logger.info('img.fs.name: {}'.format(img.fs.name))
+            flask.current_app.logger.info('Triggered filter. Received data: {}'.format(data))
             # fs_db = dbm.get_fs(img.fs_id)
             fs = FileMan(fs_db=img.fs)
-            #img = PIL.Image.open('/home/lost/data/media/10_voc2012/2007_008547.jpg')
-            # img = PIL.Image.open(img_path)
-            if data['clahe']['active'] :
-                img = fs.load_img(img.img_path, color_type='gray')
-            else:
-                img = fs.load_img(img.img_path, color_type='color')
-                
-            flask.current_app.logger.info('Triggered filter. Received data: {}'.format(data))
-
-            # img_io = BytesIO()
-            # img.save(img_io, 'PNG')
-            # img_io.seek(0)
-            # return send_file(img_io, mimetype='image/png')
-            if data['rotate']['active']:
-                if data['rotate']['angle'] == 90:
-                    img = cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE)
-                elif data['rotate']['angle'] == -90:
-                    img = cv2.rotate(img, cv2.ROTATE_90_COUNTERCLOCKWISE)
-                elif data['rotate']['angle'] == 180:
-                    img = cv2.rotate(img, cv2.ROTATE_180)
-            if data['clahe']['active']:
-                clahe = cv2.createCLAHE(data['clahe']['clipLimit'])
-                img = clahe.apply(img)
-                # img = img.rotate(data['rotate']['angle'], expand=True)
-            # img = ImageOps.autocontrast(img)
-
-            # data = BytesIO()
-            # img.save(data, "PNG")
-            _, data = cv2.imencode('.jpg', img)
-            data64 = base64.b64encode(data.tobytes())
+            params = {'clahe': data['clahe'], 'rotate': data['rotate']}
+            img_path = img.img_path
             dbm.close_session()
+            data = derivative_cache.load_derivative(fs, img_path, 'sia_filter',
+                params, lambda: apply_filter(fs, img_path, params),
+                lostconfig=LOST_CONFIG)
+            data64 = base64.b64encode(data)
             return u'data:img/jpg;base64,'+data64.decode('utf-8')
             # re = sia.update(dbm, data, user.idx)
             # dbm.close_session()
@@ -190,7 +219,7 @@ class Update(Resource):
     # @api.expect(sia_update)
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -207,7 +236,7 @@ class Update(Resource):
 class Finish(Resource):
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -241,7 +270,7 @@ class Label(Resource):
     #@api.marshal_with(label_trees)
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -257,7 +286,7 @@ class Configuration(Resource):
     @api.marshal_with(sia_config)
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
@@ -272,7 +301,7 @@ class Configuration(Resource):
 class Review(Resource):
     @jwt_required 
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -291,7 +320,7 @@ class Review(Resource):
 class ReviewOptions(Resource):
     @jwt_required 
     def get(self, pe_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
@@ -308,7 +337,7 @@ class ReviewOptions(Resource):
 class ReviewUpdate(Resource):
     @jwt_required 
     def post(self, pe_id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.DESIGNER):
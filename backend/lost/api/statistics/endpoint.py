@@ -14,7 +14,7 @@ namespace = api.namespace('statistics', description='LOST Statistics API')
 class Personal(Resource):
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ANNOTATOR):
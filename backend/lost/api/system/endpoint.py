@@ -5,6 +5,7 @@ from lost.api.api import api
 
 from lost.settings import LOST_CONFIG
 from lost.db import access, roles
+from lost.logic import derivative_cache
 
 import lost
 import os
@@ -22,7 +23,7 @@ class Version(Resource):
 class JupyterLabUrl(Resource):
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ADMINISTRATOR):
@@ -33,3 +34,29 @@ class JupyterLabUrl(Resource):
             if LOST_CONFIG.jupyter_lab_active:
                 return f'{LOST_CONFIG.jupyter_lab_port}/lab?token={LOST_CONFIG.jupyter_lab_token}' 
             return ''
+
+@namespace.route('/imgcache')
+class ImgCacheStats(Resource):
+    @jwt_required 
+    def get(self):
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
+        identity = get_jwt_identity()
+        user = dbm.get_user_by_id(identity)
+        if not user.has_role(roles.ADMINISTRATOR):
+            dbm.close_session()
+            return "You need to be {} in order to perform this request.".format(roles.ADMINISTRATOR), 401
+        dbm.close_session()
+        return derivative_cache.get_cache(LOST_CONFIG).get_stats()
+
+@namespace.route('/dbpool')
+class DBPoolStats(Resource):
+    @jwt_required 
+    def get(self):
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
+        identity = get_jwt_identity()
+        user = dbm.get_user_by_id(identity)
+        if not user.has_role(roles.ADMINISTRATOR):
+            dbm.close_session()
+            return "You need to be {} in order to perform this request.".format(roles.ADMINISTRATOR), 401
+        dbm.close_session()
+        return access.get_pool_stats()
@@ -22,7 +22,7 @@ class UserList(Resource):
     @api.marshal_with(user_list)
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ADMINISTRATOR):
@@ -41,7 +41,7 @@ class UserList(Resource):
     @jwt_required 
     @api.expect(create_user_parser)
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ADMINISTRATOR):
@@ -102,7 +102,7 @@ class User(Resource):
     @api.marshal_with(user)
     @jwt_required 
     def get(self, id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ADMINISTRATOR):
@@ -118,7 +118,7 @@ class User(Resource):
 
     @jwt_required 
     def delete(self, id):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ADMINISTRATOR):
@@ -148,7 +148,7 @@ class User(Resource):
     @api.expect(update_user_parser)
     def patch(self, id):
         args = update_user_parser.parse_args()
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if not user.has_role(roles.ADMINISTRATOR):
@@ -208,7 +208,7 @@ class UserSelf(Resource):
     @api.marshal_with(user)
     @jwt_required 
     def get(self):
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         dbm.close_session()
@@ -221,7 +221,7 @@ class UserSelf(Resource):
     @jwt_required 
     def patch(self):
         args = update_user_parser.parse_args()
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if user:
@@ -242,7 +242,7 @@ class UserLogout(Resource):
     @jwt_required 
     def post(self):
         identity = get_jwt_identity()
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         release_user_annos(dbm, identity)
         user = dbm.get_user_by_id(identity)
         if LOST_CONFIG.worker_management == 'dynamic':
@@ -265,7 +265,7 @@ class UserLogoutRefresh(Resource):
 class UserTokenRefresh(Resource):
     @jwt_refresh_token_required
     def post(self):
-        dbm = access.DBMan(LOST_CONFIG) 
+        dbm = access.DBMan(LOST_CONFIG, scoped=True) 
         identity = get_jwt_identity()
         user = dbm.get_user_by_id(identity)
         if LOST_CONFIG.worker_management == 'dynamic':
@@ -293,7 +293,7 @@ class UserLogin(Resource):
     def post(self):
         # get data from parser
         data = login_parser.parse_args()
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         user = dbm.find_user_by_user_name(data['user_name'])
         lm = LoginManager(dbm, data['user_name'], data['password'])
         response = lm.login()
@@ -309,7 +309,7 @@ class Token(Resource):
     def post(self):
         # get data from parser
         data = login_parser.parse_args()
-        dbm = access.DBMan(LOST_CONFIG)
+        dbm = access.DBMan(LOST_CONFIG, scoped=True)
         # find user in database
         if 'user_name' in data:
             user = dbm.find_user_by_user_name(data['user_name'])
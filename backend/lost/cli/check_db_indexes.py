@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import argparse
+from lost.db import model, access, state
+from lost.db.db_patch import INDEXED_TABLES
+import lostconfig as config
+import logging
+
+logging.basicConfig(level=logging.INFO, format='(%(levelname)s): %(message)s')
+
+# Hot annotation queries with placeholders for anno_task_id, iteration,
+# user_id and sim_class.
+HOT_QUERIES = [
+    ('sia next unlocked image',
+     "SELECT * FROM image_anno WHERE anno_task_id={at} AND state={unlocked} "
+     "AND iteration={it} ORDER BY idx ASC LIMIT 1"),
+    ('sia next locked image',
+     "SELECT * FROM image_anno WHERE anno_task_id={at} AND state={locked} "
+     "AND user_id={user} AND iteration={it}"),
+    ('sia first/last image of user',
+     "SELECT max(idx) FROM image_anno WHERE iteration={it} "
+     "AND anno_task_id={at} AND user_id={user}"),
+    ('image annos by state',
+     "SELECT * FROM image_anno WHERE state={locked} AND anno_task_id={at} "
+     "AND user_id={user}"),
+    ('random unlocked image anno',
+     "SELECT sim_class FROM image_anno WHERE anno_task_id={at} "
+     "AND state={unlocked} AND idx >= 1 ORDER BY idx LIMIT 1"),
+    ('image annos by sim class',
+     "SELECT * FROM image_anno WHERE state={unlocked} AND anno_task_id={at} "
+     "AND sim_class={sim_class} LIMIT 10"),
+    ('release locked image annos by timeout',
+     "SELECT COUNT(idx) FROM image_anno WHERE anno_task_id IN ({at}) "
+     "AND state IN ({locked}, {locked_priority}) "
+     "AND timestamp_lock < '2000-01-01'"),
+    ('count remaining image annos',
+     "SELECT COUNT(state) FROM image_anno WHERE anno_task_id={at} "
+     "AND state!={labeled} AND state!={labeled_locked}"),
+    ('count image annos in iteration',
+     "SELECT COUNT(idx) FROM image_anno WHERE anno_task_id={at} AND iteration={it}"),
+    ('two_d annos by state',
+     "SELECT * FROM two_d_anno WHERE state={locked} AND anno_task_id={at} "
+     "AND user_id={user}"),
+    ('random unlocked two_d anno',
+     "SELECT sim_class FROM two_d_anno WHERE anno_task_id={at} "
+     "AND state={unlocked} AND idx >= 1 ORDER BY idx LIMIT 1"),
+    ('two_d annos by sim class',
+     "SELECT * FROM two_d_anno WHERE state={unlocked} AND anno_task_id={at} "
+     "AND sim_class={sim_class} LIMIT 10"),
+    ('count remaining two_d annos',
+     "SELECT COUNT(state) FROM two_d_anno WHERE anno_task_id={at} "
+     "AND state!={labeled} AND state!={labeled_locked}"),
+    ('release locked two_d annos by timeout',
+     "SELECT COUNT(idx) FROM two_d_anno WHERE anno_task_id IN ({at}) "
+     "AND state IN ({locked}, {locked_priority}) "
+     "AND timestamp_lock < '2000-01-01'"),
+    ('two_d annos of image in iteration',
+     "SELECT * FROM two_d_anno WHERE img_anno_id=1 AND iteration={it}"),
+    ('label statistic for image annos',
+     "SELECT COUNT(idx) FROM label WHERE label_leaf_id=1 AND img_anno_id IN "
+     "(SELECT idx FROM image_anno WHERE anno_task_id={at})"),
+    ('label statistic for two_d annos',
+     "SELECT COUNT(idx) FROM label WHERE label_leaf_id=1 AND two_d_anno_id IN "
+     "(SELECT idx FROM two_d_anno WHERE anno_task_id={at})"),
+]
+
+def check_missing_indexes(dbm):
+    '''Log indexes of the data model that are not present in database.
+
+    Returns:
+        int: Number of missing indexes.
+    '''
+    missing = 0
+    for table_name in INDEXED_TABLES:
+        table = model.Base.metadata.tables[table_name]
+        present = set(row[2] for row in dbm.session.execute(
+            "SHOW INDEX FROM {}".format(table_name)))
+        for index in table.indexes:
+            if index.name not in present:
+                missing += 1
+                logging.warning('Missing index {} on {}. Restart LOST or run '
+                    'lost/logic/init/init_patchsystem.py to create it.'.format(
+                    index.name, table_name))
+    return missing
+
+def explain(dbm, sql):
+    '''Get the query plan of a sql statement.
+
+    Returns:
+        list: One dict per row of the EXPLAIN output.
+    '''
+    res = dbm.session.execute('EXPLAIN ' + sql)
+    keys = list(res.keys())
+    return [dict(zip(keys, row)) for row in res]
+
+def main(args):
+    lostconfig = config.LOSTConfig()
+    dbm = access.DBMan(lostconfig)
+    params = {
+        'at': args.anno_task_id,
+        'it': args.iteration,
+        'user': args.user_id,
+        'sim_class': args.sim_class,
+        'unlocked': state.Anno.UNLOCKED,
+        'locked': state.Anno.LOCKED,
+        'locked_priority': state.Anno.LOCKED_PRIORITY,
+        'labeled': state.Anno.LABELED,
+        'labeled_locked': state.Anno.LABELED_LOCKED
+    }
+    missing = check_missing_indexes(dbm)
+    for name, sql in HOT_QUERIES:
+        sql = sql.format(**params)
+        print('\n## {}\n{}'.format(name, sql))
+        for row in explain(dbm, sql):
+            print('  table={} type={} key={} rows={} extra={}'.format(
+                row.get('table'), row.get('type'), row.get('key'),
+                row.get('rows'), row.get('Extra')))
+            if row.get('key') is None and row.get('table') in INDEXED_TABLES:
+                logging.warning('No index used for {} in query: {}'.format(
+                    row.get('table'), name))
+    dbm.close_session()
+    if missing > 0:
+        logging.warning('{} indexes are missing'.format(missing))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Check indexes and print '
+        'the query plans of hot annotation queries')
+    parser.add_argument('--anno_task_id', type=int, default=1,
+                        help='AnnoTask id used in queries.')
+    parser.add_argument('--iteration', type=int, default=0,
+                        help='Iteration used in queries.')
+    parser.add_argument('--user_id', type=int, default=1,
+                        help='User id used in queries.')
+    parser.add_argument('--sim_class', type=int, default=1,
+                        help='Similarity class used in queries.')
+    args = parser.parse_args()
+    main(args)
@@ -6,7 +6,6 @@ import lostconfig as config
 from lost.logic.label import LabelTree
 import logging
 import os
-import pandas as pd
 
 logging.basicConfig(level=logging.INFO, format='(%(levelname)s): %(message)s')
 
@@ -14,6 +13,8 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Import a label tree into this lost instance')
     parser.add_argument('csv_file', nargs='?', action='store',
                         help='Path to the label tree in csv style.')
+    parser.add_argument('--chunksize', type=int, default=10000,
+                        help='Number of csv rows that are read at once.')
     # parser.add_argument('group_name', nargs='?', action='store',
     #                     help='Name of group that pipeline should be visible for.')
     args = parser.parse_args()
@@ -21,7 +22,7 @@ if __name__ == "__main__":
     lostconfig = config.LOSTConfig()
     dbm = access.DBMan(lostconfig)
     tree = LabelTree(dbm, logger=logging)
-    df = pd.read_csv(args.csv_file)
-    if tree.import_df(df) is None:
+    root, id_map = tree.import_csv(args.csv_file, chunksize=args.chunksize)
+    if root is None:
         logging.warning('LabelTree already present in database! {}'.format(args.csv_file))
     dbm.close_session()
\ No newline at end of file
@@ -1,9 +1,15 @@
 import sqlalchemy
 from sqlalchemy import exists
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.pool import NullPool, QueuePool
 from sqlalchemy import or_
-from lost.db import model, state, dtype
+from sqlalchemy import event
+from lost.db import model, state, dtype, anno_counter, label_version
+from contextlib import contextmanager
+import threading
+import random
+import time
 import os
 
 def convert_connection_str(lostconfig):
@@ -20,23 +26,267 @@ def convert_connection_str(lostconfig):
     out = lostconfig.db_connector + "://" + lostconfig.lost_db_user + ":" + lostconfig.lost_db_pwd + "@" + lostconfig.lost_db_ip +":"+ lostconfig.lost_db_port + "/" + lostconfig.lost_db_name
     return out
 
+class PoolStats(object):
+    '''Checkout and wait statistics of a connection pool.'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def add_wait(self, duration):
+        with self.lock:
+            self.waits += 1
+            self.wait_time += duration
+            self.max_wait_time = max(self.max_wait_time, duration)
+
+    def count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                'connects': self.connects,
+                'checkouts': self.checkouts,
+                'checkins': self.checkins,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time,
+                'avg_wait_time': self.wait_time / self.waits if self.waits else 0.0
+            }
+
+class TimedQueuePool(QueuePool):
+    '''QueuePool that measures how long a checkout waits for a connection.'''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.monotonic()
+        try:
+            return super()._do_get()
+        finally:
+            self.stats.add_wait(time.monotonic() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+class EngineRegistry(object):
+    '''Process wide registry of pooled engines.
+
+    One engine (with its session factories) is created per connection string
+    and process. After a fork the child creates new engines, while the
+    inherited ones are kept alive but never used, so that connections of
+    the parent process are not closed by the child.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.engines = dict()
+        self.stats = dict()
+        self.pid = os.getpid()
+        self._inherited = list()
+
+    def _check_fork(self):
+        if self.pid != os.getpid():
+            self._inherited.append(self.engines)
+            self.engines = dict()
+            self.stats = dict()
+            self.pid = os.getpid()
+
+    def _create_engine(self, lostconfig, debug):
+        orm_connection_str = convert_connection_str(lostconfig)
+        if lostconfig.db_pool_size <= 0:
+            return sqlalchemy.create_engine(orm_connection_str, echo=debug,
+                                            poolclass=NullPool), None
+        engine = sqlalchemy.create_engine(orm_connection_str, echo=debug,
+            poolclass=TimedQueuePool,
+            pool_size=lostconfig.db_pool_size,
+            max_overflow=lostconfig.db_max_overflow,
+            pool_timeout=lostconfig.db_pool_timeout,
+            pool_recycle=lostconfig.db_pool_recycle,
+            pool_pre_ping=lostconfig.db_pool_pre_ping)
+        stats = engine.pool.stats
+        event.listen(engine, 'connect', lambda *args: stats.count('connects'))
+        event.listen(engine, 'checkout', lambda *args: stats.count('checkouts'))
+        event.listen(engine, 'checkin', lambda *args: stats.count('checkins'))
+        return engine, stats
+
+    def get(self, lostconfig, debug=False):
+        '''Get engine, sessionmaker and scoped session registry.
+
+        Args:
+            lostconfig (object): :class:`lost.pyapi.parse.LOSTConfig`
+            debug (bool): If True, echo database communication.
+
+        Returns:
+            tuple: (engine, sessionmaker, scoped_session)
+        '''
+        key = (convert_connection_str(lostconfig), debug,
+            lostconfig.db_pool_size, lostconfig.db_max_overflow,
+            lostconfig.db_pool_timeout, lostconfig.db_pool_recycle,
+            lostconfig.db_pool_pre_ping)
+        with self.lock:
+            self._check_fork()
+            if key not in self.engines:
+                engine, stats = self._create_engine(lostconfig, debug)
+                Session = sessionmaker(bind=engine)
+                self.engines[key] = (engine, Session, scoped_session(Session))
+                if stats is not None:
+                    self.stats[key] = (engine, stats)
+            return self.engines[key]
+
+    def get_stats(self):
+        '''Get statistics for all pooled engines of this process.
+
+        Returns:
+            list: One dict per engine with pool status and checkout stats.
+        '''
+        with self.lock:
+            self._check_fork()
+            stats = list(self.stats.values())
+        res = list()
+        for engine, pool_stats in stats:
+            entry = pool_stats.to_dict()
+            entry['url'] = repr(engine.url)
+            entry['size'] = engine.pool.size()
+            entry['checkedout'] = engine.pool.checkedout()
+            entry['overflow'] = engine.pool.overflow()
+            res.append(entry)
+        return res
+
+    def remove_scoped_sessions(self):
+        '''Remove the scoped sessions of the current thread for all engines.'''
+        with self.lock:
+            self._check_fork()
+            registries = [scoped for _, _, scoped in self.engines.values()]
+        for scoped in registries:
+            if scoped is not None:
+                scoped.remove()
+
+    def dispose(self):
+        '''Dispose all engines of this process.'''
+        with self.lock:
+            self._check_fork()
+            for engine, _, scoped in self.engines.values():
+                scoped.remove()
+                engine.dispose()
+            self.engines = dict()
+            self.stats = dict()
+
+engine_registry = EngineRegistry()
+
+def get_pool_stats():
+    '''Get connection pool statistics of this process.
+
+    Returns:
+        list: One dict per engine.
+    '''
+    return engine_registry.get_stats()
+
+def remove_scoped_sessions():
+    '''Remove the scoped sessions of the current thread.
+
+    Called when a request ends, so that scoped sessions are never shared
+    between requests that are served by the same thread.
+    '''
+    engine_registry.remove_scoped_sessions()
+
+def sample_sim_class(session, anno_model, anno_task_id, rand=random):
+    '''Pick the sim class of a random unlocked annotation of an anno task.
+
+    Instead of sorting or counting all unlocked annotations, a random id
+    between the smallest and the largest id of the unlocked annotations is
+    drawn and the first unlocked annotation with an equal or greater id is
+    taken. Both are lookups on the index anno_task_id, state, idx, so the
+    cost does not grow with the number of annotations. An annotation is
+    picked with a probability proportional to the gap of ids in front of
+    it. Since annotations of a task are inserted with consecutive ids and
+    locked or labeled annotations are not grouped by sim class, sim classes
+    are drawn about proportional to their number of unlocked annotations.
+
+    Args:
+        session: Database session.
+        anno_model: :class:`model.ImageAnno` or :class:`model.TwoDAnno`
+        anno_task_id (int): Id of the anno task.
+        rand: Random number generator that provides *randint*.
+
+    Returns:
+        Row with *idx* and *sim_class* attribute or None if there is no
+        unlocked annotation.
+    '''
+    unlocked = sqlalchemy.and_(anno_model.anno_task_id==anno_task_id,
+        anno_model.state==state.Anno.UNLOCKED)
+    # Separate queries, since sqlite only optimizes a single min or max
+    min_idx = session.query(sqlalchemy.func.min(anno_model.idx))\
+        .filter(unlocked).scalar()
+    if min_idx is None:
+        return None
+    max_idx = session.query(sqlalchemy.func.max(anno_model.idx))\
+        .filter(unlocked).scalar()
+    return session.query(anno_model.idx, anno_model.sim_class)\
+        .filter(unlocked, anno_model.idx >= rand.randint(min_idx, max_idx))\
+        .order_by(anno_model.idx).limit(1).first()
+
 class DBMan(object):
     """Database access manager for Project database.
     """
-    def __init__(self, lostconfig, debug=False):
+    def __init__(self, lostconfig, debug=False, scoped=False):
         '''Init database connection
 
         Args:
             lostconfig (object): :class:`lost.pyapi.parse.LOSTConfig`
             debug (bool): If True, echo database communication.
-        '''
-        orm_connection_str = convert_connection_str(lostconfig)
-        self.engine = sqlalchemy.create_engine(orm_connection_str, echo=debug,
-                                               poolclass=NullPool)
-        self.__Session = sessionmaker(bind=self.engine)
-        self.session = self.__Session()
+            scoped (bool): If True, use the thread local session of the
+                engine, that is shared with all other scoped DBMan
+                objects of the same thread.
+
+        Note:
+            Engines and connection pools are shared inside a process, see
+            :class:`EngineRegistry`. DBMan can be used as context manager,
+            the session will be closed on exit.
+        '''
+        self.engine, self.__Session, self.__scoped = engine_registry.get(
+            lostconfig, debug)
+        self.scoped = scoped
+        self.session = self.__create_session()
         self.lostconfig = lostconfig
 
+    def __create_session(self):
+        if self.scoped:
+            return self.__scoped()
+        return self.__Session()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        if hasattr(self, 'session'):
+            if exc_type is not None:
+                self.session.rollback()
+            self.close_session()
+
+    @contextmanager
+    def session_scope(self):
+        '''Run a unit of work in the current session.
+
+        Commit on success and rollback if an exception occurs.
+
+        Yields:
+            Session: The current sqlalchemy session.
+        '''
+        try:
+            yield self.session
+            self.session.commit()
+        except:
+            self.session.rollback()
+            raise
+
     def create_database(self):
         '''Create all tables that are modeled in *data_model.project* in database.
 
@@ -54,11 +304,15 @@ class DBMan(object):
     def new_session(self):
         '''Cerate new orm session for this DBManager'''
         self.session.close()
-        self.session = self.__Session()
+        if self.scoped:
+            self.__scoped.remove()
+        self.session = self.__create_session()
 
     def close_session(self):
         '''Close current session  for this DBManager'''
         self.session.close()
+        if self.scoped:
+            self.__scoped.remove()
         del self.session
 
     def add(self, obj):
@@ -89,6 +343,114 @@ class DBMan(object):
         self.session.add(obj)
         self.session.commit()
 
+    def bulk_insert(self, table_model, rows, owner_filter):
+        '''Insert rows with one multi-row insert and get their new ids.
+
+        Note:
+            Rows are not committed. The new ids are read back with one
+            query for all rows of the owner that have a greater id than
+            before the insert. So the caller needs to be the only writer
+            of rows that match *owner_filter*.
+
+        Args:
+            table_model: Model class of the table, e.g. :class:`model.TwoDAnno`.
+            rows (list of dict): Rows to insert.
+            owner_filter: Filter that selects all rows of the same owner,
+                e.g. *model.TwoDAnno.img_anno_id==img_anno_id*.
+
+        Returns:
+            list of int: New ids in order of rows.
+        '''
+        if len(rows) == 0:
+            return list()
+        prev_max = self.session.query(sqlalchemy.func.max(table_model.idx))\
+            .filter(owner_filter).scalar()
+        if prev_max is None:
+            prev_max = 0
+        self.session.execute(table_model.__table__.insert(), rows)
+        anno_counter.apply_deltas(self.session.connection(),
+            anno_counter.deltas_from_rows(table_model, rows))
+        new_ids = [r[0] for r in self.session.query(table_model.idx)\
+            .filter(owner_filter, table_model.idx > prev_max)\
+            .order_by(table_model.idx.asc())]
+        if len(new_ids) != len(rows):
+            raise Exception('Could not determine ids of inserted {} rows!'.format(
+                table_model.__tablename__))
+        return new_ids
+
+    def lock_annos(self, anno_model, annos, timestamp_lock=None, user_id=None,
+        anno_state=None):
+        '''Update lock related columns of annotations.
+
+        Annotations are only updated if their state in the database is
+        still the state of the given objects. So annotations that were
+        locked by another annotator after they were read are skipped.
+        The rows are read with a row lock first and updated with one
+        UPDATE per state.
+
+        Note:
+            Changes are not committed. Counter deltas are applied for the
+            updated rows and the updated objects are changed in place
+            without becoming dirty. Skipped objects are expired.
+
+        Args:
+            anno_model: :class:`model.ImageAnno` or :class:`model.TwoDAnno`
+            annos (list): Annotation objects to update.
+            timestamp_lock (datetime): New lock timestamp. If None, the
+                timestamp is not changed.
+            user_id (int): New user of the annotations. If None, the user is
+                not changed.
+            anno_state (int): New state. If None, the state is not changed.
+
+        Returns:
+            list: The updated annotation objects in the given order.
+        '''
+        values = dict()
+        if timestamp_lock is not None:
+            values['timestamp_lock'] = timestamp_lock
+        if user_id is not None:
+            values['user_id'] = user_id
+        if anno_state is not None:
+            values['state'] = anno_state
+        if len(annos) == 0 or len(values) == 0:
+            return list(annos)
+        table = anno_model.__table__
+        rows = self.session.execute(sqlalchemy.select([table.c.idx,
+            table.c.anno_task_id, table.c.iteration, table.c.state])\
+            .where(table.c.idx.in_([anno.idx for anno in annos]))\
+            .with_for_update()).fetchall()
+        rows = {row.idx: row for row in rows}
+        updated = list()
+        by_state = dict()
+        for anno in annos:
+            row = rows.get(anno.idx)
+            if row is not None and row.state == anno.state:
+                updated.append(anno)
+                by_state.setdefault(anno.state, list()).append(anno)
+            else:
+                self.session.expire(anno)
+        old_rows = list()
+        for old_state, group in sorted(by_state.items()):
+            result = self.session.execute(table.update()\
+                .where(table.c.idx.in_([anno.idx for anno in group]))\
+                .where(table.c.state==old_state).values(**values))
+            if result.rowcount != len(group):
+                raise Exception('{} of {} annotations were changed by another '
+                    'transaction'.format(len(group) - result.rowcount, len(group)))
+            old_rows += [{'anno_task_id': rows[anno.idx].anno_task_id,
+                'iteration': rows[anno.idx].iteration, 'state': old_state}
+                for anno in group]
+        if anno_state is not None:
+            new_rows = [dict(row, state=anno_state) for row in old_rows]
+            anno_counter.apply_deltas(self.session.connection(),
+                anno_counter.merge_deltas(
+                    anno_counter.deltas_from_rows(anno_model, old_rows, -1),
+                    anno_counter.deltas_from_rows(anno_model, new_rows)))
+        for anno in updated:
+            for key, value in values.items():
+                set_committed_value(anno, key, value)
+        return updated
+
     def get_anno_task(self, anno_task_id=None, pipe_element_id=None, state=None):
         '''Get an AnnoationTask object.
 
@@ -149,16 +511,33 @@ class DBMan(object):
         '''
         return self.session.query(model.Pipe).all()
 
-    def get_pipes_to_process(self):
+    def get_pipes_to_process(self, pipe_ids=None):
         '''Get all :class:`project.Pipe` objects that are not finished.
 
+        Args:
+            pipe_ids (list of int): Only consider pipes with these ids.
+                If None, all pipes will be considered.
+
         Returns:
             list: A list of :class:`project.Pipe` objects
         '''
-        return self.session.query(model.Pipe)\
+        query = self.session.query(model.Pipe)\
             .filter((model.Pipe.state!=state.Pipe.FINISHED) &\
                     (model.Pipe.state!=state.Pipe.DELETED) &\
-                    (model.Pipe.state!=state.Pipe.PAUSED)).all()
+                    (model.Pipe.state!=state.Pipe.PAUSED))
+        if pipe_ids is not None:
+            query = query.filter(model.Pipe.idx.in_(pipe_ids))
+        return query.all()
+
+    def get_pipe_ids_to_delete(self):
+        '''Get ids of all pipes that are marked as deleted.
+
+        Returns:
+            list of int: Pipe ids.
+        '''
+        return [row.idx for row in self.session.query(model.Pipe.idx)\
+            .filter(model.Pipe.state==state.Pipe.DELETED)\
+            .order_by(model.Pipe.idx).all()]
 
     def get_pipes(self, group_ids):
         '''Get all :class:`project.Pipe` objects that are not finished.
@@ -189,6 +568,76 @@ class DBMan(object):
         return self.session.query(model.PipeTemplate)\
             .filter(model.PipeTemplate.idx==pipe_template_id).first()
 
+    def get_pipe_template_timestamps(self, pipe_template_ids):
+        '''Get timestamps of PipeTemplates without loading their json.
+
+        Returns:
+            dict: pipe_template_id -> timestamp
+        '''
+        if not pipe_template_ids:
+            return dict()
+        return dict(self.session.query(model.PipeTemplate.idx,
+            model.PipeTemplate.timestamp)\
+            .filter(model.PipeTemplate.idx.in_(pipe_template_ids)).all())
+
+    def get_pipe_template_jsons(self, pipe_template_ids):
+        '''Get json of PipeTemplates.
+
+        Returns:
+            list: Tuples of (idx, timestamp, json_template).
+        '''
+        if not pipe_template_ids:
+            return list()
+        return self.session.query(model.PipeTemplate.idx,
+            model.PipeTemplate.timestamp, model.PipeTemplate.json_template)\
+            .filter(model.PipeTemplate.idx.in_(pipe_template_ids)).all()
+
+    def get_pipe_list(self, group_ids, debug_mode=False):
+        '''Get list columns of all pipes that are not deleted.
+
+        Args:
+            group_ids [int]: List of group ids to search for.
+            debug_mode (bool): Get pipes in debug mode or all other pipes.
+
+        Returns:
+            list: Rows with *idx*, *name*, *description*, *timestamp*,
+            *state*, *manager_id*, *is_debug_mode*, *logfile_path*,
+            *pipe_template_id* and *group_name*, ordered by idx.
+        '''
+        if debug_mode:
+            debug_filter = model.Pipe.is_debug_mode == True
+        else:
+            debug_filter = or_(model.Pipe.is_debug_mode == False,
+                model.Pipe.is_debug_mode == None)
+        return self.session.query(model.Pipe.idx, model.Pipe.name,
+            model.Pipe.description, model.Pipe.timestamp, model.Pipe.state,
+            model.Pipe.manager_id, model.Pipe.is_debug_mode,
+            model.Pipe.logfile_path, model.Pipe.pipe_template_id,
+            model.Group.name.label('group_name'))\
+            .outerjoin(model.Group, model.Group.idx==model.Pipe.group_id)\
+            .filter(model.Pipe.group_id.in_(group_ids),
+                model.Pipe.state!=state.Pipe.DELETED, debug_filter)\
+            .order_by(model.Pipe.idx).all()
+
+    def get_pipe_progress(self, group_ids):
+        '''Count finished pipe elements of all pipes that are not deleted.
+
+        Args:
+            group_ids [int]: List of group ids to search for.
+
+        Returns:
+            dict: pipe_id -> (finished, total)
+        '''
+        finished = sqlalchemy.func.sum(sqlalchemy.case(
+            [(model.PipeElement.state==state.PipeElement.FINISHED, 1)], else_=0))
+        rows = self.session.query(model.PipeElement.pipe_id, finished,
+            sqlalchemy.func.count(model.PipeElement.idx))\
+            .join(model.Pipe, model.Pipe.idx==model.PipeElement.pipe_id)\
+            .filter(model.Pipe.group_id.in_(group_ids),
+                model.Pipe.state!=state.Pipe.DELETED)\
+            .group_by(model.PipeElement.pipe_id).all()
+        return {pipe_id: (int(f or 0), total) for pipe_id, f, total in rows}
+
     def get_script(self, script_id=None, name=None, file_name=None):
         '''Get a script object from database.
 
@@ -290,11 +739,11 @@ class DBMan(object):
         .limit(amount).all()
 
     def get_random_sim_class_img_anno(self, anno_task_id):
-        ''' get a random sim class of one anno task (created by db)
+        ''' get a random sim class of one anno task
+
+        See :func:`sample_sim_class`.
         '''
-        sql = "SELECT sim_class FROM image_anno WHERE anno_task_id=%d AND state=%d ORDER BY RAND() LIMIT 1"\
-        %(anno_task_id, state.Anno.UNLOCKED)
-        return self.session.execute(sql).first()
+        return sample_sim_class(self.session, model.ImageAnno, anno_task_id)
 
     def get_all_img_annos(self):
         '''Get a list of all ImageAnnos in database.
@@ -422,6 +871,22 @@ class DBMan(object):
          %(anno_task_id, state.Anno.LABELED, state.Anno.LABELED_LOCKED)
         return self.session.execute(sql).first()
 
+    def get_anno_counters(self, anno_task_id, anno_type, iteration=None):
+        '''Get maintained annotation counters of an anno task.
+
+        Args:
+            anno_task_id (int): Id of the anno task.
+            anno_type (int): :data:`anno_counter.IMAGE_ANNO` or
+                :data:`anno_counter.TWO_D_ANNO`
+            iteration (int): Iteration to count. All iterations if None.
+
+        Returns:
+            dict: total, locked, labeled and remaining annotations and the
+            version of the counters.
+        '''
+        return anno_counter.get_counters(self.session, anno_task_id,
+            anno_type, iteration)
+
     def count_all_image_annos(self, anno_task_id, iteration):
         ''' Count the all image annotation of an annotation task
         '''
@@ -643,11 +1108,11 @@ class DBMan(object):
         .limit(amount).all()
     
     def get_random_sim_class_two_d_anno(self, anno_task_id):
-        ''' get a random sim class of one anno task (created by db)
+        ''' get a random sim class of one anno task
+
+        See :func:`sample_sim_class`.
         '''
-        sql = "SELECT sim_class FROM two_d_anno WHERE anno_task_id=%d AND state=%d ORDER BY RAND() LIMIT 1"\
-        %(anno_task_id, state.Anno.UNLOCKED)
-        return self.session.execute(sql).first()
+        return sample_sim_class(self.session, model.TwoDAnno, anno_task_id)
     
     def count_two_d_remaining_annos(self, anno_task_id):
         ''' Count the remaining two_d annotation of an annotation task
@@ -0,0 +1,310 @@
+'''Maintained annotation counters per anno task and iteration.
+
+Changes of :class:`model.ImageAnno` and :class:`model.TwoDAnno` objects are
+collected after each ORM flush and applied to the *anno_task_counter* table
+on the same connection, so counters are committed or rolled back together
+with the annotations. Writes that bypass the ORM need to call
+:func:`apply_deltas` themselves.
+
+Counters of an anno task are only maintained once they were created by
+:func:`reconcile`. This happens on the first read and periodically in the
+cron jobs to correct any drift.
+
+The version of a counter changes whenever annotations are added or
+removed, so it can be used to validate data that is cached per anno task.
+'''
+import sqlalchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from lost.db import model, state
+
+IMAGE_ANNO = 1
+TWO_D_ANNO = 2
+
+LOCKED_STATES = [state.Anno.LOCKED, state.Anno.LOCKED_PRIORITY,
+    state.Anno.LABELED_LOCKED]
+LABELED_STATES = [state.Anno.LABELED, state.Anno.LABELED_LOCKED]
+
+ANNO_TYPES = {
+    model.ImageAnno: IMAGE_ANNO,
+    model.TwoDAnno: TWO_D_ANNO
+}
+
+def _counts(anno_state):
+    '''Get the counter increments of one annotation in a state.
+
+    Returns:
+        tuple: (total, locked, labeled)
+    '''
+    return (1, int(anno_state in LOCKED_STATES), int(anno_state in LABELED_STATES))
+
+def _add(deltas, key, counts, sign=1):
+    if key[0] is None:
+        return
+    old = deltas.get(key, (0, 0, 0))
+    deltas[key] = tuple(o + sign*c for o, c in zip(old, counts))
+
+def _values(obj, attr):
+    '''Get value before and after the current flush of an attribute.'''
+    hist = inspect(obj).attrs[attr].history
+    if hist.added:
+        new = hist.added[0]
+    elif hist.unchanged:
+        new = hist.unchanged[0]
+    else:
+        new = None
+    old = hist.deleted[0] if hist.deleted else new
+    return old, new
+
+def counter_key(anno_type, anno_task_id, iteration):
+    '''Get the key of a counter in a dict of deltas.
+
+    Args:
+        anno_type (int): :data:`IMAGE_ANNO` or :data:`TWO_D_ANNO`
+        anno_task_id (int): Id of the anno task.
+        iteration (int): Iteration of the annotations, None counts as 0.
+
+    Returns:
+        tuple: (anno_task_id, iteration, anno_type)
+    '''
+    return (anno_task_id, iteration if iteration is not None else 0, anno_type)
+
+def deltas_from_rows(table_model, rows, sign=1):
+    '''Get counter deltas for annotation rows that are inserted (sign=1)
+    or deleted (sign=-1) without ORM.
+
+    Args:
+        table_model: :class:`model.ImageAnno` or :class:`model.TwoDAnno`
+        rows (list of dict): Rows with *anno_task_id*, *iteration* and
+            *state*.
+
+    Returns:
+        dict: (anno_task_id, iteration, anno_type) -> (total, locked, labeled)
+    '''
+    deltas = dict()
+    anno_type = ANNO_TYPES.get(table_model)
+    if anno_type is None:
+        return deltas
+    for row in rows:
+        _add(deltas, counter_key(anno_type, row.get('anno_task_id'), row.get('iteration')),
+            _counts(row.get('state')), sign)
+    return deltas
+
+def merge_deltas(*deltas):
+    '''Sum up multiple dicts of counter deltas.'''
+    merged = dict()
+    for d in deltas:
+        for key, counts in d.items():
+            _add(merged, key, counts)
+    return merged
+
+def deltas_from_session(session):
+    '''Get counter deltas of all annotation objects in a flush.'''
+    deltas = dict()
+    for obj in session.new:
+        anno_type = ANNO_TYPES.get(type(obj))
+        if anno_type is not None:
+            _add(deltas, counter_key(anno_type, obj.anno_task_id, obj.iteration),
+                _counts(obj.state))
+    for obj in session.deleted:
+        anno_type = ANNO_TYPES.get(type(obj))
+        if anno_type is not None:
+            anno_task_id, _ = _values(obj, 'anno_task_id')
+            iteration, _ = _values(obj, 'iteration')
+            anno_state, _ = _values(obj, 'state')
+            _add(deltas, counter_key(anno_type, anno_task_id, iteration),
+                _counts(anno_state), -1)
+    for obj in session.dirty:
+        anno_type = ANNO_TYPES.get(type(obj))
+        if anno_type is None:
+            continue
+        old_at, new_at = _values(obj, 'anno_task_id')
+        old_it, new_it = _values(obj, 'iteration')
+        old_state, new_state = _values(obj, 'state')
+        if (old_at, old_it, old_state) == (new_at, new_it, new_state):
+            continue
+        _add(deltas, counter_key(anno_type, old_at, old_it), _counts(old_state), -1)
+        _add(deltas, counter_key(anno_type, new_at, new_it), _counts(new_state))
+    return deltas
+
+def _moved_keys(session):
+    '''Get counter keys of annotation objects that were added or removed
+    in a flush.'''
+    keys = set()
+    for obj in session.new:
+        anno_type = ANNO_TYPES.get(type(obj))
+        if anno_type is not None:
+            keys.add(counter_key(anno_type, obj.anno_task_id, obj.iteration))
+    for obj in session.deleted:
+        anno_type = ANNO_TYPES.get(type(obj))
+        if anno_type is not None:
+            keys.add(counter_key(anno_type, _values(obj, 'anno_task_id')[0],
+                _values(obj, 'iteration')[0]))
+    for obj in session.dirty:
+        anno_type = ANNO_TYPES.get(type(obj))
+        if anno_type is None:
+            continue
+        old_at, new_at = _values(obj, 'anno_task_id')
+        old_it, new_it = _values(obj, 'iteration')
+        if (old_at, old_it) != (new_at, new_it):
+            keys.add(counter_key(anno_type, old_at, old_it))
+            keys.add(counter_key(anno_type, new_at, new_it))
+    return keys
+
+def apply_deltas(conn, deltas, moved_keys=()):
+    '''Apply counter deltas on a connection.
+
+    Counters of anno tasks that were not reconciled yet are skipped. The
+    version of a counter is incremented if its total changes.
+
+    Args:
+        conn: Connection that is used for the annotation changes.
+        deltas (dict): See :func:`deltas_from_rows`.
+        moved_keys (set): Keys of counters where annotations were added
+            or removed although the total did not change.
+    '''
+    table = model.AnnoTaskCounter.__table__
+    keys = set(deltas) | set(k for k in moved_keys if k[0] is not None)
+    # Rows are always updated in the same order, so that concurrent
+    # transactions can not lock each other's counters crosswise.
+    for key in sorted(keys):
+        anno_task_id, iteration, anno_type = key
+        d_total, d_locked, d_labeled = deltas.get(key, (0, 0, 0))
+        d_version = int(d_total != 0 or key in moved_keys)
+        if d_version == 0 and d_locked == 0 and d_labeled == 0:
+            continue
+        where = sqlalchemy.and_(table.c.anno_task_id==anno_task_id,
+            table.c.iteration==iteration, table.c.anno_type==anno_type)
+        update = table.update().where(where).values(
+            total=table.c.total + d_total,
+            locked=table.c.locked + d_locked,
+            labeled=table.c.labeled + d_labeled,
+            version=table.c.version + d_version)
+        if conn.execute(update).rowcount > 0:
+            continue
+        initialized = conn.execute(sqlalchemy.select([table.c.idx])\
+            .where(table.c.anno_task_id==anno_task_id).limit(1)).first()
+        if initialized is None:
+            continue
+        # First annotations of a new iteration
+        savepoint = conn.begin_nested()
+        try:
+            conn.execute(table.insert().values(anno_task_id=anno_task_id,
+                iteration=iteration, anno_type=anno_type, total=d_total,
+                locked=d_locked, labeled=d_labeled, version=d_version))
+            savepoint.commit()
+        except IntegrityError:
+            # Row was created by a concurrent transaction
+            savepoint.rollback()
+            conn.execute(update)
+
+def _noop_set(target, value, oldvalue, initiator):
+    pass
+
+# Load the old value of expired attributes when they are set, otherwise the
+# history of a changed annotation has no old value to count down.
+for _anno_model in ANNO_TYPES:
+    for _attr in ('anno_task_id', 'iteration', 'state'):
+        event.listen(getattr(_anno_model, _attr), 'set', _noop_set,
+            active_history=True)
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    deltas = deltas_from_session(session)
+    if deltas:
+        apply_deltas(session.connection(), deltas, _moved_keys(session))
+
+def reconcile(session, anno_task_id):
+    '''Recount all annotations of an anno task and store the counters.
+
+    Existing counter rows are locked before counting and corrected by
+    updates, so deltas of concurrent annotation changes wait for the
+    reconcile and are applied on top of the new counts. Their version is
+    incremented, since annotations may have changed unnoticed.
+
+    Note:
+        Changes are not committed.
+
+    Args:
+        session: Database session.
+        anno_task_id (int): Id of the anno task.
+    '''
+    table = model.AnnoTaskCounter.__table__
+    existing = dict()
+    for row in session.execute(sqlalchemy.select([table.c.idx,
+        table.c.anno_task_id, table.c.iteration, table.c.anno_type])\
+        .where(table.c.anno_task_id==anno_task_id)\
+        .order_by(table.c.anno_task_id, table.c.iteration, table.c.anno_type)\
+        .with_for_update()):
+        existing[(row.anno_task_id, row.iteration, row.anno_type)] = row.idx
+    rows = {key: (0, 0, 0) for key in existing}
+    for anno_model, anno_type in ANNO_TYPES.items():
+        query = session.query(anno_model.iteration, anno_model.state,
+            sqlalchemy.func.count(anno_model.idx))\
+            .filter(anno_model.anno_task_id==anno_task_id)\
+            .group_by(anno_model.iteration, anno_model.state)
+        for iteration, anno_state, count in query:
+            key = counter_key(anno_type, anno_task_id, iteration)
+            counts = _counts(anno_state)
+            old = rows.get(key, (0, 0, 0))
+            rows[key] = tuple(o + count*c for o, c in zip(old, counts))
+    new_rows = list()
+    for key, c in sorted(rows.items()):
+        values = {'total': c[0], 'locked': c[1], 'labeled': c[2]}
+        if key in existing:
+            session.execute(table.update()\
+                .where(table.c.idx==existing[key])\
+                .values(version=table.c.version + 1, **values))
+        else:
+            values.update({'anno_task_id': key[0], 'iteration': key[1],
+                'anno_type': key[2], 'version': 0})
+            new_rows.append(values)
+    if new_rows:
+        session.execute(table.insert(), new_rows)
+
+def get_counters(session, anno_task_id, anno_type, iteration=None):
+    '''Get counters of an anno task.
+
+    Counters are reconciled first if they are not present.
+
+    Args:
+        session: Database session.
+        anno_task_id (int): Id of the anno task.
+        anno_type (int): :data:`IMAGE_ANNO` or :data:`TWO_D_ANNO`
+        iteration (int): Count only this iteration. If None, all iterations
+            are summed up.
+
+    Returns:
+        dict: total, locked, labeled and remaining annotations and the
+        version of the counters.
+    '''
+    counters = session.query(model.AnnoTaskCounter)\
+        .filter(model.AnnoTaskCounter.anno_task_id==anno_task_id).all()
+    if len(counters) == 0:
+        # Reconcile in an own transaction, so that pending changes of the
+        # caller are not committed.
+        rec_session = Session(bind=session.get_bind())
+        try:
+            reconcile(rec_session, anno_task_id)
+            rec_session.commit()
+        except IntegrityError:
+            # Counters were created by a concurrent reconcile
+            rec_session.rollback()
+        finally:
+            rec_session.close()
+        counters = session.query(model.AnnoTaskCounter)\
+            .filter(model.AnnoTaskCounter.anno_task_id==anno_task_id)\
+            .populate_existing().all()
+    res = {'total': 0, 'locked': 0, 'labeled': 0, 'version': 0}
+    for c in counters:
+        if c.anno_type != anno_type:
+            continue
+        if iteration is not None and c.iteration != iteration:
+            continue
+        res['total'] += c.total
+        res['locked'] += c.locked
+        res['labeled'] += c.labeled
+        res['version'] += c.version or 0
+    res['remaining'] = res['total'] - res['labeled']
+    return res
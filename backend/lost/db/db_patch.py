@@ -1,27 +1,79 @@
 import MySQLdb
 from lostconfig import LOSTConfig
+from lost.db import model
 import time
 
+# Tables where all indexes of the data model should be present in database
+INDEXED_TABLES = ['image_anno', 'two_d_anno', 'label']
+
 class DBPatcher():
-    
+
     def __init__(self):
-        pass
-    
+        # Patches are applied in this order. Each patch needs to be
+        # idempotent, since patches are executed on every version change.
+        self.patches = [
+            ('user_api_token', self.__patch_user_api_token),
+            ('anno_task_counter_version', self.__patch_anno_task_counter_version)
+        ]
+        # Patches that check the database state themselves and are
+        # executed on every startup.
+        self.startup_patches = [
+            ('anno_indexes', self.__patch_anno_indexes)
+        ]
+
     def patch(self):
-        try:
-            self.__patch_user_api_token()
-            time.sleep(3)
-        except:
-            print("Could not patch Database.")
-    
-    def __patch_user_api_token(self):
+        self.__apply(self.patches, delay=3)
+
+    def patch_startup(self):
+        self.__apply(self.startup_patches)
+
+    def __apply(self, patches, delay=0):
+        for name, patch in patches:
+            try:
+                patch()
+                print("Applied database patch: {}".format(name))
+                time.sleep(delay)
+            except:
+                print("Could not patch Database: {}".format(name))
+
+    def __connect(self):
         lost_config = LOSTConfig()
-        db = MySQLdb.connect(host=lost_config.lost_db_ip,
+        return MySQLdb.connect(host=lost_config.lost_db_ip,
                             port=int(lost_config.lost_db_port),
                             user=lost_config.lost_db_user,
                             passwd=lost_config.lost_db_pwd,
                             db=lost_config.lost_db_name)
 
+    def __patch_user_api_token(self):
+        db = self.__connect()
         cur = db.cursor()
         cur.execute("ALTER TABLE user ADD COLUMN api_token varchar(4096)")
         db.close()
+
+    def __patch_anno_task_counter_version(self):
+        db = self.__connect()
+        cur = db.cursor()
+        cur.execute("ALTER TABLE anno_task_counter ADD COLUMN version int DEFAULT 0")
+        db.close()
+
+    def __patch_anno_indexes(self):
+        '''Create composite indexes for annotation queries that are defined
+        in the data model but missing in database.'''
+        db = self.__connect()
+        try:
+            cur = db.cursor()
+            for table_name in INDEXED_TABLES:
+                table = model.Base.metadata.tables[table_name]
+                cur.execute("SHOW INDEX FROM {}".format(table_name))
+                # Column 2 of SHOW INDEX is Key_name
+                present = set(row[2] for row in cur.fetchall())
+                for index in sorted(table.indexes, key=lambda i: i.name):
+                    if index.name in present:
+                        continue
+                    columns = ', '.join([c.name for c in index.columns])
+                    print("Create index {} on {} ({})".format(index.name,
+                        table_name, columns))
+                    cur.execute("CREATE INDEX {} ON {} ({})".format(index.name,
+                        table_name, columns))
+        finally:
+            db.close()
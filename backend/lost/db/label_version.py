@@ -0,0 +1,60 @@
+'''Version token of all label trees.
+
+Every ORM flush that creates, changes or deletes a :class:`model.LabelLeaf`
+replaces the token in the *label_tree_version* table on the same
+connection. So the token changes in the same transaction as the labels and
+is visible to all processes once committed. Tokens are random and never
+reused, so a version of a rolled back transaction never becomes valid.
+Writes that bypass the ORM need to call :func:`bump` themselves.
+'''
+import uuid
+import sqlalchemy
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
+from lost.db import model
+
+VERSION_ID = 1
+
+def bump(conn):
+    '''Set a new version token on a connection.
+
+    Returns:
+        str: The new token.
+    '''
+    table = model.LabelTreeVersion.__table__
+    version = uuid.uuid4().hex
+    update = table.update().where(table.c.idx==VERSION_ID).values(version=version)
+    if conn.execute(update).rowcount > 0:
+        return version
+    savepoint = conn.begin_nested()
+    try:
+        conn.execute(table.insert().values(idx=VERSION_ID, version=version))
+        savepoint.commit()
+    except IntegrityError:
+        # Row was created by a concurrent transaction
+        savepoint.rollback()
+        conn.execute(update)
+    return version
+
+def get_version(session):
+    '''Get the current version token.
+
+    Returns:
+        str: Token or None if labels were never changed through the ORM.
+    '''
+    table = model.LabelTreeVersion.__table__
+    return session.execute(sqlalchemy.select([table.c.version])\
+        .where(table.c.idx==VERSION_ID)).scalar()
+
+def _changes_labels(session):
+    for objs in (session.new, session.dirty, session.deleted):
+        for obj in objs:
+            if isinstance(obj, model.LabelLeaf):
+                return True
+    return False
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, flush_context):
+    if _changes_labels(session):
+        bump(session.connection())
@@ -4,7 +4,7 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy import Column, Integer, String, DateTime, Float, Text, Boolean
 # from sqlalchemy.dialects.mysql import DATETIME
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index, UniqueConstraint
 from sqlalchemy.schema import MetaData
 from sqlalchemy.orm import relationship
 from sqlalchemy import orm
@@ -142,6 +142,14 @@ class TwoDAnno(Base):
         meta (str): A field for meta information added by a script
     """
     __tablename__ = "two_d_anno"
+    __table_args__ = (
+        Index('ix_two_d_anno_at_iteration_state', 'anno_task_id', 'iteration', 'state'),
+        Index('ix_two_d_anno_at_state_user', 'anno_task_id', 'state', 'user_id'),
+        Index('ix_two_d_anno_at_state_sim_class', 'anno_task_id', 'state', 'sim_class'),
+        Index('ix_two_d_anno_at_state_idx', 'anno_task_id', 'state', 'idx'),
+        Index('ix_two_d_anno_at_state_timestamp_lock', 'anno_task_id', 'state', 'timestamp_lock'),
+        Index('ix_two_d_anno_img_anno_iteration', 'img_anno_id', 'iteration'),
+    )
 
     idx = Column(Integer, primary_key=True)
     anno_task_id = Column(Integer, ForeignKey('anno_task.idx'))
@@ -664,6 +672,14 @@ class ImageAnno(Base):
         meta (str): A field for meta information added by a script
     """
     __tablename__ = "image_anno"
+    __table_args__ = (
+        Index('ix_image_anno_at_iteration_state', 'anno_task_id', 'iteration', 'state'),
+        Index('ix_image_anno_at_iteration_user_state', 'anno_task_id', 'iteration', 'user_id', 'state'),
+        Index('ix_image_anno_at_state_user', 'anno_task_id', 'state', 'user_id'),
+        Index('ix_image_anno_at_state_sim_class', 'anno_task_id', 'state', 'sim_class'),
+        Index('ix_image_anno_at_state_idx', 'anno_task_id', 'state', 'idx'),
+        Index('ix_image_anno_at_state_timestamp_lock', 'anno_task_id', 'state', 'timestamp_lock'),
+    )
 
     idx = Column(Integer, primary_key=True)
     anno_task_id = Column(Integer, ForeignKey('anno_task.idx'))
@@ -1180,6 +1196,54 @@ class ChoosenAnnoTask(Base):
         self.anno_task_id = anno_task_id
 
 
+class AnnoTaskCounter(Base):
+    """Maintained annotation counters of an anno task per iteration.
+
+    Counters are updated in the same transaction as the annotations they
+    count (see :mod:`lost.db.anno_counter`).
+
+    Attributes:
+        idx (int): ID in database.
+        anno_task_id (int): ID of the anno task.
+        iteration (int): Iteration of the counted annotations.
+        anno_type (int): Counted annotation type
+            (see :class:`lost.db.anno_counter.IMAGE_ANNO` and
+            :class:`lost.db.anno_counter.TWO_D_ANNO`).
+        total (int): Number of annotations.
+        locked (int): Number of locked annotations.
+        labeled (int): Number of labeled annotations.
+        version (int): Incremented whenever annotations are added or
+            removed and when the counters are reconciled.
+    """
+    __tablename__ = "anno_task_counter"
+    __table_args__ = (
+        UniqueConstraint('anno_task_id', 'iteration', 'anno_type',
+            name='uq_anno_task_counter_key'),
+    )
+    idx = Column(Integer, primary_key=True)
+    anno_task_id = Column(Integer, ForeignKey('anno_task.idx'))
+    iteration = Column(Integer)
+    anno_type = Column(Integer)
+    total = Column(Integer)
+    locked = Column(Integer)
+    labeled = Column(Integer)
+    version = Column(Integer, default=0)
+
+    def __init__(self, anno_task_id=None, iteration=None, anno_type=None,
+                 total=0, locked=0, labeled=0, version=0):
+        self.anno_task_id = anno_task_id
+        self.iteration = iteration
+        self.anno_type = anno_type
+        self.total = total
+        self.locked = locked
+        self.labeled = labeled
+        self.version = version
+
+    @property
+    def remaining(self):
+        return self.total - self.labeled
+
+
 class PipeElement(Base):
     """One element in a workflow pipeline.
 
@@ -1533,6 +1597,27 @@ class LabelLeaf(Base):
         return pd.DataFrame(self.to_dict(), index=[0])
 
 
+class LabelTreeVersion(Base):
+    """Version of all label trees.
+
+    The version is replaced by a new random token whenever a
+    :class:`LabelLeaf` is created, changed or deleted (see
+    :mod:`lost.db.label_version`). Cached label trees are only valid for
+    the version they were loaded with.
+
+    Attributes:
+        idx (int): ID in database. There is only one row.
+        version (str): Current version token.
+    """
+    __tablename__ = "label_tree_version"
+    idx = Column(Integer, primary_key=True)
+    version = Column(String(32))
+
+    def __init__(self, idx=None, version=None):
+        self.idx = idx
+        self.version = version
+
+
 class Label(Base):
     '''Represants an Label that is related to an annoation.
 
@@ -1551,6 +1636,10 @@ class Label(Base):
 
     '''
     __tablename__ = "label"
+    __table_args__ = (
+        Index('ix_label_label_leaf_img_anno', 'label_leaf_id', 'img_anno_id'),
+        Index('ix_label_label_leaf_two_d_anno', 'label_leaf_id', 'two_d_anno_id'),
+    )
     idx = Column(Integer, primary_key=True)
     dtype = Column(Integer)
     label_leaf_id = Column(Integer, ForeignKey(
@@ -27,5 +27,6 @@ def update_version_log():
             versions.append(lost.__version__)
             with open(path, 'w') as json_file:
                 json.dump(versions, json_file)
+    DBPatcher().patch_startup()
 
 
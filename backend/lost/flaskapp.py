@@ -2,6 +2,7 @@ from flask import Flask
 from lost import settings
 # from lost.taskman import make_celery
 from lost.logic.file_man import AppFileMan
+from lost.db import access
 from flask_mail import Mail
 import os
 import traceback 
@@ -25,6 +26,12 @@ formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(messag
 file_handler.setFormatter(formatter)
 app.logger.addHandler(file_handler)
 
+@app.teardown_appcontext
+def remove_db_sessions(exception=None):
+    # Endpoints use scoped sessions, so connections go back to the pool
+    # even if an endpoint raised before it closed its session.
+    access.remove_scoped_sessions()
+
 # app.config['CELERY_BROKER_URL'] = settings.CELERY_BROKER_URL
 # app.config['CELERY_RESULT_BACKEND'] = settings.CELERY_RESULT_BACKEND
 
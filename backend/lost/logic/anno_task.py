@@ -1,9 +1,10 @@
 import json
-from lost.db import model, state, dtype
+from lost.db import model, state, dtype, anno_counter
 from datetime import datetime
 from lost.pyapi import pipe_elements
 import pandas as pd
 from lost.logic import email
+from lost.logic.pipeline import scheduler
 
 def update_anno_task(dbm, anno_task_id, user_id=None):
     remaining = None
@@ -45,19 +46,18 @@ def update_anno_task(dbm, anno_task_id, user_id=None):
         dbm.save_obj(annotask)
         return response
 
-def __get_image_anno_counts(dbm, anno_task_id, iteration):
-    remaining = dbm.count_image_remaining_annos(anno_task_id=anno_task_id).r
-    available = None
-    for r in dbm.count_all_image_annos(anno_task_id=anno_task_id, iteration=iteration)[0]:
-        available = r
+def __get_anno_counts(dbm, anno_task_id, iteration, anno_type):
+    # Remaining annos are counted over all iterations, available annos
+    # only in the current iteration.
+    remaining = dbm.get_anno_counters(anno_task_id, anno_type)['remaining']
+    available = dbm.get_anno_counters(anno_task_id, anno_type, iteration)['total']
     return remaining, available
 
+def __get_image_anno_counts(dbm, anno_task_id, iteration):
+    return __get_anno_counts(dbm, anno_task_id, iteration, anno_counter.IMAGE_ANNO)
+
 def __get_two_d_anno_counts(dbm, anno_task_id, iteration):
-    remaining = dbm.count_two_d_remaining_annos(anno_task_id=anno_task_id).r
-    available = None
-    for r in dbm.count_all_two_d_annos(anno_task_id=anno_task_id, iteration=iteration)[0]:
-        available = r
-    return remaining, available
+    return __get_anno_counts(dbm, anno_task_id, iteration, anno_counter.TWO_D_ANNO)
 
 
 def set_finished(dbm, anno_task_id):
@@ -79,6 +79,8 @@ def set_finished(dbm, anno_task_id):
             pipe_e.state = state.PipeElement.FINISHED
             dbm.add(pipe_e)
             dbm.commit()
+            scheduler.notify(pipe_e.pipe_id, scheduler.ANNO_TASK_FINISHED,
+                dbm.lostconfig)
             try: 
                 email.send_annotask_finished(dbm, anno_task)
             except:
@@ -0,0 +1,63 @@
+import argparse
+import time
+import pandas as pd
+from lost.db.access import DBMan
+from lost.utils import testils
+from lost.pyapi.script import Script
+import lostconfig as config
+
+BBOX = [0.1, 0.1, 0.2, 0.2]
+
+def get_df(n_imgs, n_annos, prefix):
+    img_paths = list()
+    anno_data = list()
+    for i in range(n_imgs):
+        for _ in range(n_annos):
+            img_paths.append('{}/img_{}.jpg'.format(prefix, i))
+            anno_data.append(BBOX)
+    return pd.DataFrame({
+        'img_path': img_paths,
+        'anno_data': anno_data,
+        'anno_dtype': ['bbox']*len(anno_data)
+    })
+
+def bench_per_image(s, df):
+    start = time.time()
+    for img_path, group in df.groupby('img_path', sort=False):
+        s.outp.request_annos(img_path, annos=list(group['anno_data']),
+            anno_types=list(group['anno_dtype']))
+    return time.time() - start
+
+def bench_bulk(s, df, chunk_size):
+    start = time.time()
+    s.outp.request_annos_bulk(df, chunk_size=chunk_size)
+    return time.time() - start
+
+def main(args):
+    dbm = DBMan(config.LOSTConfig())
+    for name in ['per_image', 'bulk']:
+        pe_s, pe_a, pipe = testils.get_script_pipeline_fragment(dbm)
+        try:
+            s = Script(pe_id=pe_s.idx)
+            df = get_df(args.n_imgs, args.n_annos, name)
+            if name == 'bulk':
+                duration = bench_bulk(s, df, args.chunk_size)
+            else:
+                duration = bench_per_image(s, df)
+            print('{}: {} images, {} annos in {:.2f}s ({:.0f} images/s)'.format(
+                name, args.n_imgs, len(df), duration, args.n_imgs/duration))
+        finally:
+            testils.delete_script_pipeline_fragment(dbm, pipe)
+    dbm.close_session()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare request_annos with '
+        'request_annos_bulk')
+    parser.add_argument('--n_imgs', type=int, default=1000,
+                        help='Number of images to request.')
+    parser.add_argument('--n_annos', type=int, default=5,
+                        help='Number of bboxes per image.')
+    parser.add_argument('--chunk_size', type=int, default=1000,
+                        help='Images per transaction for the bulk request.')
+    args = parser.parse_args()
+    main(args)
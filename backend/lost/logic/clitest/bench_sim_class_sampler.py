@@ -0,0 +1,87 @@
+import argparse
+import random
+import time
+from collections import Counter
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+from lost.db import model, state
+from lost.db.access import sample_sim_class
+
+ANNO_TASK_ID = 1
+
+def fill_table(engine, n_annos, n_classes, chunk_size=50000):
+    model.ImageAnno.__table__.drop(engine, checkfirst=True)
+    model.ImageAnno.__table__.create(engine)
+    rows = list()
+    with engine.begin() as conn:
+        for i in range(n_annos):
+            # Skewed class sizes to check that the distribution is kept
+            rows.append({
+                'anno_task_id': ANNO_TASK_ID,
+                'state': random.choice([state.Anno.UNLOCKED, state.Anno.UNLOCKED,
+                    state.Anno.LABELED]),
+                'sim_class': int(random.paretovariate(1.0)) % n_classes + 1,
+                'iteration': 0
+            })
+            if len(rows) >= chunk_size:
+                conn.execute(model.ImageAnno.__table__.insert(), rows)
+                rows = list()
+        if rows:
+            conn.execute(model.ImageAnno.__table__.insert(), rows)
+
+def order_by_rand(session):
+    rand_fn = 'RAND()' if session.bind.dialect.name == 'mysql' else 'RANDOM()'
+    sql = "SELECT sim_class FROM image_anno WHERE anno_task_id=%d AND state=%d ORDER BY %s LIMIT 1"\
+        %(ANNO_TASK_ID, state.Anno.UNLOCKED, rand_fn)
+    return session.execute(sqlalchemy.text(sql)).first()
+
+def sampler(session):
+    return sample_sim_class(session, model.ImageAnno, ANNO_TASK_ID)
+
+def bench(session, fn, n_samples):
+    counter = Counter()
+    start = time.time()
+    for _ in range(n_samples):
+        counter[fn(session).sim_class] += 1
+    return (time.time() - start) / n_samples, counter
+
+def main(args):
+    # fill_table drops image_anno, so only scratch databases are allowed
+    if not args.db.startswith('sqlite') and not args.scratch_db:
+        raise Exception('{} is not a sqlite database. Pass --scratch-db '
+            'if all data in it may be deleted.'.format(args.db))
+    engine = sqlalchemy.create_engine(args.db)
+    session = sessionmaker(bind=engine)()
+    for n_annos in args.sizes:
+        fill_table(engine, n_annos, args.n_classes)
+        print('## {} annotations'.format(n_annos))
+        results = dict()
+        for name, fn in [('order_by_rand', order_by_rand), ('sampler', sampler)]:
+            duration, counter = bench(session, fn, args.n_samples)
+            results[name] = counter
+            print('  {}: {:.2f} ms per call'.format(name, duration*1000))
+        print('  class frequencies (order_by_rand / sampler):')
+        for sim_class in sorted(results['order_by_rand'].keys() | results['sampler'].keys())[:5]:
+            print('    {}: {:.3f} / {:.3f}'.format(sim_class,
+                results['order_by_rand'][sim_class]/args.n_samples,
+                results['sampler'][sim_class]/args.n_samples))
+    model.ImageAnno.__table__.drop(engine, checkfirst=True)
+    session.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare ORDER BY RAND() with '
+        'the index probing sim class sampler')
+    parser.add_argument('--db', default='sqlite://',
+                        help='SQLAlchemy url of an empty scratch database.')
+    parser.add_argument('--scratch-db', action='store_true',
+                        help='Allow a non sqlite database. Table image_anno '
+                        'of this database will be dropped!')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10000, 100000, 1000000],
+                        help='Number of annotations per run.')
+    parser.add_argument('--n_classes', type=int, default=50,
+                        help='Number of sim classes.')
+    parser.add_argument('--n_samples', type=int, default=200,
+                        help='Number of sampled sim classes per method.')
+    args = parser.parse_args()
+    main(args)
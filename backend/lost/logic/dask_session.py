@@ -2,7 +2,8 @@ import os
 from datetime import date, datetime, timedelta
 from lost.logic.pipeline import exec_utils
 import logging
-from time import sleep
+import threading
+from time import sleep, monotonic
 # from lost.lost_session import lost_session
 from lost.logic.file_man import AppFileMan, FileMan
 import lostconfig
@@ -97,55 +98,89 @@ class DaskSessionMan(object):
         return img.result()
 
 class PipeProjectPackageMan(object):
-    '''Remember which pipe project versions are present for which client'''
+    '''Remember which pipe project versions are present for which client
+
+    A new version of a pipe project is unpacked on the workers under a new
+    import name. Only files that changed since the version that was last
+    shipped to a client are sent, all other files are linked on the
+    workers. Workers without the previous version get the full project.
+    '''
 
     def __init__(self):
         self.mem = dict()
         self.fm = AppFileMan(config)
-    
-    def _get_import_and_update(self, client, pp_path, script_import_name, pp_hash=None):
-        client_id = id(client)
-        if pp_hash is None:
-            pp_hash = exec_utils.get_module_hash(pp_path)
-        if client_id in self.mem:
-            if pp_path in self.mem[client_id]:
-                if pp_hash == self.mem[client_id][pp_path]['hash']:
-                    return False, self.mem[client_id][pp_path]['import']
-                else:
-                    self.mem[client_id][pp_path]['hash'] = pp_hash
-                    self.mem[client_id][pp_path]['import'] = script_import_name
-                    return True, script_import_name
-            else:
-                self.mem[client_id][pp_path] = dict()
-                self.mem[client_id][pp_path]['hash'] = pp_hash
-                self.mem[client_id][pp_path]['import'] = script_import_name
-                return True, script_import_name 
-        else:
-            self.mem[client_id] = {pp_path: dict()}
-            self.mem[client_id][pp_path]['hash'] = pp_hash
-            self.mem[client_id][pp_path]['import'] = script_import_name
-            return True, script_import_name
-    
+        self.lock = threading.Lock()
+
+    def _ship(self, client, pp_path, version, base, workers, logger=None):
+        '''Send a project version to workers that do not have it yet.
+
+        Returns:
+            int: Number of bytes sent.
+        '''
+        project = os.path.basename(pp_path)
+        sent = 0
+        if base is not None:
+            changed = [rel for rel, digest in version['files'].items()
+                if base['files'].get(rel) != digest]
+            removed = [rel for rel in base['files'] if rel not in version['files']]
+            data = exec_utils.zip_files(pp_path, changed)
+            res = client.run(exec_utils.apply_package, data, version['dir_name'],
+                base['dir_name'], removed, project, workers=workers)
+            sent += len(data) * len(workers)
+            if logger is not None:
+                logger.info('Sent {} changed and {} removed files of {}'.format(
+                    len(changed), len(removed), project))
+            workers = [w for w, ok in res.items() if not ok]
+        if workers:
+            data = exec_utils.zip_files(pp_path, list(version['files']))
+            client.run(exec_utils.apply_package, data, version['dir_name'],
+                None, [], project, workers=workers)
+            sent += len(data) * len(workers)
+            if logger is not None:
+                logger.info('Sent all {} files of {} to {} workers'.format(
+                    len(version['files']), project, len(workers)))
+        return sent
+
     def prepare_import(self, client, pp_path, script_name, logger=None):
         if logger is not None:
             logger.info('pp_path: {}'.format(pp_path))
-        timestamp = datetime.now().strftime("%m%d%Y%H%M%S")
-        packed_pp_path = self.fm.get_packed_pipe_path(
-            f'{os.path.basename(pp_path)}.zip', timestamp
-        )
-        if logger is not None:
-            logger.info('packed_pp_path: {}'.format(packed_pp_path))
-        new_import_name = exec_utils.get_import_name_by_script(
-            script_name, timestamp)
-        update, import_name = self._get_import_and_update(
-            client, pp_path, new_import_name
-        )
-        if update:
-            exec_utils.zipdir(pp_path, packed_pp_path, timestamp)
-            upload_ret = client.upload_file(packed_pp_path)
-            if logger is not None:
-                logger.info(f'Upload file:{upload_ret}')
+        start = monotonic()
+        hash_index = exec_utils.get_hash_index(pp_path)
+        digests = hash_index.update(pp_path)
+        hashed = hash_index.hashed
+        pp_hash = exec_utils.get_tree_hash(digests)
+        hash_time = monotonic() - start
+        with self.lock:
+            client_mem = self.mem.setdefault(id(client), dict())
+            base = client_mem.get(pp_path)
+            if base is not None and base['hash'] == pp_hash:
+                version = base
+                base = None
+            else:
+                timestamp = datetime.now().strftime(exec_utils.VERSION_FORMAT)
+                if base is not None and base['timestamp'] == timestamp:
+                    # Import names of versions need to differ
+                    sleep(1)
+                    timestamp = datetime.now().strftime(exec_utils.VERSION_FORMAT)
+                version = {
+                    'hash': pp_hash,
+                    'files': digests,
+                    'dir_name': '{}_{}'.format(os.path.basename(pp_path), timestamp),
+                    'timestamp': timestamp
+                }
+            start = monotonic()
+            present = client.run(exec_utils.has_package, version['dir_name'])
+            missing = [w for w, ok in present.items() if not ok]
+            sent = 0
+            if missing:
+                sent = self._ship(client, pp_path, version, base, missing, logger)
+            client_mem[pp_path] = version
+        import_name = exec_utils.get_import_name_by_script(
+            script_name, version['timestamp'])
         if logger is not None:
+            logger.info('Hashed {} of {} files in {:.3f}s, shipped {} bytes '
+                'to {} workers in {:.3f}s'.format(hashed, len(digests), hash_time,
+                    sent, len(missing), monotonic() - start))
             logger.info(f'import_name:{import_name}')
         return import_name
 
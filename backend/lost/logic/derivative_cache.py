@@ -0,0 +1,323 @@
+'''Content addressed cache for image derivatives.
+
+Derivatives like filtered images in SIA or crops in MIA are stored as
+encoded bytes. The cache key is built from the filesystem id, the image
+path, size and modification time of the image file, the operation and its
+parameters. So a changed source file results in a new key and stale entries
+are never served.
+
+Entries are kept in a small in-memory LRU and in an on-disk LRU below the
+app path that is shared between processes. The size of both tiers is
+capped. Least recently used disk entries are evicted when the cap is
+exceeded.
+'''
+import os
+import json
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from lost.logic.file_man import AppFileMan
+
+class MemoryLRU(object):
+    '''In-memory LRU for byte strings with a size cap in bytes.'''
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.mem = OrderedDict()
+
+    def get(self, key):
+        if key not in self.mem:
+            return None
+        self.mem.move_to_end(key)
+        return self.mem[key]
+
+    def put(self, key, data):
+        '''Store data.
+
+        Returns:
+            int: Number of evicted entries.
+        '''
+        if len(data) > self.max_size:
+            return 0
+        if key in self.mem:
+            self.size -= len(self.mem.pop(key))
+        self.mem[key] = data
+        self.size += len(data)
+        evicted = 0
+        while self.size > self.max_size:
+            _, old = self.mem.popitem(last=False)
+            self.size -= len(old)
+            evicted += 1
+        return evicted
+
+class DiskLRU(object):
+    '''On-disk LRU for byte strings with a size cap in bytes.
+
+    Each entry is stored in its own file. The modification time of an entry
+    is updated on every hit and is used to find least recently used entries
+    on eviction. Files are written under a temporary name and renamed
+    afterwards, so that concurrent readers never see half written entries.
+
+    The size of the cache is counted up on every put and only read from
+    disk on the first put and on eviction. The lock just guards this
+    counter, files are written and removed without holding it.
+    '''
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.size = None
+        self.lock = threading.Lock()
+        self.evicting = False
+        os.makedirs(self.path, exist_ok=True)
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key)
+
+    def _scan(self):
+        entries = list()
+        for sub_dir in os.listdir(self.path):
+            sub_path = os.path.join(self.path, sub_dir)
+            if not os.path.isdir(sub_path):
+                continue
+            for name in os.listdir(sub_path):
+                if name.startswith('.'):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(sub_path, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, os.path.join(sub_path, name)))
+        return entries
+
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as f:
+                data = f.read()
+            os.utime(entry_path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, data):
+        '''Store data.
+
+        Returns:
+            int: Number of evicted entries.
+        '''
+        entry_path = self._entry_path(key)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        tmp_path = os.path.join(os.path.dirname(entry_path),
+            '.{}'.format(uuid.uuid4().hex))
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        try:
+            old_size = os.stat(entry_path).st_size
+        except FileNotFoundError:
+            old_size = 0
+        os.rename(tmp_path, entry_path)
+        with self.lock:
+            if self.size is None:
+                self.size = sum(e[1] for e in self._scan())
+            else:
+                self.size += len(data) - old_size
+            # Only one thread evicts, the others keep on writing
+            if self.size <= self.max_size or self.evicting:
+                return 0
+            self.evicting = True
+        try:
+            return self.evict()
+        finally:
+            with self.lock:
+                self.evicting = False
+
+    def evict(self):
+        '''Remove least recently used entries until the cache is filled to
+        90% of its max size.
+
+        Returns:
+            int: Number of evicted entries.
+        '''
+        entries = sorted(self._scan())
+        with self.lock:
+            # Other processes share the directory, so sync with disk
+            self.size = sum(e[1] for e in entries)
+            to_remove = self.size - self.max_size * 0.9
+        removed = 0
+        evicted = 0
+        for _, size, entry_path in entries:
+            if removed >= to_remove:
+                break
+            try:
+                os.remove(entry_path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            removed += size
+        with self.lock:
+            self.size -= removed
+        return evicted
+
+class DerivativeCache(object):
+    '''Two tier cache for image derivatives.
+
+    Args:
+        path (str): Directory of the disk tier.
+        max_disk_size (int): Max size of the disk tier in bytes.
+        max_mem_size (int): Max size of the in-memory tier in bytes.
+        logger_name (str): Name of the parent logger.
+    '''
+
+    def __init__(self, path, max_disk_size, max_mem_size, logger_name=''):
+        self.logger = logging.getLogger('{}.{}'.format(
+            logger_name, self.__class__.__name__)
+        )
+        self.mem = MemoryLRU(max_mem_size)
+        self.disk = DiskLRU(path, max_disk_size)
+        self.lock = threading.Lock()
+        self.counters = {
+            'mem_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'mem_evictions': 0,
+            'disk_evictions': 0
+        }
+
+    def make_key(self, fs_id, path, size, mtime, op, params):
+        '''Create a cache key.
+
+        Args:
+            fs_id (int): Id of the filesystem of the source image.
+            path (str): Path of the source image.
+            size (int): Size of the source image file.
+            mtime (object): Modification time of the source image file.
+            op (str): Name of the operation.
+            params (object): JSON serializable parameters of the operation.
+
+        Returns:
+            str: Hex digest that identifies the derivative.
+        '''
+        key = json.dumps([fs_id, path, size, str(mtime), op, params],
+            sort_keys=True, default=str)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        '''Get a derivative.
+
+        Returns:
+            bytes: The derivative or None on a miss.
+        '''
+        with self.lock:
+            data = self.mem.get(key)
+            if data is not None:
+                self.counters['mem_hits'] += 1
+                return data
+        data = self.disk.get(key)
+        with self.lock:
+            if data is None:
+                self.counters['misses'] += 1
+                return None
+            self.counters['disk_hits'] += 1
+            self.counters['mem_evictions'] += self.mem.put(key, data)
+        return data
+
+    def put(self, key, data):
+        '''Store a derivative in both tiers.
+
+        Note:
+            Errors of the disk tier are logged and not raised, since the
+            cache is no source of truth.
+        '''
+        with self.lock:
+            self.counters['mem_evictions'] += self.mem.put(key, data)
+        # The disk tier has its own lock, so readers of the memory tier
+        # do not wait for disk writes and evictions.
+        try:
+            evicted = self.disk.put(key, data)
+        except:
+            self.logger.exception('Could not store derivative {}'.format(key))
+            return
+        with self.lock:
+            self.counters['disk_evictions'] += evicted
+
+    def get_or_create(self, key, create):
+        '''Read through the cache.
+
+        Args:
+            key (str): Key created by :meth:`make_key`.
+            create (function): Called without arguments on a miss. Needs to
+                return the derivative as bytes.
+
+        Returns:
+            bytes: The derivative.
+        '''
+        data = self.get(key)
+        if data is None:
+            data = create()
+            self.put(key, data)
+        return data
+
+    def get_stats(self):
+        '''Get hit, miss and eviction counters and the size of the tiers.
+
+        Returns:
+            dict
+        '''
+        with self.lock:
+            stats = dict(self.counters)
+            stats['hits'] = stats['mem_hits'] + stats['disk_hits']
+            stats['mem_size'] = self.mem.size
+            stats['mem_entries'] = len(self.mem.mem)
+        with self.disk.lock:
+            stats['disk_size'] = self.disk.size
+        return stats
+
+def create_cache(lostconfig):
+    '''Create a :class:`DerivativeCache` as defined in lostconfig.'''
+    path = AppFileMan(lostconfig).get_derivative_cache_path()
+    return DerivativeCache(path,
+        int(lostconfig.img_cache_disk_size) * 1024 * 1024,
+        int(lostconfig.img_cache_mem_size) * 1024 * 1024)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache(lostconfig=None):
+    '''Get the process wide :class:`DerivativeCache`.
+
+    Args:
+        lostconfig (LOSTConfig): Used to create the cache on first call.
+    '''
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if lostconfig is None:
+                from lostconfig import LOSTConfig
+                lostconfig = LOSTConfig()
+            _cache = create_cache(lostconfig)
+        return _cache
+
+def load_derivative(fm, path, op, params, create, lostconfig=None):
+    '''Get a derivative of an image through the process wide cache.
+
+    Args:
+        fm (FileMan): FileMan of the filesystem where the image is located.
+        path (str): Path of the source image.
+        op (str): Name of the operation.
+        params (object): JSON serializable parameters of the operation.
+        create (function): Creates the derivative as bytes on a miss.
+        lostconfig (LOSTConfig): Optional config.
+
+    Returns:
+        bytes: The derivative.
+    '''
+    from lost.logic.image_stream import get_file_stat
+    abs_path = fm.get_abs_path(path)
+    size, mtime = get_file_stat(fm, abs_path)
+    cache = get_cache(lostconfig)
+    key = cache.make_key(fm.fs.lost_fs.idx, abs_path, size, mtime, op, params)
+    return cache.get_or_create(key, create)
@@ -11,6 +11,11 @@ import fsspec
 import numpy as np
 import cv2
 import ast
+import hashlib
+import threading
+from collections import OrderedDict
+from sqlalchemy import event
+from lost.db import model
 from lost.logic.crypt import decrypt_fs_connection
 #import ptvsd
 
@@ -28,11 +33,24 @@ SIA_HISTORY_PATH = DATA_ROOT_PATH + "sia_history/"
 SIA_HISTORY_BACKUP_PATH = DATA_ROOT_PATH + "sia_history/backup/"
 PIPE_LOG_PATH = DATA_ROOT_PATH + "logs/pipes/"
 APP_LOG_PATH = DATA_ROOT_PATH + "logs/"
+PIPE_EVENT_PATH = DATA_ROOT_PATH + "events/pipes/"
+DERIVATIVE_CACHE_PATH = DATA_ROOT_PATH + "cache/derivatives/"
+SCRIPT_ENV_PATH = DATA_ROOT_PATH + "envs/"
 # MIA_CROP_PATH = DATA_ROOT_PATH + "mia_crops/"
 # JUPYTER_NOTEBOOK_OUTPUT_PATH = DATA_ROOT_PATH + "notebooks/jupyter_output.txt"
 # MY_DATA_PATH = "my_data/"
 
-def chonkyfy(fs_list, root, fs):
+def chonkyfy(fs_list, root, fs=None, get_children_count=None):
+    '''Convert a fsspec listing into the format of the chonky file browser.
+
+    Args:
+        fs_list (list of dict): Result of ls with detail.
+        root (str): Path that was listed.
+        fs (FileMan): Used to count the children of directories if no
+            get_children_count is given.
+        get_children_count (callable): Returns the number of children of a
+            directory path or None if it is not known.
+    '''
     files, folder_chain = [], []
     body = root
     for idx in range((len(root.split('/')))):
@@ -42,6 +60,8 @@ def chonkyfy(fs_list, root, fs):
                 'id': os.path.join(body, head),
                 'name': head 
             })
+    if get_children_count is None and fs is not None:
+        get_children_count = lambda path: len(fs.ls(path))
     for el in fs_list:
         res = {
             'id':el['name'],
@@ -51,9 +71,10 @@ def chonkyfy(fs_list, root, fs):
             res['size'] = el['size']
         elif el['type'] == 'directory':
             res['isDir'] = True
-            # raise Exception(el['name'])
-            res['childrenCount'] = len(fs.ls(el['name']))
-            # res['childrenCount'] = 0
+            if get_children_count is not None:
+                children_count = get_children_count(el['name'])
+                if children_count is not None:
+                    res['childrenCount'] = children_count
         else:
             raise Exception('Unknown file type')
         files.append(res)
@@ -77,6 +98,39 @@ class AppFileMan(object):
             self.fs.mkdirs(base_path)
         return os.path.join(base_path, log_file_name)
 
+    def get_pipe_event_path(self):
+        '''Get path where pipe wake-up events are spooled.
+
+        Returns:
+            str: The absolute path to the event folder.
+        '''
+        base_path = os.path.join(self.lostconfig.app_path, PIPE_EVENT_PATH)
+        if not self.fs.exists(base_path):
+            self.fs.mkdirs(base_path, exist_ok=True)
+        return base_path
+
+    def get_derivative_cache_path(self):
+        '''Get path of the image derivative cache.
+
+        Returns:
+            str: The absolute path to the cache folder.
+        '''
+        base_path = os.path.join(self.lostconfig.app_path, DERIVATIVE_CACHE_PATH)
+        if not self.fs.exists(base_path):
+            self.fs.mkdirs(base_path, exist_ok=True)
+        return base_path
+
+    def get_script_env_path(self):
+        '''Get path where environments for extra packages of scripts are stored.
+
+        Returns:
+            str: The absolute path to the env folder.
+        '''
+        base_path = os.path.join(self.lostconfig.app_path, SCRIPT_ENV_PATH)
+        if not self.fs.exists(base_path):
+            self.fs.mkdirs(base_path, exist_ok=True)
+        return base_path
+
     def make_path_relative(self, in_path):
         '''Make a path relative to project root path.
 
@@ -159,15 +213,102 @@ class AppFileMan(object):
         root_path = self.lostconfig.app_path
         pipe_path = os.path.join(root_path, PIPE_ROOT_PATH)
         return pipe_path
+
+
+class FsCache(object):
+    '''Process wide LRU cache of fsspec filesystems for FileSystem records.
+
+    Creating a filesystem requires to decrypt and parse the stored
+    connection and to connect to the storage. Filesystems are cached by the
+    id of the record and a hash of its type and connection, so a changed
+    record never hits an old entry. Entries of a record are also removed
+    when the record is updated or deleted in this process. The cache is
+    cleared in forked child processes, since connections of the parent
+    can not be shared.
+
+    Args:
+        max_size (int): Max number of cached filesystems. If None,
+            LOST_FS_CACHE_SIZE of the LOSTConfig is used.
+    '''
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.mem = OrderedDict()
+        self.pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_fork(self):
+        if self.pid != os.getpid():
+            self.mem = OrderedDict()
+            self.pid = os.getpid()
+
+    def _get_max_size(self):
+        if self.max_size is None:
+            from lostconfig import LOSTConfig
+            self.max_size = LOSTConfig().fs_cache_size
+        return self.max_size
+
+    def make_key(self, fs_db, decrypt=True):
+        con_hash = hashlib.sha1('{}|{}'.format(fs_db.fs_type,
+            fs_db.connection).encode('utf-8')).hexdigest()
+        return (fs_db.idx, con_hash, decrypt)
+
+    def create(self, fs_db, decrypt=True):
+        '''Create a fsspec filesystem for a FileSystem record.'''
+        if decrypt:
+            fs_connection = decrypt_fs_connection(fs_db)
+        else:
+            fs_connection = fs_db.connection
+        fs_args = ast.literal_eval(fs_connection)
+        return fsspec.filesystem(fs_db.fs_type, **fs_args)
+
+    def get(self, fs_db, decrypt=True):
+        '''Get the filesystem of a FileSystem record.
+
+        Args:
+            fs_db (model.FileSystem): The filesystem record.
+            decrypt (bool): Decrypt the connection of the record.
+
+        Returns:
+            fsspec.AbstractFileSystem
+        '''
+        key = self.make_key(fs_db, decrypt)
+        with self.lock:
+            self._check_fork()
+            fs = self.mem.get(key)
+            if fs is not None:
+                self.mem.move_to_end(key)
+                self.hits += 1
+                return fs
+            self.misses += 1
+        fs = self.create(fs_db, decrypt)
+        with self.lock:
+            self._check_fork()
+            self.mem[key] = fs
+            while len(self.mem) > self._get_max_size():
+                self.mem.popitem(last=False)
+        return fs
+
+    def invalidate(self, fs_id=None):
+        '''Remove cached filesystems of a record or all if fs_id is None.'''
+        with self.lock:
+            for key in list(self.mem.keys()):
+                if fs_id is None or key[0] == fs_id:
+                    del self.mem[key]
+
+fs_cache = FsCache()
+
+@event.listens_for(model.FileSystem, 'after_update')
+@event.listens_for(model.FileSystem, 'after_delete')
+def _invalidate_fs(mapper, connection, target):
+    fs_cache.invalidate(target.idx)
+
 class FileMan(object):
     def __init__(self, lostconfig=None, fs_db=None, decrypt=True):
         if fs_db is not None:
-            if decrypt:
-                fs_connection = decrypt_fs_connection(fs_db)
-            else:
-                fs_connection = fs_db.connection
-            fs_args = ast.literal_eval(fs_connection)
-            fs = fsspec.filesystem(fs_db.fs_type, **fs_args)
+            fs = fs_cache.get(fs_db, decrypt)
             fs.lost_fs = fs_db
             self.fs = fs
             self.root_path = fs_db.root_path
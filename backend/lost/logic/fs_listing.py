@@ -0,0 +1,178 @@
+'''Cached directory listings for the file browser.
+
+Listings of directories are cached per filesystem and path for a short
+time, so browsing back and forth in a bucket like filesystem does not list
+the same directories again. Child directories are not listed to find out
+if they are empty. Their number of children is only reported if their
+listing is already cached or if probing is requested explicitly. Huge
+directories can be read page by page with a cursor.
+'''
+import os
+import bisect
+import threading
+from collections import OrderedDict
+from time import monotonic
+from sqlalchemy import event
+from lost.db import model
+from lost.logic.file_man import chonkyfy
+
+class ListingCache(object):
+    '''LRU cache for directory listings with a time to live.
+
+    Args:
+        ttl (float): Seconds a listing is valid.
+        max_size (int): Max number of cached listings.
+    '''
+
+    def __init__(self, ttl=30, max_size=1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.mem = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, fs_key, path):
+        '''Get a cached listing.
+
+        Returns:
+            list of dict: Listing sorted by name or None on a miss.
+        '''
+        with self.lock:
+            key = (fs_key, path)
+            entry = self.mem.get(key)
+            if entry is not None:
+                created, listing = entry
+                if monotonic() - created < self.ttl:
+                    self.mem.move_to_end(key)
+                    self.hits += 1
+                    return listing
+                del self.mem[key]
+            self.misses += 1
+            return None
+
+    def put(self, fs_key, path, listing):
+        with self.lock:
+            key = (fs_key, path)
+            self.mem.pop(key, None)
+            self.mem[key] = (monotonic(), listing)
+            while len(self.mem) > self.max_size:
+                self.mem.popitem(last=False)
+
+    def invalidate(self, fs_key, path=None):
+        '''Remove cached listings.
+
+        Args:
+            fs_key (object): Key of the filesystem.
+            path (str): Path that was changed. The listings of the path, of
+                its parent and of all sub directories are removed. If None,
+                all listings of the filesystem are removed.
+        '''
+        with self.lock:
+            for key in list(self.mem.keys()):
+                if key[0] != fs_key:
+                    continue
+                if path is None or key[1] == os.path.dirname(path.rstrip('/')) \
+                    or key[1] == path or key[1].startswith(path.rstrip('/') + '/'):
+                    del self.mem[key]
+
+def create_cache(lostconfig):
+    '''Create a :class:`ListingCache` as defined in lostconfig.'''
+    return ListingCache(lostconfig.fs_listing_ttl, lostconfig.fs_listing_cache_size)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache(lostconfig=None):
+    '''Get the process wide :class:`ListingCache`.
+
+    Args:
+        lostconfig (LOSTConfig): Used to create the cache on first call.
+    '''
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if lostconfig is None:
+                from lostconfig import LOSTConfig
+                lostconfig = LOSTConfig()
+            _cache = create_cache(lostconfig)
+        return _cache
+
+@event.listens_for(model.FileSystem, 'after_update')
+@event.listens_for(model.FileSystem, 'after_delete')
+def _invalidate_fs(mapper, connection, target):
+    if _cache is not None:
+        _cache.invalidate(target.idx)
+
+class Lister(object):
+    '''List directories of a filesystem through a :class:`ListingCache`.
+
+    Args:
+        fm (FileMan): FileMan of the filesystem.
+        fs_key (object): Key of the filesystem in the cache, e.g. the id of
+            the FileSystem record. If None, listings are not cached.
+        cache (ListingCache): Cache to use.
+    '''
+
+    def __init__(self, fm, fs_key, cache):
+        self.fm = fm
+        self.fs_key = fs_key
+        self.cache = cache
+
+    def ls(self, path):
+        '''List a directory.
+
+        Returns:
+            list of dict: Entries of fsspec ls with detail sorted by name.
+        '''
+        listing = None
+        if self.fs_key is not None:
+            listing = self.cache.get(self.fs_key, path)
+        if listing is None:
+            listing = sorted(self.fm.ls(path, detail=True),
+                key=lambda el: el['name'])
+            if self.fs_key is not None:
+                self.cache.put(self.fs_key, path, listing)
+        return listing
+
+    def get_children_count(self, path, probe=False):
+        '''Get the number of children of a directory.
+
+        Args:
+            path (str): Path of the directory.
+            probe (bool): List the directory if its listing is not cached.
+
+        Returns:
+            int: Number of children or None if not known.
+        '''
+        if not probe:
+            if self.fs_key is None:
+                return None
+            listing = self.cache.get(self.fs_key, path)
+            return None if listing is None else len(listing)
+        return len(self.ls(path))
+
+    def ls_page(self, path, cursor=None, limit=None, probe_children=False):
+        '''List a page of a directory in chonky format.
+
+        Args:
+            path (str): Path of the directory.
+            cursor (str): Name of the last entry of the previous page.
+            limit (int): Max number of entries. All entries if None.
+            probe_children (bool): Count children of all sub directories
+                on this page.
+
+        Returns:
+            dict: *files*, *folderChain* and *nextCursor*, that is None on
+            the last page.
+        '''
+        listing = self.ls(path)
+        start = 0
+        if cursor is not None:
+            start = bisect.bisect_right([el['name'] for el in listing], cursor)
+        end = len(listing) if limit is None else min(start + limit, len(listing))
+        page = listing[start:end]
+        res = chonkyfy(page, path,
+            get_children_count=lambda p: self.get_children_count(p, probe_children))
+        res['nextCursor'] = page[-1]['name'] if end < len(listing) and page else None
+        return res
@@ -0,0 +1,83 @@
+'''Cached positions of images in an anno task.
+
+SIA shows the number of the current image in its task, that is the count
+of image annotations with a smaller or equal id. Instead of counting rows
+on every request, the sorted ids of a task are loaded once and kept in
+memory. Cached ids are bound to the version of the counters of
+:mod:`lost.db.anno_counter`, so they are only loaded again after images
+were added or removed.
+'''
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from lost.db import model
+
+def load_ids(session, anno_task_id, iteration=None):
+    '''Load the sorted ids of all image annotations of an anno task.
+
+    Args:
+        session: Database session.
+        anno_task_id (int): Id of the anno task.
+        iteration (int): Only this iteration. All iterations if None.
+
+    Returns:
+        array: Sorted ids.
+    '''
+    query = session.query(model.ImageAnno.idx)\
+        .filter(model.ImageAnno.anno_task_id==anno_task_id)
+    if iteration is not None:
+        query = query.filter(model.ImageAnno.iteration==iteration)
+    return array('q', [row[0] for row in query.order_by(model.ImageAnno.idx)])
+
+class PositionCache(object):
+    '''Process wide LRU cache of image ids per anno task and iteration.
+
+    Args:
+        max_size (int): Max number of cached anno task iterations.
+    '''
+
+    def __init__(self, max_size=32):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.mem = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_position(self, session, anno_task_id, img_anno_id, version,
+        iteration=None):
+        '''Get the number of image annotations of an anno task with an id
+        less or equal than img_anno_id.
+
+        Args:
+            session: Database session.
+            anno_task_id (int): Id of the anno task.
+            img_anno_id (int): Id of the image annotation.
+            version (int): Current version of the image annotation
+                counters, see :func:`lost.db.anno_counter.get_counters`.
+            iteration (int): Only this iteration. All iterations if None.
+
+        Returns:
+            int: Position of the image, starting at 1.
+        '''
+        key = (anno_task_id, iteration)
+        with self.lock:
+            entry = self.mem.get(key)
+            if entry is not None and entry[0] == version:
+                self.mem.move_to_end(key)
+                self.hits += 1
+                return bisect_right(entry[1], img_anno_id)
+            self.misses += 1
+        ids = load_ids(session, anno_task_id, iteration)
+        with self.lock:
+            self.mem[key] = (version, ids)
+            self.mem.move_to_end(key)
+            while len(self.mem) > self.max_size:
+                self.mem.popitem(last=False)
+        return bisect_right(ids, img_anno_id)
+
+    def clear(self):
+        with self.lock:
+            self.mem = OrderedDict()
+
+position_cache = PositionCache()
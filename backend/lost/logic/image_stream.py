@@ -0,0 +1,143 @@
+'''Send images as binary HTTP responses with caching headers.
+
+Images are sent with their original bytes if the browser is able to display
+the format. Other formats and derived images (e.g. crops) are transcoded to
+JPEG. Responses carry an ETag and Last-Modified header derived from the
+file, so browsers can revalidate with conditional GET requests. Range
+requests are supported for original files.
+'''
+import hashlib
+import mimetypes
+from datetime import datetime
+from io import BytesIO
+import cv2
+from flask import request, Response
+from werkzeug.wsgi import wrap_file
+from lost.db import roles
+
+# Formats that are sent without transcoding
+BROWSER_MIMETYPES = ['image/jpeg', 'image/png', 'image/gif', 'image/webp',
+    'image/bmp', 'image/svg+xml']
+TRANSCODE_MIMETYPE = 'image/jpeg'
+MAX_AGE = 3600
+
+def is_permitted(dbm, user, anno_task_id):
+    '''Check if a user is allowed to load images of an anno task.
+
+    Annotators may load images of their chosen anno tasks. Designers may
+    load images of all anno tasks, since they are able to review them.
+
+    Args:
+        dbm (DBMan): Database manager.
+        user (lost.db.model.User): User that requests the image.
+        anno_task_id (int): Anno task of the requested image.
+    '''
+    if user.has_role(roles.DESIGNER):
+        return True
+    for cat in dbm.get_choosen_annotask(user.idx):
+        if cat.anno_task_id == anno_task_id:
+            return True
+    return False
+
+def get_file_stat(fm, abs_path):
+    '''Get size and modification time of a file in a fsspec filesystem.
+
+    Returns:
+        tuple: (size, mtime) where mtime is a datetime or None if the
+        filesystem does not provide it.
+    '''
+    info = fm.fs.info(abs_path)
+    mtime = None
+    for key in ['mtime', 'LastModified', 'last_modified', 'updated', 'created']:
+        if info.get(key) is not None:
+            mtime = info[key]
+            break
+    if isinstance(mtime, (int, float)):
+        mtime = datetime.utcfromtimestamp(mtime)
+    elif isinstance(mtime, str):
+        try:
+            mtime = datetime.fromisoformat(mtime.replace('Z', '+00:00'))
+        except ValueError:
+            mtime = None
+    return info['size'], mtime
+
+def make_etag(*parts):
+    '''Create an ETag from all parts that identify a response body.'''
+    key = '|'.join([str(p) for p in parts])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def conditional_response(stream, mimetype, size, etag, last_modified=None,
+    max_age=MAX_AGE):
+    '''Stream a file object with support for conditional and range requests.
+
+    Args:
+        stream (file): Opened file object. It is read in blocks and closed
+            after the response was sent.
+        mimetype (str): Content type of the response.
+        size (int): Size of the file in bytes.
+        etag (str): ETag of the file.
+        last_modified (datetime): Modification time of the file.
+        max_age (int): Seconds the client may cache the response.
+
+    Returns:
+        flask.Response: Response with status 200, 206 or 304.
+    '''
+    rv = Response(wrap_file(request.environ, stream), mimetype=mimetype,
+        direct_passthrough=True)
+    rv.content_length = size
+    rv.set_etag(etag)
+    if last_modified is not None:
+        rv.last_modified = last_modified
+    rv.cache_control.private = True
+    rv.cache_control.max_age = max_age
+    rv.cache_control.must_revalidate = True
+    return rv.make_conditional(request, accept_ranges=True,
+        complete_length=size)
+
+def encode_img(img, ext='.jpg'):
+    '''Encode an image array to bytes.'''
+    _, data = cv2.imencode(ext, img)
+    return data.tobytes()
+
+def send_img_file(fm, path, transcode=False):
+    '''Send an image file of a filesystem.
+
+    Args:
+        fm (FileMan): FileMan of the filesystem the image is located in.
+        path (str): Path of the image inside the filesystem.
+        transcode (bool): Always send the image as JPEG.
+
+    Returns:
+        flask.Response: Response with status 200, 206 or 304.
+    '''
+    abs_path = fm.get_abs_path(path)
+    size, mtime = get_file_stat(fm, abs_path)
+    mimetype = mimetypes.guess_type(abs_path)[0]
+    transcode = transcode or mimetype not in BROWSER_MIMETYPES
+    variant = 'jpg' if transcode else 'raw'
+    etag = make_etag(fm.fs.lost_fs.idx, abs_path, size, mtime, variant)
+    if transcode:
+        if etag in request.if_none_match:
+            # Do not decode and encode images the browser already has
+            return send_img_bytes(b'', etag, last_modified=mtime)
+        return send_img_bytes(encode_img(fm.load_img(path)), etag,
+            last_modified=mtime)
+    return conditional_response(fm.fs.open(abs_path, 'rb'), mimetype, size,
+        etag, last_modified=mtime)
+
+def send_img_bytes(data, etag=None, mimetype=TRANSCODE_MIMETYPE, last_modified=None):
+    '''Send an encoded image that was created in memory.
+
+    Args:
+        data (bytes): Encoded image.
+        etag (str): ETag of the image. Calculated from data if None.
+        mimetype (str): Content type of the image.
+        last_modified (datetime): Modification time of the source image.
+
+    Returns:
+        flask.Response: Response with status 200, 206 or 304.
+    '''
+    if etag is None:
+        etag = hashlib.sha1(data).hexdigest()
+    return conditional_response(BytesIO(data), mimetype, len(data), etag,
+        last_modified=last_modified)
@@ -3,6 +3,8 @@ import traceback
 from lost.logic import dask_session
 from lost.logic.pipeline import cron
 from lost.logic.pipeline import worker
+from lost.logic.pipeline import scheduler
+from lost.logic.pipeline import deleter
 import lostconfig as config
 from lost.db.access import DBMan
 import time
@@ -14,16 +16,15 @@ import logging
 from lost.logic.jobs import jobs
 from lost.logic.dask_session import ds_man
 
-def process_pipes(log_name, client):
+def process_pipes(log_name, client, pipe_ids=None):
     lostconfig = config.LOSTConfig()
-    dbm = DBMan(lostconfig)
-    pipe_list = dbm.get_pipes_to_process()
-    # For each task in this project
-    for p in pipe_list:
-        pipe_man = cron.PipeEngine(dbm=dbm, pipe=p, lostconfig=lostconfig, 
-            client=client, logger_name=log_name)
-        pipe_man.process_pipeline()
-    dbm.close_session()
+    with DBMan(lostconfig) as dbm:
+        pipe_list = dbm.get_pipes_to_process(pipe_ids)
+        # For each task in this project
+        for p in pipe_list:
+            pipe_man = cron.PipeEngine(dbm=dbm, pipe=p, lostconfig=lostconfig, 
+                client=client, logger_name=log_name)
+            pipe_man.process_pipeline()
         
 def run_loop(run, sleep_time, **kwargs):
     logger = logging.getLogger(kwargs["log_name"])
@@ -37,14 +38,36 @@ def run_loop(run, sleep_time, **kwargs):
             time.sleep(1)
             
 def process_pipes_loop(log_name):
+    '''Process pipes when wake-up events arrive.
+
+    All pipes are processed every *lostconfig.pipe_schedule* seconds
+    as safety net, in case an event got lost.
+    '''
     lostconfig = config.LOSTConfig()
+    logger = logging.getLogger(log_name)
     if lostconfig.worker_management != 'dynamic':
         client = Client('{}:{}'.format(
             lostconfig.scheduler_ip, lostconfig.scheduler_port)
         )
     else:
         client = None
-    run_loop(process_pipes, lostconfig.pipe_schedule, log_name=log_name, client=client)
+    pipe_scheduler = scheduler.get_scheduler(lostconfig)
+    logger.info('Starting process_pipes loop')
+    last_sweep = None
+    while True:
+        try:
+            if last_sweep is None or \
+                time.monotonic() - last_sweep >= lostconfig.pipe_schedule:
+                last_sweep = time.monotonic()
+                process_pipes(log_name, client)
+            timeout = lostconfig.pipe_schedule - (time.monotonic() - last_sweep)
+            events = pipe_scheduler.wait(max(timeout, 0))
+            if events:
+                logger.debug('Wake-up events: {}'.format(dict(events)))
+                process_pipes(log_name, client, list(events.keys()))
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            time.sleep(1)
 
 def worker_lifesign(log_name):
     worker.send_life_sign()
@@ -55,13 +78,40 @@ def worker_lifesign_loop(log_name):
 
 def release_annos(log_name):
     logger = logging.getLogger(log_name)
-    c_imgs, c_annos = jobs.release_annos_on_session_timeout()
-    logger.info('Released img_annos: {}, 2d_annos: {}'.format(c_imgs, c_annos))
+    start = time.monotonic()
+    released = jobs.release_annos_on_session_timeout()
+    duration = time.monotonic() - start
+    c_imgs = sum(r['img_annos'] for r in released.values())
+    c_annos = sum(r['two_d_annos'] for r in released.values())
+    logger.info('Released img_annos: {}, 2d_annos: {}, anno_tasks: {}, '
+        'duration: {:.3f}s'.format(c_imgs, c_annos, len(released), duration))
+    for anno_task_id, r in released.items():
+        logger.info('Released in anno_task {}: img_annos: {}, 2d_annos: {}'.format(
+            anno_task_id, r['img_annos'], r['two_d_annos']))
 
 def release_annos_loop(log_name):
     lostconfig = config.LOSTConfig()
     run_loop(release_annos, lostconfig.session_timeout*60, log_name=log_name)
 
+def reconcile_anno_counters(log_name):
+    logger = logging.getLogger(log_name)
+    c_tasks = jobs.reconcile_anno_counters_job()
+    logger.info('Reconciled anno counters of {} anno tasks'.format(c_tasks))
+
+def reconcile_anno_counters_loop(log_name):
+    lostconfig = config.LOSTConfig()
+    run_loop(reconcile_anno_counters, lostconfig.anno_counter_reconcile,
+        log_name=log_name)
+
+def delete_pipes(log_name):
+    lostconfig = config.LOSTConfig()
+    with DBMan(lostconfig) as dbm:
+        deleter.delete_marked_pipes(dbm, logger_name=log_name)
+
+def delete_pipes_loop(log_name):
+    lostconfig = config.LOSTConfig()
+    run_loop(delete_pipes, lostconfig.pipe_delete_interval, log_name=log_name)
+
 def main():
     parser = argparse.ArgumentParser(description='Run LOST cronjobs')
     parser.add_argument('--debug', action='store_true',
@@ -87,7 +137,9 @@ def main():
         jobs = [
             process_pipes_loop,
             worker_lifesign_loop,
-            release_annos_loop
+            release_annos_loop,
+            reconcile_anno_counters_loop,
+            delete_pipes_loop
         ]
         if lostconfig.worker_management == 'dynamic':
             jobs.append(dask_session.release_client_by_timeout_loop)
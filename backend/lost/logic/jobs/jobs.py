@@ -3,13 +3,14 @@ import logging
 import os
 import argparse
 from datetime import datetime, timedelta
+import sqlalchemy
 
 try:
     from lost.db import access
     from lost.logic.pipeline import cron
     import lostconfig as config
     from lost.db.access import DBMan
-    from lost.db import state
+    from lost.db import state, model, anno_counter
 except:
     logging.error(traceback.format_exc())
 
@@ -70,32 +71,75 @@ def force_anno_release(dbm, anno_task_id):
     dbm.commit()
     return c_imgs, c_2dannos
 
+def _release_locked_annos(dbm, anno_model, anno_task_ids, unlock_time):
+    '''Release locked annotations of one annotation type with a single
+    UPDATE statement.
+
+    Returns:
+        dict: anno_task_id -> number of released annotations
+    '''
+    locked = (anno_model.anno_task_id.in_(anno_task_ids),
+        anno_model.state.in_([state.Anno.LOCKED, state.Anno.LOCKED_PRIORITY]),
+        anno_model.timestamp_lock < unlock_time)
+    # Lock the affected rows, so that the counts match the UPDATE
+    counts = dbm.session.query(anno_model.anno_task_id, anno_model.iteration,
+        sqlalchemy.func.count(anno_model.idx))\
+        .filter(*locked)\
+        .group_by(anno_model.anno_task_id, anno_model.iteration)\
+        .with_for_update().all()
+    if len(counts) == 0:
+        return dict()
+    c_released = dbm.session.query(anno_model).filter(*locked)\
+        .update({anno_model.state: state.Anno.UNLOCKED}, synchronize_session=False)
+    released = dict()
+    deltas = dict()
+    anno_type = anno_counter.ANNO_TYPES[anno_model]
+    for anno_task_id, iteration, count in counts:
+        released[anno_task_id] = released.get(anno_task_id, 0) + count
+        # Released annotations are neither locked nor labeled any more
+        key = anno_counter.counter_key(anno_type, anno_task_id, iteration)
+        deltas[key] = (0, deltas.get(key, (0, 0, 0))[1] - count, 0)
+    if c_released == sum(released.values()):
+        anno_counter.apply_deltas(dbm.session.connection(), deltas)
+    else:
+        for anno_task_id in released:
+            anno_counter.reconcile(dbm.session, anno_task_id)
+    return released
+
 def release_annos_by_timeout(dbm, timeout):
     '''Release annotations based on timeout
 
+    Annotations of all anno tasks in progress are released by one UPDATE
+    statement per annotation type inside a single transaction.
+
     Args:
         dbm (DBMan): Database manager
         timeout (int): Timeout in minutes when annotations should be released
+
+    Returns:
+        dict: anno_task_id -> {'img_annos': int, 'two_d_annos': int}.
+        Only anno tasks with released annotations are included.
     '''
-    c_imgs = 0
-    c_2dannos = 0
-    present = datetime.now()
-    unlock_time = present - timedelta(minutes=timeout)
-    for anno_task in dbm.get_anno_task(state=state.AnnoTask.IN_PROGRESS):
-        for anno in dbm.get_locked_img_annos(anno_task.idx):
-            if anno.timestamp_lock is not None:
-                if anno.timestamp_lock < unlock_time:
-                    anno.state = state.Anno.UNLOCKED
-                    dbm.add(anno)
-                    c_imgs += 1
-        for anno in dbm.get_locked_two_d_annos(anno_task.idx):
-            if anno.timestamp_lock is not None:
-                if anno.timestamp_lock < unlock_time:
-                    anno.state = state.Anno.UNLOCKED
-                    dbm.add(anno)
-                    c_2dannos += 1
+    unlock_time = datetime.now() - timedelta(minutes=timeout)
+    anno_task_ids = [at.idx for at in dbm.session.query(model.AnnoTask.idx)\
+        .filter(model.AnnoTask.state==state.AnnoTask.IN_PROGRESS)]
+    released = dict()
+    if len(anno_task_ids) == 0:
+        return released
+    try:
+        for key, anno_model in [('img_annos', model.ImageAnno),
+            ('two_d_annos', model.TwoDAnno)]:
+            counts = _release_locked_annos(dbm, anno_model, anno_task_ids,
+                unlock_time)
+            for anno_task_id, count in counts.items():
+                if anno_task_id not in released:
+                    released[anno_task_id] = {'img_annos': 0, 'two_d_annos': 0}
+                released[anno_task_id][key] = count
         dbm.commit()
-    return c_imgs, c_2dannos
+    except:
+        dbm.session.rollback()
+        raise
+    return released
 
 def release_user_annos(dbm, user_id):
     '''Release locked annos for a specific user.
@@ -131,7 +175,26 @@ def release_user_annos(dbm, user_id):
 
 def release_annos_on_session_timeout():
     lostconfig = config.LOSTConfig()
-    dbm = DBMan(lostconfig)
-    c_imgs, c_2dannos = release_annos_by_timeout(dbm, lostconfig.session_timeout)
-    dbm.close_session()
-    return c_imgs, c_2dannos
+    with DBMan(lostconfig) as dbm:
+        return release_annos_by_timeout(dbm, lostconfig.session_timeout)
+
+def reconcile_anno_counters(dbm):
+    '''Recount annotation counters of all anno tasks in progress.
+
+    Args:
+        dbm (DBMan): Database manager
+
+    Returns:
+        int: Number of reconciled anno tasks.
+    '''
+    c_tasks = 0
+    for anno_task in dbm.get_anno_task(state=state.AnnoTask.IN_PROGRESS):
+        anno_counter.reconcile(dbm.session, anno_task.idx)
+        dbm.commit()
+        c_tasks += 1
+    return c_tasks
+
+def reconcile_anno_counters_job():
+    lostconfig = config.LOSTConfig()
+    with DBMan(lostconfig) as dbm:
+        return reconcile_anno_counters(dbm)
@@ -1,11 +1,33 @@
 import lost
 import json
-from lost.db import model
+import sqlalchemy
+from lost.db import model, label_version
+from lost.logic.label_cache import tree_cache, LEAF_COLUMNS
 from datetime import datetime
 import pandas as pd
 import numpy as np
 __author__ = "Jonas Jaeger"
 
+REQUIRED_COLUMNS = ['idx', 'name', 'parent_leaf_id']
+IMPORT_COLUMNS = ['abbreviation', 'description', 'timestamp', 'external_id',
+    'is_deleted', 'color']
+# Max number of parent leaves whose children are inserted at once by the
+# bulk import
+INSERT_BATCH_SIZE = 1000
+
+def get_hierarchical_dicts(dbm, root_leaves):
+    '''Get multiple label trees as nested dicts.
+
+    Args:
+        dbm (:class:`lost.db.access.DBMan`): Database manager object.
+        root_leaves (list of :class:`lost.db.model.LabelLeaf`): Roots of
+            the trees.
+
+    Returns:
+        list of dict: See :meth:`LabelTree.to_hierarchical_dict`.
+    '''
+    trees = tree_cache.get_many(dbm.session, [leaf.idx for leaf in root_leaves])
+    return [tree.to_hierarchical_dict() for tree in trees]
 
 class LabelTree(object):
     '''A class that represants a LabelTree.
@@ -22,7 +44,7 @@ class LabelTree(object):
     def __init__(self, dbm, root_id=None, root_leaf=None, name=None, logger=None, group_id=None):
         self.dbm = dbm # type: lost.db.access.DBMan
         self.root = None # type: lost.db.model.LabelLeaf
-        self.tree = {}
+        self._tree = None
         if logger is None:
             import logging
             self.logger = logging
@@ -30,10 +52,8 @@ class LabelTree(object):
             self.logger = logger
         if root_leaf is not None:
             self.root = root_leaf
-            self.__collect_tree(self.root, self.tree)
         elif root_id is not None:
             self.root = self.dbm.get_label_leaf(root_id)
-            self.__collect_tree(self.root, self.tree)
         elif name is not None:
             if group_id is None:
                 root_list = self.dbm.get_all_label_trees(global_only=True)
@@ -46,20 +66,34 @@ class LabelTree(object):
                 raise Exception('LabelTree with name "{}" not found in database!'.format(name))
             else:
                 self.root = root
-                self.__collect_tree(self.root, self.tree)
 
+    @property
+    def tree(self):
+        '''dict: Maps leaf ids to LabelLeaf objects of this tree
+        {leaf_id : LabelLeaf} in depth first order.
 
-    def __collect_tree(self, label_leaf, leaf_map):
-        '''Collect all LabelLeafs from Tree or Subtree
-        
-        Args:
-            label_leaf (:class:`lost.db.model.LabelLeaf`): The leaf to start leaf collection.
-            leaf_map (dict): Dictionary that maps leaf ids to LabelLeaf objects
-                {leaf_id : LabelLeaf} 
+        Note:
+            Leaves are loaded with one query on first access.
         '''
-        leaf_map[label_leaf.idx] = label_leaf
-        for ll in label_leaf.label_leaves:
-            self.__collect_tree(ll, leaf_map)
+        if self._tree is None:
+            self._tree = dict()
+            if self.root is not None:
+                ids = list(self._get_cached().iter_ids())
+                leaves = self.dbm.session.query(model.LabelLeaf)\
+                    .filter(model.LabelLeaf.idx.in_(ids)).all()
+                leaf_map = {leaf.idx: leaf for leaf in leaves}
+                for idx in ids:
+                    if idx in leaf_map:
+                        self._tree[idx] = leaf_map[idx]
+        return self._tree
+
+    def _get_cached(self):
+        '''Get the cached plain data of this tree.
+
+        Returns:
+            :class:`lost.logic.label_cache.CachedTree`
+        '''
+        return tree_cache.get(self.dbm.session, self.root.idx)
 
     def delete_subtree(self, leaf):
         '''Recursive delete all leafs in subtree starting with leaf
@@ -146,12 +180,9 @@ class LabelTree(object):
         Returns:
             list in the requested columns: 
         '''
-        parent = self.tree[parent_id] # type: lost.db.model.LabelLeaf
-        df_list = []
-        for ll in parent.label_leaves:
-            df_list.append(ll.to_df()[columns])
-        df = pd.concat(df_list)
-        return df.values.tolist()
+        children = self._get_cached().get_children(parent_id)
+        df = pd.DataFrame(children, columns=LEAF_COLUMNS)
+        return df[columns].values.tolist()
             
     def to_df(self):
         '''Transform this LabelTree to a pandas DataFrame.
@@ -159,11 +190,7 @@ class LabelTree(object):
         Returns:
             pandas.DataFrame
         '''
-        df_list = []
-        for leaf_id, leaf in self.tree.items():
-            df_list.append(leaf.to_df())
-        df = pd.concat(df_list)
-        return df.reset_index().drop(columns=['index'])
+        return self._get_cached().to_df()
 
     # def to_list(self):
     #     leaves = list()
@@ -171,78 +198,85 @@ class LabelTree(object):
     #         leaves.append(leaf.to_dict())
     #     return leaves
 
-    def __collect_dict_tree(self, label_leaf, t_dict):
-        t_dict['children'] = []
-        for ll in label_leaf.label_leaves:
-            ll_dict = ll.to_dict()
-            t_dict['children'].append(ll_dict)
-            self.__collect_dict_tree(ll, ll_dict)
-
     def to_hierarchical_dict(self):
-        my_dict =  self.root.to_dict()
-        self.__collect_dict_tree(self.root, my_dict)
-        return my_dict
- 
-    def _df_row_to_leaf(self, row, leaf):
-        '''Transfrom LabelLeaf in row style to a LabelLeaf object.
+        '''Transform this LabelTree to nested dicts.
 
-        Args:
-            row (pandas.Series): A LabelLeaf in row style.
-        
         Returns:
-            :class:`lost.db.model.LabelLeaf`:
-                The transformed row.
+            dict: The root leaf with a list of *children*, that contain
+            their children in the same way.
         '''
-        try:
-            leaf.abbreviation = row['abbreviation']
-            self.logger.info('\tabbreviation: {}'.format(leaf.abbreviation))
-        except KeyError:
-            self.logger.info('\tNo abbreviation provided.')
-        try:
-            leaf.description = row['description']
-            self.logger.info('\tdescription: {}'.format(leaf.description))
-        except KeyError:
-            self.logger.info('\tNo description provided.')
-        try:
-            leaf.timestamp = row['timestamp']
-            self.logger.info('\ttimestamp: {}'.format(leaf.timestamp))
-        except KeyError:
-            self.logger.info('\tNo timestamp provided.')
-        try:
-            if not np.isnan(row['external_id']):
-                leaf.external_id = row['external_id']
-                self.logger.info('\texternal_id: {}'.format(leaf.external_id))
-        except KeyError:
-            self.logger.info('\tNo external_id provided.')
-        try:
-            leaf.is_deleted = row['is_deleted']
-            self.logger.info('\tis_deleted: {}'.format(leaf.is_deleted))
-        except KeyError:
-            self.logger.info('\tNo is_deleted provided.')
-        try:
-            leaf.color = row['color']
-            self.logger.info('\tcolor: {}'.format(leaf.color))
-        except KeyError:
-            self.logger.info('\tNo color provided.')
+        return self._get_cached().to_hierarchical_dict()
+ 
+    def import_records(self, records):
+        '''Import a LabelTree from leaf records in one transaction.
 
-    def __create_childs_from_df(self, child_dict, parent, parent_row):
-        '''Create child leafs from a df.
+        All records are validated before anything is written. Leaves are
+        inserted level by level with one executemany per batch of parents.
 
         Args:
-            child_dict (dict): A dictionary that maps parent_ids from DataFrame 
-                to child rows from DataFrame.
-            parent (:class:`lost.db.model.LabelLeaf`): A parent LabelLeaf 
-                that was already imported.
-            parent_row (pandas.Series): A row from the DataFrame to import. 
+            records (iterable of dict): One dict per leaf with at least
+                *idx*, *name* and *parent_leaf_id*. Optional keys are
+                *abbreviation*, *description*, *timestamp*, *external_id*,
+                *is_deleted* and *color*. See :func:`df_to_records` and
+                :func:`iter_csv_records`.
+
+        Returns:
+            tuple: (root_leaf, id_map) with the created root leaf and a
+            dict that maps idx values of the records to ids of the created
+            leaves. (None, None) if a root leaf with the same name is
+            already present in database.
         '''
-        if parent_row['idx'] not in child_dict:
-            return
-        for child_row in child_dict[parent_row['idx']]:
-            child = self.create_child(parent.idx, 
-                        child_row['name'])
-            self._df_row_to_leaf(child_row, child)
-            self.__create_childs_from_df(child_dict, child, child_row)
-        
+        root_rec, children = _validate_records(records)
+        root_name = root_rec['values']['name']
+        root_leafs = self.dbm.get_all_label_trees(global_only=True)
+        if root_leafs is not None:
+            for leaf in root_leafs:
+                if leaf.name == root_name:
+                    return None, None
+        session = self.dbm.session
+        table = model.LabelLeaf.__table__
+        try:
+            root = model.LabelLeaf(is_root=True, **root_rec['values'])
+            session.add(root)
+            session.flush()
+            id_map = {root_rec['idx']: root.idx}
+            level = [root_rec['idx']]
+            while level:
+                parents = [p for p in level if p in children]
+                for i in range(0, len(parents), INSERT_BATCH_SIZE):
+                    batch = parents[i:i+INSERT_BATCH_SIZE]
+                    rows = [dict(rec['values'], parent_leaf_id=id_map[p])
+                        for p in batch for rec in children[p]]
+                    # Executemany is sent as multi-row inserts by the mysql
+                    # drivers and compiles the statement only once
+                    session.execute(table.insert(), rows)
+                    # Parents were created in this transaction, so all their
+                    # children are the rows above in the order of their ids
+                    new_ids = dict()
+                    query = sqlalchemy.select([table.c.idx, table.c.parent_leaf_id])\
+                        .where(table.c.parent_leaf_id.in_([id_map[p] for p in batch]))\
+                        .order_by(table.c.idx)
+                    for idx, parent_id in session.execute(query):
+                        new_ids.setdefault(parent_id, []).append(idx)
+                    for p in batch:
+                        ids = new_ids.get(id_map[p], [])
+                        if len(ids) != len(children[p]):
+                            raise Exception('Inserted {} children for leaf {}, '
+                                'expected {}'.format(len(ids), p, len(children[p])))
+                        for rec, idx in zip(children[p], ids):
+                            id_map[rec['idx']] = idx
+                level = [rec['idx'] for p in parents for rec in children[p]]
+            label_version.bump(session.connection())
+            self.dbm.commit()
+        except:
+            session.rollback()
+            raise
+        self.root = root
+        self._tree = None
+        self.logger.info('Imported label tree {} with {} leaves'.format(
+            root_name, len(id_map)))
+        return root, id_map
+
     def import_df(self, df):
         '''Import LabelTree from DataFrame
         
@@ -254,35 +288,130 @@ class LabelTree(object):
                 The created root leaf or None if a root leaf with same
                 name is already present in database.
         '''
-        df = df.where((pd.notnull(df)), None)
-        root = df[df['parent_leaf_id'].isnull()]
-        no_root = df[~df['parent_leaf_id'].isnull()]
-        childs = {}
-
-        if len(root) != 1:
-            raise ValueError('''Can not import. There needs 
-                to be exactly one root leaf for that tree! 
-                Found: \n{}'''.format(root))
-        else:
-            try:
-                root_leaf = self.create_root(root['name'].values[0])
-                if root_leaf is None:
-                    return None #A tree with the same name already exists.
-                self._df_row_to_leaf(root.loc[0], root_leaf)
-
-                #Create child dict
-                for index, row in no_root.iterrows():
-                    if not row['parent_leaf_id'] in childs:
-                        childs[row['parent_leaf_id']] = []
-                    childs[row['parent_leaf_id']].append(row)
-                
-                self.__create_childs_from_df(childs, root_leaf, root.loc[0])
-                self.dbm.commit()
-                return root_leaf
-            except KeyError:
-                self.logger.error('''At least the following columns 
-                    need to be provided: *idx*, *name*, *parent_leaf_id*''')
-                raise
+        try:
+            return self.import_records(df_to_records(df))[0]
+        except KeyError:
+            self.logger.error('''At least the following columns 
+                need to be provided: *idx*, *name*, *parent_leaf_id*''')
+            raise
 
+    def import_csv(self, path, chunksize=10000):
+        '''Import LabelTree from a csv file that is read in chunks.
 
-            
+        Args:
+            path (str or file): The csv file.
+            chunksize (int): Number of rows that are read at once.
+
+        Returns:
+            tuple: See :meth:`import_records`.
+        '''
+        return self.import_records(iter_csv_records(path, chunksize))
+
+def _to_python(value):
+    '''Convert a pandas value to a python value and NaN to None.'''
+    if value is None:
+        return None
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if value is pd.NaT:
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+def df_to_records(df):
+    '''Get leaf records of a LabelTree in DataFrame style.
+
+    Raises:
+        KeyError: If *idx*, *name* or *parent_leaf_id* is missing.
+
+    Yields:
+        dict: One record per row.
+    '''
+    for col in REQUIRED_COLUMNS:
+        if col not in df.columns:
+            raise KeyError(col)
+    columns = [c for c in REQUIRED_COLUMNS + IMPORT_COLUMNS if c in df.columns]
+    for values in zip(*[df[c].tolist() for c in columns]):
+        yield {c: _to_python(v) for c, v in zip(columns, values)}
+
+def iter_csv_records(path, chunksize=10000):
+    '''Read leaf records of a LabelTree from a csv file in chunks.
+
+    Yields:
+        dict: One record per row.
+    '''
+    reader = pd.read_csv(path, chunksize=chunksize, dtype={'external_id': str})
+    for chunk in reader:
+        for record in df_to_records(chunk):
+            yield record
+
+def _convert(col, value):
+    '''Convert the value of an import column for the database.'''
+    if value is None:
+        return None
+    if col == 'timestamp':
+        return pd.Timestamp(value).to_pydatetime()
+    if col == 'is_deleted':
+        if isinstance(value, str):
+            return value.strip().lower() in ('true', '1')
+        return bool(value)
+    if col == 'external_id' and isinstance(value, float) and value.is_integer():
+        # Integer ids become floats in columns with missing values
+        return str(int(value))
+    value = str(value)
+    length = model.LabelLeaf.__table__.c[col].type.length
+    if length is not None and len(value) > length:
+        raise ValueError('{} is longer than {} characters: {}'.format(
+            col, length, value))
+    return value
+
+def _validate_records(records):
+    '''Validate leaf records and resolve parent child relations.
+
+    Returns:
+        tuple: (root, children) with the root record and a dict that maps
+        idx values to lists of child records in input order. Records get
+        *values* with converted column values for the database.
+    '''
+    leaves = dict()
+    roots = []
+    for record in records:
+        record = {k: _to_python(v) for k, v in record.items()}
+        idx = record['idx']
+        if idx is None:
+            raise ValueError('Found leaf without idx: {}'.format(record))
+        if idx in leaves:
+            raise ValueError('idx {} is used by multiple leaves'.format(idx))
+        if record['name'] is None:
+            raise ValueError('Leaf {} has no name'.format(idx))
+        try:
+            values = {col: _convert(col, record.get(col)) for col in IMPORT_COLUMNS}
+            values['name'] = _convert('name', record['name'])
+        except ValueError as e:
+            raise ValueError('Invalid value in leaf {}: {}'.format(idx, e))
+        leaves[idx] = {'idx': idx, 'parent': record['parent_leaf_id'],
+            'values': values}
+        if record['parent_leaf_id'] is None:
+            roots.append(leaves[idx])
+    if len(roots) != 1:
+        raise ValueError('''Can not import. There needs 
+            to be exactly one root leaf for that tree! 
+            Found: \n{}'''.format([r['values']['name'] for r in roots]))
+    children = dict()
+    for leaf in leaves.values():
+        if leaf['parent'] is None:
+            continue
+        if leaf['parent'] not in leaves:
+            raise ValueError('Parent {} of leaf {} not found'.format(
+                leaf['parent'], leaf['idx']))
+        children.setdefault(leaf['parent'], []).append(leaf)
+    reached = 0
+    level = [roots[0]['idx']]
+    while level:
+        reached += len(level)
+        level = [c['idx'] for p in level for c in children.get(p, [])]
+    if reached != len(leaves):
+        raise ValueError('{} leaves are not connected to the root leaf'.format(
+            len(leaves) - reached))
+    return roots[0], children
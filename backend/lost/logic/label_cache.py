@@ -0,0 +1,188 @@
+'''Cached label trees.
+
+A label tree (or the sub tree below any leaf) is loaded with one query and
+kept in memory as plain data. Cached trees are bound to the version token
+of :mod:`lost.db.label_version`, that changes with every change of a label
+leaf. So each read costs one small query for the token and trees are only
+loaded again after labels were changed, in any process.
+'''
+import threading
+from collections import OrderedDict
+import sqlalchemy
+import pandas as pd
+from lost.db import model, label_version
+
+# Columns in the order of LabelLeaf.to_dict
+LEAF_COLUMNS = ['idx', 'name', 'abbreviation', 'description', 'timestamp',
+    'external_id', 'is_deleted', 'parent_leaf_id', 'is_root', 'group_id', 'color']
+
+def supports_recursive_cte(dialect):
+    '''Check if a database supports WITH RECURSIVE.'''
+    if dialect.name == 'mysql':
+        version = dialect.server_version_info or (0,)
+        if getattr(dialect, 'is_mariadb', False):
+            return version >= (10, 2)
+        return version >= (8, 0)
+    return dialect.name in ('sqlite', 'postgresql')
+
+def load_leaves(session, leaf_id):
+    '''Load a leaf and all leaves below it.
+
+    A recursive CTE is used if the database supports it, otherwise one
+    query per level of the tree.
+
+    Args:
+        session: Database session.
+        leaf_id (int): Id of the top leaf.
+
+    Returns:
+        list of dict: One dict per leaf with :data:`LEAF_COLUMNS`.
+    '''
+    table = model.LabelLeaf.__table__
+    columns = [table.c[c] for c in LEAF_COLUMNS]
+    if supports_recursive_cte(session.get_bind().dialect):
+        tree = sqlalchemy.select([table.c.idx]).where(table.c.idx==leaf_id)\
+            .cte('tree', recursive=True)
+        # UNION instead of UNION ALL terminates on broken trees with cycles
+        tree = tree.union(sqlalchemy.select([table.c.idx])\
+            .where(table.c.parent_leaf_id==tree.c.idx))
+        query = sqlalchemy.select(columns)\
+            .select_from(table.join(tree, table.c.idx==tree.c.idx))
+        return [dict(zip(LEAF_COLUMNS, row)) for row in session.execute(query)]
+    rows = []
+    seen = set()
+    query = sqlalchemy.select(columns).where(table.c.idx==leaf_id)
+    while True:
+        level = [dict(zip(LEAF_COLUMNS, row)) for row in session.execute(query)]
+        level = [row for row in level if row['idx'] not in seen]
+        if not level:
+            return rows
+        rows += level
+        seen.update(row['idx'] for row in level)
+        query = sqlalchemy.select(columns)\
+            .where(table.c.parent_leaf_id.in_([row['idx'] for row in level]))
+
+class CachedTree(object):
+    '''Plain data of a label tree or a sub tree.
+
+    Children are ordered by their id. Returned dicts are copies, so they
+    can be changed by the caller.
+
+    Args:
+        root_id (int): Id of the top leaf.
+        rows (list of dict): Result of :func:`load_leaves`.
+    '''
+
+    def __init__(self, root_id, rows):
+        self.root_id = root_id
+        self.leaves = {row['idx']: row for row in rows}
+        self.children = {idx: [] for idx in self.leaves}
+        for idx in sorted(self.leaves):
+            parent_id = self.leaves[idx]['parent_leaf_id']
+            if idx != root_id and parent_id in self.children:
+                self.children[parent_id].append(idx)
+
+    def iter_ids(self):
+        '''Iterate over all leaf ids in depth first order.'''
+        stack = [self.root_id]
+        while stack:
+            idx = stack.pop()
+            yield idx
+            stack.extend(reversed(self.children[idx]))
+
+    def get_leaf(self, idx):
+        return dict(self.leaves[idx])
+
+    def get_children(self, idx):
+        '''Get the direct children of a leaf as dicts.'''
+        return [dict(self.leaves[c]) for c in self.children.get(idx, [])]
+
+    def to_hierarchical_dict(self, idx=None):
+        '''Get a leaf with all its children in nested *children* lists.'''
+        if idx is None:
+            idx = self.root_id
+        res = self.get_leaf(idx)
+        res['children'] = [self.to_hierarchical_dict(c) for c in self.children[idx]]
+        return res
+
+    def to_df(self):
+        '''Get all leaves as DataFrame in depth first order.
+
+        Columns that contain None are of dtype object, like a concat of
+        one DataFrame per leaf.
+        '''
+        records = [self.leaves[idx] for idx in self.iter_ids()]
+        df = pd.DataFrame(records, columns=LEAF_COLUMNS)
+        for col in LEAF_COLUMNS:
+            values = [r[col] for r in records]
+            if any(v is None for v in values):
+                df[col] = pd.Series(values, index=df.index, dtype=object)
+        return df
+
+class TreeCache(object):
+    '''Process wide LRU cache of :class:`CachedTree` objects by top leaf id.
+
+    Args:
+        max_size (int): Max number of cached trees. If None,
+            LOST_LABEL_TREE_CACHE_SIZE of the LOSTConfig is used.
+    '''
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.mem = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get_max_size(self):
+        if self.max_size is None:
+            from lostconfig import LOSTConfig
+            self.max_size = LOSTConfig().label_tree_cache_size
+        return self.max_size
+
+    def get(self, session, leaf_id, version=None):
+        '''Get the tree below a leaf.
+
+        Args:
+            session: Database session.
+            leaf_id (int): Id of the top leaf.
+            version (str): Current version token, if already known.
+
+        Returns:
+            :class:`CachedTree` or None if the leaf does not exist.
+        '''
+        if version is None:
+            version = label_version.get_version(session)
+        with self.lock:
+            entry = self.mem.get(leaf_id)
+            if entry is not None and entry[0] == version:
+                self.mem.move_to_end(leaf_id)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        rows = load_leaves(session, leaf_id)
+        if not rows:
+            return None
+        tree = CachedTree(leaf_id, rows)
+        with self.lock:
+            self.mem[leaf_id] = (version, tree)
+            self.mem.move_to_end(leaf_id)
+            while len(self.mem) > self._get_max_size():
+                self.mem.popitem(last=False)
+        return tree
+
+    def get_many(self, session, leaf_ids):
+        '''Get trees below multiple leaves with one version query.
+
+        Returns:
+            list of :class:`CachedTree`: Trees of existing leaves.
+        '''
+        version = label_version.get_version(session)
+        trees = [self.get(session, leaf_id, version) for leaf_id in leaf_ids]
+        return [tree for tree in trees if tree is not None]
+
+    def clear(self):
+        with self.lock:
+            self.mem = OrderedDict()
+
+tree_cache = TreeCache()
@@ -0,0 +1,112 @@
+'''Partial and incremental reads of log files.
+
+Logs of long running scripts grow to hundreds of MB while they are polled
+by the UI. Instead of sending the whole file on every poll, clients can
+request the last bytes or lines of a log or all content after an offset
+they already have. Responses carry the offset of the returned content
+(X-Log-Offset) and the size of the log (X-Log-Size), that is the offset for
+the next incremental read. Files are streamed in chunks.
+'''
+from flask import request, Response
+from lost.logic.image_stream import get_file_stat, make_etag, conditional_response
+
+CHUNK_SIZE = 64 * 1024
+
+def find_tail_offset(f, size, n_lines, block_size=CHUNK_SIZE):
+    '''Find the offset where the last lines of a file start.
+
+    A trailing line break does not count as an additional line.
+
+    Args:
+        f (file): File opened in binary mode.
+        size (int): Size of the file.
+        n_lines (int): Number of lines.
+        block_size (int): Bytes read at once, starting at the end of the file.
+
+    Returns:
+        int: Offset of the first byte of the last n_lines lines.
+    '''
+    if n_lines <= 0:
+        return size
+    end = size
+    found = 0
+    while end > 0:
+        start = max(end - block_size, 0)
+        f.seek(start)
+        block = f.read(end - start)
+        # Ignore the line break that ends the last line
+        stop = len(block) - 1 if end == size and block.endswith(b'\n') else len(block)
+        pos = block.rfind(b'\n', 0, stop)
+        while pos >= 0:
+            found += 1
+            if found == n_lines:
+                return start + pos + 1
+            pos = block.rfind(b'\n', 0, pos)
+        end = start
+    return 0
+
+def iter_file(f, start, end, chunk_size=CHUNK_SIZE):
+    '''Read a part of a file in chunks and close it afterwards.'''
+    try:
+        f.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    finally:
+        f.close()
+
+def send_log(fm, path, offset=None, tail_bytes=None, tail_lines=None,
+    mimetype='text/plain'):
+    '''Send a log file or a part of it.
+
+    Without offset and tail arguments the whole file is sent. Range
+    requests and conditional requests with If-None-Match are supported
+    in this case.
+
+    Args:
+        fm (FileMan): FileMan of the filesystem the log is located in.
+        path (str): Path of the log.
+        offset (int): Send content after this offset. If the log is
+            smaller than offset (e.g. it was rewritten), it is sent from
+            the beginning.
+        tail_bytes (int): Send only the last bytes of the log.
+        tail_lines (int): Send only the last lines of the log.
+        mimetype (str): Content type of the response.
+
+    Returns:
+        flask.Response: Response with status 200, 206 or 304.
+    '''
+    abs_path = fm.get_abs_path(path)
+    size, mtime = get_file_stat(fm, abs_path)
+    etag = make_etag(abs_path, size, mtime)
+    if offset is None and tail_bytes is None and tail_lines is None:
+        rv = conditional_response(fm.fs.open(abs_path, 'rb'), mimetype, size,
+            etag, last_modified=mtime, max_age=0)
+        rv.headers['X-Log-Offset'] = 0
+        rv.headers['X-Log-Size'] = size
+        return rv
+    if etag in request.if_none_match:
+        # Nothing new since the last poll
+        rv = Response(status=304)
+        rv.set_etag(etag)
+        rv.headers['X-Log-Size'] = size
+        return rv
+    f = fm.fs.open(abs_path, 'rb')
+    if offset is not None:
+        start = offset if offset <= size else 0
+    elif tail_bytes is not None:
+        start = max(size - tail_bytes, 0)
+    else:
+        start = find_tail_offset(f, size, tail_lines)
+    rv = Response(iter_file(f, start, size), mimetype=mimetype,
+        direct_passthrough=True)
+    rv.content_length = size - start
+    rv.set_etag(etag)
+    rv.cache_control.no_cache = True
+    rv.headers['X-Log-Offset'] = start
+    rv.headers['X-Log-Size'] = size
+    return rv
@@ -4,9 +4,8 @@ import os
 from lost.db import dtype, state, model
 from lost.logic.anno_task import set_finished, update_anno_task
 from lost.logic.file_man import FileMan
+from lost.logic.label_cache import tree_cache
 from datetime import datetime
-import skimage.io
-from lost.pyapi.utils import anno_helper
 
 __author__ = "Gereon Reus"
 
@@ -18,9 +17,11 @@ def get_next(db_man, default_user_id, max_amount):
     if at and at.pipe_element.pipe.state != state.Pipe.PAUSED:
         config = json.loads(at.configuration)
         if config['type'] == 'annoBased':
-            return __get_next_two_d_anno(db_man, default_user_id, at, max_amount)
+            return __get_next_annos(db_man, default_user_id, at, max_amount,
+                model.TwoDAnno)
         elif config['type'] == 'imageBased':    
-            return __get_next_image_anno(db_man, default_user_id, at, max_amount)
+            return __get_next_annos(db_man, default_user_id, at, max_amount,
+                model.ImageAnno)
     images = dict()
     images['images'] = list()
     return images
@@ -63,8 +64,6 @@ class TwoDSerialize(object):
             image_json = dict()
             image_json['id'] = anno.idx
             image_json['type'] = 'annoBased'
-            # get image_anno of two_d anno
-            image_anno = self.db_man.get_image_annotation(img_anno_id=anno.img_anno_id)
             self.mia_json['images'].append(image_json) 
 
             # cropped_image_path = os.path.join(directory, str(anno.idx)) + '.png'
@@ -143,13 +142,15 @@ def get_label_trees(db_man, user_id):
     label_trees_json = dict()
     label_trees_json['labels'] = list()
     if at:
-        for rll in db_man.get_all_required_label_leaves(at.idx): #type: lost.db.model.RequiredLabelLeaf
-            for label_leaf in db_man.get_all_child_label_leaves(rll.label_leaf.idx): #type: lost.db.model.LabelLeaf
+        rll_ids = [rll.label_leaf_id for rll in db_man.get_all_required_label_leaves(at.idx)]
+        for tree in tree_cache.get_many(db_man.session, rll_ids):
+            parent_name = tree.leaves[tree.root_id]['name']
+            for label_leaf in tree.get_children(tree.root_id):
                 label_leaf_json = dict()
-                label_leaf_json['id'] = label_leaf.idx
-                label_leaf_json['label'] = label_leaf.name
-                label_leaf_json['nameAndClass'] = label_leaf.name + " (" + rll.label_leaf.name + ")"
-                label_leaf_json['description'] = label_leaf.description
+                label_leaf_json['id'] = label_leaf['idx']
+                label_leaf_json['label'] = label_leaf['name']
+                label_leaf_json['nameAndClass'] = label_leaf['name'] + " (" + parent_name + ")"
+                label_leaf_json['description'] = label_leaf['description']
                 label_trees_json['labels'].append(label_leaf_json)
         return label_trees_json
     else: 
@@ -163,186 +164,154 @@ def __get_mia_anno_task(db_man, user_id):
             return cat.anno_task
     return None
 
-def __get_next_two_d_anno(db_man, user_id, at, max_amount):
-    #################### get locked priority ########################
-    annos = db_man.get_two_d_annotations_by_state(at.idx,\
-    state.Anno.LOCKED_PRIORITY, user_id, max_amount)
-    if len(annos) > 0:
-        for anno in annos:
-            anno.timestamp_lock = datetime.now()
-            db_man.save_obj(anno)
-        image_serialize = TwoDSerialize(db_man, annos, user_id, at.idx, proposedLabel=False)
-        image_serialize.serialize()
-        return image_serialize.mia_json
-
-    #################### get view locked ########################
-    annos = db_man.get_two_d_annotations_by_state(at.idx, \
-    state.Anno.LOCKED, user_id, 0)
-    if len(annos) > 0:
-        while int(len(annos)) > max_amount:
-            annos[len(annos)-1].state = state.Anno.UNLOCKED
-            db_man.save_obj(annos[len(annos)-1])
-            del annos[len(annos)-1]
+def __serialize(db_man, anno_model, annos, user_id, at, proposedLabel=True):
+    if anno_model == model.TwoDAnno:
+        image_serialize = TwoDSerialize(db_man, annos, user_id, at.idx,
+            proposedLabel=proposedLabel)
+    else:
+        image_serialize = ImageSerialize(db_man, annos, user_id,
+            proposedLabel=proposedLabel)
+    image_serialize.serialize()
+    return image_serialize.mia_json
 
-        if len(annos) < max_amount:
-            sim_class = annos[0].sim_class
-            tempannos = db_man.get_image_annotation_by_sim_class(at.idx,\
-                        sim_class, (max_amount-len(annos)))
-            for tanno in tempannos:
-                tanno.state = state.Anno.LOCKED
-                tanno.timestamp_lock = datetime.now()
-                tanno.user_id = user_id
-                annos.append(tanno)
-                db_man.add(tanno)
-            db_man.commit()
-        for anno in annos:
-            anno.timestamp_lock = datetime.now()
-            db_man.save_obj(anno)
-        image_serialize = TwoDSerialize(db_man, annos, user_id, at.idx)
-        image_serialize.serialize()
-        return image_serialize.mia_json
+def __get_annos_by_state(db_man, anno_model, at, anno_state, user_id, amount):
+    if anno_model == model.TwoDAnno:
+        return db_man.get_two_d_annotations_by_state(at.idx, anno_state,
+            user_id, amount)
+    return db_man.get_image_annotations_by_state(at.idx, anno_state,
+        user_id, amount)
 
-    ################## get new (unlocked)############################
-        # first get random sim class
-    sim_class = db_man.get_random_sim_class_two_d_anno(at.idx)
-    if sim_class:
-        sim_class = sim_class.sim_class
-    else:
-        images = dict()
-        images['images'] = list()
-        return images
-    annos = db_man.get_two_d_anno_by_sim_class(at.idx, sim_class, max_amount)
-    if len(annos) > 0:
-                    for anno in annos:
-                        anno.state = state.Anno.LOCKED
-                        anno.timestamp_lock = datetime.now()
-                        anno.user_id = user_id
-                        db_man.add(anno)
-                    db_man.commit()
-                    image_serialize = TwoDSerialize(db_man, annos, user_id, at.idx)
-                    image_serialize.serialize()
-                    return image_serialize.mia_json
+def __get_unlocked_by_sim_class(db_man, anno_model, at, sim_class, amount):
+    if anno_model == model.TwoDAnno:
+        return db_man.get_two_d_anno_by_sim_class(at.idx, sim_class, amount)
+    return db_man.get_image_annotation_by_sim_class(at.idx, sim_class, amount)
 
-def __get_next_image_anno(db_man, user_id, at, max_amount):
+def __get_next_annos(db_man, user_id, at, max_amount, anno_model):
+    '''Get and lock the next annotations of a MIA task.
 
-    ## image annotations
+    Annotations are read with one query per step and locked with one
+    UPDATE. All changes are committed in one transaction, after the
+    annotations were serialized, so they are not reloaded one by one.
+    '''
+    # Proposed labels are requested like before per anno type and step
+    if anno_model == model.TwoDAnno:
+        proposed = {'priority': False, 'locked': True}
+    else:
+        proposed = {'priority': True, 'locked': False}
+    now = datetime.now()
+    try:
+        #################### get locked priority ########################
+        annos = __get_annos_by_state(db_man, anno_model, at,
+            state.Anno.LOCKED_PRIORITY, user_id, max_amount)
+        annos = db_man.lock_annos(anno_model, annos, now)
+        if len(annos) > 0:
+            mia_json = __serialize(db_man, anno_model, annos, user_id, at,
+                proposedLabel=proposed['priority'])
+            db_man.commit()
+            return mia_json
 
-    #################### get locked priority ########################
-    annos = db_man.get_image_annotations_by_state(at.idx,\
-    state.Anno.LOCKED_PRIORITY, user_id, max_amount)
-    if len(annos) > 0:
-        for anno in annos:
-            anno.timestamp_lock = datetime.now()
-            db_man.save_obj(anno)
-        image_serialize = ImageSerialize(db_man, annos, user_id)
-        image_serialize.serialize()
-        return image_serialize.mia_json
         #################### get view locked ########################
-    annos = db_man.get_image_annotations_by_state(at.idx, \
-    state.Anno.LOCKED, user_id, 0)
-    if len(annos) > 0:
-        while int(len(annos)) > max_amount:
-            annos[len(annos)-1].state = state.Anno.UNLOCKED
-            db_man.save_obj(annos[len(annos)-1])
-            del annos[len(annos)-1]
+        annos = __get_annos_by_state(db_man, anno_model, at,
+            state.Anno.LOCKED, user_id, 0)
+        if len(annos) > 0:
+            if len(annos) > max_amount:
+                db_man.lock_annos(anno_model, annos[max_amount:],
+                    anno_state=state.Anno.UNLOCKED)
+                annos = annos[:max_amount]
+            if len(annos) < max_amount:
+                annos += __get_unlocked_by_sim_class(db_man, anno_model, at,
+                    annos[0].sim_class, max_amount-len(annos))
+            annos = db_man.lock_annos(anno_model, annos, now, user_id=user_id,
+                anno_state=state.Anno.LOCKED)
+            if len(annos) > 0:
+                mia_json = __serialize(db_man, anno_model, annos, user_id, at,
+                    proposedLabel=proposed['locked'])
+                db_man.commit()
+                return mia_json
 
-        if len(annos) < max_amount:
-            sim_class = annos[0].sim_class
-            tempannos = db_man.get_image_annotation_by_sim_class(at.idx,\
-                        sim_class, (max_amount-len(annos)))
-            for tanno in tempannos:
-                tanno.state = state.Anno.LOCKED
-                tanno.timestamp_lock = datetime.now()
-                tanno.user_id = user_id
-                annos.append(tanno)
-                db_man.add(tanno)
+        ################## get new (unlocked)############################
+        # first get random sim class
+        if anno_model == model.TwoDAnno:
+            sim_class = db_man.get_random_sim_class_two_d_anno(at.idx)
+        else:
+            sim_class = db_man.get_random_sim_class_img_anno(at.idx)
+        if not sim_class:
+            images = dict()
+            images['images'] = list()
+            return images
+        annos = __get_unlocked_by_sim_class(db_man, anno_model, at,
+            sim_class.sim_class, max_amount)
+        # Annotations that were locked by another annotator in between
+        # are skipped
+        annos = db_man.lock_annos(anno_model, annos, now, user_id=user_id,
+            anno_state=state.Anno.LOCKED)
+        if len(annos) > 0:
+            mia_json = __serialize(db_man, anno_model, annos, user_id, at)
             db_man.commit()
-        for anno in annos:
-            anno.timestamp_lock = datetime.now()
-            db_man.save_obj(anno)
-        image_serialize = ImageSerialize(db_man, annos, user_id, proposedLabel=False)
-        image_serialize.serialize()
-        return image_serialize.mia_json
-    # -- fill with new annos if size < max_amount
-    # -- remove if size > max_amount
-
-    ################## get new (unlocked)############################
-    # first get random sim class
-    sim_class = db_man.get_random_sim_class_img_anno(at.idx)
-    if sim_class:
-        sim_class = sim_class.sim_class
-    else:
+            return mia_json
+        db_man.commit()
         images = dict()
         images['images'] = list()
         return images
-    annos = db_man.get_image_annotation_by_sim_class(at.idx, sim_class, max_amount)
-    if len(annos) > 0:
-        for anno in annos:
-            anno.state = state.Anno.LOCKED
-            anno.timestamp_lock = datetime.now()
-            anno.user_id = user_id
-            db_man.add(anno)
-        db_man.commit()
-        image_serialize = ImageSerialize(db_man, annos, user_id)
-        image_serialize.serialize()
-        return image_serialize.mia_json
+    except:
+        db_man.session.rollback()
+        raise
 
-def __update_image_annotation(db_man, user_id, data):
+def __update_annotations(db_man, user_id, data, anno_model, label_dtype):
+    '''Write labels of a MIA batch in one transaction.
+
+    Annotations are loaded with one query and labels are inserted in one
+    batch.
+    '''
     anno_time = None
     anno_count = len(list(filter(lambda x: x['is_active'] is True, data['images'])))
-    for img in data['images']:
-        image = db_man.get_image_annotation(img_anno_id=img['id'])
-        if img['is_active']:
-            image.state = state.Anno.LABELED
-            image.timestamp = datetime.now()
-            if anno_time is None and anno_count > 0:
-                anno_time = (image.timestamp-image.timestamp_lock).total_seconds()
-                anno_time = anno_time/anno_count
-            image.user_id = user_id
-            image.anno_time = anno_time
-            db_man.add(image)
-            for label in data['labels']:
-                
-                lab = model.Label(dtype=dtype.Label.IMG_ANNO,
-                                label_leaf_id=label['id'],
-                                annotator_id=user_id,
-                                timestamp=image.timestamp,
-                                timestamp_lock=image.timestamp_lock,
-                                anno_time=anno_time,
-                                img_anno_id=image.idx)
-                db_man.add(lab)
-        else:
-            image.state = state.Anno.LOCKED_PRIORITY
-            db_man.add(image)
+    ids = [img['id'] for img in data['images']]
+    annos = {anno.idx: anno for anno in db_man.session.query(anno_model)\
+        .filter(anno_model.idx.in_(ids))}
+    label_rows = list()
+    try:
+        for img in data['images']:
+            anno = annos[img['id']]
+            if img['is_active']:
+                anno.state = state.Anno.LABELED
+                anno.timestamp = datetime.now()
+                if anno_time is None and anno_count > 0:
+                    anno_time = (anno.timestamp-anno.timestamp_lock).total_seconds()
+                    anno_time = anno_time/anno_count
+                anno.user_id = user_id
+                anno.anno_time = anno_time
+                db_man.add(anno)
+                for label in data['labels']:
+                    lab = {'dtype': label_dtype,
+                        'label_leaf_id': label['id'],
+                        'annotator_id': user_id,
+                        'timestamp': anno.timestamp,
+                        'timestamp_lock': anno.timestamp_lock,
+                        'anno_time': anno_time,
+                        'img_anno_id': None,
+                        'two_d_anno_id': None}
+                    if anno_model == model.TwoDAnno:
+                        lab['two_d_anno_id'] = anno.idx
+                    else:
+                        lab['img_anno_id'] = anno.idx
+                    label_rows.append(lab)
+            else:
+                anno.state = state.Anno.LOCKED_PRIORITY
+                db_man.add(anno)
+        if label_rows:
+            db_man.session.execute(model.Label.__table__.insert(), label_rows)
         db_man.commit()
+    except:
+        db_man.session.rollback()
+        raise
+
+def __update_image_annotation(db_man, user_id, data):
+    __update_annotations(db_man, user_id, data, model.ImageAnno,
+        dtype.Label.IMG_ANNO)
 
 def __update_two_d_annotation(db_man, user_id, data):
-    anno_time = None
-    anno_count = len(list(filter(lambda x: x['is_active'] is True, data['images'])))
-    for img in data['images']:
-        two_d_anno = db_man.get_two_d_annotation(two_d_anno_id=img['id'])
-        if img['is_active']:
-            two_d_anno.state = state.Anno.LABELED
-            two_d_anno.timestamp = datetime.now()
-            if anno_time is None and anno_count > 0:
-                anno_time = (two_d_anno.timestamp-two_d_anno.timestamp_lock).total_seconds()
-                anno_time = anno_time/anno_count
-            two_d_anno.user_id = user_id
-            two_d_anno.anno_time = anno_time
-            db_man.add(two_d_anno)
-            for label in data['labels']:
-                lab = model.Label(dtype=dtype.Label.TWO_D_ANNO,
-                                label_leaf_id=label['id'],
-                                annotator_id=user_id,
-                                timestamp=two_d_anno.timestamp,
-                                timestamp_lock=two_d_anno.timestamp_lock,
-                                anno_time=anno_time,
-                                two_d_anno_id=two_d_anno.idx)
-                db_man.add(lab)
-        else:
-            two_d_anno.state = state.Anno.LOCKED_PRIORITY
-            db_man.add(two_d_anno)
-        db_man.commit()
+    __update_annotations(db_man, user_id, data, model.TwoDAnno,
+        dtype.Label.TWO_D_ANNO)
 
 def get_proposed_label(db_man, anno, user_id):
     if anno:
@@ -385,32 +354,34 @@ def get_special(db_man, user_id, mia_ids):
     images['images'] = list()
     return images
 
-def __get_special_two_d_annos(db_man, user_id, at, mia_ids):
-    annos = db_man.get_two_d_annotations_by_ids(at.idx, user_id, mia_ids)
+def __get_special_annos(db_man, user_id, at, mia_ids, anno_model):
+    '''Lock already labeled annotations again and remove the labels of
+    the user, all in one transaction.
+    '''
+    if anno_model == model.TwoDAnno:
+        annos = db_man.get_two_d_annotations_by_ids(at.idx, user_id, mia_ids)
+        anno_column = model.Label.two_d_anno_id
+    else:
+        annos = db_man.get_image_annotations_by_ids(at.idx, user_id, mia_ids)
+        anno_column = model.Label.img_anno_id
     if len(annos) > 0:
-        for anno in annos:
-            anno.timestamp_lock = datetime.now()
-            anno.state = state.Anno.LOCKED
-            for label in anno.labels:
-                if label.annotator_id == user_id:
-                    db_man.delete(label)
-            db_man.save_obj(anno)
+        try:
+            annos = db_man.lock_annos(anno_model, annos, datetime.now(),
+                anno_state=state.Anno.LOCKED)
+            db_man.session.query(model.Label)\
+                .filter(anno_column.in_([anno.idx for anno in annos]),
+                    model.Label.annotator_id==user_id)\
+                .delete(synchronize_session=False)
+            mia_json = __serialize(db_man, anno_model, annos, user_id, at,
+                proposedLabel=anno_model == model.ImageAnno)
             db_man.commit()
-        image_serialize = TwoDSerialize(db_man, annos, user_id, at.idx, proposedLabel=False)
-        image_serialize.serialize()
-        return image_serialize.mia_json
+        except:
+            db_man.session.rollback()
+            raise
+        return mia_json
+
+def __get_special_two_d_annos(db_man, user_id, at, mia_ids):
+    return __get_special_annos(db_man, user_id, at, mia_ids, model.TwoDAnno)
 
 def __get_special_image_annos(db_man, user_id, at, mia_ids):
-    annos = db_man.get_image_annotations_by_ids(at.idx, user_id, mia_ids)
-    if len(annos) > 0:
-        for anno in annos:
-            anno.timestamp_lock = datetime.now()
-            anno.state = state.Anno.LOCKED
-            for label in anno.labels:
-                if label.annotator_id == user_id:
-                    db_man.delete(label)
-            db_man.save_obj(anno)
-            db_man.commit()
-        image_serialize = ImageSerialize(db_man, annos, user_id)
-        image_serialize.serialize()
-        return image_serialize.mia_json
+    return __get_special_annos(db_man, user_id, at, mia_ids, model.ImageAnno)
@@ -26,20 +26,9 @@ from lost.logic.pipeline.worker import WorkerMan, CurrentWorker
 from lost.logic import email
 from lost.logic.dask_session import ds_man, ppp_man
 from lost.logic.pipeline import exec_utils
+from lost.logic.pipeline import scheduler
+from lost.logic.pipeline import script_env
 
-def gen_extra_install_cmd(extra_packages, lostconfig):
-    def cmd(install_cmd, packages):
-        return f'{install_cmd} {packages}'
-    extra = json.loads(extra_packages)
-    pip_cmd = None
-    if lostconfig.allow_extra_pip:
-        if len(extra['pip']) > 1:
-            pip_cmd = cmd('pip install', extra['pip'])
-    conda_cmd = None
-    if lostconfig.allow_extra_conda:
-        if len(extra['conda']) > 1:
-            conda_cmd = cmd('conda install', extra['conda'])
-    return pip_cmd, conda_cmd
 class PipeEngine(pipe_model.PipeEngine):
     def __init__(self, dbm, pipe, lostconfig, client, logger_name=''):
         '''
@@ -48,6 +37,7 @@ class PipeEngine(pipe_model.PipeEngine):
         '''
         super().__init__(dbm=dbm, pipe=pipe)
         self.lostconfig = lostconfig #type: lost.logic.config.LOSTConfig
+        self.pipe_id = pipe.idx
         self.file_man = AppFileMan(self.lostconfig)
         # self.logger = lost.logic.log.get_file_logger(
         #     'Executor: {}'.format(self.lostconfig.env_name), 
@@ -133,6 +123,7 @@ class PipeEngine(pipe_model.PipeEngine):
                     pe.loop.iteration = 0
             self.set_to_visit(pe)
             self.dbm.add(pe)
+        scheduler.notify(self.pipe_id, scheduler.LOOP_RELEASED, self.lostconfig)
 
     def process_loop(self, pipe_e):
         if pipe_e.loop.break_loop:
@@ -185,6 +176,8 @@ class PipeEngine(pipe_model.PipeEngine):
                     [f'{x}' for x in traceback.format_tb(fut.traceback())]
                 )
             ))
+        # Script may have finished on a remote worker
+        scheduler.notify(self.pipe_id, scheduler.SCRIPT_FINISHED, self.lostconfig)
         # class User():
         #     def __init__(self, idx):
         #         self.idx = idx
@@ -194,21 +187,12 @@ class PipeEngine(pipe_model.PipeEngine):
         # self.logger.info(f'client.restart: {client.restart()}')
 
     def _install_extra_packages(self, client, packages):
-        def install(cmd):
-            import subprocess
-            output = subprocess.check_output(f'{cmd}',stderr=subprocess.STDOUT, shell=True)
-            return output
-            # import os
-            # os.system(f'{install_cmd} {packages}')
-        pip_cmd, conda_cmd = gen_extra_install_cmd(packages, self.lostconfig)
-        if pip_cmd is not None:
-            self.logger.info(f'Start install cmd: {pip_cmd}')
-            self.logger.info(client.run(install, pip_cmd))
-            self.logger.info(f'Install finished: {pip_cmd}')
-        if conda_cmd is not None:
-            self.logger.info(f'Start install cmd: {conda_cmd}')
-            self.logger.info(client.run(install, conda_cmd))
-            self.logger.info(f'Install finished: {conda_cmd}')
+        spec = script_env.get_spec(packages, self.lostconfig)
+        if script_env.is_empty(spec):
+            return
+        env_cache = script_env.create_env_cache(self.lostconfig)
+        self.logger.info(f'Activate environment for: {spec}')
+        self.logger.info(client.run(script_env.activate, env_cache, spec))
 
     def exec_dask_direct(self, client, pipe_e, worker=None):
         scr = pipe_e.script
@@ -424,12 +408,10 @@ class PipeEngine(pipe_model.PipeEngine):
 def gen_run_cmd(program, pipe_e, lostconfig):
     # script = self.dbm.get_script(pipe_e.script_id)
     cmd = lostconfig.py3_init + "\n"
-    # extra_packages = json.loads(pipe_e.script.extra_packages)
-    pip_cmd, conda_cmd = gen_extra_install_cmd(pipe_e.script.extra_packages, lostconfig)
-    if pip_cmd is not None:
-        cmd += pip_cmd + '\n'
-    if conda_cmd is not None:
-        cmd += conda_cmd +'\n'
+    spec = script_env.get_spec(pipe_e.script.extra_packages, lostconfig)
+    if not script_env.is_empty(spec):
+        env_path = script_env.create_env_cache(lostconfig).get_env(spec)
+        program = script_env.get_program(env_path, program)
     script_path = os.path.join(lostconfig.app_path, pipe_e.script.path)
     cmd += program + " " + script_path + " --idx " + str(pipe_e.idx) 
     return cmd
@@ -462,14 +444,17 @@ def exec_script_in_subprocess(pipe_element_id):
         start_script_path = os.path.join(start_script_path, 'start.sh')
         with open(start_script_path, 'w') as sfile:
             sfile.write(cmd)
-        p = subprocess.Popen('bash {}'.format(start_script_path), stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE, shell=True)
-        logger.info("{} ({}): Started script\n{}".format(pipe.name, pipe.idx, cmd))
-        if lostconfig.worker_management == 'static':
-            worker.add_script(pipe_e, pipe_e.script)       
-        out, err = p.communicate()
-        if lostconfig.worker_management == 'static':
-            worker.remove_script(pipe_e, pipe_e.script)       
+        spec = script_env.get_spec(pipe_e.script.extra_packages, lostconfig)
+        # Environment is not removed while the script is running
+        with script_env.create_env_cache(lostconfig).use_env(spec):
+            p = subprocess.Popen('bash {}'.format(start_script_path), stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE, shell=True)
+            logger.info("{} ({}): Started script\n{}".format(pipe.name, pipe.idx, cmd))
+            if lostconfig.worker_management == 'static':
+                worker.add_script(pipe_e, pipe_e.script)       
+            out, err = p.communicate()
+            if lostconfig.worker_management == 'static':
+                worker.remove_script(pipe_e, pipe_e.script)       
         if p.returncode != 0:
             raise Exception(err.decode('utf-8'))
         logger.info('{} ({}): Executed script successful: {}'.format(pipe.name, 
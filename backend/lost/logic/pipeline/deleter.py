@@ -0,0 +1,226 @@
+'''Set based deletion of pipelines.
+
+All rows that belong to a pipe are deleted from child to parent tables in
+batches of ids. Every batch is committed on its own, so locks are only held
+for a short time. Rows are always looked up by their relation to the pipe,
+so a deletion that was interrupted can be resumed by running it again.
+A pipe that should be deleted is marked with :data:`state.Pipe.DELETED`
+first and removed later by :func:`delete_marked_pipes` in the cron jobs.
+'''
+import logging
+from collections import OrderedDict
+import sqlalchemy
+from sqlalchemy import or_
+from lost.db import model, state, dtype
+from lost.logic.file_man import FileMan
+from lost.logic.pipeline import pipe_model
+
+class PipeDeleter(object):
+    '''Delete a pipe with all its elements, annotations and files.
+
+    Args:
+        dbm (lost.db.access.DBMan): Database manager.
+        pipe_id (int): Id of the pipe to delete.
+        batch_size (int): Max number of rows that are deleted per
+            transaction. If None, LOSTConfig.pipe_delete_batch_size is used.
+        logger_name (str): Name of the parent logger.
+        progress (callable): Called with (table_name, deleted, total) after
+            each committed batch. *total* is None if :meth:`count` was
+            not called before.
+    '''
+
+    def __init__(self, dbm, pipe_id, batch_size=None, logger_name='',
+        progress=None):
+        self.dbm = dbm
+        self.pipe_id = pipe_id
+        if batch_size is None:
+            batch_size = dbm.lostconfig.pipe_delete_batch_size
+        self.batch_size = batch_size
+        self.progress = progress
+        self.logger = logging.getLogger('{}.{}'.format(
+            logger_name, self.__class__.__name__)
+        )
+        self.deleted = OrderedDict()
+        self.totals = dict()
+
+    def _execute(self, query):
+        return self.dbm.session.execute(query)
+
+    def _get_ids(self, query):
+        return [row[0] for row in self._execute(query)]
+
+    def _load_ids(self):
+        pe = model.PipeElement.__table__
+        at = model.AnnoTask.__table__
+        rl = model.ResultLink.__table__
+        self.pe_ids = self._get_ids(sqlalchemy.select([pe.c.idx])\
+            .where(pe.c.pipe_id==self.pipe_id))
+        self.anno_task_ids = self._get_ids(sqlalchemy.select([at.c.idx])\
+            .where(at.c.pipe_element_id.in_(self.pe_ids)))
+        self.result_ids = sorted(set(self._get_ids(
+            sqlalchemy.select([rl.c.result_id]).where(
+                or_(rl.c.pe_n.in_(self.pe_ids), rl.c.pe_out.in_(self.pe_ids))
+            ).where(rl.c.result_id!=None)
+        )))
+
+    def _img_anno_filter(self):
+        ia = model.ImageAnno.__table__
+        return or_(ia.c.anno_task_id.in_(self.anno_task_ids),
+            ia.c.result_id.in_(self.result_ids))
+
+    def _get_steps(self):
+        '''Get (table, filter, delete_children) in the order of deletion.'''
+        ia = model.ImageAnno.__table__
+        twod = model.TwoDAnno.__table__
+        label = model.Label.__table__
+        at = model.AnnoTask.__table__
+        pe = model.PipeElement.__table__
+        rl = model.ResultLink.__table__
+        res = model.Result.__table__
+        loop = model.Loop.__table__
+        img_anno_ids = sqlalchemy.select([ia.c.idx]).where(self._img_anno_filter())
+
+        def delete_twod_children(ids):
+            self._execute(label.delete().where(label.c.two_d_anno_id.in_(ids)))
+
+        def delete_img_children(ids):
+            self._execute(label.delete().where(label.c.img_anno_id.in_(ids)))
+
+        def delete_result_children(ids):
+            for table in (model.VisualOutput.__table__,
+                model.DataExport.__table__, rl):
+                self._execute(table.delete().where(table.c.result_id.in_(ids)))
+
+        def by_anno_task(table):
+            return table.c.anno_task_id.in_(self.anno_task_ids)
+
+        return [
+            (twod, or_(twod.c.anno_task_id.in_(self.anno_task_ids),
+                twod.c.img_anno_id.in_(img_anno_ids)), delete_twod_children),
+            (ia, self._img_anno_filter(), delete_img_children),
+            (model.Track.__table__, by_anno_task(model.Track.__table__), None),
+            (model.ChoosenAnnoTask.__table__,
+                by_anno_task(model.ChoosenAnnoTask.__table__), None),
+            (model.RequiredLabelLeaf.__table__,
+                by_anno_task(model.RequiredLabelLeaf.__table__), None),
+            (model.AnnoTaskCounter.__table__,
+                by_anno_task(model.AnnoTaskCounter.__table__), None),
+            # Results are deleted together with their result links, so
+            # they can still be found when a deletion is resumed.
+            (res, res.c.idx.in_(self.result_ids), delete_result_children),
+            (rl, or_(rl.c.pe_n.in_(self.pe_ids), rl.c.pe_out.in_(self.pe_ids)),
+                None),
+            (loop, or_(loop.c.pipe_element_id.in_(self.pe_ids),
+                loop.c.pe_jump_id.in_(self.pe_ids)), None),
+            (model.Datasource.__table__,
+                model.Datasource.__table__.c.pipe_element_id.in_(self.pe_ids),
+                None),
+            (at, at.c.idx.in_(self.anno_task_ids), None),
+            (pe, pe.c.idx.in_(self.pe_ids), None),
+        ]
+
+    def count(self):
+        '''Count the rows that are left to delete.
+
+        Returns:
+            OrderedDict: table name -> number of rows.
+        '''
+        self._load_ids()
+        for table, where, _ in self._get_steps():
+            self.totals[table.name] = self._execute(
+                sqlalchemy.select([sqlalchemy.func.count()])\
+                    .select_from(table).where(where)
+            ).scalar()
+        self.dbm.commit()
+        return OrderedDict((name, self.totals[name]) for name in self.totals)
+
+    def _delete_batches(self, table, where, delete_children=None):
+        name = table.name
+        self.deleted.setdefault(name, 0)
+        while True:
+            ids = self._get_ids(sqlalchemy.select([table.c.idx]).where(where)\
+                .order_by(table.c.idx).limit(self.batch_size))
+            if not ids:
+                return
+            with self.dbm.session_scope():
+                if delete_children is not None:
+                    delete_children(ids)
+                self._execute(table.delete().where(table.c.idx.in_(ids)))
+            self.deleted[name] += len(ids)
+            if self.progress is not None:
+                self.progress(name, self.deleted[name], self.totals.get(name))
+
+    def _delete_files(self):
+        fm = FileMan(self.dbm.lostconfig)
+        for anno_task in self.dbm.session.query(model.AnnoTask)\
+            .filter(model.AnnoTask.idx.in_(self.anno_task_ids)):
+            if anno_task.dtype != dtype.AnnoTask.MIA:
+                fm.rm_sia_history_path(anno_task)
+        for pe in self.dbm.session.query(model.PipeElement)\
+            .filter(model.PipeElement.idx.in_(self.pe_ids))\
+            .filter(model.PipeElement.dtype==dtype.PipeElement.SCRIPT):
+            fm.rm_instance_path(pe)
+        pipe = self.dbm.get_pipe(pipe_id=self.pipe_id)
+        if pipe is not None:
+            fm.rm_pipe_context_path(pipe)
+            fm.rm_pipe_log_path(pipe)
+
+    def delete(self):
+        '''Delete the pipe.
+
+        Returns:
+            OrderedDict: table name -> number of deleted rows.
+        '''
+        self._load_ids()
+        self.dbm.commit()
+        steps = self._get_steps()
+        # Files are removed before the rows that are needed to find them
+        for table, where, delete_children in steps[:-2]:
+            self._delete_batches(table, where, delete_children)
+        self._delete_files()
+        for table, where, delete_children in steps[-2:]:
+            self._delete_batches(table, where, delete_children)
+        pipe = model.Pipe.__table__
+        self._execute(pipe.delete().where(pipe.c.idx==self.pipe_id))
+        self.dbm.commit()
+        pipe_model.topology_cache.invalidate(self.pipe_id)
+        self.deleted[pipe.name] = 1
+        return self.deleted
+
+def mark_deleted(dbm, pipe_id):
+    '''Mark a pipe as deleted, so that it is removed in background.
+
+    Returns:
+        bool: False if the pipe does not exist.
+    '''
+    pipe = model.Pipe.__table__
+    with dbm.session_scope() as session:
+        res = session.execute(pipe.update().where(pipe.c.idx==pipe_id)\
+            .values(state=state.Pipe.DELETED))
+    return res.rowcount > 0
+
+def delete_marked_pipes(dbm, logger_name=''):
+    '''Delete all pipes that are marked as deleted.
+
+    Deletions that were interrupted before are resumed.
+
+    Returns:
+        list of int: Ids of deleted pipes.
+    '''
+    logger = logging.getLogger('{}.{}'.format(logger_name, 'delete_marked_pipes'))
+    deleted = []
+    for pipe_id in dbm.get_pipe_ids_to_delete():
+
+        def progress(name, count, total, pipe_id=pipe_id):
+            logger.info('Pipe {}: deleted {}/{} rows of {}'.format(
+                pipe_id, count, total, name))
+
+        deleter = PipeDeleter(dbm, pipe_id, logger_name=logger_name,
+            progress=progress)
+        totals = deleter.count()
+        logger.info('Start deleting pipe {}: {} rows'.format(
+            pipe_id, sum(totals.values()) + 1))
+        deleter.delete()
+        logger.info('Deleted pipe {}'.format(pipe_id))
+        deleted.append(pipe_id)
+    return deleted
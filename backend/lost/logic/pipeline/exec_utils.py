@@ -1,7 +1,26 @@
 import os
+import io
+import sys
+import shutil
 import hashlib
 import importlib
+import threading
 import zipfile
+from contextlib import contextmanager
+
+# Folder in the local directory of a dask worker where pipe projects
+# are unpacked
+PACKAGE_DIR = 'lost_pipe_projects'
+# Number of older versions of a project that are kept on a worker for
+# scripts that were submitted before a new version was shipped
+KEEP_VERSIONS = 2
+# Format of version timestamps. Sorted as numbers, versions are in
+# chronological order.
+VERSION_FORMAT = '%Y%m%d%H%M%S'
+
+# Number of running scripts per unpacked project version
+_running = dict()
+_running_lock = threading.Lock()
     
 def zipdir(path, out_path, timestamp=None):
     # zipf is zipfile handle
@@ -30,28 +49,179 @@ def zipdir(path, out_path, timestamp=None):
 #                         cont += f.read()
 #     return cont
 
-def get_module_hash(path, ignore=['__pycache__']):
-    # zipf is zipfile handle
+def _file_digest(path, block_size=1024*1024):
     sha = hashlib.sha256()
-    for root, dirs, files in os.walk(path):
-        for file in files:
-            for i in ignore:
-                src = os.path.join(root, file)
-                if i not in src:
-                    with open(src, 'rb') as f:
-                        sha.update(f.read())
-                        # cont += f.read()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
     return sha.hexdigest()
 
+class HashIndex(object):
+    '''Digests of all files of a directory.
+
+    Files are only read again if their mtime or size changed since the
+    last update.
+    '''
+
+    def __init__(self):
+        self.files = dict()
+        self.lock = threading.Lock()
+        self.hashed = 0
+
+    def update(self, path, ignore=['__pycache__']):
+        '''Update the index.
+
+        Args:
+            path (str): Directory to index.
+            ignore (list of str): Files whose path contains one of these
+                strings are skipped.
+
+        Returns:
+            dict: Relative file path -> sha256 digest.
+        '''
+        with self.lock:
+            files = dict()
+            self.hashed = 0
+            for root, dirs, file_names in os.walk(path):
+                for file in file_names:
+                    src = os.path.join(root, file)
+                    if any(i in src for i in ignore):
+                        continue
+                    rel = os.path.relpath(src, path)
+                    st = os.stat(src)
+                    entry = self.files.get(rel)
+                    if entry is not None and entry[0] == st.st_mtime_ns \
+                        and entry[1] == st.st_size:
+                        files[rel] = entry
+                    else:
+                        files[rel] = (st.st_mtime_ns, st.st_size, _file_digest(src))
+                        self.hashed += 1
+            self.files = files
+            return {rel: entry[2] for rel, entry in files.items()}
+
+def get_tree_hash(digests):
+    '''Get one hash for the result of :meth:`HashIndex.update`.'''
+    sha = hashlib.sha256()
+    for rel in sorted(digests):
+        sha.update('{}\0{}\n'.format(rel, digests[rel]).encode('utf-8'))
+    return sha.hexdigest()
+
+_hash_indexes = dict()
+_hash_indexes_lock = threading.Lock()
+
+def get_hash_index(path):
+    '''Get the process wide :class:`HashIndex` of a directory.'''
+    path = os.path.abspath(path)
+    with _hash_indexes_lock:
+        if path not in _hash_indexes:
+            _hash_indexes[path] = HashIndex()
+        return _hash_indexes[path]
+
+def get_module_hash(path, ignore=['__pycache__']):
+    return get_tree_hash(get_hash_index(path).update(path, ignore))
+
+def zip_files(path, rel_paths):
+    '''Zip files of a directory in memory.
+
+    Returns:
+        bytes: Zip with the files stored at their relative paths.
+    '''
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        for rel in rel_paths:
+            zipf.write(os.path.join(path, rel), rel)
+    return buf.getvalue()
+
+def _get_package_root(dask_worker):
+    root = os.path.join(dask_worker.local_directory, PACKAGE_DIR)
+    os.makedirs(root, exist_ok=True)
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    return root
+
+def has_package(dir_name, dask_worker=None):
+    '''Check if a pipe project version is unpacked on a dask worker.'''
+    return os.path.isdir(os.path.join(_get_package_root(dask_worker), dir_name))
+
+@contextmanager
+def _use_package(dir_name):
+    '''Mark a project version as used by a running script.'''
+    with _running_lock:
+        _running[dir_name] = _running.get(dir_name, 0) + 1
+    try:
+        yield
+    finally:
+        with _running_lock:
+            _running[dir_name] -= 1
+            if _running[dir_name] == 0:
+                del _running[dir_name]
+
+def apply_package(data, dir_name, base_dir_name=None, removed=[], 
+    project=None, keep=KEEP_VERSIONS, dask_worker=None):
+    '''Unpack a pipe project version on a dask worker.
+
+    Args:
+        data (bytes): Zip of :func:`zip_files`.
+        dir_name (str): Folder of the new version, i.e. its import name.
+        base_dir_name (str): If given, data only contains changed files and
+            all other files are linked from this version.
+        removed (list of str): Files of the base version that were removed.
+        project (str): Name of the project. Versions named
+            <project>_<timestamp> other than the new one and its base are
+            deleted, except the *keep* newest ones and versions of running
+            scripts.
+        keep (int): Number of older versions that are kept.
+        dask_worker: Set by dask.
+
+    Returns:
+        bool: False if the base version is not present on this worker.
+    '''
+    root = _get_package_root(dask_worker)
+    target = os.path.join(root, dir_name)
+    if not os.path.isdir(target):
+        tmp = target + '.tmp'
+        shutil.rmtree(tmp, ignore_errors=True)
+        if base_dir_name is not None:
+            base = os.path.join(root, base_dir_name)
+            if not os.path.isdir(base):
+                return False
+            shutil.copytree(base, tmp, copy_function=os.link)
+            for rel in removed:
+                os.remove(os.path.join(tmp, rel))
+        with zipfile.ZipFile(io.BytesIO(data)) as zipf:
+            for rel in zipf.namelist():
+                dst = os.path.join(tmp, rel)
+                # Never write through a link into the base version
+                if os.path.exists(dst):
+                    os.remove(dst)
+                zipf.extract(rel, tmp)
+        os.rename(tmp, target)
+        importlib.invalidate_caches()
+    if project is not None:
+        versions = []
+        for name in os.listdir(root):
+            version = name[len(project) + 1:]
+            if name.startswith(project + '_') and version.isdigit() \
+                and name not in (dir_name, base_dir_name):
+                versions.append((int(version), name))
+        old = [name for _, name in sorted(versions, reverse=True)][keep:]
+        with _running_lock:
+            for name in old:
+                if name not in _running:
+                    shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    return True
+
 def import_by_string(full_name):
     module_name, unit_name = full_name.rsplit('.', 1)
     mod = importlib.import_module(module_name)
     return getattr(mod, unit_name)
 
 def exec_dyn_class(idx, class_name):
-    my_class = import_by_string(class_name)
-    instance = my_class(idx)
-    return instance._run(ret_success=True)
+    # The project version is not removed while the script is running
+    with _use_package(class_name.split('.')[0]):
+        my_class = import_by_string(class_name)
+        instance = my_class(idx)
+        return instance._run(ret_success=True)
 
 def get_import_name_by_script(script_name, timestamp=None):
     mod_name = os.path.splitext(script_name)[0]
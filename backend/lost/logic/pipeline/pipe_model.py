@@ -1,8 +1,145 @@
 __author__ = 'Jonas Jaeger'
 from lost.db import model, access, state, dtype
 from datetime import datetime
+from collections import OrderedDict
+import threading
 import igraph
 
+def structure_version(pe_list):
+    '''Get a version that changes when the elements of a pipeline change.
+
+    Args:
+        pe_list (list): A list of pipeline elements of a pipeline.
+
+    Returns:
+        tuple: Sorted ids of all pipeline elements.
+    '''
+    return tuple(sorted(pe.idx for pe in pe_list))
+
+class PipeTopology(object):
+    '''Structure of a pipeline that does not depend on element states.
+
+    The topology stores only ids and vertex indices, no database objects,
+    so it can be reused for different db sessions.
+
+    Args:
+        pe_list (list): A list of pipeline elements that represent a pipeline.
+
+    Attributes:
+        pe_ids (list): Ids of pipeline elements in vertex order. The element
+            with pe_ids[i] is vertex i+1.
+        vertex_map (dict): pipe element id -> vertex index.
+        edges (list): List of (source, target) vertex indices.
+        prev (dict): vertex index -> list of previous vertex indices.
+        next (dict): vertex index -> list of next vertex indices.
+        topo_order (list): Vertex indices in topological order.
+    '''
+    def __init__(self, pe_list):
+        self.pe_ids = [pe.idx for pe in pe_list]
+        self.vertex_map = {pe_id: i+1 for i, pe_id in enumerate(self.pe_ids)}
+        self.vcount = len(pe_list) + 2
+        self.sink = self.vcount - 1
+        self.edges = list()
+        for pe in pe_list:
+            v_pe_n = self.vertex_map[pe.idx]
+            # Link PipeElements
+            for pe_out in pe.pe_outs:
+                self.edges.append((v_pe_n, self.vertex_map[pe_out.idx]))
+            # Check if pe should be linked to sink
+            if len(pe.pe_outs) == 0:
+                self.edges.append((v_pe_n, self.sink))
+        targets = set(t for _, t in self.edges)
+        for pe in pe_list:
+            #Check if pe should be linked to source
+            v_pe_n = self.vertex_map[pe.idx]
+            if v_pe_n not in targets:
+                self.edges.append((0, v_pe_n))
+        self.prev = {v: list() for v in range(self.vcount)}
+        self.next = {v: list() for v in range(self.vcount)}
+        for source, target in self.edges:
+            self.next[source].append(target)
+            self.prev[target].append(source)
+        self.topo_order = self.create_graph().topological_sorting()
+        self._loops = dict()
+        self._lock = threading.Lock()
+
+    def create_graph(self):
+        '''Create an igraph graph without vertex attributes.'''
+        graph = igraph.Graph(directed=True)
+        graph.add_vertices(self.vcount)
+        graph.add_edges(self.edges)
+        return graph
+
+    def get_loop_vertices(self, graph, v_jump, v_loop):
+        '''Get all vertices between v_jump and v_loop including both.
+
+        Args:
+            graph (Graph): A graph that was created from this topology.
+            v_jump (int): Vertex index where the loop starts.
+            v_loop (int): Vertex index of the loop element.
+
+        Returns:
+            list: Sorted vertex indices.
+        '''
+        key = (v_jump, v_loop)
+        with self._lock:
+            if key not in self._loops:
+                s = set(graph.subcomponent(v_jump, mode='out'))
+                t = set(graph.subcomponent(v_loop, mode='in'))
+                self._loops[key] = sorted(s.intersection(t))
+            return self._loops[key]
+
+class TopologyCache(object):
+    '''Process wide LRU cache for :class:`PipeTopology` objects.
+
+    Entries are keyed by pipe id and :func:`structure_version`.
+
+    Args:
+        max_size (int): Max number of cached topologies.
+    '''
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self.mem = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, pipe_id, pe_list):
+        '''Get topology for a pipe. Create it if not cached.
+
+        Args:
+            pipe_id (int): Id of the pipe.
+            pe_list (list): All pipeline elements of this pipe.
+
+        Returns:
+            :class:`PipeTopology`
+        '''
+        key = (pipe_id, structure_version(pe_list))
+        with self.lock:
+            if key in self.mem:
+                self.mem.move_to_end(key)
+                return self.mem[key]
+        topology = PipeTopology(pe_list)
+        with self.lock:
+            self.mem[key] = topology
+            while len(self.mem) > self.max_size:
+                self.mem.popitem(last=False)
+        return topology
+
+    def invalidate(self, pipe_id=None):
+        '''Remove cached topologies.
+
+        Args:
+            pipe_id (int): Remove entries of this pipe. If None, clear
+                the whole cache.
+        '''
+        with self.lock:
+            if pipe_id is None:
+                self.mem.clear()
+            else:
+                for key in [k for k in self.mem if k[0] == pipe_id]:
+                    self.mem.pop(key)
+
+topology_cache = TopologyCache()
+
 class PipeEngine(object):
     '''A PipeEngine object maps to one pipeline in the portal an manages it.
 
@@ -12,46 +149,46 @@ class PipeEngine(object):
         self.dbm = dbm
         self.pipe = pipe#dbm.get_task(task_id)
         self.pipe_elements = dbm.get_pipe_elements(pipe.idx)
-        self.pe_graph = self.create_pe_graph(self.pipe_elements)
+        self.topology = topology_cache.get(pipe.idx, self.pipe_elements)
+        self.pe_graph = self.create_pe_graph(self.pipe_elements, self.topology)
 
-    def create_pe_graph(self, pe_list):
+    def create_pe_graph(self, pe_list, topology=None):
         '''Create a graph for a pipeline.
 
         Args:
             pe_list (list): A list of pipeline elements that represent a pipeline.
+            topology (PipeTopology): Cached structure of the pipeline. If
+                None, the structure will be computed from pe_list.
 
         Returns:
             Graph: A graph of :class:`lost.db.model.PipeElement` objects.
                 pe_graph.vs[0] is source and pe_graph.vs[pe_graph.vcount()-1]
                 is sink.
         '''
-        pe_graph = igraph.Graph(directed=True)
-        pe_graph.add_vertices(len(pe_list)+2)
-        new_vs = pe_graph.vs.select(range(1,len(pe_list)+1))
-        new_vs["pe"] = pe_list
-        new_vs["visited"] = False
-        sink = pe_graph.vs[pe_graph.vcount()-1]
-        sink["visited"] = False
+        if topology is None:
+            topology = PipeTopology(pe_list)
+        pe_map = {pe.idx: pe for pe in pe_list}
+        ordered_pes = [pe_map[pe_id] for pe_id in topology.pe_ids]
+        pe_graph = topology.create_graph()
+        new_vs = pe_graph.vs.select(range(1,len(ordered_pes)+1))
+        new_vs["pe"] = ordered_pes
+        new_vs["visited"] = [pe.state == state.PipeElement.FINISHED for pe in ordered_pes]
+        pe_graph.vs[topology.sink]["visited"] = False
         pe_graph.vs[0]["visited"] = True
-        for pe in pe_list:
-            v_pe_n = pe_graph.vs.select(pe_eq=pe)[0]
-            if pe.state == state.PipeElement.FINISHED:
-                v_pe_n["visited"] = True
-            # Link PipeElements
-            for pe_out in pe.pe_outs:
-                v_pe_out = pe_graph.vs.select(pe_eq=pe_out)[0]
-                pe_graph.add_edge(v_pe_n.index, v_pe_out.index)
-            # Check if pe should be linked to sink
-            if len(pe.pe_outs) == 0:
-                pe_graph.add_edge(v_pe_n.index, sink.index)
-        for pe in pe_list:
-            #Check if pe should be linked to source
-            v_pe_n = pe_graph.vs.select(pe_eq=pe)[0]
-            target = pe_graph.es.select(_target=v_pe_n.index)
-            if len(target) == 0:
-                pe_graph.add_edge(0, v_pe_n.index)
         return pe_graph
 
+    def _vertex(self, pe):
+        return self.topology.vertex_map[pe.idx]
+
+    def get_topological_order(self):
+        '''Get all pipeline elements in topological order.
+
+        Returns:
+            list: A list of :class:`lost.db.model.PipeElement` objects.
+        '''
+        return [self.pe_graph.vs[v]["pe"] for v in self.topology.topo_order\
+            if v != 0 and v != self.topology.sink]
+
     def get_all_loop_elements(self):
         '''Get all loop elements in pipeline.
 
@@ -95,11 +232,8 @@ class PipeEngine(object):
         #return self.pe_graph.vs[vset]['pe']
         
         #Get all vs between v_jump and v_loop including v_jump and v_loop.
-        v_jump = self.pe_graph.vs.select(pe_eq=pe_jump)[0]
-        v_loop = self.pe_graph.vs.select(pe_eq=pe_loop)[0]
-        s = set(self.pe_graph.subcomponent(v_jump.index, mode='out'))
-        t = set(self.pe_graph.subcomponent(v_loop.index, mode='in'))
-        intersec = s.intersection(t)
+        intersec = self.topology.get_loop_vertices(self.pe_graph,
+            self._vertex(pe_jump), self._vertex(pe_loop))
         return self.pe_graph.vs[intersec]['pe']
 
     def get_next_loop(self, pe):
@@ -112,16 +246,16 @@ class PipeEngine(object):
             PipeElement or None: The next loop element in pipeline. When no
                 loop element can be found, None will be returned.
         '''
-        v_pe = self.pe_graph.vs.select(pe_eq=pe)[0]
+        v_pe = self._vertex(pe)
         min_path = None
         min_loop_e = None
         loop_e = None
         for loop_e in self.get_all_loop_elements():
-            v_loop = self.pe_graph.vs.select(pe_eq=loop_e)[0]
+            v_loop = self._vertex(loop_e)
             # TODO:We just need the distance in between two elements in the graph
             # to select the closest loop. I think there is a better method than
             # shortest path.
-            path_new = self.pe_graph.get_shortest_paths(v_pe.index, v_loop.index)[0]
+            path_new = self.pe_graph.get_shortest_paths(v_pe, v_loop)[0]
             if min_path is None:
                 min_path = path_new
                 min_loop_e = loop_e
@@ -147,8 +281,7 @@ class PipeEngine(object):
         Returns:
             list: A list of :class:`lost.db.model.PipeElement` objects.
         '''
-        v_pe = self.pe_graph.vs.select(pe_eq=pe)[0]
-        return self.get_prev_vertices(v_pe.index)["pe"]
+        return self.get_prev_vertices(self._vertex(pe))["pe"]
 
     def get_prev_vertices(self, vertex_id):
         '''Get previous vertices in pe_graph with respect to vertex_id.
@@ -159,11 +292,7 @@ class PipeEngine(object):
         Returns:
             VertexSeq: A sequence of previous vertices.
         '''
-        prev_v_list = list()
-        target = self.pe_graph.es.select(_target=vertex_id)
-        for edge in target:
-            prev_v_list.append(edge.source)
-        return self.pe_graph.vs[prev_v_list]
+        return self.pe_graph.vs[self.topology.prev[vertex_id]]
 
     def get_next_vertices(self, vertex_id):
         '''Get next vertices in pe_graph with respect to vertex_id.
@@ -174,11 +303,7 @@ class PipeEngine(object):
         Returns:
             VertexSeq: A sequence of next vertices.
         '''
-        prev_v_list = list()
-        source = self.pe_graph.es.select(_source=vertex_id)
-        for edge in source:
-            prev_v_list.append(edge.target)
-        return self.pe_graph.vs[prev_v_list]
+        return self.pe_graph.vs[self.topology.next[vertex_id]]
 
     def get_next_pes(self, pe):
         '''Get next :class:`lost.db.model.PipeElement` objects in the pipeline.
@@ -189,8 +314,7 @@ class PipeEngine(object):
         Returns:
             list: A list of :class:`lost.db.model.PipeElement` objects.
         '''
-        v_pe = self.pe_graph.vs.select(pe_eq=pe)[0]
-        return self.get_next_vertices(v_pe.index)["pe"]
+        return self.get_next_vertices(self._vertex(pe))["pe"]
 
     # def get_all_paths(self):
     #     '''Get all paths through the pipeline.
@@ -215,9 +339,7 @@ class PipeEngine(object):
         return self.get_prev_vertices(self.pe_graph.vcount()-1)["pe"]
 
     def set_visited(self, pe):
-        v_pe = self.pe_graph.vs.select(pe_eq=pe)[0]
-        v_pe["visited"] = True
+        self.pe_graph.vs[self._vertex(pe)]["visited"] = True
 
     def set_to_visit(self, pe):
-        v_pe = self.pe_graph.vs.select(pe_eq=pe)[0]
-        v_pe["visited"] = False
+        self.pe_graph.vs[self._vertex(pe)]["visited"] = False
@@ -0,0 +1,217 @@
+'''Event driven scheduling of pipelines.
+
+State transitions that allow a pipeline to make progress (an anno task was
+finished, a script was finished, a loop was released or a pipe was played)
+push a wake-up event for the affected pipe. The cron process waits for these
+events and processes only the pipes that were woken up. A slow periodic
+sweep over all pipes remains as safety net for lost events.
+'''
+import os
+import uuid
+import time
+import logging
+import threading
+from collections import OrderedDict
+from lost.logic.file_man import AppFileMan
+
+ANNO_TASK_FINISHED = 'anno_task_finished'
+SCRIPT_FINISHED = 'script_finished'
+LOOP_RELEASED = 'loop_released'
+PIPE_PLAYED = 'pipe_played'
+
+class LocalBackend(object):
+    '''In-process event queue.
+
+    Events are only visible inside the process that created the backend.
+    Multiple events for the same pipe are merged into one entry.
+    '''
+
+    def __init__(self):
+        self._events = OrderedDict()
+        self._cond = threading.Condition()
+
+    def push(self, pipe_id, reason):
+        with self._cond:
+            if pipe_id not in self._events:
+                self._events[pipe_id] = set()
+            self._events[pipe_id].add(reason)
+            self._cond.notify_all()
+
+    def pop_all(self, timeout=None):
+        '''Wait for events and remove them from the queue.
+
+        Args:
+            timeout (float): Max seconds to wait for an event. If None,
+                wait until an event arrives.
+
+        Returns:
+            OrderedDict: pipe_id -> set of reasons. Empty if timed out.
+        '''
+        with self._cond:
+            if not self._events:
+                self._cond.wait(timeout)
+            events = self._events
+            self._events = OrderedDict()
+            return events
+
+class FileBackend(object):
+    '''Event queue that is shared between processes via a spool directory.
+
+    Each event is stored as an empty file named
+    *p-<pipe_id>-<uuid>.<reason>* inside the spool directory. Files are
+    created under a temporary name and renamed afterwards, so that a reader
+    never sees half written events.
+    '''
+
+    def __init__(self, path, poll=0.5):
+        self.path = path
+        self.poll = poll
+        os.makedirs(self.path, exist_ok=True)
+
+    def push(self, pipe_id, reason):
+        name = 'p-{}-{}.{}'.format(pipe_id, uuid.uuid4().hex, reason)
+        tmp_path = os.path.join(self.path, '.{}'.format(name))
+        with open(tmp_path, 'w'):
+            pass
+        os.rename(tmp_path, os.path.join(self.path, name))
+
+    def _read_events(self):
+        events = OrderedDict()
+        for name in sorted(os.listdir(self.path)):
+            if not name.startswith('p-'):
+                continue
+            head, reason = os.path.splitext(name)
+            try:
+                pipe_id = int(head.split('-')[1])
+            except (IndexError, ValueError):
+                pipe_id = None
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                # Event was consumed by another reader
+                continue
+            if pipe_id is None:
+                continue
+            if pipe_id not in events:
+                events[pipe_id] = set()
+            events[pipe_id].add(reason[1:])
+        return events
+
+    def pop_all(self, timeout=None):
+        '''Wait for events and remove them from the spool directory.
+
+        Args:
+            timeout (float): Max seconds to wait for an event. If None,
+                wait until an event arrives.
+
+        Returns:
+            OrderedDict: pipe_id -> set of reasons. Empty if timed out.
+        '''
+        start = time.monotonic()
+        while True:
+            events = self._read_events()
+            if events:
+                return events
+            if timeout is not None:
+                remaining = timeout - (time.monotonic() - start)
+                if remaining <= 0:
+                    return events
+                time.sleep(min(self.poll, remaining))
+            else:
+                time.sleep(self.poll)
+
+class PipeScheduler(object):
+    '''Collects wake-up events for pipelines.
+
+    Args:
+        backend (object): A backend like :class:`LocalBackend` or
+            :class:`FileBackend`.
+        logger_name (str): Name of the parent logger.
+    '''
+
+    def __init__(self, backend, logger_name=''):
+        self.backend = backend
+        self.logger = logging.getLogger('{}.{}'.format(
+            logger_name, self.__class__.__name__)
+        )
+
+    def notify(self, pipe_id, reason):
+        '''Wake up a pipeline.
+
+        Note:
+            Errors are logged but never raised, since a lost event will be
+            handled by the safety net sweep.
+
+        Args:
+            pipe_id (int): Id of the pipe that should be processed.
+            reason (str): State transition that caused this event.
+        '''
+        try:
+            self.backend.push(pipe_id, reason)
+        except:
+            self.logger.exception('Could not notify pipe {}'.format(pipe_id))
+
+    def wait(self, timeout=None):
+        '''Wait for wake-up events.
+
+        Args:
+            timeout (float): Max seconds to wait.
+
+        Returns:
+            OrderedDict: pipe_id -> set of reasons. Empty if timed out.
+        '''
+        return self.backend.pop_all(timeout)
+
+def create_backend(lostconfig):
+    '''Create the event backend that is defined in lostconfig.
+
+    Args:
+        lostconfig (LOSTConfig): The LOST config.
+    '''
+    if lostconfig.pipe_event_backend == 'local':
+        return LocalBackend()
+    elif lostconfig.pipe_event_backend == 'file':
+        path = AppFileMan(lostconfig).get_pipe_event_path()
+        return FileBackend(path, lostconfig.pipe_event_poll)
+    else:
+        raise Exception('Unknown pipe event backend: {}'.format(
+            lostconfig.pipe_event_backend))
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler(lostconfig=None):
+    '''Get the process wide :class:`PipeScheduler`.
+
+    Args:
+        lostconfig (LOSTConfig): Used to create the scheduler on first call.
+    '''
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            if lostconfig is None:
+                from lostconfig import LOSTConfig
+                lostconfig = LOSTConfig()
+            _scheduler = PipeScheduler(create_backend(lostconfig))
+        return _scheduler
+
+def set_scheduler(scheduler):
+    '''Replace the process wide :class:`PipeScheduler`.'''
+    global _scheduler
+    with _scheduler_lock:
+        _scheduler = scheduler
+
+def notify(pipe_id, reason, lostconfig=None):
+    '''Push a wake-up event for a pipe to the process wide scheduler.
+
+    Args:
+        pipe_id (int): Id of the pipe that should be processed.
+        reason (str): State transition that caused this event.
+        lostconfig (LOSTConfig): Optional config.
+    '''
+    try:
+        scheduler = get_scheduler(lostconfig)
+    except:
+        logging.exception('Could not create pipe scheduler')
+        return
+    scheduler.notify(pipe_id, reason)
@@ -0,0 +1,321 @@
+'''Cached environments for extra packages of scripts.
+
+Scripts may request extra pip and conda packages. Instead of installing
+them on every execution, an environment is built once per package spec and
+reused by all following executions with the same spec. Environments are
+stored by the hash of their spec in the script env folder of LOST. Pip
+environments are virtualenvs with access to the packages of the LOST
+python, conda environments are clones of the LOST prefix.
+
+A file lock per spec makes sure that concurrent workers do not build the
+same environment twice. Processes that use an environment hold a shared
+lock on it. The least recently used environments are removed when more
+than the configured number of environments exist, but only if nobody
+uses them.
+'''
+import os
+import sys
+import json
+import glob
+import site
+import shutil
+import fcntl
+import hashlib
+import logging
+import subprocess
+from time import monotonic
+from contextlib import contextmanager
+from lost.logic.file_man import AppFileMan
+
+READY_FILE = '.lost_env_ready'
+
+# Arguments for the python of an environment that replace a program
+PROGRAMS = {
+    'python3': [],
+    'pudb3': ['-m', 'pudb']
+}
+
+logger = logging.getLogger('{}.{}'.format(__name__, 'script_env'))
+
+def _split(packages):
+    if packages is None:
+        return []
+    if isinstance(packages, str):
+        packages = packages.split()
+    return sorted(set(str(p) for p in packages))
+
+def get_spec(extra_packages, lostconfig):
+    '''Get the package spec of a script.
+
+    Args:
+        extra_packages (str): Json with *pip* and *conda* packages as
+            stored in :class:`model.Script`.
+        lostconfig (LOSTConfig): Packages of forbidden installers are
+            ignored.
+
+    Returns:
+        dict: Sorted lists of *pip* and *conda* packages.
+    '''
+    spec = {'pip': [], 'conda': []}
+    if not extra_packages:
+        return spec
+    extra = json.loads(extra_packages)
+    if lostconfig.allow_extra_pip:
+        spec['pip'] = _split(extra.get('pip'))
+    if lostconfig.allow_extra_conda:
+        spec['conda'] = _split(extra.get('conda'))
+    return spec
+
+def is_empty(spec):
+    return len(spec['pip']) == 0 and len(spec['conda']) == 0
+
+def spec_hash(spec):
+    '''Get the hash of a package spec.
+
+    The interpreter the environment is based on is part of the hash.
+    '''
+    data = json.dumps({'pip': spec['pip'], 'conda': spec['conda'],
+        'prefix': sys.prefix, 'version': list(sys.version_info[:2])},
+        sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:16]
+
+def get_python(env_path):
+    return os.path.join(env_path, 'bin', 'python')
+
+def get_program(env_path, program):
+    '''Get a command that runs a program with the python of an environment.
+
+    Args:
+        env_path (str): Path of the environment.
+        program (str): *python3* or *pudb3*.
+
+    Returns:
+        str: Command line.
+    '''
+    return ' '.join([get_python(env_path)] + PROGRAMS[program])
+
+def get_site_packages(env_path):
+    return glob.glob(os.path.join(env_path, 'lib', 'python*', 'site-packages'))
+
+class EnvCache(object):
+    '''Build and reuse environments for package specs.
+
+    Args:
+        root (str): Folder where environments are stored.
+        max_envs (int): Max number of environments that are kept.
+        wheel_dir (str): Folder with wheels. If it exists, pip installs
+            from this folder.
+        index_url (str): Url of a package index mirror for pip. If a
+            wheel_dir is given too, both are used.
+    '''
+
+    def __init__(self, root, max_envs=10, wheel_dir=None, index_url=None):
+        self.root = root
+        self.max_envs = max_envs
+        self.wheel_dir = wheel_dir
+        self.index_url = index_url
+
+    def get_path(self, env_hash):
+        return os.path.join(self.root, env_hash)
+
+    def is_ready(self, env_hash):
+        return os.path.exists(os.path.join(self.get_path(env_hash), READY_FILE))
+
+    def _touch(self, env_hash):
+        '''Mark an environment as recently used.
+
+        Returns:
+            bool: False if the environment was removed in between.
+        '''
+        try:
+            os.utime(os.path.join(self.get_path(env_hash), READY_FILE))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _open_lock(self, env_hash):
+        os.makedirs(self.root, exist_ok=True)
+        return open(self.get_path(env_hash) + '.lock', 'w')
+
+    @contextmanager
+    def _lock(self, env_hash, blocking=True):
+        '''Lock an environment exclusively across processes.
+
+        Yields:
+            bool: True if the lock was acquired.
+        '''
+        with self._open_lock(env_hash) as f:
+            flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            try:
+                fcntl.flock(f, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def acquire(self, spec):
+        '''Get the environment of a package spec, build it if required and
+        protect it from removal.
+
+        Args:
+            spec (dict): See :func:`get_spec`.
+
+        Returns:
+            file: Open lock file that holds a shared lock on the
+            environment. The environment may be removed after it was
+            closed.
+        '''
+        env_hash = spec_hash(spec)
+        while True:
+            if not self.is_ready(env_hash):
+                with self._lock(env_hash):
+                    if not self.is_ready(env_hash):
+                        self._build(spec, self.get_path(env_hash))
+                self.cleanup(keep=env_hash)
+            f = self._open_lock(env_hash)
+            fcntl.flock(f, fcntl.LOCK_SH)
+            # A missing ready file means the environment was removed
+            # before the shared lock was acquired, so build it again.
+            if self._touch(env_hash):
+                return f
+            f.close()
+
+    @contextmanager
+    def use_env(self, spec):
+        '''Use the environment of a package spec.
+
+        Yields:
+            str: Path of the environment or None if spec is empty.
+        '''
+        if is_empty(spec):
+            yield None
+            return
+        with self.acquire(spec):
+            yield self.get_path(spec_hash(spec))
+
+    def get_env(self, spec):
+        '''Get the environment of a package spec and build it if required.
+
+        Note:
+            The environment is not protected from removal, see
+            :meth:`use_env`.
+
+        Args:
+            spec (dict): See :func:`get_spec`.
+
+        Returns:
+            str: Path of the environment.
+        '''
+        self.acquire(spec).close()
+        return self.get_path(spec_hash(spec))
+
+    def _pip_source_args(self):
+        args = []
+        if self.wheel_dir is not None and os.path.isdir(self.wheel_dir):
+            args += ['--find-links', self.wheel_dir]
+            if self.index_url is None:
+                args.append('--no-index')
+        if self.index_url is not None:
+            args += ['--index-url', self.index_url]
+        return args
+
+    def _run(self, cmd):
+        logger.info('Run: {}'.format(' '.join(cmd)))
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+    def _build(self, spec, env_path):
+        start = monotonic()
+        # Remains of a failed build
+        shutil.rmtree(env_path, ignore_errors=True)
+        try:
+            if spec['conda']:
+                self._run(['conda', 'create', '-y', '-q', '-p', env_path,
+                    '--clone', sys.prefix])
+                self._run(['conda', 'install', '-y', '-q', '-p', env_path]
+                    + spec['conda'])
+            else:
+                self._run([sys.executable, '-m', 'venv',
+                    '--system-site-packages', env_path])
+            if spec['pip']:
+                self._run([get_python(env_path), '-m', 'pip', 'install', '-q']
+                    + self._pip_source_args() + spec['pip'])
+        except subprocess.CalledProcessError as e:
+            shutil.rmtree(env_path, ignore_errors=True)
+            raise Exception('Could not build environment for {}:\n{}'.format(
+                spec, e.output.decode('utf-8', errors='replace')))
+        except:
+            shutil.rmtree(env_path, ignore_errors=True)
+            raise
+        open(os.path.join(env_path, READY_FILE), 'w').close()
+        logger.info('Built environment {} for {} in {:.1f}s'.format(env_path,
+            spec, monotonic() - start))
+
+    def list_envs(self):
+        '''Get hashes of all ready environments, most recently used first.'''
+        if not os.path.isdir(self.root):
+            return []
+        envs = []
+        for name in os.listdir(self.root):
+            ready = os.path.join(self.root, name, READY_FILE)
+            try:
+                envs.append((os.path.getmtime(ready), name))
+            except OSError:
+                continue
+        return [name for _, name in sorted(envs, reverse=True)]
+
+    def cleanup(self, keep=None):
+        '''Remove least recently used environments above max_envs.
+
+        Environments that are locked by a build or in use are skipped.
+
+        Args:
+            keep (str): Hash of an environment that is never removed.
+        '''
+        envs = [env_hash for env_hash in self.list_envs() if env_hash != keep]
+        n_keep = self.max_envs - 1 if keep is not None else self.max_envs
+        for env_hash in envs[max(n_keep, 0):]:
+            with self._lock(env_hash, blocking=False) as locked:
+                if not locked:
+                    continue
+                env_path = self.get_path(env_hash)
+                os.remove(os.path.join(env_path, READY_FILE))
+                shutil.rmtree(env_path, ignore_errors=True)
+                logger.info('Removed environment {}'.format(env_path))
+
+def create_env_cache(lostconfig):
+    '''Create an :class:`EnvCache` as defined in lostconfig.'''
+    return EnvCache(AppFileMan(lostconfig).get_script_env_path(),
+        lostconfig.script_env_cache_size, lostconfig.script_env_wheel_dir,
+        lostconfig.script_env_index_url)
+
+# Lock files of environments that were activated in this process
+_active = dict()
+
+def activate(env_cache, spec):
+    '''Make the packages of an environment importable in this process.
+
+    Used for dask workers that can not switch their interpreter. The
+    environment is kept from removal as long as this process lives.
+
+    Args:
+        env_cache (EnvCache): Cache the environment is taken from.
+        spec (dict): See :func:`get_spec`.
+
+    Returns:
+        str: Path of the environment.
+    '''
+    env_path = env_cache.get_path(spec_hash(spec))
+    if env_path not in _active:
+        _active[env_path] = env_cache.acquire(spec)
+    for sp in get_site_packages(env_path):
+        if sp in sys.path:
+            continue
+        old_path = list(sys.path)
+        site.addsitedir(sp)
+        # Packages of the environment shadow packages of the worker
+        new = [p for p in sys.path if p not in old_path]
+        sys.path[:] = new + old_path
+    return env_path
@@ -2,8 +2,11 @@ import json
 import os
 from datetime import datetime
 from lost.db import model, access, state, dtype
-from lost.logic.template import combine_arguments
+from lost.logic.template import combine_arguments, template_meta_cache
 from lost.logic import file_man
+from lost.logic.pipeline import scheduler
+from lost.logic.pipeline import pipe_model
+from lost.logic.pipeline import deleter
 from lost.utils.dump import dump
 import flask
 
@@ -15,70 +18,86 @@ __author__ = "Gereon Reus"
 
 
 def start(db_man, data, manager_id, group_id):
-    # data = json.loads(data)
-    # load template
-    template = db_man.get_pipe_template(data['templateId'])
-    # initialize pipe starter
-    pipe_starter = PipeStarter(template, data, manager_id, group_id)
-    # create general pipe and fill with info
-    db_man.save_obj(pipe_starter.create_pipe())
-    # create raw pipe elements and map the ids in pipe_starter.pe_map
-    create_pe_raw_element(db_man, pipe_starter)
-    # and certain elements
-    patch_pe(db_man, pipe_starter)
-    db_man.save_obj(pipe_starter.unlock_pipe())
-    return pipe_starter.pipe.idx
-    
-def create_pe_raw_element(db_man, pipe_starter):
-    for pe in pipe_starter.template_content['elements']:
-        pipe_element = pipe_starter.create_pe_raw_element(pe['peN'])
-        db_man.save_obj(pipe_element)
-        pipe_starter.save_to_pe_map(pe['peN'], pipe_element)
-
-def patch_pe(db_man, pipe_starter):
-    for pe in pipe_starter.template_content['elements']:
-        pe_n = pe['peN']
-        if 'datasource' in pe:
-            db_man.save_obj(pipe_starter.patch_pe_datasource(pe_n))
-            db_man.save_obj(pipe_starter.create_datasource(pe_n))
-            handle_result_links(db_man, pipe_starter, pe_n)
-        elif 'script' in pe:
-            script = db_man.get_script(name=pe['script']['name'])
-            db_man.save_obj(pipe_starter.patch_pe_script(pe_n, script))
-            handle_results(db_man, pipe_starter, pe_n)
-        elif 'annoTask' in pe:
-            db_man.save_obj(pipe_starter.patch_pe_anno_task(pe_n))
-            anno_task = pipe_starter.create_anno_task(pe_n)
-            db_man.save_obj(anno_task)
-            for req_label_leaf in pipe_starter.create_required_label_leaves(pe_n, anno_task.idx):
-                db_man.add(req_label_leaf)
-            db_man.commit()
-            handle_multiple_result_links(db_man, pipe_starter, pe_n)
-        elif 'dataExport' in pe:
-            db_man.save_obj(pipe_starter.patch_pe_data_export(pe_n))
-            handle_multiple_result_links(db_man, pipe_starter, pe_n)
-        elif 'visualOutput' in pe:
-            db_man.save_obj(pipe_starter.patch_pe_visual_output(pe_n))
-            handle_multiple_result_links(db_man, pipe_starter, pe_n)
-        elif 'loop' in pe:
-            db_man.save_obj(pipe_starter.patch_pe_loop(pe_n))
-            db_man.save_obj(pipe_starter.create_loop(pe_n))
-            handle_multiple_result_links(db_man, pipe_starter, pe_n)
-def handle_results(db_man, pipe_starter, pe_n):
-    for result in pipe_starter.create_results(pe_n):
-        db_man.save_obj(result)
-        handle_result_links(db_man, pipe_starter, pe_n, result.idx)
-def handle_result_links(db_man, pipe_starter, pe_n, result_id=None):
-    for result_link in pipe_starter.create_result_links(pe_n, result_id):
-                db_man.add(result_link)
-    db_man.commit()
-def handle_multiple_result_links(db_man, pipe_starter, pe_n):
-    pe_id = pipe_starter.get_pe_id(pe_n)
-    existing_result_links = db_man.get_resultlinks_pe_out(pe_id)
-    for result_link in existing_result_links:
-        handle_result_links(db_man, pipe_starter, pe_n, result_link.result_id)
+    '''Start a pipe from a template.
+
+    Args:
+        db_man: Database manager.
+        data (dict): Start definition with templateId, name, description
+            and elements.
+        manager_id (int): Id of the user that starts the pipe.
+        group_id (int): Group that owns the pipe.
+
+    Returns:
+        int: Id of the new pipe.
+    '''
+    return start_many(db_man, [data], manager_id, group_id)[0]
+
+def start_many(db_man, data_list, manager_id, group_id):
+    '''Start multiple pipes in one transaction.
+
+    Ids are allocated by flushing one level of the pipe structure for all
+    pipes at once (pipes, pipe elements, anno tasks and results). Required
+    label leaves and result links are inserted in batches. If anything
+    fails, no pipe is created.
+
+    Args:
+        db_man: Database manager.
+        data_list (list of dict): One start definition per pipe, see
+            :func:`start`. Definitions may share the same template.
+        manager_id (int): Id of the user that starts the pipes.
+        group_id (int): Group that owns the pipes.
+
+    Returns:
+        list of int: Ids of the new pipes in order of *data_list*.
+    '''
+    session = db_man.session
+    templates = dict()
+    scripts = dict()
+    starters = list()
+    try:
+        for data in data_list:
+            template_id = data['templateId']
+            if template_id not in templates:
+                templates[template_id] = db_man.get_pipe_template(template_id)
+                if templates[template_id] is None:
+                    raise Exception('Unknown pipe template: {}'.format(template_id))
+            starters.append(PipeStarter(templates[template_id], data,
+                manager_id, group_id))
+        for pipe_starter in starters:
+            session.add(pipe_starter.create_pipe())
+        session.flush()
+        for pipe_starter in starters:
+            pipe_starter.create_pe_raw_elements(session)
+        session.flush()
+        for pipe_starter in starters:
+            pipe_starter.patch_elements(session, db_man, scripts)
+        session.flush()
+        label_leaf_rows = list()
+        result_link_rows = list()
+        for pipe_starter in starters:
+            label_leaf_rows += pipe_starter.get_required_label_leaf_rows()
+            result_link_rows += pipe_starter.get_result_link_rows()
+        if label_leaf_rows:
+            session.execute(model.RequiredLabelLeaf.__table__.insert(),
+                label_leaf_rows)
+        if result_link_rows:
+            session.execute(model.ResultLink.__table__.insert(),
+                result_link_rows)
+        db_man.commit()
+    except:
+        session.rollback()
+        raise
+    pipe_ids = [pipe_starter.pipe.idx for pipe_starter in starters]
+    for pipe_id in pipe_ids:
+        pipe_model.topology_cache.invalidate(pipe_id)
+        scheduler.notify(pipe_id, scheduler.PIPE_PLAYED, db_man.lostconfig)
+    return pipe_ids
 
 class PipeStarter(object):
+    '''Creates all database objects of a pipe from a template.
+
+    Objects are only added to the session, see :func:`start_many`.
+    '''
     def __init__(self, template, data, manager_id, group_id):
         self.pipe = model.Pipe()
         self.data_map = dict()
@@ -90,6 +109,9 @@ class PipeStarter(object):
         self.group_id = group_id
         self.timestamp_now = datetime.now()
         self.template_content = json.loads(template.json_template)
+        # (anno_task, pe_n) and result links that are inserted in batches
+        self.anno_tasks = list()
+        self.result_links = list()
         for element in self.template_content['elements']:
             self.template_map[element['peN']] = element
         for element in self.data['elements']:
@@ -99,10 +121,12 @@ class PipeStarter(object):
             is_debug_mode = self.data['isDebug']
         except KeyError:
             is_debug_mode = False
+        # The pipe is created in one transaction with all its elements,
+        # so cron will never see it unfinished and it needs no lock.
         pipe = model.Pipe(name=self.data['name'],
                         pipe_template_id=self.template.idx,
                         state=state.Pipe.PENDING,
-                        is_locked=True,
+                        is_locked=False,
                         description=self.data['description'],
                         manager_id=self.manager_id,
                         is_debug_mode=is_debug_mode,
@@ -119,10 +143,55 @@ class PipeStarter(object):
                                         is_debug_mode=False)
         return pipe_element
 
+    def create_pe_raw_elements(self, session):
+        '''Add one raw pipe element per template element to session.'''
+        for pe in self.template_content['elements']:
+            pipe_element = self.create_pe_raw_element(pe['peN'])
+            session.add(pipe_element)
+            self.save_to_pe_map(pe['peN'], pipe_element)
+
     def save_to_pe_map(self, pe_n, pipe_element):
 
         self.pe_map[pe_n] = pipe_element
     
+    def patch_elements(self, session, db_man, scripts):
+        '''Patch raw pipe elements and add their specific objects to session.
+
+        Args:
+            session: Database session.
+            db_man: Database manager.
+            scripts (dict): Scripts by name, shared between starters.
+        '''
+        for pe in self.template_content['elements']:
+            pe_n = pe['peN']
+            if 'datasource' in pe:
+                self.patch_pe_datasource(pe_n)
+                session.add(self.create_datasource(pe_n))
+                self.add_result_links(pe_n)
+            elif 'script' in pe:
+                name = pe['script']['name']
+                if name not in scripts:
+                    scripts[name] = db_man.get_script(name=name)
+                self.patch_pe_script(pe_n, scripts[name])
+                for result in self.create_results(pe_n):
+                    session.add(result)
+                    self.add_result_links(pe_n, result)
+            elif 'annoTask' in pe:
+                self.patch_pe_anno_task(pe_n)
+                anno_task = self.create_anno_task(pe_n)
+                session.add(anno_task)
+                self.anno_tasks.append((anno_task, pe_n))
+                self.add_multiple_result_links(pe_n)
+            elif 'dataExport' in pe:
+                self.patch_pe_data_export(pe_n)
+                self.add_multiple_result_links(pe_n)
+            elif 'visualOutput' in pe:
+                self.patch_pe_visual_output(pe_n)
+                self.add_multiple_result_links(pe_n)
+            elif 'loop' in pe:
+                self.patch_pe_loop(pe_n)
+                session.add(self.create_loop(pe_n))
+                self.add_multiple_result_links(pe_n)
 
     def patch_pe_datasource(self, pe_n):
         pipe_element = self.pe_map.get(pe_n)
@@ -200,17 +269,19 @@ class PipeStarter(object):
         anno_task.state = state.AnnoTask.PENDING
         return anno_task
     def create_required_label_leaves(self, pe_n, anno_task_id):
-        template_element = self.template_map.get(pe_n)
         data_element = self.data_map.get(pe_n)
-        pe_id = self.pe_map.get(pe_n).idx
         required_label_leaves = list()
         for label_leaf in data_element['annoTask']['labelLeaves']:
-            required_label_leaf = model.RequiredLabelLeaf()
-            required_label_leaf.anno_task_id = anno_task_id
-            required_label_leaf.label_leaf_id = label_leaf['id']
-            required_label_leaf.max_labels = label_leaf['maxLabels']
-            required_label_leaves.append(required_label_leaf)
+            required_label_leaves.append({'anno_task_id': anno_task_id,
+                'label_leaf_id': label_leaf['id'],
+                'max_labels': label_leaf['maxLabels']})
         return required_label_leaves
+    def get_required_label_leaf_rows(self):
+        '''Get rows of required label leaves for all flushed anno tasks.'''
+        rows = list()
+        for anno_task, pe_n in self.anno_tasks:
+            rows += self.create_required_label_leaves(pe_n, anno_task.idx)
+        return rows
     def create_loop(self, pe_n):
         template_element = self.template_map.get(pe_n)
         data_element = self.data_map.get(pe_n)
@@ -232,22 +303,41 @@ class PipeStarter(object):
                 result = model.Result(timestamp=self.timestamp_now)
                 results.append(result)
         return results
-    def create_result_links(self, pe_n, result_id=None):
+    def add_result_links(self, pe_n, result=None):
+        '''Remember result links of an element to all its outputs.
+
+        Args:
+            pe_n (int): Template element number.
+            result (:class:`model.Result`): Result of the links. Its id may
+                not be allocated yet.
+        '''
         pe_outs = self.template_map.get(pe_n)['peOut']
-        result_links = list()
+        pe_id = self.get_pe_id(pe_n)
         if pe_outs:
             for pe_out in pe_outs:
-                result_link = model.ResultLink(result_id=result_id,
-                                            pe_n=self.pe_map.get(pe_n).idx,
-                                            pe_out=self.pe_map.get(pe_out).idx)
-                result_links.append(result_link)
+                self.result_links.append({'result': result, 'pe_n': pe_id,
+                    'pe_out': self.get_pe_id(pe_out)})
         # if last element in pipeline - create one last 
         # result link without pe_out
         else: 
-            result_link = model.ResultLink(result_id=None,
-                                        pe_n=self.pe_map.get(pe_n).idx)
-            result_links.append(result_link)
-        return result_links
+            self.result_links.append({'result': None, 'pe_n': pe_id,
+                'pe_out': None})
+    def add_multiple_result_links(self, pe_n):
+        '''Pass results of all links into an element to its outputs.'''
+        pe_id = self.get_pe_id(pe_n)
+        incoming = [link for link in self.result_links if link['pe_out'] == pe_id]
+        for link in incoming:
+            self.add_result_links(pe_n, link['result'])
+    def get_result_link_rows(self):
+        '''Get rows of all result links, after results were flushed.'''
+        rows = list()
+        for link in self.result_links:
+            result_id = None
+            if link['result'] is not None:
+                result_id = link['result'].idx
+            rows.append({'result_id': result_id, 'pe_n': link['pe_n'],
+                'pe_out': link['pe_out']})
+        return rows
     def unlock_pipe(self):
         self.pipe.is_locked = False
         return self.pipe
@@ -270,48 +360,48 @@ def get_pipelines(db_man, group_ids, debug_mode=False):
     '''
     
     # dump(group_ids, "--- printing group_ids ---")
-    pipes = db_man.get_pipes(group_ids)
-    result = __serialize_pipes(db_man, debug_mode, pipes)
-    return result
+    pipes = db_man.get_pipe_list(group_ids, debug_mode)
+    progress = db_man.get_pipe_progress(group_ids)
+    templates = template_meta_cache.get_many(db_man,
+        [pipe.pipe_template_id for pipe in pipes])
+    return __serialize_pipes(pipes, progress, templates)
 ############################ get_completed_pipes ##################
 #                                                                 #
 ###################################################################
-def __serialize_pipes(db_man, debug_mode, pipes):
+def __serialize_pipes(pipes, progress, templates):
+    '''Serialize pipes for the pipeline list.
+
+    Args:
+        pipes (list): Rows of :meth:`DBMan.get_pipe_list`.
+        progress (dict): Result of :meth:`DBMan.get_pipe_progress`.
+        templates (dict): Template meta data by template id.
+    '''
     pipes_json = dict()
     pipes_json["pipes"] = list()
     for pipe in pipes:
-        # filter pipes with debug mode
-        if debug_mode:
-            if not pipe.is_debug_mode:
-                continue
-        else:
-            if pipe.is_debug_mode:
-                continue
-        progress = calculate_progress(db_man, pipe.idx)
+        finished, total = progress.get(pipe.idx, (0, 0))
+        pipe_progress = format_progress(finished, total)
         creator_name = "Unknown"
         if pipe.manager_id:
-            creator_name = pipe.group.name 
+            creator_name = pipe.group_name
         if pipe.state == state.Pipe.ERROR:
-            progress = "ERROR"
+            pipe_progress = "ERROR"
         if pipe.state == state.Pipe.PAUSED:
-            progress = "PAUSED"
+            pipe_progress = "PAUSED"
+        template = templates.get(pipe.pipe_template_id, {})
         pipe_json = {'id': pipe.idx,
                      'name': pipe.name,
                      'description': pipe.description,
                      'date': pipe.timestamp.strftime("%b %d %Y %H:%M:%S"),
-                     'progress': progress,
+                     'progress': pipe_progress,
                      'creatorName': creator_name,
                      'isDebug': pipe.is_debug_mode,
                      'logfilePath': pipe.logfile_path,
-                     'templateName': __get_template_name(db_man, pipe.pipe_template_id)
+                     'templateName': template.get('name')
                      }
         pipes_json['pipes'].append(pipe_json)
     return pipes_json
 
-def __get_template_name(db_man, template_id):
-    template = db_man.get_pipe_template(template_id)
-    return json.loads(template.json_template)['name']
-
 ############################ get_running_pipe #####################
 #                                                                 #
 ###################################################################
@@ -599,117 +689,34 @@ def get_completed_pipe(db_man, pipe_id, media_url):
 #                                                                 #
 ###################################################################
 def delete(db_man, pipe_id):
+    '''Delete a pipe with all its elements right away.
+
+    Note:
+        Web requests should use :func:`mark_deleted` instead, so that
+        large pipes are removed in background by the cron jobs.
+    '''
     pipe_godfather = PipeGodfather(db_man, pipe_id)
     pipe_godfather.delete()
     return True
+
+def mark_deleted(db_man, pipe_id):
+    '''Mark a pipe as deleted. It will be removed by the cron jobs.'''
+    return deleter.mark_deleted(db_man, pipe_id)
+
 class PipeGodfather(object):
-    ''' contains every dependent elements with foreign keys in db
+    ''' Deletes a pipe with all dependent elements.
+
+    The pipe is marked as deleted on init, so cron won't touch it anymore.
     '''
     def __init__(self, db_man, pipe_id):
         self.db_man = db_man
-        self.result_links = list()
-        self.visual_outputs = list()
-        self.data_exports = list()
-        self.datasources = list()
-        self.loops = list()
-        self.two_d_annotations = list()
-        self.image_annotations = list()
-        self.results = list()
-        self.required_label_leaves = list()
-        self.choosen_anno_tasks = list()
-        self.anno_tasks = list()
-        self.pipe = self.db_man.get_pipe(pipe_id=pipe_id)
-        self.pipe_elements = self.db_man.get_pipe_elements(pipe_id=pipe_id)
-        self.file_man = file_man.FileMan(db_man.lostconfig)
-
-        # Stop pipeline - so cron won't touch it.
-        self.pipe.state = state.Pipe.DELETED 
-        db_man.save_obj(self.pipe)
-
-        for pe in self.pipe_elements:
-            anno_task = self.db_man.get_anno_task(pipe_element_id=pe.idx)
-            if anno_task:
-                self.anno_tasks.append(anno_task)
-            for result_link in self.db_man.get_resultlinks_pe_n(pe_n_id=pe.idx):
-                if result_link not in self.result_links:
-                    self.result_links.append(result_link)
-                if result_link.result not in self.results:
-                    if result_link.result:
-                        self.results.append(result_link.result)
-            loop = self.db_man.get_loop(pipe_element_id=pe.idx)
-            if loop:
-                self.loops.append(loop)
-            datasource = self.db_man.get_datasource(pipe_element_id=pe.idx)
-            if datasource:
-                self.datasources.append(datasource)
-        for anno_task in self.anno_tasks:
-            
-            for ch_anno_task in self.db_man.get_choosen_annotask(anno_task_id=anno_task.idx):
-                self.choosen_anno_tasks.append(ch_anno_task)
-            
-            for leaf in self.db_man.get_all_required_label_leaves(anno_task_id=anno_task.idx):
-                self.required_label_leaves.append(leaf)
-
-            for image_annotation in self.db_man.get_image_annotations(anno_task_id=anno_task.idx):
-                self.image_annotations.append(image_annotation)
-                for two_d_anno in self.db_man.get_two_d_annotations(img_anno_id=image_annotation.idx):
-                    self.two_d_annotations.append(two_d_anno)
-        for result in self.results:
-            for data_export in self.db_man.get_data_exports(result_id=result.idx):
-                self.data_exports.append(data_export)
-            for visual_output in self.db_man.get_visual_outputs(result_id=result.idx):
-              self.visual_outputs.append(visual_output)
-            
+        self.pipe_id = pipe_id
+        deleter.mark_deleted(db_man, pipe_id)
+
     def delete(self):
-        ''' delete a pipe with all certain elements
-        Todo: Cleanup filesystem
+        ''' delete a pipe with all certain elements and files
         '''
-        for result_link in self.result_links:
-            self.db_man.delete(result_link)
-            self.db_man.commit()
-        for visual_outputs in self.visual_outputs:
-            self.db_man.delete(visual_outputs)
-            self.db_man.commit()
-        for data_export in self.data_exports:
-            self.db_man.delete(data_export)
-            self.db_man.commit()
-        for datasource in self.datasources:
-            self.db_man.delete(datasource)
-            self.db_man.commit()
-        for loop in self.loops:
-            self.db_man.delete(loop)
-            self.db_man.commit()
-        for two_d_annotation in self.two_d_annotations:
-            self.db_man.delete(two_d_annotation)
-            self.db_man.commit()
-        for image_annotation in self.image_annotations:
-            self.db_man.delete(image_annotation)
-            self.db_man.commit()
-        for result in self.results:
-            self.db_man.delete(result)
-            self.db_man.commit()
-        for required_label_leaf in self.required_label_leaves:
-            self.db_man.delete(required_label_leaf)
-            self.db_man.commit()
-        for choosen_anno_task in self.choosen_anno_tasks:
-            self.db_man.delete(choosen_anno_task)
-            self.db_man.commit()
-        for anno_task in self.anno_tasks:
-            if anno_task.dtype == dtype.AnnoTask.MIA:
-                self.file_man.rm_mia_crop_path(anno_task.idx)
-            else:
-                self.file_man.rm_sia_history_path(anno_task)
-            self.db_man.delete(anno_task)
-            self.db_man.commit()
-        for pipe_element in self.pipe_elements:
-            if pipe_element.dtype == dtype.PipeElement.SCRIPT:
-                self.file_man.rm_instance_path(pipe_element)
-            self.db_man.delete(pipe_element)
-            self.db_man.commit()
-        self.file_man.rm_pipe_context_path(self.pipe)
-        self.file_man.rm_pipe_log_path(self.pipe)
-        self.db_man.delete(self.pipe)
-        self.db_man.commit()
+        return deleter.PipeDeleter(self.db_man, self.pipe_id).delete()
 
 def pause(db_man, pipe_id):
     ''' pause a pipe. 
@@ -745,6 +752,8 @@ def play(db_man, pipe_id):
             if pipe.state != state.Pipe.FINISHED and pipe.state != state.Pipe.PENDING:
                 pipe.state = state.Pipe.IN_PROGRESS
                 db_man.save_obj(pipe) 
+                scheduler.notify(pipe.idx, scheduler.PIPE_PLAYED,
+                    db_man.lostconfig)
                 return "success"
     return "error"
 ############################ utils ################################
@@ -759,14 +768,18 @@ def calculate_progress(db_man, pipe_id):
     Returns:
         string representing the progress in percent.
     '''
-    progress = 0 
     finished = 0
     elements = db_man.get_pipe_elements(pipe_id)
     for element in elements:
         if element.state == state.PipeElement.FINISHED:
             finished += 1
-    progress = str(int(100*(finished/len(elements)))) + "%"
-    return progress
+    return format_progress(finished, len(elements))
+
+def format_progress(finished, total):
+    '''Format the progress of a pipe in percent of finished elements.'''
+    if total == 0:
+        return "0%"
+    return str(int(100*(finished/total))) + "%"
 class PipeNotFoundError(Exception):
     """ Base class for PipeNotFoundError
     """
@@ -1,10 +1,14 @@
 import lost
 import json
 import os
-from lost.db import dtype, state, model
+from lost.db import dtype, state, model, anno_counter
 from lost.logic.anno_task import set_finished, update_anno_task
 from datetime import datetime
+from sqlalchemy.orm import joinedload, selectinload
 from lost.logic.file_man import FileMan
+from lost.logic import sia_prefetch, derivative_cache, image_position
+from lost.logic.label_cache import tree_cache
+import cv2
 __author__ = "Gereon Reus"
 
 def get_first(db_man, user_id, media_url):
@@ -23,11 +27,13 @@ def get_first(db_man, user_id, media_url):
                 image_anno.state = state.Anno.LOCKED
             elif image_anno.state == state.Anno.LABELED:
                 image_anno.state = state.Anno.LABELED_LOCKED
+            reserved = sia_prefetch.reserve(db_man, user_id, at.idx, iteration,
+                image_anno.idx, db_man.lostconfig.sia_prefetch_depth)
             is_last_image = __is_last_image__(db_man, user_id, at.idx, iteration, image_anno.idx)
-            current_image_number, total_image_amount = get_image_progress(db_man, at, image_anno.idx, at.pipe_element.iteration)
-            sia_serialize = SiaSerialize(image_anno, user_id, media_url, True, is_last_image, current_image_number, total_image_amount)
+            sia_json = __serialize(db_man, at, image_anno, user_id, media_url, True, is_last_image)
             db_man.save_obj(image_anno)
-            return sia_serialize.serialize()
+            sia_prefetch.warm(db_man.lostconfig, user_id, reserved, media_url)
+            return sia_json
     else:
         return "nothing available"
 def get_next(db_man, user_id, img_id, media_url):
@@ -71,12 +77,41 @@ def get_next(db_man, user_id, img_id, media_url):
             first_image_anno = db_man.get_first_sia_anno(at.idx, iteration, user_id)
             if first_image_anno is not None and first_image_anno.idx != image_anno.idx:
                 is_first_image = False
+            reserved = sia_prefetch.reserve(db_man, user_id, at.idx, iteration,
+                image_anno.idx, db_man.lostconfig.sia_prefetch_depth)
             is_last_image = __is_last_image__(db_man, user_id, at.idx, iteration, image_anno.idx) 
-            current_image_number, total_image_amount = get_image_progress(db_man, at, image_anno.idx, at.pipe_element.iteration)
-            sia_serialize = SiaSerialize(image_anno, user_id, media_url, is_first_image, is_last_image, current_image_number, total_image_amount)
+            sia_json = __serialize(db_man, at, image_anno, user_id, media_url, is_first_image, is_last_image)
             db_man.save_obj(image_anno)
-            return sia_serialize.serialize()
+            sia_prefetch.warm(db_man.lostconfig, user_id, reserved, media_url)
+            return sia_json
     return "nothing available"
+def __serialize(db_man, at, image_anno, user_id, media_url, is_first_image, is_last_image):
+    '''Serialize an image anno for SIA. Use a prefetched payload if present.'''
+    sia_json = sia_prefetch.prefetch_cache.pop(user_id, image_anno.idx, image_anno.timestamp)
+    if sia_json is not None:
+        sia_json['image']['isFirst'] = is_first_image
+        sia_json['image']['isLast'] = is_last_image
+        return sia_json
+    current_image_number, total_image_amount = get_image_progress(db_man, at, image_anno.idx, at.pipe_element.iteration)
+    sia_serialize = SiaSerialize(image_anno, user_id, media_url, is_first_image, is_last_image, current_image_number, total_image_amount)
+    return sia_serialize.serialize()
+
+def load_jpeg(image_anno, lostconfig):
+    '''Load the image of an image anno encoded as JPEG.
+
+    The encoded image is read through the derivative cache.
+
+    Returns:
+        bytes: The encoded image.
+    '''
+    fm = FileMan(fs_db=image_anno.fs)
+    img_path = image_anno.img_path
+    def create():
+        _, data = cv2.imencode('.jpg', fm.load_img(img_path))
+        return data.tobytes()
+    return derivative_cache.load_derivative(fm, img_path, 'jpeg', {}, create,
+        lostconfig=lostconfig)
+
 def get_previous(db_man, user_id, img_id, media_url):
     """ Get previous image anno
     :type db_man: lost.db.access.DBMan
@@ -109,15 +144,17 @@ def get_label_trees(db_man, user_id, at=None):
     label_trees_json = dict()
     label_trees_json['labels'] = list()
     if at:
-        for rll in db_man.get_all_required_label_leaves(at.idx): #type: lost.db.model.RequiredLabelLeaf
-            for label_leaf in db_man.get_all_child_label_leaves(rll.label_leaf.idx): #type: lost.db.model.LabelLeaf
+        rll_ids = [rll.label_leaf_id for rll in db_man.get_all_required_label_leaves(at.idx)]
+        for tree in tree_cache.get_many(db_man.session, rll_ids):
+            parent_name = tree.leaves[tree.root_id]['name']
+            for label_leaf in tree.get_children(tree.root_id):
                 label_leaf_json = dict()
-                label_leaf_json['id'] = label_leaf.idx
-                label_leaf_json['label'] = label_leaf.name
-                label_leaf_json['nameAndClass'] = label_leaf.name + " (" + rll.label_leaf.name + ")"
-                label_leaf_json['description'] = label_leaf.description
-                if label_leaf.color and label_leaf.color != '':
-                    label_leaf_json['color'] = label_leaf.color
+                label_leaf_json['id'] = label_leaf['idx']
+                label_leaf_json['label'] = label_leaf['name']
+                label_leaf_json['nameAndClass'] = label_leaf['name'] + " (" + parent_name + ")"
+                label_leaf_json['description'] = label_leaf['description']
+                if label_leaf['color'] and label_leaf['color'] != '':
+                    label_leaf_json['color'] = label_leaf['color']
                 label_trees_json['labels'].append(label_leaf_json)
         return label_trees_json
     else: 
@@ -143,15 +180,11 @@ def get_image_progress(db_man, anno_task, img_id, iteration=None):
         iteration (int): int or None. If None all annotations will be considered
 
     '''
-    anno_ids = list()
-    if iteration is None:
-        for anno in db_man.get_all_image_annos(anno_task.idx):
-            anno_ids.append(anno.idx)
-    else:
-        for anno in db_man.get_all_image_annos_by_iteration(anno_task.idx, iteration):
-            anno_ids.append(anno.idx)
-    total_image_amount = len(anno_ids)
-    current_image_number = anno_ids.index(img_id) + 1 
+    counters = db_man.get_anno_counters(anno_task.idx,
+        anno_counter.IMAGE_ANNO, iteration)
+    total_image_amount = counters['total']
+    current_image_number = image_position.position_cache.get_position(
+        db_man.session, anno_task.idx, img_id, counters['version'], iteration)
 
     return current_image_number, total_image_amount
 
@@ -177,6 +210,7 @@ def __is_last_image__(db_man, user_id, at_id, iteration, img_id):
         img = db_man.get_image_anno(image_anno.idx)
         img.user_id = user_id
         img.state = state.Anno.LOCKED
+        img.timestamp_lock = datetime.now()
         db_man.save_obj(img)
         return False
     else:
@@ -283,23 +317,65 @@ class SiaUpdate(object):
     def update(self):
         if self.at.pipe_element.pipe.state == state.Pipe.PAUSED:
             return "pipe is paused"
-        if self.b_boxes is not None:
-            self.__update_annotations(self.b_boxes, dtype.TwoDAnno.BBOX)
-        if self.points is not None:
-            self.__update_annotations(self.points, dtype.TwoDAnno.POINT)
-        if self.lines is not None:
-            self.__update_annotations(self.lines, dtype.TwoDAnno.LINE)
-        if self.polygons is not None:
-            self.__update_annotations(self.polygons, dtype.TwoDAnno.POLYGON)
-        self.image_anno.state = state.Anno.LABELED
-        # Update Image Label
-        # self.image_anno.labels = self.img_labels
-        self.db_man.add(self.image_anno)
-        self.db_man.commit()
+        # All changes of this image are stored in one transaction
+        try:
+            if self.b_boxes is not None:
+                self.__update_annotations(self.b_boxes, dtype.TwoDAnno.BBOX)
+            if self.points is not None:
+                self.__update_annotations(self.points, dtype.TwoDAnno.POINT)
+            if self.lines is not None:
+                self.__update_annotations(self.lines, dtype.TwoDAnno.LINE)
+            if self.polygons is not None:
+                self.__update_annotations(self.polygons, dtype.TwoDAnno.POLYGON)
+            self.image_anno.state = state.Anno.LABELED
+            # Update Image Label
+            # self.image_anno.labels = self.img_labels
+            self.db_man.add(self.image_anno)
+            self.db_man.commit()
+        except:
+            self.db_man.session.rollback()
+            raise
         # self.__update_history_json_file()
         update_anno_task(self.db_man, self.at.idx, self.user_id)
         return "success"
+
+    def __load_two_d_annos(self, two_d_ids, refresh=False):
+        '''Load TwoDAnnos with their labels in one query.
+
+        Returns:
+            dict: two_d_anno_id -> :class:`lost.db.model.TwoDAnno`
+        '''
+        if len(two_d_ids) == 0:
+            return dict()
+        query = self.db_man.session.query(model.TwoDAnno)\
+            .filter(model.TwoDAnno.idx.in_(two_d_ids))\
+            .options(selectinload(model.TwoDAnno.labels)\
+                .joinedload(model.Label.label_leaf),
+                joinedload(model.TwoDAnno.annotator))
+        if refresh:
+            query = query.populate_existing()
+        return {two_d.idx: two_d for two_d in query}
+
+    def __label_row(self, two_d_anno_id, label_leaf_id, anno_time):
+        return {
+            'two_d_anno_id': two_d_anno_id,
+            'img_anno_id': None,
+            'label_leaf_id': label_leaf_id,
+            'dtype': dtype.Label.TWO_D_ANNO,
+            'timestamp': self.timestamp,
+            'annotator_id': self.user_id,
+            'timestamp_lock': self.image_anno.timestamp_lock,
+            'anno_time': anno_time
+        }
+
     def __update_annotations(self, annotations, two_d_type):
+        '''Apply all changes of one annotation type.
+
+        Existing annotations are loaded with one query and changed in the
+        session, so that updates and deletes are sent as batched statements
+        with the next flush. New annotations and labels are inserted with
+        multi-row inserts. Nothing is committed here.
+        '''
         annotation_json = dict()
         annotation_json['unchanged'] = list()
         annotation_json['deleted'] = list()
@@ -314,9 +390,16 @@ class SiaUpdate(object):
                 error_msg = "Status: '" + str(annotation['status']) + "' is not valid."
                 raise SiaStatusNotFoundError(error_msg)
 
+        session = self.db_man.session
+        two_ds = self.__load_two_d_annos([annotation['id'] for annotation in annotations
+            if annotation['status'] != "new"])
+        new_rows = list()
+        new_label_ids = list()
+        label_rows = list()
+        changed_ids = list()
         for annotation in annotations: 
             if annotation['status'] == "database":
-                two_d = self.db_man.get_two_d_anno(annotation['id']) #type: lost.db.model.TwoDAnno
+                two_d = two_ds[annotation['id']] #type: lost.db.model.TwoDAnno
                 two_d.user_id = self.user_id
                 two_d.state = state.Anno.LABELED
                 two_d.timestamp = self.timestamp
@@ -326,17 +409,16 @@ class SiaUpdate(object):
                 # two_d.anno_time += average_anno_time
                 two_d_json = self.__serialize_two_d_json(two_d)
                 annotation_json['unchanged'].append(two_d_json)
-                self.db_man.save_obj(two_d)
             elif annotation['status'] == "deleted":
-                try:
-                    two_d = self.db_man.get_two_d_anno(annotation['id']) #type: lost.db.model.TwoDAnno
-                    two_d_json = self.__serialize_two_d_json(two_d)
-                    annotation_json['deleted'].append(two_d_json)
-                    for label in self.db_man.get_all_two_d_label(two_d.idx):
-                        self.db_man.delete(label)
-                    self.db_man.delete(two_d)
-                except KeyError:
+                if annotation['id'] not in two_ds:
                     print('SIA bug backend fix! Do not try to delete annotations that are not in db!')
+                    continue
+                two_d = two_ds[annotation['id']] #type: lost.db.model.TwoDAnno
+                two_d_json = self.__serialize_two_d_json(two_d)
+                annotation_json['deleted'].append(two_d_json)
+                for label in two_d.labels:
+                    session.delete(label)
+                session.delete(two_d)
             elif annotation['status'] == "new":
                 annotation_data = annotation['data']
                 try:
@@ -346,30 +428,20 @@ class SiaUpdate(object):
                     annotation_data.pop('bottom')
                 except:
                     pass
-                two_d = model.TwoDAnno(anno_task_id=self.at.idx,
-                                    img_anno_id=self.image_anno.idx,
-                                    timestamp=self.timestamp,
-                                    timestamp_lock=self.image_anno.timestamp_lock,
-                                    anno_time=annotation['annoTime'],
-                                    data=json.dumps(annotation_data),
-                                    user_id=self.user_id,
-                                    iteration=self.iteration,
-                                    dtype=two_d_type,
-                                    state=state.Anno.LABELED)
-                if 'comment' in annotation:
-                    two_d.description = annotation['comment']
-                self.db_man.save_obj(two_d)
-                for l_id in annotation['labelIds']:
-                    label = model.Label(two_d_anno_id=two_d.idx,
-                                     label_leaf_id=l_id,
-                                     dtype=dtype.Label.TWO_D_ANNO,
-                                     timestamp=self.timestamp,
-                                     annotator_id=self.user_id,
-                                     timestamp_lock=self.image_anno.timestamp_lock,
-                                     anno_time=annotation['annoTime'])
-                    self.db_man.save_obj(label)
-                two_d_json = self.__serialize_two_d_json(two_d)
-                annotation_json['new'].append(two_d_json)
+                new_rows.append({
+                    'anno_task_id': self.at.idx,
+                    'img_anno_id': self.image_anno.idx,
+                    'timestamp': self.timestamp,
+                    'timestamp_lock': self.image_anno.timestamp_lock,
+                    'anno_time': annotation['annoTime'],
+                    'data': json.dumps(annotation_data),
+                    'user_id': self.user_id,
+                    'iteration': self.iteration,
+                    'dtype': two_d_type,
+                    'state': state.Anno.LABELED,
+                    'description': annotation.get('comment')
+                })
+                new_label_ids.append((annotation['labelIds'], annotation['annoTime']))
             elif annotation['status'] == "changed":
                 annotation_data = annotation['data']
                 try:
@@ -379,51 +451,46 @@ class SiaUpdate(object):
                     annotation_data.pop('bottom')
                 except:
                     pass
-                two_d = self.db_man.get_two_d_anno(annotation['id']) #type: lost.db.model.TwoDAnno
+                two_d = two_ds[annotation['id']] #type: lost.db.model.TwoDAnno
                 two_d.timestamp = self.timestamp
                 two_d.timestamp_lock = self.image_anno.timestamp_lock
                 two_d.data = json.dumps(annotation_data)
                 two_d.user_id = self.user_id
-                if two_d.anno_time is None:
-                    two_d.anno_time = 0.0
                 two_d.anno_time = annotation['annoTime']
                 two_d.state = state.Anno.LABELED
                 if 'comment' in annotation:
                     two_d.description = annotation['comment']
 
-                l_id_list = list()
-                # get all labels of that two_d_anno.
-                for label in self.db_man.get_all_two_d_label(two_d.idx):
-                    # save id.
-                    l_id_list.append(label.idx)
+                ll_ids = list()
+                for label in two_d.labels:
                     # delete labels, that are not in user labels list.
-                    if label.idx not in annotation['labelIds']:
-                        self.db_man.delete(label)
+                    if label.label_leaf_id not in annotation['labelIds']:
+                        session.delete(label)
                     # labels that are in the list get a new anno_time
-                    else:   
-                        if label.anno_time is None:
-                            label.anno_time = 0.0
+                    else:
+                        ll_ids.append(label.label_leaf_id)
                         label.anno_time = annotation['annoTime']
                         label.timestamp = self.timestamp
-                        label.annotator_id=self.user_id,
+                        label.annotator_id = self.user_id
                         label.timestamp_lock = self.image_anno.timestamp_lock
-                        self.db_man.save_obj(label)
-                # new labels 
+                # new labels
                 for l_id in annotation['labelIds']:
-                    if l_id not in l_id_list:
-                        label = model.Label(two_d_anno_id=two_d.idx,
-                                        label_leaf_id=l_id,
-                                        dtype=dtype.Label.TWO_D_ANNO,
-                                        timestamp=self.timestamp,
-                                        annotator_id=self.user_id,
-                                        timestamp_lock=self.image_anno.timestamp_lock,
-                                        anno_time=annotation['annoTime'])
-                        self.db_man.save_obj(label) 
-                self.db_man.save_obj(two_d)
-                two_d_json = self.__serialize_two_d_json(two_d)
-                annotation_json['changed'].append(two_d_json)
-            else:
-                continue
+                    if l_id not in ll_ids:
+                        label_rows.append(self.__label_row(two_d.idx, l_id,
+                            annotation['annoTime']))
+                changed_ids.append(two_d.idx)
+        session.flush()
+        new_ids = self.db_man.bulk_insert(model.TwoDAnno, new_rows,
+            model.TwoDAnno.img_anno_id==self.image_anno.idx)
+        for two_d_id, (ll_ids, anno_time) in zip(new_ids, new_label_ids):
+            for l_id in ll_ids:
+                label_rows.append(self.__label_row(two_d_id, l_id, anno_time))
+        if len(label_rows) > 0:
+            session.execute(model.Label.__table__.insert(), label_rows)
+        # Serialize new and changed annos with their final labels
+        two_ds = self.__load_two_d_annos(new_ids + changed_ids, refresh=True)
+        annotation_json['new'] = [self.__serialize_two_d_json(two_ds[idx]) for idx in new_ids]
+        annotation_json['changed'] = [self.__serialize_two_d_json(two_ds[idx]) for idx in changed_ids]
         self.history_json['annotations'] = annotation_json
         return "success"
 
@@ -0,0 +1,139 @@
+'''Prefetching of the next images in SIA.
+
+When an image is served to an annotator, the following images are reserved
+for the same user with the usual lock semantics (state LOCKED, user_id and
+timestamp_lock). So reserved images are released by the timeout job like
+any other locked image. The annotation payload and the encoded image of
+reserved images are prepared in a background thread, so that the next
+request of the annotator is served from memory.
+'''
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from time import monotonic
+from lost.db import state, model
+
+class PrefetchCache(object):
+    '''Bounded cache for serialized SIA payloads.
+
+    Entries are bound to the timestamp of the image annotation. An entry is
+    only returned if the image annotation was not updated since the entry
+    was created.
+
+    Args:
+        max_size (int): Max number of entries.
+        ttl (int): Seconds after an entry expires.
+    '''
+
+    def __init__(self, max_size=256, ttl=600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.mem = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def put(self, user_id, img_id, timestamp, payload):
+        with self.lock:
+            key = (user_id, img_id)
+            self.mem.pop(key, None)
+            self.mem[key] = (timestamp, monotonic(), payload)
+            while len(self.mem) > self.max_size:
+                self.mem.popitem(last=False)
+
+    def pop(self, user_id, img_id, timestamp):
+        '''Remove an entry and return its payload.
+
+        Returns:
+            dict: The payload or None if no valid entry was found.
+        '''
+        with self.lock:
+            entry = self.mem.pop((user_id, img_id), None)
+            if entry is not None:
+                e_timestamp, created, payload = entry
+                if e_timestamp == timestamp and monotonic() - created < self.ttl:
+                    self.hits += 1
+                    return payload
+            self.misses += 1
+            return None
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.mem
+
+prefetch_cache = PrefetchCache()
+_executor = ThreadPoolExecutor(max_workers=2)
+logger = logging.getLogger('{}.{}'.format(__name__, 'prefetch'))
+
+def reserve(db_man, user_id, anno_task_id, iteration, img_id, depth):
+    '''Reserve the next images for a user.
+
+    Args:
+        db_man (DBMan): Database manager.
+        user_id (int): User that will annotate the reserved images.
+        anno_task_id (int): Id of the SIA anno task.
+        iteration (int): Current iteration of the anno task.
+        img_id (int): Id of the image that is currently served.
+        depth (int): Number of images that should be reserved after
+            the current image.
+
+    Returns:
+        list of int: Ids of the reserved images after the current image.
+    '''
+    if depth <= 0:
+        return list()
+    reserved = [anno.idx for anno in db_man.session.query(model.ImageAnno.idx)\
+        .filter(model.ImageAnno.anno_task_id==anno_task_id,
+            model.ImageAnno.state==state.Anno.LOCKED,
+            model.ImageAnno.user_id==user_id,
+            model.ImageAnno.iteration==iteration,
+            model.ImageAnno.idx > img_id)\
+        .order_by(model.ImageAnno.idx.asc()).limit(depth)]
+    while len(reserved) < depth:
+        image_anno = db_man.get_next_unlocked_sia_anno(anno_task_id, iteration)
+        if image_anno is None:
+            break
+        image_anno.state = state.Anno.LOCKED
+        image_anno.user_id = user_id
+        image_anno.timestamp_lock = datetime.now()
+        db_man.save_obj(image_anno)
+        reserved.append(image_anno.idx)
+    return reserved
+
+def warm(lostconfig, user_id, img_ids, media_url):
+    '''Prepare payload and encoded images of reserved images in background.
+
+    Args:
+        lostconfig (LOSTConfig): The LOST config.
+        user_id (int): User the images are reserved for.
+        img_ids (list of int): Ids of reserved images.
+        media_url (str): Media url used for serialization.
+    '''
+    for img_id in img_ids:
+        if (user_id, img_id) in prefetch_cache:
+            continue
+        _executor.submit(_warm_job, lostconfig, user_id, img_id, media_url)
+
+def _warm_job(lostconfig, user_id, img_id, media_url):
+    from lost.db.access import DBMan
+    from lost.logic import sia
+    dbm = DBMan(lostconfig)
+    try:
+        image_anno = dbm.get_image_anno(img_id)
+        if image_anno is None or image_anno.user_id != user_id:
+            return
+        at = image_anno.anno_task
+        current_image_number, total_image_amount = sia.get_image_progress(dbm,
+            at, image_anno.idx, at.pipe_element.iteration)
+        # isFirst and isLast are set when the payload is served
+        payload = sia.SiaSerialize(image_anno, user_id, media_url, False, False,
+            current_image_number, total_image_amount).serialize()
+        prefetch_cache.put(user_id, img_id, image_anno.timestamp, payload)
+        if lostconfig.worker_management != 'dynamic':
+            sia.load_jpeg(image_anno, lostconfig)
+    except:
+        logger.exception('Could not prefetch image {}'.format(img_id))
+    finally:
+        dbm.close_session()
@@ -1,10 +1,62 @@
 import json
+import threading
 from datetime import datetime
 from lost.db import model, access, dtype
 from lost.logic.file_man import FileMan
-from lost.logic.label import LabelTree
+from lost.logic.label import get_hierarchical_dicts
 __author__ = "Gereon Reus"
 
+def parse_template_meta(json_template):
+    '''Get name, description and author of a pipe template json.'''
+    content = json.loads(json_template)
+    return {
+        'name': content.get('name'),
+        'description': content.get('description', "No description"),
+        'author': content.get('author', "Unknown author")
+    }
+
+class TemplateMetaCache(object):
+    '''Process wide cache of parsed pipe template meta data.
+
+    Entries are bound to id and timestamp of a template, so the json of a
+    template is only loaded and parsed again if the template changed.
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.mem = dict()
+
+    def get_many(self, db_man, template_ids):
+        '''Get meta data of pipe templates.
+
+        Args:
+            db_man: Database manager.
+            template_ids (iterable of int): Ids of the templates.
+
+        Returns:
+            dict: template_id -> dict with *name*, *description* and
+            *author*. Missing templates are left out.
+        '''
+        timestamps = db_man.get_pipe_template_timestamps(
+            [idx for idx in set(template_ids) if idx is not None])
+        res = dict()
+        missing = []
+        with self.lock:
+            for idx, timestamp in timestamps.items():
+                entry = self.mem.get(idx)
+                if entry is not None and entry[0] == timestamp:
+                    res[idx] = entry[1]
+                else:
+                    missing.append(idx)
+        for idx, timestamp, json_template in db_man.get_pipe_template_jsons(missing):
+            meta = parse_template_meta(json_template)
+            with self.lock:
+                self.mem[idx] = (timestamp, meta)
+            res[idx] = meta
+        return res
+
+template_meta_cache = TemplateMetaCache()
+
 ############################ get_templates ########################
 #                                                                 #
 ###################################################################
@@ -154,10 +206,7 @@ class TemplateSerialize(object):
         return res
 
     def __label_trees(self):
-        label_trees_json = list()
-        for label_tree in self.available_label_trees:
-            label_trees_json.append(LabelTree(self.dbm, label_tree.idx).to_hierarchical_dict())
-        return label_trees_json
+        return get_hierarchical_dicts(self.dbm, self.available_label_trees)
 
     def __groups(self):
         groups_json = list()
@@ -0,0 +1,34 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+import lostconfig as config
+from lost.db import model, access
+
+@pytest.fixture
+def engine():
+    '''In-memory sqlite database with all tables.'''
+    engine = create_engine('sqlite://')
+    model.Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def session(engine):
+    session = sessionmaker(bind=engine)()
+    yield session
+    session.close()
+
+@pytest.fixture
+def dbm(monkeypatch, tmp_path, engine):
+    '''DBMan on the in-memory sqlite database.
+
+    Files of LOST are stored in tmp_path.
+    '''
+    Session = sessionmaker(bind=engine)
+    monkeypatch.setattr(access.engine_registry, 'get',
+        lambda lostconfig, debug=False: (engine, Session, None))
+    lostconfig = config.LOSTConfig()
+    lostconfig.data_path = str(tmp_path)
+    dbm = access.DBMan(lostconfig)
+    yield dbm
+    dbm.close_session()
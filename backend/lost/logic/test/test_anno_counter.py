@@ -0,0 +1,134 @@
+from lost.db import model, state, anno_counter
+from lost.logic import sia
+from lost.logic.image_position import PositionCache, position_cache
+
+def add_images(session, anno_states, anno_task_id=1, iteration=0):
+    annos = [model.ImageAnno(anno_task_id=anno_task_id, iteration=iteration,
+        state=anno_state) for anno_state in anno_states]
+    session.add_all(annos)
+    session.commit()
+    return annos
+
+def get_counters(session, anno_task_id=1, iteration=None, version=False):
+    counters = anno_counter.get_counters(session, anno_task_id,
+        anno_counter.IMAGE_ANNO, iteration)
+    session.commit()
+    if not version:
+        del counters['version']
+    return counters
+
+class TestAnnoCounter(object):
+
+    def test_deltas_from_rows(self):
+        rows = [
+            {'anno_task_id': 1, 'iteration': 0, 'state': state.Anno.UNLOCKED},
+            {'anno_task_id': 1, 'iteration': 0, 'state': state.Anno.LOCKED},
+            {'anno_task_id': 1, 'iteration': 0, 'state': state.Anno.LABELED_LOCKED},
+            {'anno_task_id': 1, 'iteration': 1, 'state': state.Anno.LABELED},
+            {'anno_task_id': None, 'iteration': 0, 'state': state.Anno.UNLOCKED}
+        ]
+        deltas = anno_counter.deltas_from_rows(model.TwoDAnno, rows)
+        assert deltas == {
+            (1, 0, anno_counter.TWO_D_ANNO): (3, 2, 1),
+            (1, 1, anno_counter.TWO_D_ANNO): (1, 0, 1)
+        }
+        deltas = anno_counter.deltas_from_rows(model.ImageAnno, rows[:1], sign=-1)
+        assert deltas == {(1, 0, anno_counter.IMAGE_ANNO): (-1, 0, 0)}
+        assert anno_counter.deltas_from_rows(model.Label, rows) == {}
+
+    def test_after_flush(self, session):
+        annos = add_images(session, [state.Anno.UNLOCKED]*3)
+        # First read reconciles the counters
+        assert get_counters(session) == {'total': 3, 'locked': 0,
+            'labeled': 0, 'remaining': 3}
+        annos[0].state = state.Anno.LOCKED
+        annos[1].state = state.Anno.LABELED
+        session.delete(annos[2])
+        session.commit()
+        add_images(session, [state.Anno.LABELED_LOCKED], iteration=1)
+        assert get_counters(session) == {'total': 3, 'locked': 2,
+            'labeled': 2, 'remaining': 1}
+        assert get_counters(session, iteration=1)['total'] == 1
+        # Other anno tasks are not counted
+        add_images(session, [state.Anno.UNLOCKED], anno_task_id=2)
+        assert get_counters(session)['total'] == 3
+
+    def test_rollback(self, session):
+        annos = add_images(session, [state.Anno.UNLOCKED]*2)
+        get_counters(session)
+        annos[0].state = state.Anno.LABELED
+        session.add(model.ImageAnno(anno_task_id=1, iteration=0,
+            state=state.Anno.LOCKED))
+        session.flush()
+        session.rollback()
+        assert get_counters(session) == {'total': 2, 'locked': 0,
+            'labeled': 0, 'remaining': 2}
+
+    def test_reconcile(self, session):
+        add_images(session, [state.Anno.UNLOCKED, state.Anno.LOCKED])
+        add_images(session, [state.Anno.LABELED], iteration=1)
+        get_counters(session)
+        table = model.AnnoTaskCounter.__table__
+        ids = sorted(row[0] for row in session.execute(table.select()))
+        # Drift by writes that bypass the ORM
+        session.execute(table.update().values(total=10, locked=5))
+        session.execute(model.ImageAnno.__table__.delete()\
+            .where(model.ImageAnno.iteration==1))
+        anno_counter.reconcile(session, 1)
+        session.commit()
+        assert get_counters(session, iteration=0) == {'total': 2,
+            'locked': 1, 'labeled': 0, 'remaining': 2}
+        assert get_counters(session, iteration=1)['total'] == 0
+        # Counters are corrected in place
+        assert sorted(row[0] for row in session.execute(table.select())) == ids
+
+    def test_version(self, session):
+        annos = add_images(session, [state.Anno.UNLOCKED]*3)
+        version = get_counters(session, version=True)['version']
+        # State changes keep the version
+        annos[0].state = state.Anno.LOCKED
+        session.commit()
+        assert get_counters(session, version=True)['version'] == version
+        # One image added and one removed keep the total, but not the version
+        session.delete(annos[1])
+        session.add(model.ImageAnno(anno_task_id=1, iteration=0,
+            state=state.Anno.UNLOCKED))
+        session.commit()
+        counters = get_counters(session, version=True)
+        assert counters['total'] == 3 and counters['version'] > version
+        version = counters['version']
+        anno_counter.reconcile(session, 1)
+        session.commit()
+        assert get_counters(session, version=True)['version'] > version
+
+class TestPositionCache(object):
+    def test_position(self, session):
+        annos = add_images(session, [state.Anno.UNLOCKED]*3)
+        add_images(session, [state.Anno.UNLOCKED], anno_task_id=2)
+        other = add_images(session, [state.Anno.UNLOCKED], iteration=1)
+        cache = PositionCache()
+        ids = [a.idx for a in annos]
+        assert [cache.get_position(session, 1, idx, 1, 0) for idx in ids] == [1, 2, 3]
+        assert cache.get_position(session, 1, other[0].idx, 1) == 4
+        assert cache.misses == 2 and cache.hits == 2
+        # A new version loads the ids again
+        session.delete(annos[0])
+        session.commit()
+        assert cache.get_position(session, 1, ids[2], 2, 0) == 2
+        assert cache.misses == 3
+
+    def test_same_total(self, dbm):
+        position_cache.clear()
+        annos = add_images(dbm.session, [state.Anno.UNLOCKED]*3)
+        at = model.AnnoTask()
+        at.idx = 1
+        progress = lambda idx: sia.get_image_progress(dbm, at, idx, 0)
+        assert progress(annos[2].idx) == (3, 3)
+        # One image removed in front and one added keep the total
+        dbm.session.delete(annos[0])
+        new = model.ImageAnno(anno_task_id=1, iteration=0,
+            state=state.Anno.UNLOCKED)
+        dbm.session.add(new)
+        dbm.session.commit()
+        assert progress(annos[2].idx) == (2, 3)
+        assert progress(new.idx) == (3, 3)
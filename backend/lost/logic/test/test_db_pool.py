@@ -0,0 +1,76 @@
+import pytest
+import sqlalchemy
+import lostconfig as config
+from lost.db import access
+
+@pytest.fixture
+def lostconfig(monkeypatch, tmp_path):
+    url = 'sqlite:///{}'.format(tmp_path / 'pool.db')
+    monkeypatch.setattr(access, 'convert_connection_str', lambda lc: url)
+    lostconfig = config.LOSTConfig()
+    lostconfig.db_pool_size = 2
+    lostconfig.db_max_overflow = 0
+    lostconfig.db_pool_timeout = 1
+    return lostconfig
+
+class TestEngineRegistry(object):
+    def test_reuse(self, lostconfig):
+        registry = access.EngineRegistry()
+        engine, Session, scoped = registry.get(lostconfig)
+        assert registry.get(lostconfig) == (engine, Session, scoped)
+        assert isinstance(engine.pool, access.TimedQueuePool)
+        lostconfig.db_pool_size = 3
+        other = registry.get(lostconfig)
+        assert other[0] is not engine
+        # A forked process creates own engines
+        registry.pid = -1
+        assert registry.get(lostconfig)[0] is not other[0]
+        assert len(registry._inherited) == 1
+        registry.dispose()
+
+    def test_null_pool(self, lostconfig):
+        registry = access.EngineRegistry()
+        lostconfig.db_pool_size = 0
+        engine, _, _ = registry.get(lostconfig)
+        assert isinstance(engine.pool, sqlalchemy.pool.NullPool)
+        assert registry.get_stats() == []
+        registry.dispose()
+
+    def test_stats(self, lostconfig):
+        registry = access.EngineRegistry()
+        engine, _, _ = registry.get(lostconfig)
+        conns = [engine.connect() for _ in range(2)]
+        stats = registry.get_stats()[0]
+        assert stats['checkedout'] == 2 and stats['size'] == 2
+        assert stats['checkouts'] == 2 and stats['waits'] == 2
+        # Pool is exhausted, the next checkout waits for the timeout
+        with pytest.raises(sqlalchemy.exc.TimeoutError):
+            engine.connect()
+        stats = registry.get_stats()[0]
+        assert stats['max_wait_time'] >= 0.9
+        for conn in conns:
+            conn.close()
+        stats = registry.get_stats()[0]
+        assert stats['checkins'] == 2 and stats['checkedout'] == 0
+        registry.dispose()
+
+    def test_remove_scoped_sessions(self, lostconfig, monkeypatch):
+        registry = access.EngineRegistry()
+        monkeypatch.setattr(access, 'engine_registry', registry)
+        dbm = access.DBMan(lostconfig, scoped=True)
+        session = dbm.session
+        assert access.DBMan(lostconfig, scoped=True).session is session
+        access.remove_scoped_sessions()
+        assert access.DBMan(lostconfig, scoped=True).session is not session
+        registry.dispose()
+
+    def test_release_on_remove(self, lostconfig, monkeypatch):
+        registry = access.EngineRegistry()
+        monkeypatch.setattr(access, 'engine_registry', registry)
+        # An endpoint that raised before close_session
+        dbm = access.DBMan(lostconfig, scoped=True)
+        dbm.session.execute('SELECT 1')
+        assert registry.get_stats()[0]['checkedout'] == 1
+        access.remove_scoped_sessions()
+        assert registry.get_stats()[0]['checkedout'] == 0
+        registry.dispose()
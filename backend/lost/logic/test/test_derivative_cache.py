@@ -0,0 +1,57 @@
+from lost.logic.derivative_cache import DerivativeCache
+
+def get_cache(tmp_path, max_disk_size=100, max_mem_size=20):
+    return DerivativeCache(str(tmp_path), max_disk_size, max_mem_size)
+
+class TestDerivativeCache(object):
+    def test_key(self, tmp_path):
+        cache = get_cache(tmp_path)
+        key = cache.make_key(1, '/img.jpg', 10, 1.0, 'crop', {'a': 1, 'b': 2})
+        assert key == cache.make_key(1, '/img.jpg', 10, 1.0, 'crop', {'b': 2, 'a': 1})
+        assert key != cache.make_key(1, '/img.jpg', 11, 1.0, 'crop', {'a': 1, 'b': 2})
+        assert key != cache.make_key(1, '/img.jpg', 10, 2.0, 'crop', {'a': 1, 'b': 2})
+
+    def test_read_through(self, tmp_path):
+        cache = get_cache(tmp_path)
+        calls = list()
+        def create():
+            calls.append(1)
+            return b'0123456789'
+        assert cache.get_or_create('aa01', create) == b'0123456789'
+        assert cache.get_or_create('aa01', create) == b'0123456789'
+        assert len(calls) == 1
+        # A new process only has the disk tier
+        other = get_cache(tmp_path)
+        assert other.get('aa01') == b'0123456789'
+        stats = cache.get_stats()
+        assert stats['misses'] == 1
+        assert stats['mem_hits'] == 1
+        assert other.get_stats()['disk_hits'] == 1
+
+    def test_eviction(self, tmp_path):
+        cache = get_cache(tmp_path, max_disk_size=35, max_mem_size=20)
+        for idx in range(4):
+            cache.put('aa{}'.format(idx), b'x'*10)
+        stats = cache.get_stats()
+        assert stats['mem_evictions'] == 2
+        assert stats['disk_evictions'] == 1
+        assert cache.disk.get('aa0') is None
+        assert cache.disk.get('aa3') == b'x'*10
+
+    def test_disk_size(self, tmp_path):
+        cache = get_cache(tmp_path)
+        cache.put('aa01', b'x'*10)
+        cache.put('aa02', b'x'*10)
+        cache.put('aa01', b'x'*5)
+        assert cache.get_stats()['disk_size'] == 15
+
+    def test_disk_put_unlocked(self, tmp_path):
+        cache = get_cache(tmp_path)
+        disk_put = cache.disk.put
+        def put(key, data):
+            # Memory tier stays available while writing to disk
+            assert not cache.lock.locked()
+            return disk_put(key, data)
+        cache.disk.put = put
+        cache.put('aa01', b'x'*10)
+        assert cache.get('aa01') == b'x'*10
@@ -0,0 +1,92 @@
+import os
+import sys
+from datetime import datetime, timedelta
+from lost.logic.pipeline import exec_utils
+
+class WorkerDummy(object):
+    def __init__(self, local_directory):
+        self.local_directory = local_directory
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+class TestExecUtils(object):
+    def test_hash_index(self, tmp_path):
+        root = str(tmp_path)
+        write(os.path.join(root, 'a.py'), 'a')
+        write(os.path.join(root, 'sub', 'b.py'), 'b')
+        write(os.path.join(root, '__pycache__', 'a.pyc'), 'c')
+        index = exec_utils.HashIndex()
+        digests = index.update(root)
+        assert sorted(digests) == ['a.py', os.path.join('sub', 'b.py')]
+        assert index.hashed == 2
+        tree_hash = exec_utils.get_tree_hash(digests)
+        assert exec_utils.get_tree_hash(index.update(root)) == tree_hash
+        assert index.hashed == 0
+        write(os.path.join(root, 'a.py'), 'aa')
+        assert exec_utils.get_tree_hash(index.update(root)) != tree_hash
+        assert index.hashed == 1
+
+    def test_apply_package(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(sys, 'path', list(sys.path))
+        src = str(tmp_path / 'src')
+        write(os.path.join(src, 'a.py'), 'a')
+        write(os.path.join(src, 'b.py'), 'b')
+        worker = WorkerDummy(str(tmp_path / 'worker'))
+        data = exec_utils.zip_files(src, ['a.py', 'b.py'])
+        assert not exec_utils.has_package('proj_1', dask_worker=worker)
+        assert exec_utils.apply_package(data, 'proj_1', project='proj',
+            dask_worker=worker)
+        assert exec_utils.has_package('proj_1', dask_worker=worker)
+        assert not exec_utils.apply_package(data, 'proj_3', 'proj_2',
+            dask_worker=worker)
+        write(os.path.join(src, 'a.py'), 'new')
+        data = exec_utils.zip_files(src, ['a.py'])
+        assert exec_utils.apply_package(data, 'proj_2', 'proj_1', ['b.py'],
+            project='proj', dask_worker=worker)
+        root = os.path.join(worker.local_directory, exec_utils.PACKAGE_DIR)
+        assert root in sys.path
+        with open(os.path.join(root, 'proj_1', 'a.py')) as f:
+            assert f.read() == 'a'
+        with open(os.path.join(root, 'proj_2', 'a.py')) as f:
+            assert f.read() == 'new'
+        assert os.listdir(os.path.join(root, 'proj_2')) == ['a.py']
+        exec_utils.apply_package(data, 'proj_3', 'proj_2', project='proj',
+            keep=0, dask_worker=worker)
+        assert sorted(os.listdir(root)) == ['proj_2', 'proj_3']
+
+    def test_keep_versions(self, tmp_path):
+        src = str(tmp_path / 'src')
+        write(os.path.join(src, 'a.py'), 'a')
+        worker = WorkerDummy(str(tmp_path / 'worker'))
+        root = os.path.join(worker.local_directory, exec_utils.PACKAGE_DIR)
+        data = exec_utils.zip_files(src, ['a.py'])
+        for version in range(1, 5):
+            exec_utils.apply_package(data, 'proj_{}'.format(version),
+                project='proj', keep=1, dask_worker=worker)
+        assert sorted(os.listdir(root)) == ['proj_3', 'proj_4']
+        # Versions of running scripts are kept
+        with exec_utils._use_package('proj_3'):
+            for version in range(5, 7):
+                exec_utils.apply_package(data, 'proj_{}'.format(version),
+                    project='proj', keep=1, dask_worker=worker)
+            assert sorted(os.listdir(root)) == ['proj_3', 'proj_5', 'proj_6']
+        exec_utils.apply_package(data, 'proj_7', project='proj', keep=1,
+            dask_worker=worker)
+        assert sorted(os.listdir(root)) == ['proj_6', 'proj_7']
+
+    def test_keep_versions_new_year(self, tmp_path):
+        src = str(tmp_path / 'src')
+        write(os.path.join(src, 'a.py'), 'a')
+        worker = WorkerDummy(str(tmp_path / 'worker'))
+        root = os.path.join(worker.local_directory, exec_utils.PACKAGE_DIR)
+        data = exec_utils.zip_files(src, ['a.py'])
+        start = datetime(2025, 12, 31, 23, 59, 58)
+        names = ['proj_{}'.format((start + timedelta(seconds=s)).strftime(
+            exec_utils.VERSION_FORMAT)) for s in range(4)]
+        for name in names:
+            exec_utils.apply_package(data, name, project='proj', keep=1,
+                dask_worker=worker)
+        assert sorted(os.listdir(root)) == names[2:]
@@ -0,0 +1,44 @@
+from lost.db import model
+from lost.logic.file_man import FsCache, FileMan
+
+def get_fs_db(idx, connection='{"auto_mkdir": True}'):
+    fs_db = model.FileSystem(fs_type='file', connection=connection,
+        root_path='/', name='fs{}'.format(idx))
+    fs_db.idx = idx
+    return fs_db
+
+class TestFsCache(object):
+    def test_get(self):
+        cache = FsCache(max_size=2)
+        fs_db = get_fs_db(1)
+        fs = cache.get(fs_db)
+        assert cache.get(fs_db) is fs
+        assert cache.hits == 1 and cache.misses == 1
+        # A changed connection is never served from an old entry
+        fs_db.connection = '{"auto_mkdir": False}'
+        cache.get(fs_db)
+        assert cache.misses == 2
+
+    def test_max_size_and_invalidate(self):
+        cache = FsCache(max_size=2)
+        for idx in range(3):
+            cache.get(get_fs_db(idx))
+        assert len(cache.mem) == 2
+        assert [key[0] for key in cache.mem.keys()] == [1, 2]
+        cache.invalidate(2)
+        assert [key[0] for key in cache.mem.keys()] == [1]
+        cache.invalidate()
+        assert len(cache.mem) == 0
+
+    def test_fork(self):
+        cache = FsCache(max_size=2)
+        cache.get(get_fs_db(1))
+        cache.pid = -1
+        cache.get(get_fs_db(2))
+        assert [key[0] for key in cache.mem.keys()] == [2]
+
+    def test_file_man(self):
+        fs_db = get_fs_db(1)
+        fm = FileMan(fs_db=fs_db)
+        assert fm.fs.lost_fs is fs_db
+        assert FileMan(fs_db=fs_db).fs is fm.fs
@@ -0,0 +1,83 @@
+import fsspec
+from lost.logic.fs_listing import ListingCache, Lister
+
+class FileManDummy(object):
+    def __init__(self, fs):
+        self.fs = fs
+        self.ls_calls = 0
+
+    def ls(self, path, detail=False):
+        self.ls_calls += 1
+        return self.fs.ls(path, detail=detail)
+
+def make_tree(fs, root):
+    fs.mkdirs(root + '/empty', exist_ok=True)
+    fs.mkdirs(root + '/sub', exist_ok=True)
+    for name in ['c.txt', 'a.txt', 'b.txt']:
+        fs.pipe(root + '/' + name, b'12345')
+    fs.pipe(root + '/sub/x.txt', b'1')
+
+class TestFsListing(object):
+    def test_local(self, tmp_path):
+        fs = fsspec.filesystem('file')
+        root = str(tmp_path)
+        make_tree(fs, root)
+        fm = FileManDummy(fs)
+        lister = Lister(fm, 1, ListingCache())
+        res = lister.ls_page(root)
+        assert [f['name'] for f in res['files']] == ['a.txt', 'b.txt', 'c.txt',
+            'empty', 'sub']
+        assert res['files'][0]['size'] == 5
+        assert res['folderChain'][-1]['id'] == root
+        assert res['nextCursor'] is None
+        # Sub directories are not listed
+        assert fm.ls_calls == 1
+        assert 'childrenCount' not in res['files'][4]
+        lister.ls_page(root + '/sub')
+        res = lister.ls_page(root)
+        assert fm.ls_calls == 2
+        assert res['files'][4]['childrenCount'] == 1
+        res = lister.ls_page(root, probe_children=True)
+        assert res['files'][3]['childrenCount'] == 0
+        assert fm.ls_calls == 3
+
+    def test_paging(self):
+        fs = fsspec.filesystem('memory')
+        root = '/test_fs_listing_paging'
+        make_tree(fs, root)
+        lister = Lister(FileManDummy(fs), 1, ListingCache())
+        names, cursor = [], None
+        while True:
+            res = lister.ls_page(root, cursor=cursor, limit=2)
+            names += [f['name'] for f in res['files']]
+            cursor = res['nextCursor']
+            if cursor is None:
+                break
+        assert names == ['a.txt', 'b.txt', 'c.txt', 'empty', 'sub']
+        fs.rm(root, recursive=True)
+
+    def test_ttl_and_invalidate(self):
+        fs = fsspec.filesystem('memory')
+        root = '/test_fs_listing_ttl'
+        make_tree(fs, root)
+        fm = FileManDummy(fs)
+        cache = ListingCache(ttl=60)
+        lister = Lister(fm, 1, cache)
+        lister.ls_page(root)
+        lister.ls_page(root + '/sub')
+        fs.pipe(root + '/d.txt', b'1')
+        assert len(lister.ls_page(root)['files']) == 5
+        cache.invalidate(1, root + '/d.txt')
+        assert len(lister.ls_page(root)['files']) == 6
+        assert (1, root + '/sub') in cache.mem
+        cache.invalidate(1)
+        assert len(cache.mem) == 0
+        cache.ttl = 0
+        lister.ls_page(root)
+        calls = fm.ls_calls
+        lister.ls_page(root)
+        assert fm.ls_calls == calls + 1
+        # Listings without fs key are never cached
+        Lister(fm, None, cache).ls_page(root)
+        assert len(cache.mem) == 1
+        fs.rm(root, recursive=True)
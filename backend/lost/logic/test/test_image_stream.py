@@ -0,0 +1,60 @@
+import fsspec
+import numpy as np
+import cv2
+from flask import Flask
+from lost.logic import image_stream
+
+class FsDummy(object):
+    def __init__(self, idx):
+        self.idx = idx
+
+class FileManDummy(object):
+    def __init__(self, root_path):
+        self.fs = fsspec.filesystem('file')
+        self.fs.lost_fs = FsDummy(1)
+        self.root_path = root_path
+
+    def get_abs_path(self, path):
+        return '{}/{}'.format(self.root_path, path)
+
+    def load_img(self, path):
+        return cv2.imread(self.get_abs_path(path))
+
+def get_response(fm, path, headers=dict(), **kwargs):
+    app = Flask(__name__)
+    with app.test_request_context(headers=headers):
+        rv = image_stream.send_img_file(fm, path, **kwargs)
+        rv.direct_passthrough = False
+        return rv.status_code, rv.headers, rv.get_data()
+
+class TestImageStream(object):
+    def test_send_original_and_conditional(self, tmp_path):
+        img = np.zeros((4, 4, 3), dtype=np.uint8)
+        cv2.imwrite(str(tmp_path / 'img.png'), img)
+        fm = FileManDummy(str(tmp_path))
+        status, headers, data = get_response(fm, 'img.png')
+        assert status == 200
+        assert headers['Content-Type'] == 'image/png'
+        assert data == (tmp_path / 'img.png').read_bytes()
+        etag = headers['ETag']
+        status, _, _ = get_response(fm, 'img.png', {'If-None-Match': etag})
+        assert status == 304
+
+    def test_range(self, tmp_path):
+        img = np.zeros((4, 4, 3), dtype=np.uint8)
+        cv2.imwrite(str(tmp_path / 'img.png'), img)
+        fm = FileManDummy(str(tmp_path))
+        status, headers, data = get_response(fm, 'img.png', {'Range': 'bytes=0-9'})
+        assert status == 206
+        assert data == (tmp_path / 'img.png').read_bytes()[:10]
+
+    def test_transcode(self, tmp_path):
+        img = np.zeros((4, 4, 3), dtype=np.uint8)
+        cv2.imwrite(str(tmp_path / 'img.tiff'), img)
+        fm = FileManDummy(str(tmp_path))
+        status, headers, data = get_response(fm, 'img.tiff')
+        assert status == 200
+        assert headers['Content-Type'] == 'image/jpeg'
+        assert data[:2] == b'\xff\xd8'
+        status, _, _ = get_response(fm, 'img.tiff', {'If-None-Match': headers['ETag']})
+        assert status == 304
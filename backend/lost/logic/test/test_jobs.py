@@ -0,0 +1,54 @@
+import pytest
+from datetime import datetime, timedelta
+from lost.db import model, state, anno_counter
+from lost.db.access import DBMan
+import lostconfig as config
+from lost.logic.jobs import jobs
+
+N_LOCKED = 2000
+N_FRESH = 100
+
+@pytest.fixture
+def locked_anno_task():
+    dbm = DBMan(config.LOSTConfig())
+    anno_task = model.AnnoTask(name='test release annos',
+        state=state.AnnoTask.IN_PROGRESS)
+    dbm.save_obj(anno_task)
+    old = datetime.now() - timedelta(hours=2)
+    rows = [{'anno_task_id': anno_task.idx, 'iteration': 0,
+        'state': state.Anno.LOCKED, 'timestamp_lock': old}
+        for i in range(N_LOCKED)]
+    rows += [{'anno_task_id': anno_task.idx, 'iteration': 0,
+        'state': state.Anno.LOCKED, 'timestamp_lock': datetime.now()}
+        for i in range(N_FRESH)]
+    rows += [{'anno_task_id': anno_task.idx, 'iteration': 0,
+        'state': state.Anno.LABELED, 'timestamp_lock': old}]
+    dbm.session.execute(model.ImageAnno.__table__.insert(), rows)
+    dbm.session.execute(model.TwoDAnno.__table__.insert(), rows[:N_LOCKED//2])
+    dbm.commit()
+    yield dbm, anno_task
+    dbm.session.rollback()
+    for anno_model in [model.TwoDAnno, model.ImageAnno, model.AnnoTaskCounter]:
+        dbm.session.query(anno_model)\
+            .filter(anno_model.anno_task_id==anno_task.idx).delete()
+    dbm.delete(anno_task)
+    dbm.commit()
+    dbm.close_session()
+
+class TestReleaseAnnos(object):
+    def test_release_annos_by_timeout(self, locked_anno_task):
+        dbm, anno_task = locked_anno_task
+        counters = dbm.get_anno_counters(anno_task.idx, anno_counter.IMAGE_ANNO)
+        assert counters['locked'] == N_LOCKED + N_FRESH
+        released = jobs.release_annos_by_timeout(dbm, 30)
+        assert released[anno_task.idx] == {'img_annos': N_LOCKED,
+            'two_d_annos': N_LOCKED//2}
+        assert dbm.session.query(model.ImageAnno)\
+            .filter(model.ImageAnno.anno_task_id==anno_task.idx,
+                model.ImageAnno.state==state.Anno.UNLOCKED).count() == N_LOCKED
+        counters = dbm.get_anno_counters(anno_task.idx, anno_counter.IMAGE_ANNO)
+        assert counters['locked'] == N_FRESH
+        assert counters['labeled'] == 1
+        # Nothing left to release
+        released = jobs.release_annos_by_timeout(dbm, 30)
+        assert anno_task.idx not in released
@@ -0,0 +1,73 @@
+import pytest
+import pandas as pd
+from lost.db import model, label_version
+from lost.logic import label_cache
+from lost.logic.label_cache import CachedTree, TreeCache, LEAF_COLUMNS
+
+def leaf(idx, name, parent_leaf_id=None, **kwargs):
+    row = {c: None for c in LEAF_COLUMNS}
+    row.update(idx=idx, name=name, parent_leaf_id=parent_leaf_id,
+        is_root=parent_leaf_id is None, **kwargs)
+    return row
+
+@pytest.fixture
+def session(session):
+    '''Session with the label tree animals -> (cat -> kitten, dog).'''
+    root = model.LabelLeaf(name='animals', is_root=True)
+    session.add(root)
+    session.flush()
+    cat = model.LabelLeaf(name='cat', parent_leaf_id=root.idx)
+    session.add(cat)
+    session.flush()
+    session.add(model.LabelLeaf(name='kitten', parent_leaf_id=cat.idx))
+    session.add(model.LabelLeaf(name='dog', parent_leaf_id=root.idx))
+    session.commit()
+    return session
+
+class TestCachedTree(object):
+    def test_structure(self):
+        tree = CachedTree(1, [leaf(3, 'dog', 1), leaf(1, 'animals'),
+            leaf(4, 'kitten', 2), leaf(2, 'cat', 1)])
+        assert list(tree.iter_ids()) == [1, 2, 4, 3]
+        assert [c['name'] for c in tree.get_children(1)] == ['cat', 'dog']
+        d = tree.to_hierarchical_dict()
+        assert d['name'] == 'animals'
+        assert [c['name'] for c in d['children']] == ['cat', 'dog']
+        assert d['children'][0]['children'][0]['children'] == []
+        # Returned dicts are copies
+        d['name'] = 'changed'
+        assert tree.leaves[1]['name'] == 'animals'
+
+    def test_to_df(self):
+        tree = CachedTree(1, [leaf(1, 'animals'), leaf(2, 'cat', 1, color='#fff')])
+        df = tree.to_df()
+        legacy = pd.concat([pd.DataFrame(tree.leaves[idx], index=[0])
+            for idx in tree.iter_ids()]).reset_index().drop(columns=['index'])
+        assert list(df.columns) == LEAF_COLUMNS
+        assert df.dtypes.equals(legacy.dtypes)
+        assert df.equals(legacy)
+
+class TestTreeCache(object):
+    def test_load_leaves(self, session, monkeypatch):
+        rows = label_cache.load_leaves(session, 2)
+        assert sorted(r['name'] for r in rows) == ['cat', 'kitten']
+        monkeypatch.setattr(label_cache, 'supports_recursive_cte', lambda d: False)
+        rows = label_cache.load_leaves(session, 1)
+        assert sorted(r['name'] for r in rows) == ['animals', 'cat', 'dog', 'kitten']
+
+    def test_version(self, session):
+        cache = TreeCache(max_size=2)
+        tree = cache.get(session, 1)
+        assert cache.get(session, 1) is tree
+        assert cache.hits == 1 and cache.misses == 1
+        version = label_version.get_version(session)
+        kitten = session.query(model.LabelLeaf).filter_by(name='kitten').one()
+        kitten.name = 'kitty'
+        session.commit()
+        assert label_version.get_version(session) != version
+        tree = cache.get(session, 1)
+        assert tree.leaves[kitten.idx]['name'] == 'kitty'
+        assert cache.misses == 2
+        cache.get_many(session, [2, 3])
+        assert list(cache.mem.keys()) == [2, 3]
+        assert cache.get(session, 42) is None
@@ -0,0 +1,57 @@
+import io
+import pytest
+import pandas as pd
+from lost.db import model
+from lost.logic.label import LabelTree, df_to_records, _validate_records
+
+CSV = '''idx,name,description,external_id,parent_leaf_id,is_root,color
+0,animals,Some animals,,,True,
+1,mammals,,,0,,#46aed7
+2,cat,,12,1,,
+3,birds,,7,0,,#50b897
+4,dog,,,1,,
+'''
+
+def get_df():
+    return pd.read_csv(io.StringIO(CSV))
+
+class TestLabelImport(object):
+    def test_validate(self):
+        root, children = _validate_records(df_to_records(get_df()))
+        assert root['values']['name'] == 'animals'
+        assert [c['idx'] for c in children[0]] == [1, 3]
+        assert [c['values']['external_id'] for c in children[1]] == ['12', None]
+        df = get_df()
+        df.loc[2, 'parent_leaf_id'] = 42
+        with pytest.raises(ValueError):
+            _validate_records(df_to_records(df))
+        df = get_df()
+        df.loc[1, 'parent_leaf_id'] = 2
+        with pytest.raises(ValueError):
+            _validate_records(df_to_records(df))
+        df = get_df()
+        df.loc[4, 'idx'] = 3
+        with pytest.raises(ValueError):
+            _validate_records(df_to_records(df))
+        with pytest.raises(KeyError):
+            list(df_to_records(get_df().drop(columns=['parent_leaf_id'])))
+
+    def test_import_csv(self, dbm):
+        root, id_map = LabelTree(dbm).import_csv(io.StringIO(CSV), chunksize=2)
+        assert sorted(id_map) == [0, 1, 2, 3, 4]
+        tree = LabelTree(dbm, root.idx)
+        assert tree.tree[id_map[2]].parent_leaf_id == id_map[1]
+        assert tree.tree[id_map[2]].external_id == '12'
+        assert tree.tree[id_map[1]].color == '#46aed7'
+        d = tree.to_hierarchical_dict()
+        assert [c['name'] for c in d['children']] == ['mammals', 'birds']
+        assert [c['name'] for c in d['children'][0]['children']] == ['cat', 'dog']
+        # A tree with the same name is not imported again
+        assert LabelTree(dbm).import_df(get_df()) is None
+
+    def test_import_is_atomic(self, dbm):
+        df = get_df()
+        df.loc[4, 'color'] = 'x' * 101
+        with pytest.raises(ValueError):
+            LabelTree(dbm).import_df(df)
+        assert dbm.session.query(model.LabelLeaf).count() == 0
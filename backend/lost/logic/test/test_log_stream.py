@@ -0,0 +1,61 @@
+import fsspec
+from flask import Flask
+from lost.logic import log_stream
+
+LOG = b''.join([b'line %d\n' % i for i in range(1000)])
+
+class FileManDummy(object):
+    def __init__(self, root_path):
+        self.fs = fsspec.filesystem('file')
+        self.root_path = root_path
+
+    def get_abs_path(self, path):
+        return '{}/{}'.format(self.root_path, path)
+
+def get_response(fm, headers=dict(), **kwargs):
+    app = Flask(__name__)
+    with app.test_request_context(headers=headers):
+        rv = log_stream.send_log(fm, 'p-1.log', **kwargs)
+        rv.direct_passthrough = False
+        return rv.status_code, rv.headers, rv.get_data()
+
+class TestLogStream(object):
+    def test_find_tail_offset(self, tmp_path):
+        (tmp_path / 'p-1.log').write_bytes(LOG)
+        with open(str(tmp_path / 'p-1.log'), 'rb') as f:
+            offset = log_stream.find_tail_offset(f, len(LOG), 3, block_size=5)
+            assert LOG[offset:] == b'line 997\nline 998\nline 999\n'
+            assert log_stream.find_tail_offset(f, len(LOG), 5000, block_size=7) == 0
+
+    def test_tail_and_range(self, tmp_path):
+        (tmp_path / 'p-1.log').write_bytes(LOG)
+        fm = FileManDummy(str(tmp_path))
+        status, headers, data = get_response(fm, tail_lines=2)
+        assert status == 200
+        assert data == b'line 998\nline 999\n'
+        status, headers, data = get_response(fm, tail_bytes=4)
+        assert data == LOG[-4:]
+        assert int(headers['X-Log-Offset']) == len(LOG) - 4
+        status, headers, data = get_response(fm, {'Range': 'bytes=0-9'})
+        assert status == 206
+        assert data == LOG[:10]
+
+    def test_incremental(self, tmp_path):
+        (tmp_path / 'p-1.log').write_bytes(LOG)
+        fm = FileManDummy(str(tmp_path))
+        status, headers, data = get_response(fm, offset=0)
+        assert data == LOG
+        offset = int(headers['X-Log-Size'])
+        etag = headers['ETag']
+        status, headers, data = get_response(fm, {'If-None-Match': etag},
+            offset=offset)
+        assert status == 304
+        with open(str(tmp_path / 'p-1.log'), 'ab') as f:
+            f.write(b'new line\n')
+        status, headers, data = get_response(fm, {'If-None-Match': etag},
+            offset=offset)
+        assert status == 200
+        assert data == b'new line\n'
+        # Rewritten logs are sent from the beginning
+        status, headers, data = get_response(fm, offset=10**6)
+        assert int(headers['X-Log-Offset']) == 0
@@ -0,0 +1,107 @@
+import json
+import pytest
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import set_committed_value
+from lost.db import model, state, dtype, anno_counter
+from lost.logic import mia
+
+@pytest.fixture
+def dbm(dbm):
+    dbm.statements = list()
+    event.listen(dbm.engine, 'before_cursor_execute',
+        lambda conn, cursor, statement, *args: dbm.statements.append(statement))
+    return dbm
+
+def create_task(dbm, anno_type='annoBased', n_annos=6):
+    leaf = model.LabelLeaf(name='leaf', is_root=True)
+    pipe = model.Pipe(name='pipe', state=state.Pipe.IN_PROGRESS)
+    dbm.add(leaf)
+    dbm.save_obj(pipe)
+    pe = model.PipeElement(pipe_id=pipe.idx, dtype=dtype.PipeElement.ANNO_TASK)
+    dbm.save_obj(pe)
+    at = model.AnnoTask(pipe_element_id=pe.idx, dtype=dtype.AnnoTask.MIA,
+        configuration=json.dumps({'type': anno_type}))
+    dbm.save_obj(at)
+    dbm.add(model.ChoosenAnnoTask(user_id=1, anno_task_id=at.idx))
+    img = model.ImageAnno(anno_task_id=at.idx, iteration=0, sim_class=1,
+        state=state.Anno.UNLOCKED)
+    dbm.save_obj(img)
+    for i in range(n_annos):
+        if anno_type == 'annoBased':
+            dbm.add(model.TwoDAnno(anno_task_id=at.idx, img_anno_id=img.idx,
+                iteration=0, sim_class=1, state=state.Anno.UNLOCKED))
+        else:
+            dbm.add(model.ImageAnno(anno_task_id=at.idx, iteration=0,
+                sim_class=1, state=state.Anno.UNLOCKED))
+    anno_counter.reconcile(dbm.session, at.idx)
+    dbm.commit()
+    return at, leaf
+
+def get_counters(dbm, at, anno_type=anno_counter.TWO_D_ANNO):
+    counters = anno_counter.get_counters(dbm.session, at.idx, anno_type)
+    dbm.commit()
+    return counters
+
+class TestMia(object):
+    def test_next(self, dbm):
+        at, leaf = create_task(dbm)
+        dbm.statements.clear()
+        res = mia.get_next(dbm, 1, 4)
+        assert len(res['images']) == 4
+        assert len([s for s in dbm.statements if s.startswith('UPDATE two_d_anno')]) == 1
+        assert len([s for s in dbm.statements if s.startswith('SELECT')]) <= 12
+        ids = [img['id'] for img in res['images']]
+        locked = dbm.session.query(model.TwoDAnno)\
+            .filter(model.TwoDAnno.state==state.Anno.LOCKED).all()
+        assert sorted(a.idx for a in locked) == sorted(ids)
+        assert all(a.user_id == 1 and a.timestamp_lock for a in locked)
+        assert get_counters(dbm, at)['locked'] == 4
+        # Less annotations requested than locked: the rest is unlocked
+        res = mia.get_next(dbm, 1, 2)
+        assert len(res['images']) == 2
+        assert get_counters(dbm, at)['locked'] == 2
+
+    def test_lock_stale(self, dbm):
+        at, leaf = create_task(dbm)
+        annos = dbm.session.query(model.TwoDAnno).order_by(model.TwoDAnno.idx).all()
+        locked = dbm.lock_annos(model.TwoDAnno, annos[:2], datetime.now(),
+            user_id=2, anno_state=state.Anno.LOCKED)
+        assert locked == annos[:2]
+        # Another annotator read the annotations before they were locked
+        for anno in annos[:2]:
+            set_committed_value(anno, 'state', state.Anno.UNLOCKED)
+        locked = dbm.lock_annos(model.TwoDAnno, annos, datetime.now(),
+            user_id=1, anno_state=state.Anno.LOCKED)
+        assert locked == annos[2:]
+        dbm.commit()
+        assert [a.user_id for a in annos] == [2, 2, 1, 1, 1, 1]
+        assert all(a.state == state.Anno.LOCKED for a in annos)
+        assert get_counters(dbm, at)['locked'] == 6
+
+    def test_update(self, dbm):
+        at, leaf = create_task(dbm)
+        ids = [img['id'] for img in mia.get_next(dbm, 1, 3)['images']]
+        data = {'labels': [{'id': leaf.idx}], 'images': [
+            {'id': ids[0], 'is_active': True}, {'id': ids[1], 'is_active': True},
+            {'id': ids[2], 'is_active': False}]}
+        mia.update(dbm, 1, data)
+        annos = {a.idx: a for a in dbm.session.query(model.TwoDAnno)}
+        assert annos[ids[0]].state == state.Anno.LABELED
+        assert annos[ids[2]].state == state.Anno.LOCKED_PRIORITY
+        assert dbm.session.query(model.Label).count() == 2
+        counters = get_counters(dbm, at)
+        assert counters['labeled'] == 2 and counters['locked'] == 1
+        # Labeled annotations can be requested again
+        res = mia.get_special(dbm, 1, ids[:1])
+        assert [img['id'] for img in res['images']] == ids[:1]
+        assert dbm.session.query(model.Label).count() == 1
+        counters = get_counters(dbm, at)
+        assert counters['labeled'] == 1 and counters['locked'] == 2
+
+    def test_image_based(self, dbm):
+        at, leaf = create_task(dbm, 'imageBased')
+        res = mia.get_next(dbm, 1, 5)
+        assert len(res['images']) == 5
+        assert all(img['type'] == 'imageBased' for img in res['images'])
+        assert get_counters(dbm, at, anno_counter.IMAGE_ANNO)['locked'] == 5
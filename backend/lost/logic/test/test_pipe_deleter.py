@@ -0,0 +1,83 @@
+import os
+import pytest
+from lost.db import model, state, dtype
+from lost.logic.pipeline import deleter
+
+def create_pipe(dbm, n_imgs=5, n_annos=3):
+    leaf = dbm.session.query(model.LabelLeaf).first()
+    if leaf is None:
+        leaf = model.LabelLeaf(name='leaf', is_root=True)
+        dbm.save_obj(leaf)
+    pipe = model.Pipe(name='pipe', state=state.Pipe.IN_PROGRESS)
+    dbm.save_obj(pipe)
+    pe_script = model.PipeElement(pipe_id=pipe.idx, dtype=dtype.PipeElement.SCRIPT)
+    pe_anno = model.PipeElement(pipe_id=pipe.idx, dtype=dtype.PipeElement.ANNO_TASK)
+    pe_loop = model.PipeElement(pipe_id=pipe.idx, dtype=dtype.PipeElement.LOOP)
+    result = model.Result()
+    dbm.add(pe_script)
+    dbm.add(pe_anno)
+    dbm.add(pe_loop)
+    dbm.add(result)
+    dbm.commit()
+    anno_task = model.AnnoTask(pipe_element_id=pe_anno.idx, name='task',
+        dtype=dtype.AnnoTask.SIA)
+    dbm.add(anno_task)
+    dbm.add(model.ResultLink(result_id=result.idx, pe_n=pe_script.idx,
+        pe_out=pe_anno.idx))
+    dbm.add(model.Loop(pipe_element_id=pe_loop.idx, pe_jump_id=pe_script.idx))
+    dbm.add(model.VisualOutput(result_id=result.idx))
+    dbm.commit()
+    dbm.add(model.AnnoTaskCounter(anno_task_id=anno_task.idx))
+    dbm.add(model.RequiredLabelLeaf(anno_task_id=anno_task.idx,
+        label_leaf_id=leaf.idx))
+    for i in range(n_imgs):
+        img = model.ImageAnno(anno_task_id=anno_task.idx, result_id=result.idx)
+        dbm.add(img)
+        dbm.session.flush()
+        dbm.add(model.Label(img_anno_id=img.idx, label_leaf_id=leaf.idx))
+        for j in range(n_annos):
+            twod = model.TwoDAnno(anno_task_id=anno_task.idx, img_anno_id=img.idx)
+            dbm.add(twod)
+            dbm.session.flush()
+            dbm.add(model.Label(two_d_anno_id=twod.idx,
+                label_leaf_id=leaf.idx))
+    dbm.commit()
+    return pipe
+
+def count_rows(dbm):
+    return {table.name: dbm.session.query(table).count()
+        for table in model.Base.metadata.sorted_tables}
+
+class TestPipeDeleter(object):
+    def test_delete(self, dbm):
+        other = create_pipe(dbm, 2, 2)
+        before = count_rows(dbm)
+        pipe = create_pipe(dbm)
+        calls = []
+        pipe_deleter = deleter.PipeDeleter(dbm, pipe.idx, batch_size=4,
+            progress=lambda *args: calls.append(args))
+        totals = pipe_deleter.count()
+        assert totals['two_d_anno'] == 15 and totals['image_anno'] == 5
+        deleted = pipe_deleter.delete()
+        assert deleted['two_d_anno'] == 15 and deleted['pipe'] == 1
+        assert calls[0] == ('two_d_anno', 4, 15)
+        assert ('two_d_anno', 15, 15) in calls
+        assert count_rows(dbm) == before
+        assert dbm.get_pipe(pipe_id=other.idx) is not None
+
+    def test_resume(self, dbm):
+        pipe_id = create_pipe(dbm).idx
+        assert deleter.mark_deleted(dbm, pipe_id)
+
+        def interrupt(name, count, total):
+            raise KeyboardInterrupt()
+
+        with pytest.raises(KeyboardInterrupt):
+            deleter.PipeDeleter(dbm, pipe_id, batch_size=4,
+                progress=interrupt).delete()
+        assert count_rows(dbm)['two_d_anno'] == 11
+        assert dbm.get_pipe_ids_to_delete() == [pipe_id]
+        assert deleter.delete_marked_pipes(dbm) == [pipe_id]
+        rows = count_rows(dbm)
+        assert rows['pipe'] == rows['pipe_element'] == rows['label'] == 0
+        assert rows['label_leaf'] == 1
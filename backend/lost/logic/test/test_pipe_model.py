@@ -0,0 +1,45 @@
+from lost.logic.pipeline.pipe_model import PipeTopology, TopologyCache
+
+class FakePe(object):
+    def __init__(self, idx):
+        self.idx = idx
+        self.pe_outs = list()
+
+def get_pe_list():
+    # datasource -> script -> annotask -> loop (jump to script) -> export
+    pes = [FakePe(idx) for idx in [10, 11, 12, 13, 14]]
+    for pe, pe_out in zip(pes[:-1], pes[1:]):
+        pe.pe_outs.append(pe_out)
+    return pes
+
+class TestPipeTopology(object):
+    def test_structure(self):
+        pes = get_pe_list()
+        topo = PipeTopology(pes)
+        assert topo.vertex_map == {10: 1, 11: 2, 12: 3, 13: 4, 14: 5}
+        assert topo.prev[1] == [0]
+        assert topo.next[5] == [topo.sink]
+        assert topo.topo_order == [0, 1, 2, 3, 4, 5, 6]
+
+    def test_loop_vertices(self):
+        topo = PipeTopology(get_pe_list())
+        graph = topo.create_graph()
+        assert topo.get_loop_vertices(graph, 2, 4) == [2, 3, 4]
+
+class TestTopologyCache(object):
+    def test_get_and_invalidate(self):
+        cache = TopologyCache(max_size=2)
+        pes = get_pe_list()
+        topo = cache.get(1, pes)
+        assert cache.get(1, pes) is topo
+        # Other elements result in a new structure version
+        assert cache.get(1, [FakePe(20), FakePe(21)]) is not topo
+        cache.invalidate(1)
+        assert len(cache.mem) == 0
+
+    def test_max_size(self):
+        cache = TopologyCache(max_size=2)
+        pes = get_pe_list()
+        for pipe_id in range(3):
+            cache.get(pipe_id, pes)
+        assert [k[0] for k in cache.mem] == [1, 2]
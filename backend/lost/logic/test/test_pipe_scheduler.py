@@ -0,0 +1,37 @@
+import threading
+from lost.logic.pipeline import scheduler
+from lost.logic.pipeline.scheduler import PipeScheduler, LocalBackend, FileBackend
+
+class TestLocalBackend(object):
+    def test_notify_and_wait(self):
+        sched = PipeScheduler(LocalBackend())
+        sched.notify(1, scheduler.ANNO_TASK_FINISHED)
+        sched.notify(2, scheduler.PIPE_PLAYED)
+        sched.notify(1, scheduler.SCRIPT_FINISHED)
+        events = sched.wait(0)
+        assert list(events.keys()) == [1, 2]
+        assert events[1] == {scheduler.ANNO_TASK_FINISHED, scheduler.SCRIPT_FINISHED}
+        assert events[2] == {scheduler.PIPE_PLAYED}
+        assert len(sched.wait(0)) == 0
+
+    def test_wait_timeout(self):
+        sched = PipeScheduler(LocalBackend())
+        assert len(sched.wait(0.01)) == 0
+
+    def test_wake_up_from_other_thread(self):
+        sched = PipeScheduler(LocalBackend())
+        t = threading.Timer(0.05, sched.notify, args=(3, scheduler.LOOP_RELEASED))
+        t.start()
+        events = sched.wait(5)
+        t.join()
+        assert events[3] == {scheduler.LOOP_RELEASED}
+
+class TestFileBackend(object):
+    def test_notify_and_wait(self, tmp_path):
+        sched = PipeScheduler(FileBackend(str(tmp_path), poll=0.01))
+        sched.notify(5, scheduler.PIPE_PLAYED)
+        sched.notify(5, scheduler.SCRIPT_FINISHED)
+        # Events are visible for other backend instances on the same path
+        events = FileBackend(str(tmp_path), poll=0.01).pop_all(0)
+        assert events[5] == {scheduler.PIPE_PLAYED, scheduler.SCRIPT_FINISHED}
+        assert len(sched.wait(0.02)) == 0
@@ -0,0 +1,78 @@
+import json
+import pytest
+from lost.db import model, state, dtype
+from lost.logic.pipeline import service, scheduler
+
+TEMPLATE = {'name': 'sia', 'elements': [
+    {'peN': 0, 'peOut': [1], 'datasource': {'type': 'rawFile'}},
+    {'peN': 1, 'peOut': [2], 'script': {'name': 'request_annos'}},
+    {'peN': 2, 'peOut': [3], 'annoTask': {'type': 'sia', 'configuration': {}}},
+    {'peN': 3, 'peOut': [4], 'loop': {'peJumpId': 1}},
+    {'peN': 4, 'peOut': None, 'dataExport': {}},
+]}
+
+def get_data(template_id, name='pipe', label_leaf_id=1):
+    return {'templateId': template_id, 'name': name, 'description': 'desc',
+        'elements': [
+            {'peN': 0, 'datasource': {'selectedPath': 'imgs', 'fs_id': 1}},
+            {'peN': 1, 'script': {'isDebug': False}},
+            {'peN': 2, 'annoTask': {'name': 'task', 'instructions': '',
+                'workerId': -1,
+                'labelLeaves': [{'id': label_leaf_id, 'maxLabels': 3}]}},
+            {'peN': 3, 'loop': {'maxIteration': 2}},
+            {'peN': 4, 'dataExport': {}},
+        ]}
+
+@pytest.fixture
+def dbm(dbm, monkeypatch):
+    monkeypatch.setattr(scheduler, '_scheduler',
+        scheduler.PipeScheduler(scheduler.LocalBackend()))
+    dbm.save_obj(model.Script(name='request_annos'))
+    dbm.save_obj(model.LabelLeaf(name='leaf', is_root=True))
+    template = model.PipeTemplate(json_template=json.dumps(TEMPLATE))
+    dbm.save_obj(template)
+    dbm.template_id = template.idx
+    return dbm
+
+class TestPipeStarter(object):
+    def test_start(self, dbm):
+        pipe_id = service.start(dbm, get_data(dbm.template_id), 1, 1)
+        pipe = dbm.get_pipe(pipe_id=pipe_id)
+        assert pipe.state == state.Pipe.PENDING and not pipe.is_locked
+        pes = {pe.dtype: pe for pe in pipe.pe_list}
+        assert len(pes) == 5
+        anno_task = pes[dtype.PipeElement.ANNO_TASK].anno_task
+        assert anno_task.group_id is None
+        assert [(r.label_leaf_id, r.max_labels)
+            for r in anno_task.req_label_leaves] == [(1, 3)]
+        loop = dbm.session.query(model.Loop).one()
+        assert loop.pe_jump_id == pes[dtype.PipeElement.SCRIPT].idx
+        links = sorted((rl.pe_n, rl.pe_out, rl.result_id)
+            for rl in dbm.session.query(model.ResultLink))
+        result = dbm.session.query(model.Result).one()
+        pe_ids = [pes[d].idx for d in (dtype.PipeElement.DATASOURCE,
+            dtype.PipeElement.SCRIPT, dtype.PipeElement.ANNO_TASK,
+            dtype.PipeElement.LOOP, dtype.PipeElement.DATA_EXPORT)]
+        assert links == [(pe_ids[0], pe_ids[1], None),
+            (pe_ids[1], pe_ids[2], result.idx),
+            (pe_ids[2], pe_ids[3], result.idx),
+            (pe_ids[3], pe_ids[4], result.idx),
+            (pe_ids[4], None, None)]
+        assert list(scheduler.get_scheduler().wait(0)) == [pipe_id]
+
+    def test_start_many(self, dbm):
+        data = [get_data(dbm.template_id, 'p{}'.format(i)) for i in range(3)]
+        pipe_ids = service.start_many(dbm, data, 1, 1)
+        assert [dbm.get_pipe(pipe_id=i).name for i in pipe_ids] == ['p0', 'p1', 'p2']
+        assert dbm.session.query(model.PipeElement).count() == 15
+        assert dbm.session.query(model.ResultLink).count() == 15
+        assert dbm.session.query(model.RequiredLabelLeaf).count() == 3
+
+    def test_rollback(self, dbm):
+        data = [get_data(dbm.template_id), get_data(dbm.template_id)]
+        del data[1]['elements'][2]['annoTask']['labelLeaves'][0]['maxLabels']
+        with pytest.raises(KeyError):
+            service.start_many(dbm, data, 1, 1)
+        assert dbm.session.query(model.Pipe).count() == 0
+        assert dbm.session.query(model.PipeElement).count() == 0
+        assert list(scheduler.get_scheduler().wait(0)) == []
@@ -0,0 +1,50 @@
+import json
+from datetime import datetime
+from lost.db import model, state
+from lost.logic.pipeline import service
+from lost.logic.template import TemplateMetaCache
+
+def add_template(dbm, name):
+    template = model.PipeTemplate(json_template=json.dumps({'name': name,
+        'description': 'desc', 'elements': []}), timestamp=datetime(2021, 1, 1))
+    dbm.save_obj(template)
+    return template
+
+class TestPipelineList(object):
+    def test_format_progress(self):
+        assert service.format_progress(1, 3) == '33%'
+        assert service.format_progress(0, 0) == '0%'
+
+    def test_template_meta_cache(self, dbm):
+        template = add_template(dbm, 'first')
+        cache = TemplateMetaCache()
+        meta = cache.get_many(dbm, [template.idx, None, 42])
+        assert meta == {template.idx: {'name': 'first', 'description': 'desc',
+            'author': 'Unknown author'}}
+        template.json_template = json.dumps({'name': 'changed'})
+        dbm.save_obj(template)
+        assert cache.get_many(dbm, [template.idx])[template.idx]['name'] == 'first'
+        template.timestamp = datetime(2021, 1, 2)
+        dbm.save_obj(template)
+        assert cache.get_many(dbm, [template.idx])[template.idx]['name'] == 'changed'
+
+    def test_get_pipelines(self, dbm):
+        group = model.Group(name='designer')
+        dbm.save_obj(group)
+        template = add_template(dbm, 'tmpl')
+        for idx, (pipe_state, debug) in enumerate([(state.Pipe.IN_PROGRESS, False),
+            (state.Pipe.PAUSED, None), (state.Pipe.DELETED, False),
+            (state.Pipe.IN_PROGRESS, True)]):
+            pipe = model.Pipe(name='p{}'.format(idx), state=pipe_state,
+                manager_id=1, pipe_template_id=template.idx, group_id=group.idx,
+                timestamp=datetime(2021, 1, 1), is_debug_mode=debug)
+            dbm.save_obj(pipe)
+            for pe_state in [state.PipeElement.FINISHED, state.PipeElement.PENDING]:
+                dbm.save_obj(model.PipeElement(pipe_id=pipe.idx, state=pe_state))
+        pipes = service.get_pipelines(dbm, [group.idx])['pipes']
+        assert [p['name'] for p in pipes] == ['p0', 'p1']
+        assert [p['progress'] for p in pipes] == ['50%', 'PAUSED']
+        assert pipes[0]['templateName'] == 'tmpl'
+        assert pipes[0]['creatorName'] == 'designer'
+        pipes = service.get_pipelines(dbm, [group.idx], debug_mode=True)['pipes']
+        assert [p['name'] for p in pipes] == ['p3']
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import shutil
+from lost.logic.pipeline import script_env
+from lost.logic.pipeline.script_env import EnvCache
+
+class LOSTConfigDummy(object):
+    def __init__(self, allow_extra_pip=True, allow_extra_conda=True):
+        self.allow_extra_pip = allow_extra_pip
+        self.allow_extra_conda = allow_extra_conda
+
+class EnvCacheDummy(EnvCache):
+    '''Records commands instead of running them.'''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cmds = []
+
+    def _run(self, cmd):
+        self.cmds.append(cmd)
+        if 'venv' in cmd or 'create' in cmd:
+            os.makedirs(cmd[-1] if 'venv' in cmd else cmd[cmd.index('-p') + 1])
+
+def get_spec(pip='', conda='', **kwargs):
+    return script_env.get_spec(json.dumps({'pip': pip, 'conda': conda}),
+        LOSTConfigDummy(**kwargs))
+
+class TestScriptEnv(object):
+    def test_spec(self):
+        spec = get_spec(pip='scipy  numpy', conda='opencv')
+        assert spec == {'pip': ['numpy', 'scipy'], 'conda': ['opencv']}
+        assert script_env.spec_hash(spec) == \
+            script_env.spec_hash(get_spec(pip='numpy scipy', conda='opencv'))
+        assert script_env.spec_hash(spec) != \
+            script_env.spec_hash(get_spec(pip='numpy', conda='opencv'))
+        assert get_spec(pip='numpy', allow_extra_pip=False)['pip'] == []
+        assert script_env.is_empty(get_spec())
+        assert script_env.is_empty(script_env.get_spec(None, LOSTConfigDummy()))
+
+    def test_build_once(self, tmp_path):
+        cache = EnvCacheDummy(str(tmp_path), wheel_dir=str(tmp_path))
+        spec = get_spec(pip='numpy')
+        env_path = cache.get_env(spec)
+        assert cache.cmds[0][1:3] == ['-m', 'venv']
+        assert cache.cmds[1][-4:] == ['--find-links', str(tmp_path),
+            '--no-index', 'numpy']
+        assert cache.get_env(spec) == env_path
+        assert len(cache.cmds) == 2
+        assert script_env.get_program(env_path, 'pudb3') == \
+            os.path.join(env_path, 'bin', 'python') + ' -m pudb'
+        cache.get_env(get_spec(conda='opencv'))
+        assert cache.cmds[2][:2] == ['conda', 'create']
+        assert cache.cmds[3][-1] == 'opencv'
+
+    def test_cleanup(self, tmp_path):
+        cache = EnvCacheDummy(str(tmp_path), max_envs=2)
+        hashes = []
+        for pip in ['a', 'b', 'c']:
+            spec = get_spec(pip=pip)
+            cache.get_env(spec)
+            hashes.append(script_env.spec_hash(spec))
+            # mtime resolution of some filesystems
+            time.sleep(0.01)
+        assert cache.list_envs() == [hashes[2], hashes[1]]
+        assert not os.path.exists(cache.get_path(hashes[0]))
+        # Using an environment marks it as recently used
+        cache.get_env(get_spec(pip='b'))
+        time.sleep(0.01)
+        cache.get_env(get_spec(pip='a'))
+        assert cache.list_envs() == [hashes[0], hashes[1]]
+
+    def test_in_use(self, tmp_path):
+        cache = EnvCacheDummy(str(tmp_path), max_envs=1)
+        spec = get_spec(pip='a')
+        with cache.use_env(spec) as env_path:
+            assert os.path.isdir(env_path)
+            cache.get_env(get_spec(pip='b'))
+            # Environments in use are not removed
+            assert cache.is_ready(script_env.spec_hash(spec))
+        cache.get_env(get_spec(pip='c'))
+        assert not os.path.exists(env_path)
+        with cache.use_env(get_spec()) as env_path:
+            assert env_path is None
+
+    def test_removed_before_use(self, tmp_path):
+        cache = EnvCacheDummy(str(tmp_path))
+        spec = get_spec(pip='a')
+        env_path = cache.get_env(spec)
+        # Removed by another process after the ready check
+        checks = []
+        is_ready = cache.is_ready
+        def removed_is_ready(env_hash):
+            checks.append(env_hash)
+            if len(checks) == 1:
+                shutil.rmtree(env_path)
+                return True
+            return is_ready(env_hash)
+        cache.is_ready = removed_is_ready
+        assert cache.get_env(spec) == env_path
+        assert len(cache.cmds) == 4
+        assert os.path.exists(os.path.join(env_path, script_env.READY_FILE))
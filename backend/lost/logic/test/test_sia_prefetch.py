@@ -0,0 +1,25 @@
+from lost.logic.sia_prefetch import PrefetchCache
+
+class TestPrefetchCache(object):
+    def test_pop(self):
+        cache = PrefetchCache()
+        cache.put(1, 10, None, {'image': {'id': 10}})
+        assert (1, 10) in cache
+        assert cache.pop(2, 10, None) is None
+        assert cache.pop(1, 10, None) == {'image': {'id': 10}}
+        # Entries are only served once
+        assert cache.pop(1, 10, None) is None
+        assert cache.hits == 1
+
+    def test_updated_image(self):
+        cache = PrefetchCache()
+        cache.put(1, 10, 'before', {'image': {'id': 10}})
+        assert cache.pop(1, 10, 'after') is None
+
+    def test_bounds(self):
+        cache = PrefetchCache(max_size=2, ttl=0)
+        for img_id in range(3):
+            cache.put(1, img_id, None, dict())
+        assert (1, 0) not in cache
+        # Expired entries are not served
+        assert cache.pop(1, 2, None) is None
@@ -0,0 +1,95 @@
+import json
+import pytest
+from datetime import datetime
+from lost.db import model, state, dtype
+from lost.logic.sia import SiaUpdate
+
+def create_image(dbm):
+    '''Create a locked image with three bboxes, two of them labeled.'''
+    dbm.save_obj(model.User(user_name='annotator', password='pwd',
+        first_name='Anno', last_name='Tator'))
+    leafs = [model.LabelLeaf(name=name) for name in ('cat', 'dog')]
+    pipe = model.Pipe(name='pipe', state=state.Pipe.IN_PROGRESS)
+    for obj in leafs + [pipe]:
+        dbm.add(obj)
+    dbm.commit()
+    pe = model.PipeElement(pipe_id=pipe.idx, dtype=dtype.PipeElement.ANNO_TASK,
+        iteration=0)
+    dbm.save_obj(pe)
+    at = model.AnnoTask(pipe_element_id=pe.idx, dtype=dtype.AnnoTask.SIA)
+    dbm.save_obj(at)
+    img = model.ImageAnno(anno_task_id=at.idx, iteration=0, user_id=1,
+        state=state.Anno.LOCKED)
+    img.timestamp_lock = datetime.now()
+    dbm.save_obj(img)
+    two_ds = list()
+    for i in range(3):
+        two_d = model.TwoDAnno(anno_task_id=at.idx, img_anno_id=img.idx,
+            iteration=0, dtype=dtype.TwoDAnno.BBOX, state=state.Anno.UNLOCKED,
+            data=json.dumps({'x': 0.5, 'y': 0.5, 'w': 0.1, 'h': 0.1}))
+        if i > 0:
+            two_d.labels = [model.Label(label_leaf_id=leafs[0].idx,
+                dtype=dtype.Label.TWO_D_ANNO)]
+        dbm.add(two_d)
+        two_ds.append(two_d)
+    dbm.commit()
+    return at, img, leafs, [two_d.idx for two_d in two_ds]
+
+def get_data(img, leafs, two_d_ids, new_label_ids):
+    bbox = {'x': 0.2, 'y': 0.3, 'w': 0.1, 'h': 0.2}
+    return {
+        'imgId': img.idx,
+        'annoTime': 12.0,
+        'imgLabelChanged': False,
+        'imgLabelIds': [],
+        'isJunk': False,
+        'annotations': {'bBoxes': [
+            {'id': two_d_ids[0], 'status': 'database'},
+            {'id': two_d_ids[1], 'status': 'deleted'},
+            {'id': two_d_ids[2], 'status': 'changed', 'annoTime': 3.0,
+                'data': dict(bbox), 'labelIds': [leafs[1].idx]},
+            {'id': 'new_1', 'status': 'new', 'annoTime': 4.0,
+                'data': dict(bbox), 'labelIds': new_label_ids}
+        ]}
+    }
+
+class TestSiaUpdate(object):
+    def test_update(self, dbm):
+        at, img, leafs, two_d_ids = create_image(dbm)
+        data = get_data(img, leafs, two_d_ids, [leafs[0].idx, leafs[1].idx])
+        sia_update = SiaUpdate(dbm, data, 1, at)
+        assert sia_update.update() == 'success'
+        annos = sia_update.history_json['annotations']
+        assert [a['id'] for a in annos['unchanged']] == two_d_ids[:1]
+        assert [a['id'] for a in annos['deleted']] == two_d_ids[1:2]
+        assert annos['deleted'][0]['labels'][0]['label_leaf_id'] == [leafs[0].idx]
+        changed = annos['changed'][0]
+        assert changed['id'] == two_d_ids[2]
+        assert changed['user_name'] == 'Anno Tator'
+        assert json.loads(changed['data']) == data['annotations']['bBoxes'][2]['data']
+        assert changed['labels'][0]['label_leaf_id'] == [leafs[1].idx]
+        new = annos['new'][0]
+        assert new['id'] not in two_d_ids and new['anno_time'] == 4.0
+        assert sorted(new['labels'][0]['label_leaf_name']) == ['cat', 'dog']
+        # Response matches the database
+        rows = {two_d.idx: two_d for two_d in dbm.session.query(model.TwoDAnno)}
+        assert sorted(rows) == sorted([two_d_ids[0], two_d_ids[2], new['id']])
+        assert all(two_d.state == state.Anno.LABELED for two_d in rows.values())
+        assert dbm.session.query(model.Label).count() == 3
+        assert dbm.get_image_anno(img.idx).state == state.Anno.LABELED
+
+    def test_rollback(self, dbm):
+        at, img, leafs, two_d_ids = create_image(dbm)
+        # label_leaf_id is not nullable, so the label insert fails
+        data = get_data(img, leafs, two_d_ids, [None])
+        with pytest.raises(Exception):
+            SiaUpdate(dbm, data, 1, at).update()
+        rows = {two_d.idx: two_d for two_d in dbm.session.query(model.TwoDAnno)}
+        assert sorted(rows) == two_d_ids
+        assert all(two_d.state == state.Anno.UNLOCKED for two_d in rows.values())
+        assert rows[two_d_ids[2]].data == json.dumps(
+            {'x': 0.5, 'y': 0.5, 'w': 0.1, 'h': 0.1})
+        assert [lbl.label_leaf_id for lbl in rows[two_d_ids[2]].labels] \
+            == [leafs[0].idx]
+        assert dbm.session.query(model.Label).count() == 2
+        assert dbm.get_image_anno(img.idx).state == state.Anno.LOCKED
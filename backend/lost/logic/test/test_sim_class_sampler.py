@@ -0,0 +1,37 @@
+import random
+from collections import Counter
+from lost.db import model, state
+from lost.db.access import sample_sim_class
+
+def add_annos(session, sim_class, count, anno_state=state.Anno.UNLOCKED,
+    anno_task_id=1):
+    for _ in range(count):
+        session.add(model.ImageAnno(anno_task_id=anno_task_id, iteration=0,
+            sim_class=sim_class, state=anno_state))
+    session.commit()
+
+class TestSampleSimClass(object):
+    def test_unlocked_only(self, session):
+        add_annos(session, 1, 5)
+        add_annos(session, 2, 5, state.Anno.LOCKED)
+        add_annos(session, 3, 5, state.Anno.LABELED)
+        add_annos(session, 4, 5, anno_task_id=2)
+        rand = random.Random(0)
+        for _ in range(20):
+            row = sample_sim_class(session, model.ImageAnno, 1, rand)
+            assert row.sim_class == 1
+
+    def test_weighted_by_count(self, session):
+        add_annos(session, 1, 10)
+        add_annos(session, 2, 30)
+        rand = random.Random(42)
+        n_samples = 2000
+        counter = Counter(sample_sim_class(session, model.ImageAnno, 1,
+            rand).sim_class for _ in range(n_samples))
+        assert abs(counter[1] / n_samples - 0.25) < 0.05
+        assert abs(counter[2] / n_samples - 0.75) < 0.05
+
+    def test_none_left(self, session):
+        assert sample_sim_class(session, model.ImageAnno, 1) is None
+        add_annos(session, 1, 3, state.Anno.LOCKED)
+        assert sample_sim_class(session, model.ImageAnno, 1) is None
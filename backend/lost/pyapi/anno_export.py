@@ -0,0 +1,600 @@
+'''Columnar export of annotations.
+
+Annotations of a result set are loaded in chunks of images. Per chunk a
+fixed number of queries is executed (images, 2D annotations, labels and
+users) and the geometry of all 2D annotations is parsed with a single
+json.loads call. Rows have the same keys and order as
+:meth:`lost.db.model.ImageAnno.to_dict` in *flat* style, so DataFrames
+built from them have the same columns as
+:meth:`lost.db.model.ImageAnno.to_df`.
+'''
+import os
+import io
+import csv
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from lost.db import model, dtype
+
+CHUNK_SIZE = 1000
+
+IMG_COLUMNS = ['img_uid', 'img_timestamp', 'img_state', 'img_sim_class',
+    'img_frame_n', 'img_path', 'abs_path', 'img_iteration', 'img_user_id',
+    'img_anno_time', 'img_lbl', 'img_user', 'img_is_junk', 'img_fs_name']
+ANNO_COLUMNS = ['anno_uid', 'anno_timestamp', 'anno_state', 'anno_dtype',
+    'anno_sim_class', 'anno_iteration', 'anno_user_id', 'anno_user',
+    'anno_confidence', 'anno_anno_time', 'anno_lbl', 'anno_style',
+    'anno_format', 'anno_comment', 'anno_data']
+
+LBL_TYPE = pa.list_(pa.string())
+COLUMN_TYPES = {
+    'img_uid': pa.int64(),
+    'img_timestamp': pa.timestamp('us'),
+    'img_state': pa.int64(),
+    'img_sim_class': pa.int64(),
+    'img_frame_n': pa.int64(),
+    'img_path': pa.string(),
+    'abs_path': pa.string(),
+    'img_iteration': pa.int64(),
+    'img_user_id': pa.int64(),
+    'img_anno_time': pa.float64(),
+    'img_lbl': LBL_TYPE,
+    'img_user': pa.string(),
+    'img_is_junk': pa.bool_(),
+    'img_fs_name': pa.string(),
+    'anno_uid': pa.int64(),
+    'anno_timestamp': pa.timestamp('us'),
+    'anno_state': pa.int64(),
+    'anno_dtype': pa.string(),
+    'anno_sim_class': pa.int64(),
+    'anno_iteration': pa.int64(),
+    'anno_user_id': pa.int64(),
+    'anno_user': pa.string(),
+    'anno_confidence': pa.float64(),
+    'anno_anno_time': pa.float64(),
+    'anno_lbl': LBL_TYPE,
+    'anno_style': pa.string(),
+    'anno_format': pa.string(),
+    'anno_comment': pa.string(),
+    'anno_data': pa.list_(pa.list_(pa.float64()))
+}
+
+def _empty_anno():
+    '''Row part of an image without 2D annotation, see
+    :meth:`lost.db.model.TwoDAnno.to_dict`'''
+    return {
+        'anno_uid': None,
+        'anno_timestamp': None,
+        'anno_state': None,
+        'anno_dtype': None,
+        'anno_sim_class': None,
+        'anno_iteration': 0,
+        'anno_user_id': None,
+        'anno_user': None,
+        'anno_confidence': None,
+        'anno_anno_time': None,
+        'anno_lbl': [],
+        'anno_style': '',
+        'anno_format': 'rel',
+        'anno_comment': None,
+        'anno_data': [[None]]
+    }
+
+def _add_meta(row, meta):
+    try:
+        if meta is not None:
+            for key, val in json.loads(meta).items():
+                row[f'meta_{key}'] = val
+    except:
+        pass
+
+def _anno_style(anno_dtype):
+    if anno_dtype == dtype.TwoDAnno.BBOX:
+        return 'xcycwh'
+    elif anno_dtype in (dtype.TwoDAnno.POINT, dtype.TwoDAnno.LINE,
+        dtype.TwoDAnno.POLYGON):
+        return 'xy'
+    elif anno_dtype is None:
+        return ''
+    else:
+        raise Exception('Unknown TwoDAnno type!')
+
+def _serialization_format(anno_dtype, data):
+    '''Same as :meth:`lost.db.model.TwoDAnno.get_anno_serialization_format`
+    for already parsed data.'''
+    if anno_dtype == dtype.TwoDAnno.BBOX:
+        return [[data['x'], data['y'], data['w'], data['h']]]
+    elif anno_dtype == dtype.TwoDAnno.POINT:
+        return [[data['x'], data['y']]]
+    elif anno_dtype in (dtype.TwoDAnno.LINE, dtype.TwoDAnno.POLYGON):
+        return [[e['x'], e['y']] for e in data]
+    elif anno_dtype is None:
+        return [[None]]
+    else:
+        raise Exception('Unknown TwoDAnno type!')
+
+def parse_anno_data(anno_dtypes, datas):
+    '''Parse the json data of many 2D annotations at once.
+
+    Args:
+        anno_dtypes (list of int): dtype of each annotation.
+        datas (list of str): json data of each annotation.
+
+    Returns:
+        list: Annotation data in serialization format.
+    '''
+    to_parse = [data for anno_dtype, data in zip(anno_dtypes, datas)
+        if anno_dtype is not None]
+    parsed = iter(json.loads('[{}]'.format(','.join(to_parse))))
+    return [_serialization_format(anno_dtype,
+        next(parsed) if anno_dtype is not None else None)
+        for anno_dtype in anno_dtypes]
+
+def get_img_anno_ids(dbm, result_ids):
+    '''Get ids of all image annotations of results in export order.'''
+    ids = []
+    for result_id in result_ids:
+        ids += [row.idx for row in dbm.session.query(model.ImageAnno.idx)\
+            .filter(model.ImageAnno.result_id==result_id)\
+            .order_by(model.ImageAnno.idx)]
+    return ids
+
+class _Loader(object):
+    '''Load rows for chunks of image annotations.
+
+    File systems and user names are cached between chunks.
+    '''
+
+    def __init__(self, dbm):
+        self.dbm = dbm
+        self.fs = dict()
+        self.users = dict()
+
+    def _load_users(self, user_ids):
+        missing = set(user_ids) - set(self.users.keys()) - {None}
+        if missing:
+            for idx, user_name in self.dbm.session.query(model.User.idx,
+                model.User.user_name).filter(model.User.idx.in_(missing)):
+                self.users[idx] = user_name
+
+    def _load_fs(self, fs_ids):
+        missing = set(fs_ids) - set(self.fs.keys()) - {None}
+        if missing:
+            for idx, root_path, name in self.dbm.session.query(
+                model.FileSystem.idx, model.FileSystem.root_path,
+                model.FileSystem.name).filter(model.FileSystem.idx.in_(missing)):
+                self.fs[idx] = (root_path, name)
+
+    def _load_labels(self, owner_column, query_filter):
+        labels = dict()
+        for owner_id, name in self.dbm.session.query(owner_column,
+            model.LabelLeaf.name)\
+            .join(model.LabelLeaf, model.LabelLeaf.idx==model.Label.label_leaf_id)\
+            .filter(query_filter).order_by(model.Label.idx):
+            labels.setdefault(owner_id, []).append(name)
+        return labels
+
+    def load(self, img_ids):
+        '''Get flat rows for image annotations.
+
+        Args:
+            img_ids (list of int): Ids of image annotations.
+
+        Returns:
+            list of dict: One row per image and one per 2D annotation.
+        '''
+        IA = model.ImageAnno
+        TA = model.TwoDAnno
+        imgs = self.dbm.session.query(IA.idx, IA.timestamp, IA.state,
+            IA.sim_class, IA.frame_n, IA.img_path, IA.iteration, IA.user_id,
+            IA.anno_time, IA.is_junk, IA.fs_id, IA.meta)\
+            .filter(IA.idx.in_(img_ids)).all()
+        annos = self.dbm.session.query(TA.idx, TA.img_anno_id, TA.timestamp,
+            TA.state, TA.dtype, TA.sim_class, TA.iteration, TA.user_id,
+            TA.confidence, TA.anno_time, TA.description, TA.meta, TA.data)\
+            .filter(TA.img_anno_id.in_(img_ids)).order_by(TA.idx).all()
+        img_lbls = self._load_labels(model.Label.img_anno_id,
+            model.Label.img_anno_id.in_(img_ids))
+        anno_lbls = self._load_labels(model.Label.two_d_anno_id,
+            model.Label.two_d_anno_id.in_(
+                self.dbm.session.query(TA.idx).filter(TA.img_anno_id.in_(img_ids))))
+        self._load_users([img.user_id for img in imgs] + [a.user_id for a in annos])
+        self._load_fs([img.fs_id for img in imgs])
+        anno_datas = parse_anno_data([a.dtype for a in annos],
+            [a.data for a in annos])
+        img_annos = dict()
+        for anno, anno_data in zip(annos, anno_datas):
+            anno_dict = {
+                'anno_uid': anno.idx,
+                'anno_timestamp': anno.timestamp,
+                'anno_state': anno.state,
+                'anno_dtype': dtype.TwoDAnno.TYPE_TO_STR.get(anno.dtype),
+                'anno_sim_class': anno.sim_class,
+                'anno_iteration': anno.iteration,
+                'anno_user_id': anno.user_id,
+                'anno_user': self.users.get(anno.user_id),
+                'anno_confidence': anno.confidence,
+                'anno_anno_time': anno.anno_time,
+                'anno_lbl': anno_lbls.get(anno.idx, []),
+                'anno_style': _anno_style(anno.dtype),
+                'anno_format': 'rel',
+                'anno_comment': anno.description
+            }
+            _add_meta(anno_dict, anno.meta)
+            anno_dict['anno_data'] = anno_data
+            img_annos.setdefault(anno.img_anno_id, []).append(anno_dict)
+        imgs = {img.idx: img for img in imgs}
+        rows = []
+        for img_id in img_ids:
+            img = imgs[img_id]
+            root_path, fs_name = self.fs[img.fs_id]
+            img_dict = {
+                'img_uid': img.idx,
+                'img_timestamp': img.timestamp,
+                'img_state': img.state,
+                'img_sim_class': img.sim_class,
+                'img_frame_n': img.frame_n,
+                'img_path': img.img_path,
+                'abs_path': os.path.join(root_path, img.img_path),
+                'img_iteration': img.iteration,
+                'img_user_id': img.user_id,
+                'img_anno_time': img.anno_time,
+                'img_lbl': img_lbls.get(img.idx, []),
+                'img_user': self.users.get(img.user_id),
+                'img_is_junk': img.is_junk,
+                'img_fs_name': fs_name
+            }
+            _add_meta(img_dict, img.meta)
+            rows.append(dict(img_dict, **_empty_anno()))
+            for anno_dict in img_annos.get(img_id, []):
+                rows.append(dict(img_dict, **anno_dict))
+        return rows
+
+def iter_rows(dbm, result_ids, chunk_size=CHUNK_SIZE, img_ids=None):
+    '''Iterate over flat annotation rows of results in chunks of images.
+
+    Args:
+        dbm (DBMan): Database manager.
+        result_ids (list of int): Ids of results to export.
+        chunk_size (int): Number of images per chunk.
+        img_ids (list of int): Ids of the image annotations of the results
+            if already known.
+
+    Returns:
+        Iterator of list of dict: Rows of one chunk.
+    '''
+    if img_ids is None:
+        img_ids = get_img_anno_ids(dbm, result_ids)
+    loader = _Loader(dbm)
+    for i in range(0, len(img_ids), chunk_size):
+        yield loader.load(img_ids[i:i+chunk_size])
+
+def _to_object(df, column, is_int, none_mask=None):
+    '''Convert a column like pandas does when concatenating DataFrames of
+    single images where the column is of object dtype in some of them.
+
+    Args:
+        df (pandas.DataFrame): Rows of a chunk.
+        column (str): Column to convert.
+        is_int (bool): Values of the column are python ints.
+        none_mask (numpy.ndarray): Rows that are None in the result.
+    '''
+    series = df[column]
+    values = series.to_numpy(dtype=object)
+    if is_int:
+        # Images without missing values keep their int64 dtype
+        has_null = series.isnull().groupby(df['img_uid'].values)\
+            .transform('any').values
+        values[~has_null] = [int(v) for v in series.values[~has_null]]
+    if none_mask is not None:
+        values[none_mask] = None
+    df[column] = pd.Series(values, index=df.index, dtype=object)
+
+def _chunk_df(rows):
+    '''Create the DataFrame of a chunk with the dtypes that
+    concatenated ImageAnno.to_df results would have.
+
+    Returns:
+        tuple: (DataFrame, set of columns that hold python ints)
+    '''
+    df = pd.DataFrame(rows)
+    img_uids = df['img_uid'].values
+    int_columns = set()
+    for column in df.columns:
+        if df[column].dtype == object:
+            continue
+        values = [row.get(column) for row in rows]
+        if all(isinstance(v, int) and not isinstance(v, bool)
+            for v in values if v is not None):
+            int_columns.add(column)
+        null = pd.Series([v is None for v in values])
+        present = pd.Series([column in row for row in rows])
+        # An image where the column is None in all rows has object dtype
+        none_mask = (null.groupby(img_uids).transform('all') \
+            & present.groupby(img_uids).transform('any') & null).values
+        if none_mask.any():
+            _to_object(df, column, column in int_columns, none_mask)
+    # Index is counted per image like in ImageAnno.to_df
+    df.index = df.groupby('img_uid', sort=False).cumcount().values
+    return df, int_columns
+
+def iter_dfs(dbm, result_ids, chunk_size=CHUNK_SIZE):
+    '''Iterate over annotations of results as DataFrames.
+
+    Args:
+        dbm (DBMan): Database manager.
+        result_ids (list of int): Ids of results to export.
+        chunk_size (int): Number of images per DataFrame.
+
+    Returns:
+        Iterator of pandas.DataFrame
+    '''
+    for rows in iter_rows(dbm, result_ids, chunk_size):
+        yield _chunk_df(rows)[0]
+
+def to_df(dbm, result_ids, chunk_size=CHUNK_SIZE):
+    '''Get all annotations of results as one DataFrame.'''
+    chunks = [_chunk_df(rows) for rows in iter_rows(dbm, result_ids, chunk_size)]
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=IMG_COLUMNS + ANNO_COLUMNS)
+    object_columns = set()
+    for df, _ in chunks:
+        object_columns.update(c for c in df.columns if df[c].dtype == object)
+    for df, int_columns in chunks:
+        for column in object_columns:
+            if column in df.columns and df[column].dtype != object:
+                _to_object(df, column, column in int_columns)
+    return pd.concat([df for df, _ in chunks])
+
+def _per_image(df, rows, int_columns):
+    '''Undo changes of a chunk that single images do not have.
+
+    Columns that hold ints are float in a chunk if other images miss the
+    column. Meta columns are only part of images that have this meta key,
+    in the order they appear in the rows of the image.
+
+    Returns:
+        tuple: (DataFrame, list of column positions per row or None if all
+        rows have all columns in chunk order)
+    '''
+    df = df.copy()
+    for column in int_columns:
+        if df[column].dtype == float:
+            _to_object(df, column, True)
+    if not any(c.startswith('meta_') for c in df.columns):
+        return df, None
+    img_keys = dict()
+    for row in rows:
+        img_keys.setdefault(row['img_uid'], dict()).update(dict.fromkeys(row))
+    positions = {column: pos for pos, column in enumerate(df.columns)}
+    img_positions = {img_uid: [positions[k] for k in keys]
+        for img_uid, keys in img_keys.items()}
+    return df, [img_positions[row['img_uid']] for row in rows]
+
+def to_vec(dbm, result_ids, columns='all', chunk_size=CHUNK_SIZE):
+    '''Get all annotations of results in list style.
+
+    See :meth:`lost.db.model.ImageAnno.to_vec` for columns.
+    '''
+    vec_list = []
+    for rows in iter_rows(dbm, result_ids, chunk_size):
+        df, int_columns = _chunk_df(rows)
+        df, positions = _per_image(df, rows, int_columns)
+        if columns == 'all':
+            values = df.values.tolist()
+            if positions is not None:
+                values = [[row[p] for p in pos]
+                    for row, pos in zip(values, positions)]
+            vec_list += values
+        elif isinstance(columns, str):
+            # ImageAnno.to_vec returns an empty list for images without
+            # 2D annotations if the value is None
+            single = df.groupby('img_uid', sort=False)['img_uid']\
+                .transform('size').values == 1
+            vec_list += df[columns][~(single & pd.isnull(df[columns]).values)]\
+                .values.tolist()
+        else:
+            vec_list += df[columns].values.tolist()
+    return vec_list
+
+def _meta_type(types):
+    '''Get the arrow type for python types of meta values.
+
+    Returns:
+        pyarrow.DataType: None if values need to be json encoded.
+    '''
+    types = types - {type(None)}
+    if types == {bool}:
+        return pa.bool_()
+    if types == {int}:
+        return pa.int64()
+    if types and types <= {int, float}:
+        return pa.float64()
+    if types <= {str}:
+        return pa.string()
+    return None
+
+def _scan_meta(dbm, img_ids, chunk_size):
+    '''Get all columns and the value types of meta columns.
+
+    Returns:
+        tuple: (list of columns in the order of :func:`to_df`,
+        dict of meta column -> set of python types)
+    '''
+    columns = dict()
+    meta = dict()
+    for i in range(0, len(img_ids), chunk_size):
+        chunk = img_ids[i:i+chunk_size]
+        img_meta = dict()
+        for row in dbm.session.query(model.ImageAnno.idx, model.ImageAnno.meta)\
+            .filter(model.ImageAnno.idx.in_(chunk), model.ImageAnno.meta != None):
+            _add_meta(img_meta.setdefault(row.idx, dict()), row.meta)
+        anno_meta = dict()
+        for row in dbm.session.query(model.TwoDAnno.img_anno_id,
+            model.TwoDAnno.meta).filter(model.TwoDAnno.img_anno_id.in_(chunk),
+                model.TwoDAnno.meta != None).order_by(model.TwoDAnno.idx):
+            row_dict = dict()
+            _add_meta(row_dict, row.meta)
+            anno_meta.setdefault(row.img_anno_id, []).append(row_dict)
+        # Columns appear in the order of the rows of ImageAnno.to_dict
+        for img_id in chunk:
+            row_dicts = [img_meta.get(img_id, dict())] + anno_meta.get(img_id, [])
+            columns.update(dict.fromkeys(IMG_COLUMNS))
+            columns.update(dict.fromkeys(row_dicts[0]))
+            columns.update(dict.fromkeys(ANNO_COLUMNS))
+            for row_dict in row_dicts:
+                columns.update(dict.fromkeys(row_dict))
+                for key, val in row_dict.items():
+                    meta.setdefault(key, set()).add(type(val))
+    if not columns:
+        columns = dict.fromkeys(IMG_COLUMNS + ANNO_COLUMNS)
+    return list(columns), meta
+
+class Schema(object):
+    '''Columns and arrow types of an export.
+
+    Columns are known in advance, since the schema of streamed exports
+    can not change after the first batch was written. Meta columns are
+    collected by scanning the meta fields of all annotations. Meta values
+    that are neither numbers, bools nor strings are exported as json
+    strings.
+
+    Args:
+        dbm (DBMan): Database manager.
+        img_ids (list of int): Image annotations of the export.
+        chunk_size (int): Number of images per query.
+    '''
+
+    def __init__(self, dbm, img_ids, chunk_size=CHUNK_SIZE):
+        self.columns, meta = _scan_meta(dbm, img_ids, chunk_size)
+        self.json_columns = []
+        fields = []
+        for column in self.columns:
+            if column in meta:
+                arrow_type = _meta_type(meta[column])
+                if arrow_type is None:
+                    self.json_columns.append(column)
+                    arrow_type = pa.string()
+            else:
+                arrow_type = COLUMN_TYPES[column]
+            fields.append(pa.field(column, arrow_type))
+        self.arrow_schema = pa.schema(fields)
+
+    def conform(self, df):
+        '''Bring a batch into the column order of this schema.'''
+        df = df.reindex(columns=self.columns)
+        for column in self.json_columns:
+            df[column] = [json.dumps(v) if v is not None and not \
+                (isinstance(v, float) and v != v) else None for v in df[column]]
+        return df
+
+    def to_arrow(self, df):
+        '''Convert a batch into an arrow table.'''
+        df = self.conform(df).astype(object)
+        df = df.where(pd.notnull(df), None)
+        return pa.Table.from_pandas(df, schema=self.arrow_schema,
+            preserve_index=False)
+
+def iter_batches(dbm, result_ids, chunk_size=CHUNK_SIZE):
+    '''Read annotations of results in batches with a fixed schema.
+
+    Returns:
+        tuple: (:class:`Schema`, Iterator of pandas.DataFrame)
+    '''
+    img_ids = get_img_anno_ids(dbm, result_ids)
+    schema = Schema(dbm, img_ids, chunk_size)
+    batches = (_chunk_df(rows)[0]
+        for rows in iter_rows(dbm, result_ids, chunk_size, img_ids))
+    return schema, batches
+
+class _StreamSink(object):
+    '''File like object that collects written bytes until they are
+    drained.'''
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+        self.pos = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer.write(data)
+        self.pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = self.buffer.getvalue()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+def iter_parquet(dbm, result_ids, row_group_size=10000,
+    compression='snappy', chunk_size=CHUNK_SIZE):
+    '''Export annotations as parquet file in row groups.
+
+    Args:
+        dbm (DBMan): Database manager.
+        result_ids (list of int): Ids of results to export.
+        row_group_size (int): Number of rows per row group.
+        compression (str): Parquet compression codec.
+        chunk_size (int): Number of images per read batch.
+
+    Returns:
+        Iterator of bytes: Parts of the parquet file.
+    '''
+    schema, batches = iter_batches(dbm, result_ids, chunk_size)
+    sink = _StreamSink()
+    writer = pq.ParquetWriter(sink, schema.arrow_schema,
+        compression=compression)
+    pending = []
+    n_pending = 0
+    for df in batches:
+        table = schema.to_arrow(df)
+        pending.append(table)
+        n_pending += table.num_rows
+        if n_pending < row_group_size:
+            continue
+        table = pa.concat_tables(pending)
+        offset = 0
+        while table.num_rows - offset >= row_group_size:
+            writer.write_table(table.slice(offset, row_group_size))
+            offset += row_group_size
+        pending = [table.slice(offset)]
+        n_pending = table.num_rows - offset
+        yield sink.drain()
+    if n_pending > 0:
+        writer.write_table(pa.concat_tables(pending))
+    writer.close()
+    yield sink.drain()
+
+def iter_csv(dbm, result_ids, chunk_size=CHUNK_SIZE):
+    '''Export annotations as csv.
+
+    Returns:
+        Iterator of bytes: Header and one part per read batch.
+    '''
+    schema, batches = iter_batches(dbm, result_ids, chunk_size)
+    yield pd.DataFrame(columns=schema.columns).to_csv(index=False).encode('utf-8')
+    for df in batches:
+        yield schema.conform(df).to_csv(index=False, header=False,
+            quoting=csv.QUOTE_MINIMAL).encode('utf-8')
+
+def iter_jsonl(dbm, result_ids, chunk_size=CHUNK_SIZE):
+    '''Export annotations as json lines with one record per row.
+
+    Returns:
+        Iterator of bytes: One part per read batch.
+    '''
+    schema, batches = iter_batches(dbm, result_ids, chunk_size)
+    for df in batches:
+        yield schema.conform(df).to_json(orient='records', lines=True,
+            date_format='iso').encode('utf-8') + b'\n'
@@ -1,6 +1,7 @@
 from shutil import ExecError
 from lost.logic import file_man
 from lost.pyapi import pipe_elements
+from lost.pyapi import anno_export
 from lost.logic.file_man import DummyFileMan
 from lost.db import access, dtype
 from lost.db import model
@@ -11,6 +12,8 @@ import numpy as np
 import json
 from datetime import date, datetime
 
+TWOD_ANNO_TYPES = ['point', 'bbox', 'line', 'polygon']
+
 def _json_default(obj):
     """Try to serialize dates to isoformat"""
 
@@ -19,6 +22,43 @@ def _json_default(obj):
     elif isinstance(obj, np.ndarray):
         return obj.tolist()
     raise TypeError ("Type %s not serializable" % type(obj))
+
+def _is_missing(val):
+    '''Check if a cell value of a DataFrame is None or NaN'''
+    if val is None:
+        return True
+    if isinstance(val, float) and np.isnan(val):
+        return True
+    return False
+
+def _to_df(annos):
+    '''Convert columnar input (DataFrame, pyarrow Table or dict of lists)
+    into a pandas DataFrame.'''
+    if isinstance(annos, pd.DataFrame):
+        return annos
+    if hasattr(annos, 'to_pandas'):
+        return annos.to_pandas()
+    return pd.DataFrame(annos)
+
+def _encode_twod_data(anno_type, vec):
+    '''Encode an annotation vector like the TwoDAnno setters do.
+
+    Returns:
+        tuple: (data, dtype) of a :class:`model.TwoDAnno`
+
+    Raises:
+        ValueError: If anno_type is no known annotation type.
+    '''
+    if anno_type not in TWOD_ANNO_TYPES:
+        raise ValueError('Unknown *anno_dtype* {}! Use one of {}'.format(
+            anno_type, TWOD_ANNO_TYPES))
+    if isinstance(vec, np.ndarray):
+        # Nested lists become arrays of arrays when read from arrow
+        vec = [v.tolist() if isinstance(v, np.ndarray) else v for v in vec]
+    anno = model.TwoDAnno()
+    setattr(anno, anno_type, vec)
+    return anno.data, anno.dtype
+
 class Input(object):
     '''Class that represants an input of a pipeline element.
 
@@ -100,7 +140,7 @@ class Input(object):
             for img_anno in result.img_annos:
                 yield img_anno #type: lost.db.model.ImageAnno
     
-    def to_vec(self, columns='all'):
+    def to_vec(self, columns='all', chunk_size=anno_export.CHUNK_SIZE):
         '''Get a vector of all Annotations related to this object.
 
         Args:
@@ -138,13 +178,26 @@ class Input(object):
                     ['path/to/img3.jpg', 'Horse', [0.2, 0.15, 0.3, 0.18], 'bbox'] 
                 ]
         '''
-        vec_list = []
-        for result in self._results:
-            for img_anno in result.img_annos:
-                vec_list += img_anno.to_vec(columns)
-        return vec_list
+        return anno_export.to_vec(self._element._dbm, self._result_ids(),
+            columns, chunk_size)
 
-    def to_df(self):
+    def _result_ids(self):
+        return [result.idx for result in self._results]
+
+    def iter_df(self, chunk_size=anno_export.CHUNK_SIZE):
+        '''Iterate over all annotations related to this object in chunks.
+
+        Args:
+            chunk_size (int): Number of images per DataFrame.
+
+        Returns:
+            Iterator of pandas.DataFrame: DataFrames with the same columns
+            as returned by :meth:`to_df`.
+        '''
+        return anno_export.iter_dfs(self._element._dbm, self._result_ids(),
+            chunk_size)
+
+    def to_df(self, chunk_size=anno_export.CHUNK_SIZE):
         '''Get a pandas DataFrame of all annotations related to this object.
 
         Returns:
@@ -162,11 +215,8 @@ class Input(object):
                 'anno.confidence', 'anno.anno_time', 'anno.lbl.idx', 
                 'anno.lbl.name', 'anno.lbl.external_id', 'anno.data'
         '''
-        df_list = []
-        for result in self._results:
-            for img_anno in result.img_annos:
-                df_list.append(img_anno.to_df())
-        return pd.concat(df_list)
+        return anno_export.to_df(self._element._dbm, self._result_ids(),
+            chunk_size)
 
     @property
     def twod_annos(self):
@@ -456,6 +506,175 @@ class ScriptOutput(Output):
                     fm=fm, img_meta=img_meta, anno_meta=anno_meta,
                     img_comment=img_comment)
 
+    def request_annos_bulk(self, annos, fm=None, chunk_size=1000):
+        '''Request annotations for many images at once.
+
+        In contrast to calling *request_annos* for each image, all rows are
+        written with multi-row inserts. Each chunk of images is stored in
+        its own transaction.
+
+        Args:
+            annos (pandas.DataFrame or pyarrow.Table): Columnar annotation
+                data with one row per TwoDAnno. Rows of the same image share
+                the *img_path*. Images without TwoDAnnos are represented by
+                a row where *anno_data* is missing. Possible columns:
+                *img_path* (required), *img_lbl*, *img_sim_class*,
+                *img_frame_n*, *img_video_path*, *img_meta*, *img_comment*,
+                *anno_data*, *anno_dtype*, *anno_lbl*, *anno_sim_class*,
+                *anno_meta*. Semantics of the values are the same as for
+                the arguments of *request_annos*.
+            fm (obj): The FileSystemManager for the filesystem where the
+                images are located. Use lost standard filesystem if no
+                filesystem was given.
+            chunk_size (int): Number of images that are inserted per
+                transaction.
+
+        Returns:
+            int: Number of requested image annotations per connected
+            annotation task.
+
+        Example:
+            Request annotations for two images::
+
+                >>> df = pd.DataFrame({
+                ...     'img_path': ['path/to/img1.jpg', 'path/to/img1.jpg', 'path/to/img2.jpg'],
+                ...     'anno_data': [[0.1, 0.1, 0.2, 0.2], [0.1, 0.2], None],
+                ...     'anno_dtype': ['bbox', 'point', None],
+                ...     'anno_lbl': [[1], [4], None]
+                ... })
+                >>> self.outp.request_annos_bulk(df)
+        '''
+        df = _to_df(annos)
+        if 'img_path' not in df:
+            raise ValueError('*img_path* column is required!')
+        if 'anno_data' in df and 'anno_dtype' not in df:
+            raise ValueError('*anno_dtype* column is required for *anno_data*!')
+        if 'anno_data' in df:
+            # Check all types before the first chunk is inserted
+            for anno_data, anno_dtype in zip(df['anno_data'], df['anno_dtype']):
+                if not _is_missing(anno_data) and anno_dtype not in TWOD_ANNO_TYPES:
+                    raise ValueError('Unknown *anno_dtype* {}! Use one of {}'.format(
+                        anno_dtype, TWOD_ANNO_TYPES))
+        n_imgs = 0
+        for pe in self._connected_pes:
+            if pe.dtype == dtype.PipeElement.ANNO_TASK:
+                n_imgs = self._add_annos_bulk(pe, df, fm=fm, chunk_size=chunk_size)
+        return n_imgs
+
+    def _add_annos_bulk(self, pe, df, fm=None, chunk_size=1000):
+        '''Add annos in columnar style for a connected annotation task.
+
+        Args:
+            pe (PipeElement): The connected PipeElement where annotation
+                should be provided for.
+            df (pandas.DataFrame): See *request_annos_bulk*.
+            fm (obj): The FileSystemManager for the filesystem where the
+                images are located.
+            chunk_size (int): Number of images per transaction.
+
+        Returns:
+            int: Number of added image annotations.
+        '''
+        dbm = self._script._dbm
+        if fm is None:
+            fs_db = dbm.get_fs(name='lost_data')
+            fs = DummyFileMan(fs_db)
+            fm = file_man.FileMan(fs_db=fs.lost_fs)
+        lbl_map = pipe_elements.AnnoTask(pe, dbm).lbl_map
+        img_df = df.drop_duplicates('img_path')
+        if 'anno_data' in df:
+            anno_df = df[~df['anno_data'].isnull()]
+            anno_positions = anno_df.groupby('img_path', sort=False).indices
+        else:
+            anno_df = None
+            anno_positions = dict()
+        for start in range(0, len(img_df), chunk_size):
+            chunk = img_df.iloc[start:start+chunk_size]
+            self._insert_anno_chunk(pe, chunk, anno_df, anno_positions,
+                fm, lbl_map)
+        return len(img_df)
+
+    def _insert_anno_chunk(self, pe, img_chunk, anno_df, anno_positions,
+        fm, lbl_map):
+        '''Insert a chunk of images with all their annotations and labels
+        in one transaction.'''
+        dbm = self._script._dbm
+        session = dbm.session
+        iteration = self._script._pipe_element.iteration
+        anno_task_id = pe.anno_task.idx
+        result_id = self._result_map[pe.idx]
+        fs_id = fm.fs.lost_fs.idx
+        img_rows = list()
+        img_lbls = list()
+        for _, row in img_chunk.iterrows():
+            rel_img_path = fm.make_path_relative(row['img_path'])
+            img_sim_class = row.get('img_sim_class')
+            video_path = row.get('img_video_path')
+            if not _is_missing(video_path):
+                video_path = self._script.get_rel_path(video_path)
+            else:
+                video_path = None
+            img_meta = row.get('img_meta')
+            frame_n = row.get('img_frame_n')
+            comment = row.get('img_comment')
+            img_rows.append({
+                'anno_task_id': anno_task_id,
+                'img_path': rel_img_path,
+                'abs_path': os.path.join(fm.root_path, rel_img_path),
+                'state': state.Anno.UNLOCKED,
+                'result_id': result_id,
+                'iteration': iteration,
+                'frame_n': None if _is_missing(frame_n) else int(frame_n),
+                'video_path': video_path,
+                'sim_class': 1 if _is_missing(img_sim_class) else int(img_sim_class),
+                'fs_id': fs_id,
+                'description': None if _is_missing(comment) else comment,
+                'meta': None if _is_missing(img_meta) else json.dumps(img_meta, default=_json_default)
+            })
+            img_lbls.append(self._get_label_ids(row.get('img_lbl'), lbl_map))
+        try:
+            # Ids of new rows are read back by result_id, since only this
+            # script writes ImageAnnos for its result.
+            img_ids = dbm.bulk_insert(model.ImageAnno, img_rows,
+                model.ImageAnno.result_id == result_id)
+            lbl_rows = list()
+            for img_id, ll_ids in zip(img_ids, img_lbls):
+                for ll_id in ll_ids:
+                    lbl_rows.append({'label_leaf_id': ll_id, 'img_anno_id': img_id})
+            twod_rows = list()
+            twod_lbls = list()
+            for img_id, (_, row) in zip(img_ids, img_chunk.iterrows()):
+                if row['img_path'] not in anno_positions:
+                    continue
+                for _, anno in anno_df.iloc[anno_positions[row['img_path']]].iterrows():
+                    data, anno_dtype = _encode_twod_data(anno['anno_dtype'], anno['anno_data'])
+                    sim_class = anno.get('anno_sim_class')
+                    meta = anno.get('anno_meta')
+                    twod_rows.append({
+                        'iteration': iteration,
+                        'anno_task_id': anno_task_id,
+                        'state': state.Anno.UNLOCKED,
+                        'img_anno_id': img_id,
+                        'data': data,
+                        'dtype': anno_dtype,
+                        'sim_class': 1 if _is_missing(sim_class) else int(sim_class),
+                        'meta': None if _is_missing(meta) else json.dumps(meta, default=_json_default)
+                    })
+                    twod_lbls.append(self._get_label_ids(anno.get('anno_lbl'), lbl_map))
+            if len(twod_rows) > 0:
+                twod_ids = dbm.bulk_insert(model.TwoDAnno, twod_rows,
+                    model.TwoDAnno.img_anno_id.in_(img_ids))
+                for twod_id, ll_ids in zip(twod_ids, twod_lbls):
+                    for ll_id in ll_ids:
+                        lbl_rows.append({'label_leaf_id': ll_id, 'two_d_anno_id': twod_id})
+            if len(lbl_rows) > 0:
+                session.execute(model.Label.__table__.insert(),
+                    [dict({'img_anno_id': None, 'two_d_anno_id': None}, **r) for r in lbl_rows])
+            session.commit()
+        except:
+            session.rollback()
+            raise
+
     def _get_lds_fm(self, df, fm_cache=dict(), fm=None):
         if 'img_fs_name' in df:
             fs_name = df['img_fs_name'].values[0]
@@ -692,19 +911,26 @@ class ScriptOutput(Output):
         else:
             return lbl
 
-    def _update_labels(self, ll_ids, anno, lbl_map=None):
+    def _get_label_ids(self, ll_ids, lbl_map=None):
+        '''Get a list of label_leaf_ids for labels given by id or name.'''
+        res = list()
         if isinstance(ll_ids, list) or isinstance(ll_ids, np.ndarray):
             if len(ll_ids) > 0:
                 for ll_id in ll_ids:
                     if ll_id is not None:
                         ll_id = self._lbl_name_to_id(ll_id, lbl_map)
                         if ll_id is not None:
-                            anno.labels.append(model.Label(label_leaf_id=ll_id))
+                            res.append(ll_id)
         else:
-            if ll_ids is not None:
+            if not _is_missing(ll_ids):
                 ll_ids = self._lbl_name_to_id(ll_ids, lbl_map)
                 if ll_ids is not None:
-                    anno.labels.append(model.Label(label_leaf_id=ll_ids))
+                    res.append(ll_ids)
+        return res
+
+    def _update_labels(self, ll_ids, anno, lbl_map=None):
+        for ll_id in self._get_label_ids(ll_ids, lbl_map):
+            anno.labels.append(model.Label(label_leaf_id=ll_id))
 
     def add_annos(self, img_path, img_labels=None, img_sim_class=None, 
         annos=[], anno_types=[], anno_labels=[], anno_sim_classes=[], frame_n=None, 
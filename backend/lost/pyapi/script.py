@@ -18,6 +18,7 @@ import pickle
 from lost.pyapi import pe_base
 from lost.logic.label import LabelTree
 from lost.pyapi import pipe_elements
+from lost.logic.pipeline import scheduler
 import ast 
 
 def report_script_err(pipe_element, task, dbm, msg):
@@ -375,6 +376,8 @@ class Script(pe_base.Element):
             self._dbm.add(self._pipe)
             self._dbm.add(self._pipe_element)
             self._dbm.commit()
+            scheduler.notify(self._pipe.idx, scheduler.SCRIPT_FINISHED,
+                self._lostconfig)
         else:
             answer = input("Have you finished debugging? [y/n]: ")
             if answer[0].lower() == 'y':
@@ -0,0 +1,2 @@
+# The sqlite fixtures of the logic tests are used here as well
+from lost.logic.test.conftest import engine, session, dbm
@@ -0,0 +1,178 @@
+import io
+import json
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from datetime import datetime
+from lost.db import model, dtype
+from lost.pyapi import anno_export
+
+def create_result(dbm):
+    '''Create a result with three images, the second one without 2D
+    annotations.
+
+    Returns:
+        model.Result
+    '''
+    fs = model.FileSystem(root_path='/data', name='fs', fs_type='file')
+    user = model.User(user_name='anno', password='pwd')
+    leafs = [model.LabelLeaf(name=name) for name in ('cat', 'dog')]
+    result = model.Result(timestamp=datetime(2021, 1, 1))
+    for obj in [fs, user, result] + leafs:
+        dbm.add(obj)
+    dbm.commit()
+    def add_img(meta, **kwargs):
+        img = model.ImageAnno(result_id=result.idx, fs_id=fs.idx,
+            img_path='imgs/{}.jpg'.format(meta), state=4, iteration=0,
+            timestamp=datetime(2021, 1, 2), meta=json.dumps(meta)
+            if isinstance(meta, dict) else None, **kwargs)
+        dbm.save_obj(img)
+        return img
+    def add_anno(img, anno_dtype, data, meta=None, label_leafs=[], **kwargs):
+        anno = model.TwoDAnno(img_anno_id=img.idx, dtype=anno_dtype,
+            data=json.dumps(data), iteration=0, **kwargs)
+        anno.meta = json.dumps(meta) if meta is not None else None
+        anno.labels = [model.Label(label_leaf_id=leaf.idx,
+            dtype=dtype.Label.TWO_D_ANNO) for leaf in label_leafs]
+        dbm.add(anno)
+    img = add_img({'weather': 'sun', 'n': 1}, user_id=user.idx,
+        anno_time=2.5, is_junk=False)
+    img.labels = [model.Label(label_leaf_id=leafs[0].idx,
+        dtype=dtype.Label.IMG_ANNO)]
+    add_anno(img, dtype.TwoDAnno.BBOX, {'x': 0.5, 'y': 0.5, 'w': 0.2, 'h': 0.1},
+        {'score': 0.5, 'tags': ['a']}, leafs[::-1], user_id=user.idx,
+        confidence=0.9, timestamp=datetime(2021, 1, 3))
+    add_anno(img, dtype.TwoDAnno.LINE, [{'x': 0.1, 'y': 0.1}, {'x': 0.2, 'y': 0.3}],
+        description='line')
+    add_anno(img, dtype.TwoDAnno.POINT, {'x': 0.3, 'y': 0.4}, {'score': 1})
+    add_img('empty', is_junk=True)
+    img = add_img({'weather': 'rain', 'extra': {'a': 1}}, user_id=user.idx)
+    add_anno(img, dtype.TwoDAnno.POLYGON, [{'x': 0.1, 'y': 0.1},
+        {'x': 0.2, 'y': 0.3}, {'x': 0.4, 'y': 0.1}], label_leafs=leafs[1:])
+    dbm.commit()
+    return result
+
+def _rows(img_uid, user_id, anno_uids):
+    img = {'img_uid': img_uid, 'img_user_id': user_id, 'img_path': 'img.jpg'}
+    rows = [dict(img, anno_uid=None, anno_dtype=None)]
+    for anno_uid in anno_uids:
+        rows.append(dict(img, anno_uid=anno_uid, anno_dtype='bbox'))
+    return rows
+
+class TestAnnoExport(object):
+    def test_parse_anno_data(self):
+        datas = [
+            json.dumps({'x': 0.1, 'y': 0.2, 'w': 0.3, 'h': 0.4}),
+            None,
+            json.dumps([{'x': 0.1, 'y': 0.1}, {'x': 0.2, 'y': 0.2}])
+        ]
+        res = anno_export.parse_anno_data(
+            [dtype.TwoDAnno.BBOX, None, dtype.TwoDAnno.LINE], datas)
+        assert res == [[[0.1, 0.2, 0.3, 0.4]], [[None]], [[0.1, 0.1], [0.2, 0.2]]]
+
+    def test_dtypes_like_img_anno_to_df(self):
+        images = [_rows(1, 7, [10, 11]), _rows(2, None, []), _rows(3, 8, [12])]
+        ref = pd.concat([pd.DataFrame(rows) for rows in images])
+        df, _ = anno_export._chunk_df([row for rows in images for row in rows])
+        assert list(df.columns) == list(ref.columns)
+        assert list(df.index) == list(ref.index)
+        assert df.dtypes.to_dict() == ref.dtypes.to_dict()
+        assert df.astype(str).values.tolist() == ref.astype(str).values.tolist()
+
+    def test_meta_type(self):
+        assert anno_export._meta_type({int, type(None)}) == pa.int64()
+        assert anno_export._meta_type({int, float}) == pa.float64()
+        assert anno_export._meta_type({str}) == pa.string()
+        assert anno_export._meta_type({dict, str}) is None
+
+    def test_stream_sink(self):
+        sink = anno_export._StreamSink()
+        table = pa.table({'a': [1, 2, 3]})
+        writer = pq.ParquetWriter(sink, table.schema)
+        writer.write_table(table)
+        parts = [sink.drain()]
+        writer.write_table(table)
+        writer.close()
+        parts.append(sink.drain())
+        assert sink.drain() == b''
+        pq_file = pq.ParquetFile(io.BytesIO(b''.join(parts)))
+        assert pq_file.metadata.num_row_groups == 2
+        assert pq_file.read().column('a').to_pylist() == [1, 2, 3, 1, 2, 3]
+
+    def test_like_img_anno_to_df(self, dbm):
+        result = create_result(dbm)
+        imgs = sorted(result.img_annos, key=lambda img: img.idx)
+        ref = pd.concat([img.to_df() for img in imgs])
+        for chunk_size in (1, 2, 10):
+            df = anno_export.to_df(dbm, [result.idx], chunk_size)
+            assert list(df.columns) == list(ref.columns)
+            assert 'meta_extra' in df.columns and 'meta_score' in df.columns
+            assert list(df.index) == list(ref.index)
+            assert df.dtypes.to_dict() == ref.dtypes.to_dict()
+            assert df.astype(str).values.tolist() == ref.astype(str).values.tolist()
+            # nan != nan, so rows are compared by their repr
+            for columns in ('all', 'anno_lbl', ['img_uid', 'anno_data']):
+                vec = anno_export.to_vec(dbm, [result.idx], columns, chunk_size)
+                ref_vec = [row for img in imgs for row in img.to_vec(columns)]
+                assert [repr(row) for row in vec] == [repr(row) for row in ref_vec]
+
+def _normalize(value):
+    '''Make values of to_df and of an exported file comparable.'''
+    if hasattr(value, 'tolist'):
+        value = value.tolist()
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if hasattr(value, 'to_pydatetime'):
+        value = value.to_pydatetime()
+    try:
+        if pd.isnull(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return value
+
+class TestStreamExport(object):
+    def test_parquet(self, dbm):
+        result = create_result(dbm)
+        df = anno_export.to_df(dbm, [result.idx])
+        data = b''.join(anno_export.iter_parquet(dbm, [result.idx],
+            row_group_size=3, chunk_size=2))
+        pq_file = pq.ParquetFile(io.BytesIO(data))
+        # 7 rows in row groups of 3
+        assert [pq_file.metadata.row_group(i).num_rows
+            for i in range(pq_file.metadata.num_row_groups)] == [3, 3, 1]
+        table = pq_file.read()
+        assert table.schema.field('meta_extra').type == pa.string()
+        assert table.schema.field('meta_score').type == pa.float64()
+        assert table.column_names == list(df.columns)
+        for column in df.columns:
+            values = table.column(column).to_pylist()
+            if column in ('meta_tags', 'meta_extra'):
+                values = [json.loads(v) if v is not None else None
+                    for v in values]
+            assert values == [_normalize(v) for v in df[column]], column
+
+    def test_csv(self, dbm):
+        result = create_result(dbm)
+        df = anno_export.to_df(dbm, [result.idx])
+        parts = list(anno_export.iter_csv(dbm, [result.idx], chunk_size=2))
+        # Header and one part per chunk of 2 images
+        assert len(parts) == 3
+        csv_df = pd.read_csv(io.BytesIO(b''.join(parts)))
+        assert list(csv_df.columns) == list(df.columns)
+        assert csv_df['img_uid'].tolist() == df['img_uid'].tolist()
+        assert [json.loads(v) for v in csv_df['meta_extra'].dropna()] == [{'a': 1}]*2
+        assert csv_df['meta_score'].dropna().tolist() == [0.5, 1.0]
+
+    def test_jsonl(self, dbm):
+        result = create_result(dbm)
+        df = anno_export.to_df(dbm, [result.idx])
+        parts = list(anno_export.iter_jsonl(dbm, [result.idx], chunk_size=2))
+        assert len(parts) == 2
+        records = [json.loads(line) for part in parts
+            for line in part.decode('utf-8').splitlines() if line]
+        assert len(records) == len(df)
+        assert all(list(r.keys()) == list(df.columns) for r in records)
+        assert [r['meta_tags'] for r in records if r['meta_tags']] == ['["a"]']
+        assert records[1]['anno_lbl'] == ['dog', 'cat']
+        assert records[1]['anno_data'] == [[0.5, 0.5, 0.2, 0.1]]
@@ -4,6 +4,7 @@ from lost.db.access import DBMan
 import lostconfig as config
 import json
 import datetime
+import pandas as pd
 from lost.utils import testils
 from lost.pyapi.script import Script
 # import pudb
@@ -83,4 +84,38 @@ class TestScriptApi(object):
         for img_anno in s.outp.img_annos:
             if img_anno.img_path == IMG_PATH2:
                 bbox2 = img_anno.to_vec('anno_data')[1]
-                assert check_bbox(REF_BBOXES[0], bbox2[0])
\ No newline at end of file
+                assert check_bbox(REF_BBOXES[0], bbox2[0])
+
+    def test_request_annos_bulk(self, script_element, tree):
+        s = Script(pe_id=script_element.idx)
+        lbl_vec = tree.get_child_vec(tree.root.idx)
+        df = pd.DataFrame({
+            'img_path': [IMG_PATH1]*len(REF_BBOXES) + [IMG_PATH2],
+            'img_lbl': [[lbl_vec[1]]]*len(REF_BBOXES) + [[lbl_vec[2]]],
+            'anno_data': REF_BBOXES + [None],
+            'anno_dtype': ['bbox']*len(REF_BBOXES) + [None],
+            'anno_lbl': [[lbl_vec[1]]]*len(REF_BBOXES) + [None]
+        })
+        assert s.outp.request_annos_bulk(df, chunk_size=1) == 2
+        df = s.outp.to_df()
+        df1 = df[df['img_path']==IMG_PATH1]
+        assert len(df1)-1 == len(REF_BBOXES)
+        df2 = df[df['img_path']==IMG_PATH2]
+        assert len(df2) == 1
+        assert df2['img_lbl'].values[0][0] == 'Bird'
+        for img_anno in s.outp.img_annos:
+            if img_anno.img_path == IMG_PATH1:
+                bboxes = img_anno.to_vec('anno_data')[1]
+                for ref, bbox in zip(REF_BBOXES, bboxes):
+                    assert check_bbox(ref, bbox)
+
+    def test_request_annos_bulk_unknown_dtype(self, script_element):
+        s = Script(pe_id=script_element.idx)
+        df = pd.DataFrame({
+            'img_path': [IMG_PATH1, IMG_PATH2],
+            'anno_data': [REF_BBOXES[0], REF_BBOXES[1]],
+            'anno_dtype': ['bbox', 'box']
+        })
+        with pytest.raises(ValueError, match='box'):
+            s.outp.request_annos_bulk(df, chunk_size=1)
+        assert len(s.outp.img_annos) == 0
@@ -79,6 +79,15 @@ class LOSTConfig(object):
         self.lost_db_port = str(ge('LOST_DB_PORT','3306'))
         self.lost_db_ip = str(ge('LOST_DB_IP',"db-lost"))
         self.db_connector = ge('LOST_DB_CONNECTOR',"mysql+mysqldb")
+        # Connection pool per process. Set pool size to 0 to disable pooling.
+        self.db_pool_size = ge('LOST_DB_POOL_SIZE',5)
+        self.db_max_overflow = ge('LOST_DB_MAX_OVERFLOW',10)
+        # Seconds to wait for a free connection
+        self.db_pool_timeout = ge('LOST_DB_POOL_TIMEOUT',30)
+        # Seconds after which a connection will be replaced
+        self.db_pool_recycle = ge('LOST_DB_POOL_RECYCLE',3600)
+        # Test connections for liveness on checkout
+        self.db_pool_pre_ping = ge('LOST_DB_POOL_PRE_PING',True)
 
         # Worker management
         # Unique name for this container worker
@@ -116,7 +125,46 @@ class LOSTConfig(object):
         self.worker_timeout = ge('LOST_WORKER_TIMEOUT',30)
         # Intervall in seconds in which a worker should give a lifesign
         self.worker_beat = ge('LOST_WORKER_BEAT',10)
-        self.pipe_schedule = ge('LOST_PIPE_SCHEDULE',5)
+        # Pipelines are processed when a wake-up event arrives. The
+        # schedule is the intervall in seconds for a full safety net sweep.
+        self.pipe_schedule = ge('LOST_PIPE_SCHEDULE',60)
+        # Backend for pipe wake-up events: 'file' or 'local' (in-process)
+        self.pipe_event_backend = ge('LOST_PIPE_EVENT_BACKEND','file')
+        # Intervall in seconds in which the file backend looks for events
+        self.pipe_event_poll = ge('LOST_PIPE_EVENT_POLL',0.5)
+        # Max size in MB of the on-disk and in-memory cache for image
+        # derivatives like SIA filters and MIA crops
+        self.img_cache_disk_size = ge('LOST_IMG_CACHE_DISK_SIZE',1024)
+        self.img_cache_mem_size = ge('LOST_IMG_CACHE_MEM_SIZE',64)
+        # Number of images that are reserved and prepared in advance for
+        # an annotator in SIA. 0 disables prefetching.
+        self.sia_prefetch_depth = ge('LOST_SIA_PREFETCH_DEPTH',1)
+        # Intervall in seconds in which maintained annotation counters of
+        # anno tasks are recounted to correct drift
+        self.anno_counter_reconcile = ge('LOST_ANNO_COUNTER_RECONCILE',3600)
+        # Number of rows per parquet row group and compression codec of
+        # streamed annotation exports
+        self.annoexport_row_group_size = ge('LOST_ANNOEXPORT_ROW_GROUP_SIZE',10000)
+        self.annoexport_compression = ge('LOST_ANNOEXPORT_COMPRESSION','snappy')
+        # Max number of filesystem connections that are cached per process
+        self.fs_cache_size = ge('LOST_FS_CACHE_SIZE',32)
+        # Seconds a directory listing of the file browser is cached and max
+        # number of cached listings per process
+        self.fs_listing_ttl = ge('LOST_FS_LISTING_TTL',30)
+        self.fs_listing_cache_size = ge('LOST_FS_LISTING_CACHE_SIZE',1024)
+        # Max number of cached environments for extra packages of scripts and
+        # local wheel folder or index mirror used to build them
+        self.script_env_cache_size = ge('LOST_SCRIPT_ENV_CACHE_SIZE',10)
+        self.script_env_wheel_dir = ge('LOST_SCRIPT_ENV_WHEEL_DIR',None)
+        self.script_env_index_url = ge('LOST_SCRIPT_ENV_INDEX_URL',None)
+        # Max number of label trees that are cached per process
+        self.label_tree_cache_size = ge('LOST_LABEL_TREE_CACHE_SIZE',256)
+        # Pipes marked as deleted are removed by a cron job in batches of
+        # rows. Intervall in seconds in which the job looks for such pipes.
+        self.pipe_delete_batch_size = ge('LOST_PIPE_DELETE_BATCH_SIZE',1000)
+        self.pipe_delete_interval = ge('LOST_PIPE_DELETE_INTERVAL',10)
+        # Max number of pipes that can be started by one request
+        self.pipe_start_max_count = ge('LOST_PIPE_START_MAX_COUNT',100)
         self.session_timeout = ge('LOST_SESSION_TIME_OUT',30*60)
 
         # Timout when a user get automatically logged out
@@ -29,6 +29,11 @@ class LOSTConfig(object):
         self.lost_db_port = '3306'
         self.lost_db_ip = "192.168.1.42"
         self.db_connector = "mysql+mysqldb"
+        self.db_pool_size = 5
+        self.db_max_overflow = 10
+        self.db_pool_timeout = 30
+        self.db_pool_recycle = 3600
+        self.db_pool_pre_ping = True
 
         # Worker management
         # Name of the environment that is installed in this container and used to execute scripts
@@ -59,7 +64,25 @@ class LOSTConfig(object):
         self.worker_timeout = 30
         # Intervall in seconds in which a worker should give a lifesign
         self.worker_beat = 10
-        self.pipe_schedule = 5
+        self.pipe_schedule = 60
+        self.pipe_event_backend = 'file'
+        self.pipe_event_poll = 0.5
+        self.img_cache_disk_size = 1024
+        self.img_cache_mem_size = 64
+        self.sia_prefetch_depth = 1
+        self.anno_counter_reconcile = 3600
+        self.annoexport_row_group_size = 10000
+        self.annoexport_compression = 'snappy'
+        self.fs_cache_size = 32
+        self.fs_listing_ttl = 30
+        self.fs_listing_cache_size = 1024
+        self.script_env_cache_size = 10
+        self.script_env_wheel_dir = None
+        self.script_env_index_url = None
+        self.label_tree_cache_size = 256
+        self.pipe_delete_batch_size = 1000
+        self.pipe_delete_interval = 10
+        self.pipe_start_max_count = 100
         self.session_timeout = 30*60
 
         # DASK scheduler properties